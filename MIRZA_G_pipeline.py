@@ -10,14 +10,22 @@ __version__ = "2.0.0"
 
 import os
 import sys
+import glob
+import json
 import shutil
 import random
 import traceback
 from errno import EEXIST
-from Jobber import JobClient
 
 from configobj import ConfigObj
 from argparse import ArgumentParser, RawTextHelpFormatter
+from mirzag import runstats
+from mirzag import fingerprint
+from mirzag import costmodel
+from mirzag import resultsdb
+from mirzag import columnar
+from mirzag.resources import parse_memory_resources, DEFAULT_MEMORY_RESOURCES
+from mirzag import estimate as estimator
 
 
 parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
@@ -51,6 +59,26 @@ run_parser.add_argument("--modules",
                     dest="modules",
                     nargs="*",
                     help="A list of modules to load (if HPC or environment requires)")
+run_parser.add_argument("--incremental",
+                    dest="incremental",
+                    action="store_true",
+                    default=False,
+                    help="Reuse results of the previous run in the output directory for miRNAs that did not change\n(the same UTRs, models and settings) and calculate only new or changed miRNAs (seed protocol)")
+run_parser.add_argument("--estimate",
+                    dest="estimate",
+                    action="store_true",
+                    default=False,
+                    help="Do not submit anything, only estimate number of sites, core-hours, output sizes and\nwall time of the run (from the cost model, see general setting cost_model)")
+run_parser.add_argument("--parallelism",
+                    dest="parallelism",
+                    type=int,
+                    default=100,
+                    help="Number of jobs running at the same time for the estimate of wall time, defaults to 100")
+run_parser.add_argument("--estimate-sample",
+                    dest="estimate_sample",
+                    type=float,
+                    default=1.0,
+                    help="Fraction of UTRs scanned for the estimate (counts are scaled back), defaults to 1.0")
 
 clean_parser = subparsers.add_parser("clean", help="Clean after previous run")
 clean_parser.add_argument("-v",
@@ -66,6 +94,109 @@ clean_parser.add_argument("-y",
                         default=False,
                         help="Force deletion of files.")
 
+report_parser = subparsers.add_parser("report", help="Report resources used by each stage and chunk of the run")
+report_parser.add_argument("-v",
+                    "--verbose",
+                    dest="verbose",
+                    action="store_true",
+                    default=False,
+                    help="Be loud!")
+report_parser.add_argument("--output-dir",
+                    dest="output_dir",
+                    default="output",
+                    help="Output directory of the run with *.stats.json files, defaults to output")
+report_parser.add_argument("--json",
+                    dest="json",
+                    default=None,
+                    help="Save per stage summary and critical path also in JSON file")
+report_parser.add_argument("--update-cost-model",
+                    dest="cost_model",
+                    default=None,
+                    help="Update the cost model (general setting cost_model) with the statistics of the run,\nthe model is used to submit the most expensive chunks first")
+
+serve_parser = subparsers.add_parser("serve", help="Serve predictions of the seed protocol keeping UTRs, models and tree in memory")
+serve_parser.add_argument("-v",
+                    "--verbose",
+                    dest="verbose",
+                    action="store_true",
+                    default=False,
+                    help="Be loud!")
+serve_parser.add_argument("--config",
+                    dest="config",
+                    required=True,
+                    help="Config file")
+serve_parser.add_argument("--socket",
+                    dest="socket",
+                    default=None,
+                    help="Listen on this Unix socket instead of HTTP")
+serve_parser.add_argument("--host",
+                    dest="host",
+                    default="127.0.0.1",
+                    help="Host to listen on with HTTP, defaults to 127.0.0.1")
+serve_parser.add_argument("--port",
+                    dest="port",
+                    type=int,
+                    default=8750,
+                    help="Port to listen on with HTTP, defaults to 8750")
+serve_parser.add_argument("--workers",
+                    dest="workers",
+                    type=int,
+                    default=2,
+                    help="Number of batches predicted in parallel, defaults to 2")
+serve_parser.add_argument("--batch-size",
+                    dest="batch_size",
+                    type=int,
+                    default=20,
+                    help="Maximal number of miRNAs predicted in one batch, defaults to 20")
+serve_parser.add_argument("--batch-wait",
+                    dest="batch_wait",
+                    type=float,
+                    default=0.05,
+                    help="Seconds to wait for more requests before a batch is started, defaults to 0.05")
+
+query_parser = subparsers.add_parser("query", help="Query per gene scores in the results database (general setting results_database)")
+query_parser.add_argument("-v",
+                    "--verbose",
+                    dest="verbose",
+                    action="store_true",
+                    default=False,
+                    help="Be loud!")
+query_parser.add_argument("--database",
+                    dest="database",
+                    default=None,
+                    help="Results database of the run, without it sites of a gene (--sites --gene) are read\nfrom the per site outputs in --output-dir through their index by gene")
+query_parser.add_argument("--output-dir",
+                    dest="output_dir",
+                    default="output",
+                    help="Output directory of the run with *.sites files, defaults to output")
+query_parser.add_argument("--mirna",
+                    dest="mirna",
+                    default=None,
+                    help="Only scores of this miRNA (e.g. its top targets)")
+query_parser.add_argument("--gene",
+                    dest="gene",
+                    default=None,
+                    help="Only scores of this gene (e.g. miRNAs targeting it)")
+query_parser.add_argument("--sites",
+                    dest="sites",
+                    action="store_true",
+                    default=False,
+                    help="Print sites instead of per gene scores (run with general setting site_output = yes)")
+query_parser.add_argument("--min-score",
+                    dest="min_score",
+                    type=float,
+                    default=None,
+                    help="Only scores (probabilities of sites with --sites) of at least this value, defaults to None")
+query_parser.add_argument("--order-by",
+                    dest="order_by",
+                    default=None,
+                    choices=("score", "score_with_conservation", "probability", "probability_with_conservation"),
+                    help="Column the results are ordered by (best first), defaults to score (probability with --sites)")
+query_parser.add_argument("--top",
+                    dest="top",
+                    type=int,
+                    default=None,
+                    help="Print only so many best scores, defaults to None (all)")
 
 
 
@@ -73,6 +204,19 @@ clean_parser.add_argument("-y",
 syserr = sys.stderr.write
 sysout = sys.stdout.write
 
+
+def remove_failed_jobs(output_directory):
+    """Remove run statistics of the jobs that failed (rg_collect_results.py stops on them)"""
+    for path in glob.glob(os.path.join(output_directory, "*" + runstats.SIDECAR_SUFFIX)):
+        try:
+            with open(path) as infile:
+                failed = json.load(infile).get('status') == 'failed'
+        except (IOError, ValueError):
+            continue
+        if failed:
+            os.remove(path)
+
+
 def main(options):
     working_directory = os.getcwd()
     pipeline_directory = os.path.dirname(os.path.abspath(__file__))
@@ -108,8 +252,31 @@ def main(options):
         finally:
             sys.exit()
 
+    if options.command == 'report':
+        report(options)
+        sys.exit()
+
+    if options.command == 'serve':
+        serve(options)
+        sys.exit()
+
+    if options.command == 'query':
+        query(options)
+        sys.exit()
+
     settings = ConfigObj(options.config).dict()
-    mkdir_p(output_directory)
+    if options.incremental and options.protocol != "seed":
+        raise Exception("Incremental runs are available only for the seed protocol")
+    if options.estimate:
+        estimate(options, settings)
+        sys.exit()
+    # jobs forked by the zygote run outside of the cluster jobs, so their memory is not limited by
+    # the requests learned from the previous runs (and the learned usage is not theirs)
+    if (settings['general'].get('zygote', 'no') == 'yes' and settings['general'].get('learn_resources', 'no') == 'yes'
+            and settings['general'].get('executer', 'drmaa') != 'local'):
+        raise Exception("Settings zygote and learn_resources cannot be used together on the cluster, set one of them to no")
+    if not options.incremental or not os.path.isdir(output_directory):
+        mkdir_p(output_directory)
     if options.protocol == "scan":
         mkdir_p(os.path.join(output_directory, "MIRZAscan"))
 
@@ -129,6 +296,10 @@ def main(options):
             raise Exception("Path to MIRZA is invalid (%s)! Please define it with --mirzabin option." % settings['general']['mirza_binary'])
 
 
+    # jobs that failed in a previous run would stop the collection before they are run again
+    remove_failed_jobs(output_directory)
+    # imported here so that the estimate, report, query and serve work without Jobber
+    from Jobber import JobClient
     jobber = JobClient.Jobber()
 
     #Create a group for whole pipeline. The module "Python" will be inherited by all jobs that are in this group,
@@ -144,9 +315,16 @@ def main(options):
     if options.protocol == "seed":
 
         #First step is to split the file
-        split_command = "python %s --input %s --output-dir %s" % (os.path.join(pipeline_directory, "scripts/rg_prepare_mirnas_for_mirza_and_split.py"),
-                                                                  settings['general']['motifs'],
-                                                                  output_directory)
+        # miRNAs that did not change since the previous run are recognized by fingerprints
+        run_fingerprint = fingerprint.run_fingerprint(settings, options.protocol, __version__)
+        split_command = "python %s --input %s --output-dir %s --mirnas-per-file %s --run-fingerprint %s --seqs %s --split-by \"%s\" --index-after-split %s" % (os.path.join(pipeline_directory, "scripts/rg_prepare_mirnas_for_mirza_and_split.py"),
+                                                                                       settings['general']['motifs'],
+                                                                                       output_directory,
+                                                                                       settings['general'].get('mirnas_per_chunk', 1),
+                                                                                       run_fingerprint,
+                                                                                       settings['general']['seqs'],
+                                                                                       settings['general'].get('split_by', "NONE"),
+                                                                                       settings['general'].get('index_after_split', 0))
         split_files_id = jobber.job(split_command, {'name': "SplitMiRNAs"})
 
     if options.protocol == "scan":
@@ -206,12 +384,36 @@ def main(options):
 
     jobber.endGroup()
 
-    # We merge the files into our result file after analysis finishes
-    final_merge_command = "zcat {output_dir}/*.score > {cwd}/mirza_g_results_{protocol}.tab".format(output_dir=output_directory,
+    # We collect the chunks into our result file as soon as they are merged. Locally the jobs
+    # might not run in parallel so the collection waits for the analysis to finish
+    final_merge_command = "python {script} --input-dir {output_dir} --output {cwd}/mirza_g_results_{protocol}.tab --chunks-from {chunks_from} -v".format(script=os.path.join(pipeline_directory, "scripts/rg_collect_results.py"),
+                                                                                         output_dir=output_directory,
                                                                                          cwd=working_directory,
-                                                                                                    protocol=options.protocol)
+                                                                                         protocol=options.protocol,
+                                                                                         chunks_from="manifest" if options.protocol == "seed" else "seedcount")
+    # scores are loaded also into the results database for the query command
+    if settings['general'].get('results_database', None):
+        final_merge_command += " --database %s" % os.path.join(working_directory, settings['general']['results_database'])
+    # per gene scores for the thresholds of the sweep (MergeAndCollect thresholds) go to a table of their own
+    if settings['tasks']['MergeAndCollect'].get('thresholds', None):
+        final_merge_command += " --sweep-output %s/mirza_g_results_%s.sweep.tab" % (working_directory, options.protocol)
+    # and so do the per gene scores of the models of the registries (general models)
+    if settings['general'].get('models', None):
+        final_merge_command += " --models-output %s/mirza_g_results_%s.models.tab" % (working_directory, options.protocol)
+    # a chunk that is never merged (e.g. its job was killed by the scheduler) stops the collection after collect_timeout
+    final_merge_command += " --timeout %s" % settings['tasks']['MergeAndCollect'].get('collect_timeout', 86400)
+    # on the cluster the collection runs as long as the analysis
+    collect_memory = settings['tasks']['MergeAndCollect'].get('collect_mem_req', '2G')
+    collect_options = [('q', settings['tasks']['MergeAndCollect'].get('collect_queue', 'long.q'))]
+    collect_options += [('l', "%s=%s" % (resource, collect_memory))
+                        for resource in parse_memory_resources(settings['general'].get('mem_resources', DEFAULT_MEMORY_RESOURCES))]
+    if settings['general'].get('executer', 'drmaa') == 'local':
+        merge_dependencies = [analyse_files_id]
+    else:
+        merge_dependencies = [split_files_id]
     jobber.job(final_merge_command, {'name': "MergeResults",
-                                     'dependencies': [analyse_files_id]})
+                                     'options': collect_options,
+                                     'dependencies': merge_dependencies})
 
 
     jobber.endGroup()
@@ -224,6 +426,126 @@ def main(options):
     jobber.launch(pipeline_id)
 
 
+def report(options):
+    """Print the report of resources used in the run"""
+    records = runstats.load_records(options.output_dir)
+    if options.verbose:
+        syserr("Found %i run statistics in %s\n" % (len(records), options.output_dir))
+    if not records:
+        syserr("There are no run statistics in %s\n" % options.output_dir)
+        return
+    sysout(runstats.format_report(records))
+    if options.json is not None:
+        with open(options.json, 'w') as outfile:
+            json.dump({'stages': runstats.summarize_stages(records),
+                       'critical_path': runstats.critical_path(records)},
+                      outfile, indent=1, sort_keys=True)
+    if options.cost_model is not None:
+        model = costmodel.CostModel.load(options.cost_model)
+        used = model.update(records, options.output_dir)
+        model.save(options.cost_model)
+        if options.verbose:
+            syserr("Updated cost model %s with %i jobs\n" % (options.cost_model, used))
+
+
+def query(options):
+    """Print per gene scores or sites from the results database (or sites from the per site outputs)"""
+    if options.database is None:
+        if not options.sites or options.gene is None:
+            syserr("Per gene scores and sites of miRNAs are queried in the results database (--database)\n")
+            return
+        try:
+            sysout(resultsdb.format_sites(indexed_sites(options)))
+        except ValueError as e:
+            syserr("%s\n" % str(e))
+        return
+    if not os.path.exists(options.database):
+        syserr("There is no results database %s\n" % options.database)
+        return
+    connection = resultsdb.connect(options.database)
+    try:
+        if options.verbose:
+            syserr("Database %s: %s\n" % (options.database, ", ".join("%i %s" % (count, name)
+                                                                     for name, count in sorted(resultsdb.summary(connection).items()))))
+        if options.sites:
+            sysout(resultsdb.format_sites(resultsdb.query_sites(connection,
+                                                                gene=options.gene,
+                                                                mirna=options.mirna,
+                                                                min_probability=options.min_score,
+                                                                order_by=options.order_by or "probability",
+                                                                limit=options.top)))
+        else:
+            sysout(resultsdb.format_rows(resultsdb.query(connection,
+                                                         gene=options.gene,
+                                                         mirna=options.mirna,
+                                                         min_score=options.min_score,
+                                                         order_by=options.order_by or "score",
+                                                         limit=options.top)))
+    except ValueError as e:
+        syserr("%s\n" % str(e))
+    finally:
+        connection.close()
+
+
+def indexed_sites(options):
+    """Sites of the gene from the per site outputs of the chunks, most probable first"""
+    if (options.order_by or "probability") not in resultsdb.SITE_ORDER_COLUMNS:
+        raise ValueError("Unknown order %s, use one of: %s" % (options.order_by, ", ".join(resultsdb.SITE_ORDER_COLUMNS)))
+    order_by = resultsdb.SITE_COLUMNS.index(options.order_by or "probability")
+    sites = []
+    for path in sorted(glob.glob(os.path.join(options.output_dir, "*.sites"))):
+        for site in columnar.read_indexed(path, options.gene):
+            site = site[:5] + tuple(None if columnar.is_missing(value) else value for value in site[5:])
+            if options.mirna is not None and site[2] != options.mirna:
+                continue
+            if options.min_score is not None and (site[order_by] is None or site[order_by] < options.min_score):
+                continue
+            sites.append(site)
+    # as ordered in the database: missing probabilities last
+    sites.sort(key=lambda site: (site[order_by] is None, -(site[order_by] or 0.0), site[0], site[2], site[1], site[3]))
+    return sites[:options.top] if options.top is not None else sites
+
+
+def estimate(options, settings):
+    """Print the estimate of the run without submitting it"""
+    model = costmodel.CostModel.load(settings['general'].get('cost_model', None))
+    if options.verbose:
+        syserr("Counting %s of the miRNAs in the UTRs\n" % ("seed matches" if options.protocol == "seed" else "windows"))
+    if options.protocol == "seed":
+        result = estimator.estimate_seed(settings, model, options.parallelism, options.estimate_sample)
+    else:
+        result = estimator.estimate_scan(settings, options.parallelism)
+    sysout(estimator.format_estimate(result))
+
+
+def serve(options):
+    """Serve predictions until interrupted"""
+    # imported here because the service loads pandas and the models
+    from mirzag.service import PredictionService, make_server
+    settings = ConfigObj(options.config).dict()
+    if options.verbose:
+        syserr("Loading UTRs and models\n")
+    service = PredictionService.from_config(settings,
+                                            workers=options.workers,
+                                            batch_size=options.batch_size,
+                                            batch_wait=options.batch_wait,
+                                            verbose=options.verbose)
+    server = make_server(service, options.socket, options.host, options.port)
+    if options.socket is not None:
+        syserr("Serving %i UTRs on %s\n" % (len(service.utrs), options.socket))
+    else:
+        syserr("Serving %i UTRs on http://%s:%i\n" % (len(service.utrs), options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if options.socket is not None and os.path.exists(options.socket):
+            os.remove(options.socket)
+
+
 def mkdir_p(path_to_dir):
     """Make directory with subdirectories"""
     try:
@@ -231,7 +553,8 @@ def mkdir_p(path_to_dir):
     except OSError as e: # Python >2.5
         if e.errno == EEXIST and os.path.isdir(path_to_dir):
             message = "Output directory %s (and files) exist.\nYou need to clean before you proceed. Run:\n" + \
-            "python MIRZA-G_pipeline clean \n"
+            "python MIRZA-G_pipeline clean \n" + \
+            "or continue the previous run with run --incremental\n"
             sys.stderr.write(message % path_to_dir)
             sys.exit()
         else:
@@ -0,0 +1 @@
+../scripts/mirzag_path.py
\ No newline at end of file
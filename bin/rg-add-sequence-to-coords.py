@@ -12,9 +12,11 @@ __license__ = "GPL"
 import sys
 import csv
 import time
-from Bio import SeqIO
 from argparse import ArgumentParser
 
+import mirzag_path
+from mirzag.fasta import IndexedFasta, read_fasta
+
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("-v",
                     "--verbose",
@@ -52,7 +54,7 @@ sysout = sys.stdout.write
 
 def main():
     """Main logic of the script"""
-    mRNAseqs = read_fasta_to_dict(options.seqs)
+    length, fetch = open_sequences(options.seqs)
     if options.verbose:
         syserr("Adjusting data\n")
     all_count = 0
@@ -62,19 +64,19 @@ def main():
             beg = int(beg)
             end = int(end)
             all_count += 1
-            seq = mRNAseqs[seqid]
-            dist_to_boundary = calculate_distance_to_boundary(len(seq), beg)
+            seq_len = length(seqid)
+            dist_to_boundary = calculate_distance_to_boundary(seq_len, beg)
             if dist_to_boundary < 50:
                 continue
             lowerIndex, upperIndex = get_indices(options.context,
                                                  beg,
                                                  end)
-            if upperIndex >= len(seq):
-                mRNA = seq[-1 * options.context:]
+            if upperIndex >= seq_len:
+                mRNA = fetch(seqid, max(0, seq_len - options.context), seq_len)
             elif lowerIndex < 0:
-                mRNA = seq[:options.context]
+                mRNA = fetch(seqid, 0, options.context)
             else:
-                mRNA = seq[lowerIndex:upperIndex]
+                mRNA = fetch(seqid, lowerIndex, upperIndex)
             if len(mRNA) == options.context:
                 out.write("%s\t%s\t%i\t%i\t%s\n" % (seqid,
                                                     mirid,
@@ -98,26 +100,27 @@ def calculate_distance_to_boundary(mRNAlen, begpos):
     return begpos if begpos < (mRNAlen - begpos) else (mRNAlen - begpos)
 
 
-def read_fasta_to_dict(path_to_file):
-    """Read fasta file into dictionary
+def open_sequences(path_to_file):
+    """Open UTR sequences for reading of their parts
+
+    Only the contexts of the sites are read from the file through its index
+    (see mirzag/fasta.py), files that cannot be indexed are read into memory.
 
     Args:
-        path_to_file (@todo): @todo
+        path_to_file (str): path to the fasta file
 
-    Returns: @todo
+    Returns: tuple of functions: length of the sequence by id and its part by id, start and end
 
     """
     if options.verbose:
         syserr("Reading sequences from %s \n" % (path_to_file))
     try:
-        seq_obj = open(path_to_file, 'Ur')
-        seqs = {}
-        for seq in SeqIO.parse(seq_obj, 'fasta'):
-            seqs[str(seq.id)] = str(seq.seq)
-    except IOError:
-        raise IOError('Cannot read from %s' % (path_to_file))
-
-    return seqs
+        seqs = IndexedFasta(path_to_file)
+        return seqs.length, seqs.fetch
+    except ValueError:
+        seqs = read_fasta(path_to_file)
+        return (lambda seqid: len(seqs[seqid]),
+                lambda seqid, start, end: seqs[seqid][start:end])
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Export fitted GLMs (statsmodels pickles) into a registry of models (see
+mirzag/models.py), which is loaded by the merge without statsmodels.
+
+    rg-export-models.py --model with_bls=data/glm-with-bls.bin --model retrained=glm.bin --output models.json
+
+Models of an existing registry (--registry) are kept, models with the same
+name are replaced.
+"""
+
+__license__ = "GPL"
+
+# imports
+import sys
+import time
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import mirzag_path
+from mirzag import models
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+parser.add_argument("-v",
+                    "--verbose",
+                    dest="verbose",
+                    action="store_true",
+                    default=False,
+                    help="Be loud!")
+parser.add_argument("--model",
+                    dest="models",
+                    action="append",
+                    default=[],
+                    required=True,
+                    help="Name and pickle of the model as name=path, can be given many times")
+parser.add_argument("--registry",
+                    dest="registry",
+                    default=None,
+                    help="Add the models to this registry, defaults to None")
+parser.add_argument("--scaling-factor",
+                    dest="scaling_factor",
+                    type=float,
+                    default=models.DEFAULT_SCALING_FACTOR,
+                    help="Scaling of the inverse logit of the models, defaults to %g" % models.DEFAULT_SCALING_FACTOR)
+parser.add_argument("--output",
+                    dest="output",
+                    required=True,
+                    help="Registry of the models (JSON)")
+
+# redefine a functions for writing to stdout and stderr to save some writting
+syserr = sys.stderr.write
+sysout = sys.stdout.write
+
+
+def main(options):
+    """Main logic of the script"""
+    registry = models.load_registry(options.registry) if options.registry is not None else []
+    for spec in options.models:
+        if "=" not in spec:
+            parser.error("Model has to be given as name=path: %s" % spec)
+        name, path = spec.split("=", 1)
+        if options.verbose:
+            syserr("Exporting %s from %s\n" % (name, path))
+        model = models.Model.from_glm(name, path, options.scaling_factor)
+        registry = [entry for entry in registry if entry.name != name] + [model]
+    models.save_registry(options.output, registry)
+    if options.verbose:
+        syserr("Registry %s: %s\n" % (options.output, ", ".join(model.name for model in registry)))
+
+
+if __name__ == '__main__':
+    try:
+        try:
+            options = parser.parse_args()
+        except Exception, e:
+            parser.print_help()
+            sys.exit()
+        if options.verbose:
+            start_time = time.time()
+            start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
+            syserr("############## Started script on %s ##############\n" % start_date)
+        main(options)
+        if options.verbose:
+            syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
+    except KeyboardInterrupt:
+        syserr("Interrupted by user after %i seconds!\n" % (time.time() - start_time))
+        sys.exit(-1)
@@ -0,0 +1,22 @@
+"""
+Shared code of the MIRZA-G pipeline used by the scripts and the launchers.
+
+The seed protocol can be also run in-process:
+
+    import mirzag
+    sites = mirzag.scan_seeds(utrs, mirnas, split_by="|", index_after_split=1)
+    features = mirzag.compute_features(sites, utrs, mirnas)
+    scored = mirzag.score(features, model_bls, model_nobls)
+    genes = mirzag.per_gene_scores(scored, split_by="|", column=1)
+
+or with mirzag.predict(utrs, mirnas) which does all of it.
+"""
+
+__license__ = "GPL"
+
+from mirzag.sites import Site, SiteTable, site_key, read_sites, write_sites
+from mirzag.fasta import read_fasta
+from mirzag.seeds import scan_seeds
+from mirzag.features import compute_features
+from mirzag.scoring import score, per_gene_scores
+from mirzag.pipeline import predict
@@ -0,0 +1,110 @@
+"""
+Content-hash cache of the outputs of the jobs.
+
+Each job generated by run_analysis.py has a key: digest of its stage, its
+command (script and parameters), the content of its input files and the
+keys of the jobs it depends on. After the job finishes, a digest record
+(output + '.digest') with the key and the digest of the output is saved.
+When the jobs are generated again (e.g. restart after a failure of the
+cluster), a job is skipped if its output has a record with the same key
+and was not modified since.
+"""
+
+__license__ = "GPL"
+
+import os
+import json
+import hashlib
+
+from mirzag.fingerprint import file_digest
+
+DIGEST_SUFFIX = ".digest"
+
+# digests of the input files are calculated once per file (UTRs are used by every job)
+_file_digests = {}
+
+
+def input_digest(path):
+    """Digest of the input file, None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    cache_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if cache_key not in _file_digests:
+        _file_digests[cache_key] = file_digest(path)
+    return _file_digests[cache_key]
+
+
+def job_key(stage, command, inputs=(), upstream=()):
+    """Key of the job
+
+    Args:
+        stage (str): name of the stage
+        command (str): command of the job (with all parameters)
+
+    Kwargs:
+        inputs (list): paths to input files that exist when the job is generated
+        upstream (list): keys of the jobs that make the other inputs
+
+    Returns: str
+
+    """
+    description = {'stage': stage,
+                   'command': " ".join(command.split()),
+                   'inputs': [input_digest(path) for path in inputs],
+                   'upstream': list(upstream)}
+    return hashlib.sha1(json.dumps(description, sort_keys=True)).hexdigest()
+
+
+def digest_path(output):
+    return output + DIGEST_SUFFIX
+
+
+def read_record(output):
+    """Read the digest record of the output, None if there is none"""
+    try:
+        with open(digest_path(output)) as infile:
+            return json.load(infile)
+    except (IOError, ValueError):
+        return None
+
+
+def is_cached(output, key):
+    """Is the output made by the job with this key and not modified since"""
+    record = read_record(output)
+    return record is not None and record.get('key') == key and input_digest(output) == record.get('output')
+
+
+def is_recorded(output):
+    """Is the output finished, i.e. has a digest record that matches it"""
+    record = read_record(output)
+    return record is not None and input_digest(output) == record.get('output')
+
+
+def remove_output(output):
+    """Remove the output with its digest record and run statistics"""
+    for path in [output, digest_path(output), output + ".stats.json"]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def save_record(output, key):
+    """Save the digest record of the output made by the job with this key"""
+    path = digest_path(output)
+    with open(path + ".tmp", 'w') as outfile:
+        json.dump({'key': key, 'output': file_digest(output)}, outfile, indent=1, sort_keys=True)
+    os.rename(path + ".tmp", path)
+
+
+def with_record(command, pipeline_dir, output, key):
+    """Add saving of the digest record to the command of the job
+
+    The record is saved only if the command (and moving the output back,
+    if the job runs in the temporary directory) succeeds.
+
+    """
+    record_command = "python %s --output %s --key %s" % (os.path.join(pipeline_dir, "scripts/rg_record_digest.py"),
+                                                         output,
+                                                         key)
+    return "%s && %s" % (command.rstrip(), record_command)
@@ -0,0 +1,390 @@
+"""
+Typed columnar binary format of the intermediate files of the pipeline.
+
+With the general setting intermediate_format = columnar the stages write
+sites (.seedcount), features (.mirza, .contrafold, .flanks, .distance) and
+per gene scores (.score) in this format instead of gzipped TSV, so the
+stages do not format and parse text (and the "id,miRNA,begin,end" keys of
+the sites). Only the final output is written as TSV (by
+rg_collect_results.py). Readers recognize the format by the magic bytes,
+so every stage reads both formats.
+
+A file is the magic bytes, the header (JSON with the columns and the codec)
+and blocks of rows. Each block is the number of rows and the size of its
+compressed payload followed by the payload with the columns one after
+another: integers as int32, features as float32 (NaN when missing), scores
+as float64 and ids as int32 codes into the dictionary of the block (so
+blocks are independent and can be written and concatenated separately).
+Blocks are compressed with the codec of the file (see mirzag/compress.py).
+
+Files written with write_indexed (per site output of the merge) have their
+rows sorted by the first column and an index of its values next to them
+(path + INDEX_SUFFIX, JSON with the offsets of the blocks and the block,
+row and number of rows of each value), so rows of one value (e.g. of one
+gene) are read without decompressing the other blocks.
+"""
+
+__license__ = "GPL"
+
+import sys
+import json
+import struct
+from array import array
+from operator import itemgetter
+from itertools import izip
+from collections import OrderedDict
+
+from mirzag import compress
+
+MAGIC = "MZGCOL1\n"
+INDEX_SUFFIX = ".index"
+FORMATS = ('tsv', 'columnar')
+# rows in one block of the writer
+BLOCK_ROWS = 65536
+
+NAN = float('nan')
+_LENGTH = struct.Struct('<I')
+_BLOCK = struct.Struct('<II')
+_ARRAY_TYPES = {'int32': 'i', 'float32': 'f', 'float64': 'd'}
+_SWAP = sys.byteorder == 'big'
+
+# key of the site: the columns of "id,miRNA,begin,end"
+SITE_KEY = [('id', 'dict'), ('mirna', 'dict'), ('beg', 'int32'), ('end', 'int32')]
+SITES = SITE_KEY + [('seq', 'str')]
+MIRZA = SITE_KEY + [('score', 'float32'), ('bls', 'float32')]
+CONTRAFOLD = SITE_KEY + [('accessibility', 'float32')]
+FLANKS = SITE_KEY + [('G', 'float32'), ('A', 'float32'), ('C', 'float32'), ('U', 'float32')]
+DISTANCE = SITE_KEY + [('distance', 'float32')]
+SCORE = [('id', 'dict'), ('mirna', 'dict'), ('score', 'float64'), ('score_with_conservation', 'float64')]
+# sites with their features (MIRZA score as its logarithm, as in the models) and probabilities by gene
+SITE_SCORES = ([('gene', 'dict')] + SITE_KEY
+               + [('flanks_u', 'float32'), ('flanks_g', 'float32'), ('accessibility', 'float32'),
+                  ('distance', 'float32'), ('log_mirza_score', 'float32'), ('conservation', 'float32'),
+                  ('probability', 'float64'), ('probability_with_conservation', 'float64')])
+
+
+def is_columnar(path):
+    """Is the file in the columnar format"""
+    with open(path, 'rb') as infile:
+        return infile.read(len(MAGIC)) == MAGIC
+
+
+def header(columns, codec=None):
+    """Magic bytes and header of the file with the columns (codec defaults to the configured one)"""
+    if codec is None:
+        codec = compress.settings()['codec']
+    data = json.dumps({'columns': columns, 'codec': codec})
+    return MAGIC + _LENGTH.pack(len(data)) + data
+
+
+def encode_block(columns, rows, level=None, codec=None):
+    """Encode and compress the rows (tuples of values of the columns)
+
+    Args:
+        columns (list): tuples of name and type of the columns
+        rows (list): rows of the block, None is a missing value
+
+    Kwargs:
+        level (int): zlib compression level, defaults to the configured one
+        codec (str): codec of the block, defaults to the configured one
+
+    Returns: str
+
+    """
+    settings = compress.settings()
+    sections = []
+    for (name, kind), values in izip(columns, izip(*rows) if rows else [()] * len(columns)):
+        if kind == 'dict':
+            codes = {}
+            entries = []
+            data = array('i')
+            for value in values:
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(entries)
+                    entries.append(value)
+                data.append(code)
+            sections.append("\n".join(entries))
+            sections.append(_tostring(data))
+        elif kind == 'str':
+            sections.append("\n".join('' if value is None else value for value in values))
+        elif kind == 'int32':
+            sections.append(_tostring(array('i', values)))
+        else:
+            sections.append(_tostring(array(_ARRAY_TYPES[kind],
+                                            [NAN if value is None else value for value in values])))
+    payload = compress.compress_block("".join(_LENGTH.pack(len(section)) + section for section in sections),
+                                      settings['codec'] if codec is None else codec,
+                                      settings['level'] if level is None else level)
+    return _BLOCK.pack(len(rows), len(payload)) + payload
+
+
+def decode_block(columns, rows, payload, codec="zlib"):
+    """Decompress and decode the block into lists of values of the columns"""
+    data = compress.decompress_block(payload, codec)
+    offset = [0]
+
+    def section():
+        length, = _LENGTH.unpack_from(data, offset[0])
+        start = offset[0] + _LENGTH.size
+        offset[0] = start + length
+        return data[start:offset[0]]
+
+    values = []
+    for name, kind in columns:
+        if kind == 'dict':
+            entries = section().split("\n")
+            codes = _fromstring('i', section())
+            values.append([entries[code] for code in codes])
+        elif kind == 'str':
+            values.append([value or None for value in section().split("\n")] if rows else [])
+        else:
+            values.append(_fromstring(_ARRAY_TYPES[kind], section()))
+    return values
+
+
+class Writer(object):
+
+    """Write rows into the columnar file in blocks
+
+    Args:
+        path (str): output file
+        columns (list): tuples of name and type of the columns
+
+    Kwargs:
+        block_rows (int): number of rows in one block
+
+    Blocks are compressed on the threads configured in mirzag/compress.py.
+
+    """
+
+    def __init__(self, path, columns, block_rows=BLOCK_ROWS):
+        settings = compress.settings()
+        self.columns = columns
+        self.block_rows = block_rows
+        self.level = settings['level']
+        self.codec = settings['codec']
+        self.rows = []
+        self.handle = open(path, 'wb')
+        self.handle.write(header(columns, self.codec))
+        self.pool = compress.OrderedPool(self.handle, settings['threads'])
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.block_rows:
+            self.flush_block()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def write_block(self, block):
+        """Append a block encoded with encode_block"""
+        self.flush_block()
+        self.pool.submit(str, block)
+
+    def flush_block(self):
+        if self.rows:
+            self.pool.submit(encode_block, self.columns, self.rows, self.level, self.codec)
+            self.rows = []
+
+    def close(self):
+        self.flush_block()
+        self.pool.finish()
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Reader(object):
+
+    """Read the columnar file block by block
+
+    Args:
+        path (str): columnar file
+
+    """
+
+    def __init__(self, path):
+        self.handle = open(path, 'rb')
+        if self.handle.read(len(MAGIC)) != MAGIC:
+            self.handle.close()
+            raise IOError("%s is not a columnar file" % path)
+        length, = _LENGTH.unpack(self.handle.read(_LENGTH.size))
+        info = json.loads(self.handle.read(length))
+        self.columns = [(str(name), str(kind)) for name, kind in info['columns']]
+        self.codec = info['codec']
+
+    def block_headers(self):
+        """Number of rows and payload of each block (not decompressed)"""
+        while True:
+            data = self.handle.read(_BLOCK.size)
+            if not data:
+                return
+            if len(data) < _BLOCK.size:
+                raise IOError("Truncated block in %s" % self.handle.name)
+            rows, size = _BLOCK.unpack(data)
+            payload = self.handle.read(size)
+            if len(payload) < size:
+                raise IOError("Truncated block in %s" % self.handle.name)
+            yield rows, payload
+
+    def block_offsets(self):
+        """Offsets of the blocks in the file (payloads are skipped)"""
+        offsets = []
+        while True:
+            offset = self.handle.tell()
+            data = self.handle.read(_BLOCK.size)
+            if len(data) < _BLOCK.size:
+                return offsets
+            rows, size = _BLOCK.unpack(data)
+            self.handle.seek(size, 1)
+            offsets.append(offset)
+
+    def block_at(self, offset):
+        """Lists of values of the columns of the block at the offset"""
+        self.handle.seek(offset)
+        rows, size = _BLOCK.unpack(self.handle.read(_BLOCK.size))
+        payload = self.handle.read(size)
+        if len(payload) < size:
+            raise IOError("Truncated block in %s" % self.handle.name)
+        return decode_block(self.columns, rows, payload, self.codec)
+
+    def blocks(self):
+        """Lists of values of the columns of each block"""
+        for rows, payload in self.block_headers():
+            yield decode_block(self.columns, rows, payload, self.codec)
+
+    def __iter__(self):
+        for values in self.blocks():
+            for row in izip(*values):
+                yield row
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_rows(path):
+    """Rows (tuples) of the columnar file"""
+    with Reader(path) as reader:
+        for row in reader:
+            yield row
+
+
+def write_indexed(path, columns, rows, block_rows=BLOCK_ROWS):
+    """Write the rows sorted by the first column with the index of its values
+
+    Args:
+        path (str): output file (the index is saved as path + INDEX_SUFFIX)
+        columns (list): tuples of name and type of the columns
+        rows (iterable): rows (tuples of values of the columns)
+
+    Kwargs:
+        block_rows (int): number of rows in one block
+
+    Returns: number of written rows
+
+    """
+    keys = OrderedDict()
+    count = 0
+    with Writer(path, columns, block_rows) as writer:
+        for row in sorted(rows, key=itemgetter(0)):
+            entry = keys.get(row[0])
+            if entry is None:
+                keys[row[0]] = [count // block_rows, count % block_rows, 1]
+            else:
+                entry[2] += 1
+            writer.write(row)
+            count += 1
+    with Reader(path) as reader:
+        offsets = reader.block_offsets()
+    with open(path + INDEX_SUFFIX, 'w') as outfile:
+        json.dump({'blocks': offsets, 'keys': keys}, outfile)
+    return count
+
+
+def read_indexed(path, key):
+    """Rows of the file written by write_indexed with the value of the first column
+
+    Returns: generator of tuples
+
+    """
+    with open(path + INDEX_SUFFIX) as infile:
+        index = json.load(infile)
+    entry = index['keys'].get(key)
+    if entry is None:
+        return
+    block, row, count = entry
+    with Reader(path) as reader:
+        while count > 0:
+            values = reader.block_at(index['blocks'][block])
+            rows = list(izip(*values))[row:row + count]
+            for found in rows:
+                yield found
+            count -= len(rows)
+            block += 1
+            row = 0
+
+
+def count_rows(path):
+    """Number of rows of the columnar file (blocks are not decompressed)"""
+    with Reader(path) as reader:
+        return sum(rows for rows, payload in reader.block_headers())
+
+
+def site_rows(sites, values, width):
+    """Rows of the key columns of the sites followed by their values
+
+    Args:
+        sites (list): list of Site
+        values (OrderedDict): values by site key in the order of the sites
+            (as returned by the functions of mirzag.features), None if missing
+        width (int): number of values of a site
+
+    Returns: generator of tuples
+
+    """
+    seen = set()
+    missing = (None,) * width
+    unique = []
+    for site in sites:
+        key = site[:4]
+        if key not in seen:
+            seen.add(key)
+            unique.append(key)
+    for key, value in izip(unique, values.itervalues()):
+        if value is None:
+            yield key + missing
+        elif width == 1:
+            yield key + (value,)
+        else:
+            yield key + tuple(value)
+
+
+def is_missing(value):
+    """Is the value read from a columnar file missing (NaN)"""
+    return value is None or value != value
+
+
+def _tostring(data):
+    if _SWAP:
+        data.byteswap()
+    return data.tostring()
+
+
+def _fromstring(typecode, data):
+    values = array(typecode)
+    values.fromstring(data)
+    if _SWAP:
+        values.byteswap()
+    return values.tolist()
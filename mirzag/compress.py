@@ -0,0 +1,207 @@
+"""
+Compressed outputs of the stages written in independent blocks on a pool
+of threads.
+
+Gzipped outputs are written as BGZF (as bgzip does): a series of gzip
+members of at most 64 kB of data each, which every gzip reader (and
+zcat) reads as one stream. Members are independent, so they are
+compressed in parallel (zlib releases the GIL) and written in order.
+Blocks of the columnar format (see mirzag/columnar.py) are compressed on
+the same pool, with zlib or, for intermediate files only, with the faster
+lz4 (optional, needs the lz4 package).
+
+Level, threads and codec are set once per script with configure() from
+the options added by add_arguments(); run_analysis.py passes them from the
+general settings compress_level, compress_threads and columnar_codec.
+"""
+
+__license__ = "GPL"
+
+import zlib
+import struct
+from collections import deque
+
+# level 9 of gzip.open costs a lot of time and saves little on the intermediate files
+DEFAULT_LEVEL = 6
+CODECS = ('zlib', 'lz4')
+# data of one BGZF block (as in bgzip, compressed block must stay below 64 kB)
+BGZF_BLOCK_SIZE = 0xff00
+# fixed header of a BGZF member: gzip header with the BC extra field (size of the member - 1)
+_BGZF_HEADER = struct.Struct('<4BI2BH2BHH')
+_GZIP_FOOTER = struct.Struct('<II')
+# empty member closing the BGZF file
+BGZF_EOF = ("\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43"
+            "\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00")
+
+_settings = {'level': DEFAULT_LEVEL, 'threads': 1, 'codec': 'zlib'}
+
+
+def add_arguments(parser):
+    """Add options of the compression of the outputs to the parser of a script"""
+    parser.add_argument("--compress-level",
+                        dest="compress_level",
+                        type=int,
+                        default=DEFAULT_LEVEL,
+                        help="Compression level of the outputs, defaults to %i" % DEFAULT_LEVEL)
+    parser.add_argument("--compress-threads",
+                        dest="compress_threads",
+                        type=int,
+                        default=1,
+                        help="Number of threads compressing the outputs, defaults to 1")
+    parser.add_argument("--codec",
+                        dest="codec",
+                        choices=CODECS,
+                        default="zlib",
+                        help="Codec of the blocks of columnar outputs, defaults to zlib")
+
+
+def configure(level=DEFAULT_LEVEL, threads=1, codec="zlib"):
+    """Set level, threads and codec used by the writers of the script"""
+    if codec not in CODECS:
+        raise ValueError("Unknown codec %s, use one of: %s" % (codec, ", ".join(CODECS)))
+    _settings.update({'level': level, 'threads': max(1, threads), 'codec': codec})
+
+
+def configure_from(options):
+    """Configure from the options added by add_arguments"""
+    configure(options.compress_level, options.compress_threads, options.codec)
+
+
+def settings():
+    return dict(_settings)
+
+
+def bgzf_block(data, level=DEFAULT_LEVEL):
+    """Compress the data (at most BGZF_BLOCK_SIZE bytes) into one BGZF member"""
+    body = _deflate(data, level)
+    if len(body) + _BGZF_HEADER.size + _GZIP_FOOTER.size > 0x10000:
+        # incompressible data grows, stored blocks fit
+        body = _deflate(data, 0)
+    size = len(body) + _BGZF_HEADER.size + _GZIP_FOOTER.size
+    return (_BGZF_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 0x42, 0x43, 2, size - 1)
+            + body
+            + _GZIP_FOOTER.pack(zlib.crc32(data) & 0xffffffff, len(data)))
+
+
+def _deflate(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_block(data, codec="zlib", level=DEFAULT_LEVEL):
+    """Compress a block of the columnar format"""
+    if codec == "lz4":
+        return _lz4().compress(data)
+    return zlib.compress(data, level)
+
+
+def decompress_block(data, codec="zlib"):
+    if codec == "lz4":
+        return _lz4().decompress(data)
+    return zlib.decompress(data)
+
+
+def _lz4():
+    try:
+        import lz4.block
+    except ImportError:
+        raise ImportError("Codec lz4 needs the lz4 package (pip install lz4)")
+    return lz4.block
+
+
+class OrderedPool(object):
+
+    """Run functions on a pool of threads and write their results in order
+
+    Args:
+        handle (file): output the results are written to
+
+    Kwargs:
+        threads (int): number of threads, with 1 the functions run right away
+
+    """
+
+    def __init__(self, handle, threads=1):
+        self.handle = handle
+        self.threads = threads
+        self.pending = deque()
+        self.pool = None
+        if threads > 1:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(threads)
+
+    def submit(self, func, *args):
+        if self.pool is None:
+            self.handle.write(func(*args))
+            return
+        self.pending.append(self.pool.apply_async(func, args))
+        # keep the memory bounded: few blocks per thread are in flight
+        while len(self.pending) > 2 * self.threads:
+            self.handle.write(self.pending.popleft().get())
+
+    def finish(self):
+        """Write results of all submitted functions and stop the threads"""
+        while self.pending:
+            self.handle.write(self.pending.popleft().get())
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+class BgzfWriter(object):
+
+    """File-like writer of the gzipped (BGZF) output
+
+    Args:
+        path (str): output file
+
+    Kwargs:
+        level (int): compression level, defaults to the configured one
+        threads (int): number of compressing threads, defaults to the configured one
+        mode (str): 'wb' or 'ab' to append members to the file
+
+    """
+
+    def __init__(self, path, level=None, threads=None, mode='wb'):
+        self.level = _settings['level'] if level is None else level
+        self.handle = open(path, mode)
+        self.pool = OrderedPool(self.handle, _settings['threads'] if threads is None else threads)
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= BGZF_BLOCK_SIZE:
+            data = "".join(self.buffer)
+            for start in xrange(0, len(data) - BGZF_BLOCK_SIZE + 1, BGZF_BLOCK_SIZE):
+                self.pool.submit(bgzf_block, data[start:start + BGZF_BLOCK_SIZE], self.level)
+            rest = data[len(data) - len(data) % BGZF_BLOCK_SIZE:]
+            self.buffer = [rest]
+            self.buffered = len(rest)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        if self.handle is None:
+            return
+        if self.buffered:
+            self.pool.submit(bgzf_block, "".join(self.buffer), self.level)
+        self.pool.finish()
+        self.handle.write(BGZF_EOF)
+        self.handle.close()
+        self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_output(path, mode='wb'):
+    """Open gzipped output of a stage (replaces gzip.open(path, 'wb'))"""
+    return BgzfWriter(path, mode=mode)
@@ -0,0 +1,439 @@
+"""
+MIRZA-based Branch Length Score (conservation) of the target sites.
+
+The site is searched in the multiple alignment of its UTR, homologous
+fragments are hybridized with the miRNA and the branch length of the tree
+of species with MIRZA score above threshold is reported.
+"""
+
+__license__ = "GPL"
+
+import os
+import re
+import sys
+import cPickle as cpickle
+
+from mirzag.mirza import run_mirza
+
+# dendropy, pandas and numpy are imported in the functions that need them:
+# scripts run with --onlyMIRZA yes import this module but never use them
+
+syserr = sys.stderr.write
+
+
+class Conservation(object):
+
+    """Phylogenetic tree and multiple alignments of UTRs kept in memory
+
+    Alignments are read from the directory (one pickle per UTR) when they
+    are needed for the first time and kept for the next calls.
+    """
+
+    def __init__(self, tree_path, alignment_dir, ref_org='hg19', threshold=50,
+                 context_len=50):
+        self.tree = read_phylogenetic_tree(tree_path)
+        self.alignment_dir = alignment_dir
+        self.ref_org = ref_org
+        self.threshold = threshold
+        self.context_len = context_len
+        self.alignments = {}
+
+    def alignment(self, mrnaid):
+        """Multiple alignment of the UTR, None if there is no alignment"""
+        if mrnaid not in self.alignments:
+            self.alignments.update(read_multiple_alignments(self.tree, self.alignment_dir, [(mrnaid,)]))
+            self.alignments.setdefault(mrnaid, None)
+        return self.alignments[mrnaid]
+
+    def branch_length_score(self, record, mirna_seq, mirzabin="MIRZA", workdir=None):
+        """Calculate conservation of the site hybridized by MIRZA
+
+        Args:
+            record (MirzaRecord): hybrid of the site
+            mirna_seq (str): sequence of the miRNA
+
+        Kwargs:
+            mirzabin (str): path to MIRZA binary
+            workdir (str): directory for temporary files of MIRZA
+
+        Returns: float or None if there is no alignment for the UTR
+
+        """
+        mrnaid = record.mrna.split(",")[0]
+        mln_frag = self.alignment(mrnaid)
+        if mln_frag is None:
+            return None
+        return calculate_conservation(phylotree=self.tree,
+                                      mrna_frag=record.mrna_hybrid.replace("-", "")[::-1],
+                                      mrnaid=mrnaid,
+                                      mirna={record.mirna: {org: mirna_seq[:21] for org in mln_frag}},
+                                      mirname=record.mirna,
+                                      mln_dict=mln_frag,
+                                      ref_org=self.ref_org,
+                                      threshold=self.threshold,
+                                      mrna_len=self.context_len,
+                                      mirzabin=mirzabin,
+                                      workdir=workdir)
+
+
+def calculate_mirza_for_mln(mRNAseqs, mRNAids, miRNAseq, miRNAid,
+        update='noupdate', context_len=50, mirzabin="MIRZA", workdir=None):
+    """Get the mirza results
+
+    Args:
+        mRNAseqs (@todo): @todo
+        mRNAids (@todo): @todo
+        miRNAseq (@todo): @todo
+        miRNAid (@todo): @todo
+
+    Kwargs:
+        update (str): update prior probability? defaults to noupdate
+        mirzabin (str): path to MIRZA binary
+        workdir (str): directory for temporary files of MIRZA
+
+    Returns: @todo
+
+    """
+    #
+    # Get MIRZA results
+    #
+    stdout = run_mirza(zip(mRNAids, mRNAseqs),
+                       {miRNAid: miRNAseq},
+                       mirzabin=mirzabin,
+                       update=update,
+                       context_len=context_len,
+                       workdir=workdir)
+
+    #
+    # Parse results into dictionary
+    out_dict = {}
+    for line in stdout.split("\n"):
+        if line.startswith(">"):
+            l = line.split()
+            try:
+                out_dict[l[0][1:]] = float(l[-1])
+            except TypeError, e:
+                raise e
+    return out_dict
+
+
+def extend_seq(mrnaseq, mrna_frag, total_length=50):
+    """Extend the sequence from both ends
+
+    Args:
+        mrnaseq (str): sequence (with gaps) to extend from
+        mrna_frag (str): sequence (with gaps) for extension
+
+    Kwargs:
+        total_length (int): length to extend to
+
+    Returns: @todo
+
+    """
+    #
+    # Prepare sequences with no gaps
+    #
+    mrnaseq_nogap = mrnaseq.replace("-", "")
+    mrna_frag_nogap = mrna_frag.replace("-", "")
+    #
+    # check if the sequence is shorter
+    #
+    if len(mrna_frag_nogap) > total_length:
+        syserr("mrnaseq_nogap: ", mrnaseq_nogap)
+        syserr("mrna_frag_nogap: ", mrna_frag_nogap)
+        syserr("mrnaseq: ", mrnaseq)
+        syserr("mrna_frag: ", mrna_frag)
+        raise Exception(
+            "Check your sequences maybe you should shrink, not extend them")
+    span = re.search(mrna_frag_nogap, mrnaseq_nogap).span()
+
+    # Decide which type of extension to do
+    from numpy import mean, median
+    gap_pos_mean = mean([i for i, x in enumerate(mrna_frag) if x == "-"])
+    list_median = median([i for i in range(len(mrna_frag))])
+
+    # this ratio gives us relative position of the gaps
+    ratio = gap_pos_mean / list_median
+
+    # Based on the ratio do the extension of the sequence
+    if ratio > 0.5 and ratio < 1.5:  # extend both sides
+        li = span[0]
+        ui = span[1]
+        length = ui - li
+        if length > total_length:
+            return -1
+        elif length == total_length:
+            return mrnaseq_nogap[li:ui]
+        else:
+            dif = total_length - length
+            quot = dif // 2  # this is explicit integer division
+            l_ext = li - quot  # TODO check if they are not lower than 0
+            u_ext = ui + (dif - quot)
+            if (l_ext < 0) or (u_ext > len(mrnaseq_nogap) - 1):
+                return "NA"
+            else:
+                return mrnaseq_nogap[l_ext:u_ext]
+    elif ratio <= 0.5:  # extend left - it means upstream (5'end)
+        li = span[0]
+        ui = span[1]
+        length = ui - li
+        dif = total_length - len(mrna_frag_nogap)
+        if (li - dif < 0):
+            return mrnaseq_nogap[:ui + abs(li - dif)]
+        else:
+            return mrnaseq_nogap[li - dif:ui]
+    elif ratio >= 1.5:  # extend right - it means downstream (3'end)
+        li = span[0]
+        ui = span[1]
+        length = ui - li
+        dif = total_length - len(mrna_frag_nogap)
+        # if there is noting to extend to the right
+        if ui + dif > len(mrnaseq_nogap):
+            return mrnaseq_nogap[li - ((ui + dif) - len(mrnaseq_nogap)):]
+        else:
+            return mrnaseq_nogap[li:ui + dif]
+
+
+def shrink_seq(mrnaseq, mrna_frag, mrna_frag_target, total_length=50):
+    """Extend the sequence from both ends
+
+    Args:
+        mrnaseq (str): sequence (with gaps) to extend from
+        mrna_frag (str): sequence (with gaps) for extension
+        mrna_frag_target (str): sequence of the target mRNA
+
+    Kwargs:
+        total_length (int): length to extend to
+
+    Returns: @todo
+
+    """
+    # Prepare sequences with no gaps
+    mrnaseq_nogap = mrnaseq.replace("-", "")
+    mrna_frag_nogap = mrna_frag.replace("-", "")
+    if len(mrna_frag_nogap) < total_length:
+        syserr(mrna_frag_nogap)
+        syserr(mrnaseq)
+        syserr(mrna_frag)
+        syserr(mrna_frag_target)
+        raise Exception(
+            "Check your sequences maybe you should extend, not shrink them")
+    span = re.search(mrna_frag_nogap, mrnaseq_nogap).span()
+
+    # Decide which type of extension to do
+    from numpy import mean, median
+    gap_pos_mean = mean(
+        [i for i, x in enumerate(mrna_frag_target) if x == "-"])
+    list_median = median([i for i in range(len(mrna_frag_target))])
+
+    # this ratio gives us relative position of the gaps
+    ratio = gap_pos_mean / list_median
+
+    # Based on the ratio do the shrinkage of the sequence
+    if ratio > 0.5 and ratio < 1.5:  # extend both sides
+        li = span[0]
+        ui = span[1]
+        length = ui - li
+        if length < total_length:
+            return -1
+        elif length == total_length:
+            return mrnaseq_nogap[li:ui]
+        else:
+            dif = abs(total_length - length)
+            quot = dif // 2  # this is explicit integer division
+            l_ext = li + quot
+            u_ext = ui - (dif - quot)
+            if (u_ext < 0) or (u_ext > len(mrnaseq_nogap) - 1):
+                return "NA"
+            else:
+                return mrnaseq_nogap[l_ext:u_ext]
+    elif ratio <= 0.5:  # trim left - it means upstream (5'end)
+        li = span[0]
+        ui = span[1]
+        length = ui - li
+        dif = len(mrna_frag_nogap) - total_length
+        return mrnaseq_nogap[li + dif:ui]
+    elif ratio >= 1.5:  # extend right - it means downstream (3'end)
+        li = span[0]
+        ui = span[1]
+        length = ui - li
+        dif = len(mrna_frag_nogap) - total_length
+        return mrnaseq_nogap[li:ui - dif]
+
+
+def scale(x, minimum, maximum):
+    """Scale number from 0 to 1
+
+    Args:
+        x (float): number to scale
+        minimum (float): minimum for the set
+        maximum (float): maximum for the set
+
+    Returns: float
+
+    """
+    return (x - minimum) / (maximum - minimum)
+
+
+def calculate_conservation(phylotree, mrna_frag, mrnaid, mirna, mirname,
+                           mln_dict, mrna_len, ref_org='hg19', threshold=50,
+                           mirzabin="MIRZA", workdir=None):
+    """Calculate conservation
+
+    Args:
+        phylotree (@todo): @todo
+        mrna_frag (@todo): @todo
+        mrnaid (@todo): @todo
+        mirna (@todo): @todo
+        mirname (@todo): @todo
+        mln_dict (@todo): @todo
+        mrna_len (@todo): @todo
+
+    Kwargs:
+        ref_org (@todo): @todo
+        threshold (@todo): @todo
+        mirzabin (str): path to MIRZA binary
+        workdir (str): directory for temporary files of MIRZA
+
+    Returns: float
+
+    """
+    #
+    # calculate total branch lengths of the tree
+    #
+    import dendropy
+    tree = dendropy.Tree(phylotree)
+    min_score = dendropy.Tree(phylotree)
+    min_score.retain_taxa_with_labels([ref_org])
+    total_branch_length = tree.length()
+    min_s = min_score.length() / total_branch_length
+    #
+    # get the dictionary with the homologous fragments
+    #
+    reg_pattern = re.compile("-*".join(list(mrna_frag)))
+    queries_dict = {}
+    for org in mln_dict.keys():
+        TSeq = mln_dict[org][0]
+        QSeq = mln_dict[org][1]
+        match = re.search(reg_pattern, TSeq)
+        if match != None and len(QSeq.replace("-", "")) >= mrna_len:
+            span = match.span()
+            tseq = TSeq[span[0]:span[1]]  # those are sequences with gaps
+            qseq = QSeq[span[0]:span[1]]
+            # Decide if we need to shrink or expand sequences
+            if len(qseq.replace("-", "")) < mrna_len:
+                myseq = extend_seq(QSeq, qseq, total_length=mrna_len)
+                queries_dict[org] = myseq
+                try:
+                    assert len(myseq) == mrna_len or myseq == "NA"
+                except AssertionError:
+                    message = "Error in extend_seq"
+                    raise Exception(message)
+            elif len(qseq.replace("-", "")) > mrna_len:
+                myseq = shrink_seq(QSeq, qseq, tseq, total_length=mrna_len)
+                queries_dict[org] = myseq
+                assert len(myseq) == mrna_len or myseq == "NA"
+            else:
+                if "-" in qseq:
+                    myseq = qseq.replace("-", "")
+                    assert len(myseq) == mrna_len or myseq == "NA"
+                else:
+                    myseq = qseq
+                queries_dict[org] = myseq
+        else:
+            queries_dict[org] = "NA"
+            myseq = "NA"
+    #
+    # for each found sequence calculate MIRZAscore
+    #
+    results_dict = {}
+    mrnas_dict = {}
+    for horg in queries_dict.keys():
+        if queries_dict[horg] != "NA":  # and mirna[mirname][horg] != "-" * 21:
+            mrnas_dict[horg] = queries_dict[horg]
+        else:
+            results_dict[horg] = "NA"
+
+    if len(mrnas_dict.keys()) > 0:
+        results_to_join_dict = calculate_mirza_for_mln(mrnas_dict.values(),
+                                                       mrnas_dict.keys(),
+                                                       mirna[mirname][horg],
+                                                       mirname,
+                                                       update='noupdate',
+                                                       context_len=mrna_len,
+                                                       mirzabin=mirzabin,
+                                                       workdir=workdir)
+    else:
+        results_to_join_dict = {}
+    #
+    # Join the dictionaries with scores and with NAs
+    #
+    results_dict = dict(results_to_join_dict.items() + results_dict.items())
+
+    # get the list of names where the mirza score is above threshold
+    names = [i for i in results_dict.keys() if
+             ((results_dict[i] >= threshold) and results_dict[i] != "NA")]
+    tree.retain_taxa_with_labels(names + [ref_org])
+    branch_length = tree.length()
+    conservation = scale(branch_length / float(total_branch_length), min_s, 1)
+    return conservation
+
+
+def read_phylogenetic_tree(path_to_file):
+    """Read phylogenetic tree
+
+    Args:
+        path_to_file (@todo): @todo
+
+    Returns: @todo
+
+    """
+    import dendropy
+    try:
+        phylo_tree = dendropy.Tree()
+        phylo_tree.read_from_path(path_to_file, "newick")
+    except IOError:
+        raise IOError("Cannot open phylogenetic tree %s" % path_to_file)
+
+    return phylo_tree
+
+
+def read_multiple_alignments(tree, directory_path, coordinates):
+    """Read MLN files into dict
+
+    Args:
+        tree (@todo): @todo
+        directory_path (@todo): @todo
+        coordinates (@todo): @todo
+
+    Returns: @todo
+
+    """
+    multiple_alignment_dict = {}
+    for coord in coordinates:
+        try:
+            handle = open(os.path.join(directory_path, coord[0]), 'rb')
+            multiple_alignment_dict[coord[0]] = cpickle.load(handle)
+        except Exception, e:
+            syserr("No alignment for %s, going on without it.\n" % coord[0])
+            syserr(str(e) + "\n")
+
+    return multiple_alignment_dict
+
+
+def make_homologues_mirnas(phylogenetic_tree, mirna_seqs):
+    """Make DataFrame with miRNAs for different species
+
+    Args:
+        phylogenetic_tree (@todo): @todo
+        mirna_seqs (@todo): @todo
+
+    Returns: @todo
+
+    """
+    import pandas as pd
+    species = [leaf.taxon.label for leaf in phylogenetic_tree.leaf_iter()]
+    mirhomologues = pd.DataFrame({sp: {mirid: mirna_seqs[mirid][:21]
+                                       for mirid in mirna_seqs.keys()}
+                                  for sp in species}).transpose()
+    return mirhomologues
@@ -0,0 +1,231 @@
+"""
+Cost model of the jobs of the analysis, used by run_analysis.py to submit
+the most expensive chunks first.
+
+Wall time (and peak memory) of a job of each stage is modeled as
+overhead + cost per site * number of sites of its chunk, fitted by least
+squares on the run statistics (see mirzag/runstats.py). Only the sums of the fit are kept so
+the model can be updated with the statistics of every run
+(`MIRZA_G_pipeline.py report --update-cost-model`). The number of sites of
+a chunk is known after seed counting; before that it is predicted from the
+sites found for the seeds of its miRNAs in the previous runs (miRNAs of one
+family share the seed and so have similar number of sites). For each
+output directory the model keeps the end of the newest job it used, so a
+run reported many times is only counted once.
+"""
+
+__license__ = "GPL"
+
+import os
+import json
+import gzip
+
+from mirzag import runstats
+from mirzag import columnar
+from mirzag.fasta import iter_fasta
+
+# stage of the run statistics (name of the script) that counts sites of the chunk
+SEED_STAGE = "rg_count_miRNA_seeds_and_filter_duplicates"
+# stages of the jobs of one chunk generated by run_analysis.py
+ANALYSIS_STAGES = [SEED_STAGE,
+                   "rg_calculate_MIRZA",
+                   "rg_calculate_contrafold",
+                   "rg_calculate_flanks_composition",
+                   "rg_calculate_distance",
+                   "rg_merge_results_add_probability_and_calculate_per_gene_score"]
+
+
+def mirna_seed(seq):
+    """Seed of the miRNA (nucleotides 2-8) in DNA alphabet"""
+    return str(seq)[1:8].upper().replace("U", "T")
+
+
+def read_seeds(path):
+    """Seeds of the miRNAs in the fasta file"""
+    with open(path) as infile:
+        return [mirna_seed(seq) for seqid, seq in iter_fasta(infile)]
+
+
+class CostModel(object):
+
+    """Per stage fits of wall time and memory on number of sites and sites per seed"""
+
+    def __init__(self, stages=None, seeds=None, ingested=None, memory=None, output=None):
+        # sums of n, x, y, xx, xy of the fit of wall time (seconds) and peak memory (kB) by stage
+        self.stages = stages or {}
+        self.memory = memory or {}
+        # total number of sites and bytes of the outputs by stage
+        self.output = output or {}
+        # total number of sites and number of observations by seed
+        self.seeds = seeds or {}
+        # end of the newest job used by output directory (the same run can be reported many times)
+        self.ingested = ingested or {}
+
+    @classmethod
+    def load(cls, path):
+        """Load the model, empty model if the file does not exist"""
+        if path is None or not os.path.exists(path):
+            return cls()
+        with open(path) as infile:
+            data = json.load(infile)
+        return cls(data.get('stages'), data.get('seeds'), data.get('ingested'), data.get('memory'), data.get('output'))
+
+    def save(self, path):
+        with open(path + ".tmp", 'w') as outfile:
+            json.dump({'stages': self.stages,
+                       'memory': self.memory,
+                       'output': self.output,
+                       'seeds': self.seeds,
+                       'ingested': self.ingested},
+                      outfile, indent=1, sort_keys=True)
+        os.rename(path + ".tmp", path)
+
+    def update(self, records, input_dir=None):
+        """Add finished jobs of a run to the model
+
+        Args:
+            records (list): run statistics (see runstats.load_records)
+
+        Kwargs:
+            input_dir (str): output directory of the run with the chunks of miRNAs (*.fa)
+
+        Returns: number of records used
+
+        """
+        directory = os.path.abspath(input_dir) if input_dir is not None else ""
+        watermark = self.ingested.get(directory)
+        records = [r for r in records if r.get('status') == 'ok' and r.get('end') is not None
+                   and (watermark is None or r['end'] > watermark)]
+        if records:
+            self.ingested[directory] = max(r['end'] for r in records)
+        chunk_sites = {r['chunk']: r['items']['sites'] for r in records
+                       if r.get('stage') == SEED_STAGE and 'sites' in r.get('items', {})}
+        used = 0
+        for record in records:
+            sites = record.get('items', {}).get('sites', chunk_sites.get(record['chunk']))
+            if sites is None or record.get('wall_time') is None:
+                continue
+            add_point(self.stages.setdefault(record['stage'], [0, 0.0, 0.0, 0.0, 0.0]), sites, record['wall_time'])
+            rss = max(record.get('max_rss_kb') or 0, record.get('children_max_rss_kb') or 0)
+            if rss:
+                add_point(self.memory.setdefault(record['stage'], [0, 0.0, 0.0, 0.0, 0.0]), sites, rss)
+            if record.get('output_bytes') is not None:
+                output = self.output.setdefault(record['stage'], [0.0, 0.0])
+                output[0] += sites
+                output[1] += record['output_bytes']
+            used += 1
+        if input_dir is not None:
+            for chunk, sites in chunk_sites.iteritems():
+                path = os.path.join(input_dir, chunk + ".fa")
+                if not os.path.exists(path):
+                    continue
+                seeds = read_seeds(path)
+                for seed in seeds:
+                    observed = self.seeds.setdefault(seed, [0.0, 0])
+                    observed[0] += float(sites) / len(seeds)
+                    observed[1] += 1
+        return used
+
+    def fit(self, stage):
+        """Overhead and time per site of the stage, None if the stage was never seen"""
+        if stage not in self.stages:
+            return None
+        return fit_line(self.stages[stage])
+
+    def predict_memory(self, stage, sites):
+        """Predicted peak memory (kB) of the job of the stage, None if it cannot be predicted"""
+        if sites is None or stage not in self.memory:
+            return None
+        overhead, per_site = fit_line(self.memory[stage])
+        return overhead + per_site * sites
+
+    def predict_output(self, stage, sites):
+        """Predicted size (bytes) of the output of the stage, None if it cannot be predicted"""
+        if sites is None or not self.output.get(stage, [0])[0]:
+            return None
+        total_sites, total_bytes = self.output[stage]
+        return total_bytes / total_sites * sites
+
+    def predict_sites(self, seeds):
+        """Number of sites of the chunk with miRNAs of these seeds"""
+        if not self.seeds:
+            return None
+        default = sum(total / count for total, count in self.seeds.itervalues()) / len(self.seeds)
+        sites = 0.0
+        for seed in seeds:
+            if seed in self.seeds:
+                sites += self.seeds[seed][0] / self.seeds[seed][1]
+            else:
+                sites += default
+        return sites
+
+    def predict(self, stages, sites):
+        """Predicted wall time of the jobs of the stages for a chunk with this many sites"""
+        if sites is None:
+            return None
+        total = 0.0
+        for stage in stages:
+            fit = self.fit(stage)
+            if fit is not None:
+                total += fit[0] + fit[1] * sites
+        return total
+
+    def chunk_cost(self, seedcount, fasta=None):
+        """Predicted wall time of all jobs of the chunk, 0 if it cannot be predicted
+
+        Args:
+            seedcount (str): seed matches of the chunk (may not exist yet)
+
+        Kwargs:
+            fasta (str): miRNAs of the chunk
+
+        Returns: float
+
+        """
+        return self.predict(ANALYSIS_STAGES, self.chunk_sites(seedcount, fasta)) or 0.0
+
+    def chunk_sites(self, seedcount, fasta=None):
+        """Number of sites of the chunk: known, counted or predicted from its miRNAs, None if unknown"""
+        sites = known_sites(seedcount)
+        if sites is None and fasta is not None:
+            sites = self.predict_sites(read_seeds(fasta))
+        elif sites is None and os.path.exists(seedcount):
+            sites = count_sites(seedcount)
+        return sites
+
+
+def add_point(sums, x, y):
+    """Add the point to the sums of the least squares fit"""
+    for index, value in enumerate([1, x, y, x * x, x * y]):
+        sums[index] += value
+
+
+def fit_line(sums):
+    """Intercept and slope (both non-negative) fitted from the sums n, x, y, xx, xy"""
+    n, sx, sy, sxx, sxy = sums
+    denominator = n * sxx - sx * sx
+    slope = (n * sxy - sx * sy) / denominator if denominator > 0 else 0.0
+    if slope < 0:
+        slope = 0.0
+    intercept = max((sy - slope * sx) / n, 0.0)
+    return intercept, slope
+
+
+def count_sites(seedcount):
+    """Number of sites in the seed matches (gzipped or columnar)"""
+    if columnar.is_columnar(seedcount):
+        return columnar.count_rows(seedcount)
+    with gzip.open(seedcount) as infile:
+        return sum(1 for line in infile)
+
+
+def known_sites(seedcount):
+    """Number of sites of the chunk with seed matches already calculated, None if unknown"""
+    try:
+        with open(runstats.sidecar_path(seedcount)) as infile:
+            record = json.load(infile)
+    except (IOError, ValueError):
+        return None
+    if record.get('status') != 'ok':
+        return None
+    return record.get('items', {}).get('sites')
@@ -0,0 +1,217 @@
+"""
+Estimate of the size and cost of a run before it is launched
+(`MIRZA_G_pipeline.py run --estimate`).
+
+For the seed protocol the seed matches of every miRNA are pre-counted in
+one pass over the UTRs (k-mers of the UTRs are looked up among the seed
+matches of all miRNAs instead of running one regular expression per miRNA),
+duplicated sites of a gene are filtered by hashes of their context and the
+sites are grouped into chunks as the run would do. Number of sites of each
+chunk is then turned into core-hours, output sizes and memory of each stage
+by the cost model (see mirzag/costmodel.py). For the scan protocol the
+windows scanned by MIRZA are counted.
+"""
+
+__license__ = "GPL"
+
+import math
+import random
+
+from mirzag.fasta import read_fasta
+from mirzag.seeds import seed_regex, get_indices
+from mirzag.costmodel import ANALYSIS_STAGES, SEED_STAGE
+
+# stages of the features that run in parallel after seed counting
+FEATURE_STAGES = ANALYSIS_STAGES[1:-1]
+MERGE_STAGE = ANALYSIS_STAGES[-1]
+
+
+def seed_matches(mirnas, how="TargetScan"):
+    """miRNA ids by the sequences of their seed matches in the target"""
+    matches = {}
+    for mirid, seq in mirnas.iteritems():
+        for match in set(seed_regex(seq, how).split("|")):
+            matches.setdefault(match, []).append(mirid)
+    return matches
+
+
+def count_seed_matches(utrs, mirnas, how="TargetScan", context=50, split_by=None,
+                       index_after_split=0, sample=1.0, seed=0):
+    """Number of sites of each miRNA in the UTRs (as seeds.scan_seeds would find)
+
+    Args:
+        utrs (dict): UTR sequences by id (DNA alphabet)
+        mirnas (dict): miRNA sequences by id (DNA alphabet)
+
+    Kwargs:
+        how (str): definition of the seed, see seeds.seed_regex
+        context (int): length of the sequence around the match
+        split_by (str): split UTR id by this string to get gene id
+        index_after_split (int): column to take after split, 0 based
+        sample (float): fraction of the UTRs to scan, counts are scaled back
+        seed (int): seed of the random sample
+
+    Returns: dict of number of sites by miRNA id
+
+    """
+    matches = seed_matches(mirnas, how)
+    lengths = sorted(set(len(match) for match in matches))
+    counts = dict.fromkeys(mirnas, 0)
+    # hashes of (gene, miRNA, context) of the sites found so far
+    seen = set()
+    rng = random.Random(seed)
+    for seqid, seq in utrs.iteritems():
+        if sample < 1.0 and rng.random() >= sample:
+            continue
+        gene = seqid.split(split_by)[index_after_split] if split_by else seqid
+        # matches of one miRNA do not overlap (as with re.finditer)
+        match_ends = {}
+        for length in lengths:
+            for index in xrange(len(seq) - length + 1):
+                mirids = matches.get(seq[index:index + length])
+                if mirids is None:
+                    continue
+                mirids = [mirid for mirid in mirids if match_ends.get(mirid, 0) <= index]
+                for mirid in mirids:
+                    match_ends[mirid] = index + length
+                lower_index, upper_index = get_indices(context, index, index + length)
+                if upper_index >= len(seq):
+                    mrna = seq[-1 * context:]
+                elif lower_index < 0:
+                    mrna = seq[:context]
+                else:
+                    mrna = seq[lower_index:upper_index]
+                if len(mrna) != context:
+                    continue
+                for mirid in mirids:
+                    key = hash((gene, mirid, mrna))
+                    if key not in seen:
+                        seen.add(key)
+                        counts[mirid] += 1
+    if sample < 1.0:
+        counts = {mirid: count / sample for mirid, count in counts.iteritems()}
+    return counts
+
+
+def count_windows(utrs, window_size=50, slide_size=20):
+    """Number of windows of the UTRs scanned by MIRZA in the scan protocol"""
+    return sum(max(0, (len(seq) - window_size) // slide_size + 1) for seq in utrs.itervalues())
+
+
+def estimate_seed(settings, model, parallelism=100, sample=1.0):
+    """Estimate of the run of the seed protocol
+
+    Args:
+        settings (dict): config file read with ConfigObj
+        model (CostModel): cost model of the stages
+
+    Kwargs:
+        parallelism (int): number of jobs running at the same time
+        sample (float): fraction of the UTRs to scan
+
+    Returns: dict
+
+    """
+    general = settings['general']
+    utrs = read_fasta(general['seqs'], to_dna=True)
+    mirnas = read_fasta(general['motifs'], to_dna=True)
+    seed_settings = settings['tasks']['CalculateSeedMatches']
+    counts = count_seed_matches(utrs, mirnas,
+                                how=seed_settings.get('how', 'TargetScan'),
+                                context=int(seed_settings.get('context', 50)),
+                                split_by=general.get('split_by', "NONE"),
+                                index_after_split=int(general.get('index_after_split', 0)),
+                                sample=sample)
+    mirnas_per_chunk = int(general.get('mirnas_per_chunk', 1))
+    mirids = list(mirnas)
+    chunks = [sum(counts[mirid] for mirid in mirids[index:index + mirnas_per_chunk])
+              for index in xrange(0, len(mirids), mirnas_per_chunk)]
+    stages = []
+    for stage in ANALYSIS_STAGES:
+        times = [model.predict([stage], sites) for sites in chunks] if model.fit(stage) else None
+        outputs = [model.predict_output(stage, sites) for sites in chunks]
+        memory = [model.predict_memory(stage, sites) for sites in chunks]
+        stages.append({'stage': stage,
+                       'jobs': len(chunks),
+                       'core_hours': sum(times) / 3600.0 if times is not None else None,
+                       'output_bytes': sum(outputs) if None not in outputs else None,
+                       'max_rss_kb': max(memory) if memory and None not in memory else None})
+    return {'protocol': 'seed',
+            'utrs': len(utrs),
+            'mirnas': len(mirnas),
+            'chunks': len(chunks),
+            'sites': sum(chunks),
+            # MIRZA and CONTRAfold are run once per site
+            'mirza_records': sum(chunks),
+            'contrafold_folds': sum(chunks),
+            'stages': stages,
+            'parallelism': parallelism,
+            'wall_hours': wall_hours(model, chunks, parallelism)}
+
+
+def estimate_scan(settings, parallelism=100, part_size=40000):
+    """Estimate of the run of the scan protocol (counts only)"""
+    general = settings['general']
+    utrs = read_fasta(general['seqs'], to_dna=True)
+    mirnas = read_fasta(general['motifs'], to_dna=True)
+    windows = count_windows(utrs)
+    return {'protocol': 'scan',
+            'utrs': len(utrs),
+            'mirnas': len(mirnas),
+            'chunks': int(math.ceil(windows / float(part_size))),
+            'windows': windows,
+            # MIRZA aligns each miRNA to each window
+            'mirza_records': windows * len(mirnas),
+            'stages': [],
+            'parallelism': parallelism,
+            'wall_hours': None}
+
+
+def wall_hours(model, chunks, parallelism):
+    """Lower bound of the wall time: all work spread on the slots or the longest chunk"""
+    if not chunks or any(model.fit(stage) is None for stage in ANALYSIS_STAGES):
+        return None
+    work = 0.0
+    longest = 0.0
+    for sites in chunks:
+        features = [model.predict([stage], sites) for stage in FEATURE_STAGES]
+        seed_count = model.predict([SEED_STAGE], sites)
+        merge = model.predict([MERGE_STAGE], sites)
+        work += seed_count + sum(features) + merge
+        longest = max(longest, seed_count + max(features) + merge)
+    return max(work / parallelism, longest) / 3600.0
+
+
+def format_estimate(estimate):
+    """Make a text report from the estimate"""
+    lines = ["Estimate of the %s protocol: %i UTRs, %i miRNAs in %i chunks" % (estimate['protocol'],
+                                                                           estimate['utrs'],
+                                                                           estimate['mirnas'],
+                                                                           estimate['chunks'])]
+    if estimate['protocol'] == 'seed':
+        lines.append("Sites: %i" % estimate['sites'])
+        lines.append("MIRZA records: %i" % estimate['mirza_records'])
+        lines.append("CONTRAfold folds: %i" % estimate['contrafold_folds'])
+    else:
+        lines.append("Windows: %i" % estimate['windows'])
+        lines.append("MIRZA records (windows x miRNAs): %i" % estimate['mirza_records'])
+    if estimate['stages']:
+        lines.append("")
+        lines.append("%-62s %6s %11s %11s %9s" % ("stage", "jobs", "core-hours", "output MB", "rss MB"))
+        for stage in estimate['stages']:
+            lines.append("%-62s %6i %11s %11s %9s" % (stage['stage'],
+                                                      stage['jobs'],
+                                                      _format(stage['core_hours'], 1.0),
+                                                      _format(stage['output_bytes'], 1024.0 ** 2),
+                                                      _format(stage['max_rss_kb'], 1024.0)))
+    lines.append("")
+    if estimate['wall_hours'] is not None:
+        lines.append("Wall time with %i jobs in parallel: at least %.2f hours" % (estimate['parallelism'],
+                                                                                estimate['wall_hours']))
+    else:
+        lines.append("Wall time: n/a (set cost_model in the config and update it with the reports of previous runs)")
+    return "\n".join(lines) + "\n"
+
+
+def _format(value, unit):
+    return "%.1f" % (value / unit) if value is not None else "n/a"
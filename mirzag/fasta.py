@@ -0,0 +1,405 @@
+"""
+Reading of sequences in FASTA format
+
+Stages that need only the UTRs of their sites read them through the index
+of the file (compatible with samtools faidx: id, length, offset of the
+sequence, bases and bytes per line). The index is built once and saved
+next to the file (seqs.fa.fai) and the sequences are read from the mapped
+file. It is checked against the file for every sequence read (header and
+end of the sequence) and as a whole (number of sequences) before ids that
+are not in it are trusted to be missing, so an index copied together with
+the file stays valid and a stale one is built again. Files that cannot be indexed (lines
+of a sequence of different lengths, spaces in sequences, ids given more
+than once) are read as a whole.
+"""
+
+__license__ = "GPL"
+
+import os
+import mmap
+from collections import OrderedDict
+
+INDEX_SUFFIX = ".fai"
+
+# sequences preloaded in the zygote (see mirzag/zygote.py), shared with the
+# forked jobs: tuples of plain and DNA sequences by identity of the file
+_preloaded = {}
+
+
+def iter_fasta(handle):
+    """Parse fasta records from the open file (as Bio.SeqIO does, without importing Biopython)
+
+    Id is the first word of the header, lines before the first header are
+    skipped and spaces in sequences are removed.
+
+    Returns: generator of (id, sequence)
+
+    """
+    seqid = None
+    lines = []
+    for line in handle:
+        if line.startswith(">"):
+            if seqid is not None:
+                yield seqid, "".join(lines).replace(" ", "").replace("\r", "")
+            title = line[1:].rstrip()
+            seqid = title.split(None, 1)[0] if title else ""
+            lines = []
+        elif seqid is not None:
+            lines.append(line.rstrip())
+    if seqid is not None:
+        yield seqid, "".join(lines).replace(" ", "").replace("\r", "")
+
+
+def read_fasta(path, to_dna=False, ids=None):
+    """Read fasta file into dictionary
+
+    Args:
+        path (str): path to the fasta file
+
+    Kwargs:
+        to_dna (bool): make sequences upper case and replace U with T
+        ids (iterable): read only sequences with these ids (through the index of the file), None for all
+
+    Returns: OrderedDict of sequences by id (in order of the file)
+
+    """
+    if ids is not None:
+        ids = set(ids)
+    if _preloaded:
+        preloaded = _preloaded.get(path_identity(path))
+        if preloaded is not None:
+            seqs = preloaded[1 if to_dna else 0]
+            if ids is None:
+                return OrderedDict(seqs)
+            return OrderedDict((seqid, seq) for seqid, seq in seqs.iteritems() if seqid in ids)
+    if ids is not None:
+        try:
+            with IndexedFasta(path) as indexed:
+                return indexed.read(ids, to_dna)
+        except ValueError:
+            # the file cannot be indexed
+            pass
+    seqs = OrderedDict()
+    try:
+        with open(path, 'Ur') as handle:
+            for seqid, seq in iter_fasta(handle):
+                if ids is not None and seqid not in ids:
+                    continue
+                if to_dna:
+                    seq = seq.upper().replace('U', 'T')
+                seqs[seqid] = seq
+    except IOError:
+        raise IOError('Cannot read from %s' % (path))
+    return seqs
+
+
+def build_index(path):
+    """Index the fasta file as samtools faidx does
+
+    Returns: OrderedDict of tuples (length, offset, bases per line, bytes per line) by id
+
+    Raises ValueError if the file cannot be indexed.
+
+    """
+    index = OrderedDict()
+    seqid = None
+    position = 0
+    try:
+        handle = open(path, 'rb')
+    except IOError:
+        raise IOError('Cannot read from %s' % (path))
+    with handle:
+        for line in handle:
+            position += len(line)
+            if line.startswith(">"):
+                if seqid is not None:
+                    index[seqid] = (length, offset, linebases, linewidth)
+                title = line[1:].rstrip()
+                if "\r" in title:
+                    raise ValueError("%s has lines ending with \\r only" % path)
+                seqid = title.split(None, 1)[0] if title else ""
+                if seqid in index:
+                    raise ValueError("Sequence %s is given more than once in %s" % (seqid, path))
+                length, offset, linebases, linewidth = 0, position, 0, 0
+                ended = False
+                continue
+            if seqid is None:
+                continue
+            data = line.rstrip("\r\n")
+            bases = len(data)
+            if not bases:
+                ended = True
+                continue
+            if ended or " " in data or "\r" in data or data.rstrip() != data:
+                raise ValueError("Sequence %s in %s has lines of different lengths or spaces" % (seqid, path))
+            if not linebases:
+                linebases, linewidth = bases, len(line)
+            elif bases > linebases or (line.endswith("\n") and len(line) - bases != linewidth - linebases):
+                raise ValueError("Sequence %s in %s has lines of different lengths" % (seqid, path))
+            ended = bases < linebases
+            length += bases
+    if seqid is not None:
+        index[seqid] = (length, offset, linebases, linewidth)
+    return index
+
+
+def read_index(path):
+    """Index saved next to the fasta file, None if there is none (or it cannot be read)"""
+    index = OrderedDict()
+    try:
+        with open(path + INDEX_SUFFIX) as handle:
+            for line in handle:
+                fields = line.rstrip("\r\n").split("\t")
+                index[fields[0]] = tuple(int(field) for field in fields[1:5])
+    except (IOError, ValueError, IndexError):
+        return None
+    return index
+
+
+def save_index(path, index):
+    """Save the index next to the fasta file (replaced at once for jobs reading it)
+
+    Returns: True if it was saved, False if the directory is not writable
+
+    """
+    tmp_path = "%s%s.%i.tmp" % (path, INDEX_SUFFIX, os.getpid())
+    try:
+        with open(tmp_path, 'w') as handle:
+            for seqid, entry in index.iteritems():
+                handle.write("%s\t%i\t%i\t%i\t%i\n" % ((seqid,) + entry))
+        os.rename(tmp_path, path + INDEX_SUFFIX)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+def ensure_index(path):
+    """Build the index of the fasta file and save it next to the file if it changed
+
+    Returns: True if the file has an up-to-date index
+
+    """
+    try:
+        index = build_index(path)
+    except (IOError, ValueError):
+        return False
+    if read_index(path) == index:
+        return True
+    return save_index(path, index)
+
+
+class IndexedFasta(object):
+
+    """Fasta file read through its index (see the module documentation)
+
+    Args:
+        path (str): path to the fasta file
+
+    The index is read from the .fai file next to the fasta file, or built
+    and saved there if possible. Raises ValueError if the file cannot be
+    indexed.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.handle = open(path, 'rb')
+        except IOError:
+            raise IOError('Cannot read from %s' % (path))
+        size = os.fstat(self.handle.fileno()).st_size
+        # empty files cannot be mapped
+        self.data = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ) if size else ""
+        self.built = False
+        self.checked = False
+        self.index = read_index(path)
+        if self.index is None:
+            self.rebuild()
+
+    def rebuild(self):
+        self.index = build_index(self.path)
+        self.built = True
+        self.checked = True
+        save_index(self.path, self.index)
+
+    def __contains__(self, seqid):
+        if seqid not in self.index and not self.checked:
+            self.check()
+        return seqid in self.index
+
+    def __len__(self):
+        self.check()
+        return len(self.index)
+
+    def keys(self):
+        self.check()
+        return self.index.keys()
+
+    def length(self, seqid):
+        """Length of the sequence"""
+        return self.entry(seqid)[0]
+
+    def entry(self, seqid):
+        """Entry of the index checked against the file, the index is built again if it is stale"""
+        entry = self.index[seqid]
+        if not self.is_valid(seqid, entry):
+            self.check()
+            entry = self.index[seqid]
+        return entry
+
+    def check(self, ids=None):
+        """Build the index again if any of the sequences (all by default) does not match it
+
+        The whole index is checked (once) also if any of the ids is not in it,
+        the file may have sequences that a stale index does not know about.
+
+        """
+        if self.checked:
+            return
+        if ids is not None and all(seqid in self.index for seqid in ids):
+            if all(self.is_valid(seqid, self.index[seqid]) for seqid in ids):
+                return
+        elif self.count_headers() == len(self.index) and all(self.is_valid(seqid, entry)
+                                                              for seqid, entry in self.index.iteritems()):
+            self.checked = True
+            return
+        if self.built:
+            raise ValueError("Index of %s does not match the file" % self.path)
+        self.rebuild()
+
+    def count_headers(self):
+        """Number of lines of the file that start with >"""
+        count = 1 if self.data[:1] == ">" else 0
+        position = self.data.find("\n>")
+        while position != -1:
+            count += 1
+            position = self.data.find("\n>", position + 2)
+        return count
+
+    def is_valid(self, seqid, entry):
+        """Does the sequence start after its header and end where the index says"""
+        length, offset, linebases, linewidth = entry
+        end = self.position(entry, length)
+        if offset < 1 or end > len(self.data) or self.data[offset - 1] != "\n":
+            return False
+        start = self.data.rfind("\n>", 0, offset - 1) + 1
+        if self.data[start] != ">" or self.data.find("\n", start, offset - 1) != -1:
+            return False
+        title = self.data[start + 1:offset].rstrip()
+        if (title.split(None, 1)[0] if title else "") != seqid:
+            return False
+        # the next line starts the next sequence, is empty or the file ends
+        rest = self.data[end:end + 3].lstrip("\r\n")
+        return not rest or rest[0] == ">"
+
+    def position(self, entry, base):
+        """Offset in the file of the base of the sequence (or of its end)"""
+        length, offset, linebases, linewidth = entry
+        if base <= 0 or not linebases:
+            return offset
+        # the end of the sequence is right after its last base, not at the start of the next line
+        return offset + ((base - 1) // linebases) * linewidth + (base - 1) % linebases + 1
+
+    def fetch(self, seqid, start=0, end=None):
+        """Sequence or its part (from start to end, as in slicing)
+
+        Args:
+            seqid (str): id of the sequence
+
+        Kwargs:
+            start (int): first base (0-based)
+            end (int): end of the part (exclusive), None for the end of the sequence
+
+        Returns: str
+
+        """
+        entry = self.entry(seqid)
+        start, end, _ = slice(start, end).indices(entry[0])
+        if start >= end:
+            return ""
+        data = self.data[self.position(entry, start + 1) - 1:self.position(entry, end)]
+        return data.replace("\n", "").replace("\r", "")
+
+    def read(self, ids, to_dna=False):
+        """Sequences with the ids (that are in the file)
+
+        Returns: OrderedDict of sequences by id (in order of the file)
+
+        """
+        self.check(ids)
+        seqs = OrderedDict()
+        for seqid in self.index:
+            if seqid in ids:
+                seq = self.fetch(seqid)
+                seqs[seqid] = seq.upper().replace('U', 'T') if to_dna else seq
+        return seqs
+
+    def close(self):
+        if self.data:
+            self.data.close()
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def path_identity(path):
+    """Device, inode, size and modification time of the file (the same for its links), None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+def preload(path):
+    """Keep the sequences of the fasta file in memory, read_fasta of the file
+    (or of a link to it) returns them without reading the file
+
+    Returns: True if the file was read now, False if it was preloaded already
+
+    """
+    identity = path_identity(path)
+    if identity is None:
+        raise IOError('Cannot read from %s' % (path))
+    if identity in _preloaded:
+        return False
+    seqs = read_fasta(path)
+    dna = OrderedDict()
+    for seqid, seq in seqs.iteritems():
+        converted = seq.upper().replace('U', 'T')
+        # most UTRs are DNA already, the same string is kept only once
+        dna[seqid] = seq if converted == seq else converted
+    _preloaded[identity] = (seqs, dna)
+    return True
+
+
+def as_dict(sequences, to_dna=False):
+    """Make dictionary of sequences from dict, list of (id, sequence) or path
+
+    Args:
+        sequences (dict, list or str): sequences or path to fasta file
+
+    Kwargs:
+        to_dna (bool): make sequences upper case and replace U with T
+
+    Returns: OrderedDict of sequences by id
+
+    """
+    if isinstance(sequences, basestring):
+        return read_fasta(sequences, to_dna)
+    if isinstance(sequences, dict):
+        sequences = sequences.iteritems()
+    seqs = OrderedDict()
+    for seqid, seq in sequences:
+        seq = str(seq)
+        # sequences kept in memory are usually converted already
+        if to_dna and (not seq.isupper() or 'U' in seq):
+            seq = seq.upper().replace('U', 'T')
+        seqs[str(seqid)] = seq
+    return seqs
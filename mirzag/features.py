@@ -0,0 +1,355 @@
+"""
+Features of the target sites used by the MIRZA-G models: MIRZA score,
+accessibility (CONTRAfold), flanks composition and distance to the
+boundary of the UTR.
+
+Each function takes a list of sites and sequences of UTRs and returns an
+OrderedDict of values by site key (see mirzag.sites.site_key), None means
+that the feature could not be calculated for the site.
+"""
+
+__license__ = "GPL"
+
+import os
+import sys
+import csv
+import gzip
+import shutil
+import tempfile
+import subprocess
+from itertools import izip
+from collections import OrderedDict
+
+from mirzag import runstats
+from mirzag import columnar
+from mirzag.fasta import as_dict
+from mirzag.sites import site_key, read_sites
+from mirzag.seeds import distance_to_boundary
+from mirzag.mirza import run_mirza, parse_mirza_output, is_executable
+
+# names of the features as used by the models
+FEATURES = ['ContraScoreTargetSite',
+            'MIRZAscore',
+            'MIRZABranchLengthScoreFill',
+            'distToBoundary',
+            'flanksG',
+            'flanksA',
+            'flanksC',
+            'flanksU']
+
+
+def mirza_hybrids(sites, mirnas, mirzabin="MIRZA", context_len=50, workdir=None):
+    """Hybridize the sites with their miRNAs with MIRZA
+
+    Every site is hybridized once with all miRNAs of the sites in one MIRZA
+    run and only the pairs that are in sites are reported.
+
+    Args:
+        sites (list): list of Site with context sequences
+        mirnas (dict): miRNA sequences by id
+
+    Kwargs:
+        mirzabin (str): path to MIRZA binary
+        context_len (int): length of the context sequences
+        workdir (str): directory for temporary files
+
+    Returns: OrderedDict of MirzaRecord by site key
+
+    """
+    mirnas = as_dict(mirnas)
+    fragments = OrderedDict()
+    for site in sites:
+        fragment_id = "%s,%s,%s" % (site.id, site.beg, site.end)
+        if fragment_id not in fragments:
+            fragments[fragment_id] = (site.seq, set())
+        fragments[fragment_id][1].add(site.mirna)
+    used_mirnas = {mirid: mirnas[mirid][:21] for mirid in set(site.mirna for site in sites)}
+    runstats.count('mirnas', len(used_mirnas))
+
+    hybrids = OrderedDict((site_key(site), None) for site in sites)
+    output = run_mirza([(fid, value[0]) for fid, value in fragments.iteritems()],
+                       used_mirnas,
+                       mirzabin=mirzabin,
+                       context_len=context_len,
+                       workdir=workdir)
+    for record in parse_mirza_output(output, used_mirnas):
+        # MIRZA hybridizes every site with every miRNA - keep only the pairs from sites
+        if record.mrna not in fragments or record.mirna not in fragments[record.mrna][1]:
+            continue
+        if len(used_mirnas[record.mirna]) < 21:
+            continue
+        mrnaid, beg, end = record.mrna.split(",")
+        hybrids["%s,%s,%s,%s" % (mrnaid, record.mirna, beg, end)] = record
+    return hybrids
+
+
+def mirza_scores(sites, mirnas, mirzabin="MIRZA", context_len=50, workdir=None):
+    """Calculate MIRZA score of the sites, see mirza_hybrids
+
+    Returns: OrderedDict of MIRZA scores by site key
+
+    """
+    hybrids = mirza_hybrids(sites, mirnas, mirzabin, context_len, workdir)
+    return OrderedDict((key, record.score if record is not None else None)
+                       for key, record in hybrids.iteritems())
+
+
+def accessibility(sites, utrs, contrabin="contrafold", context=50,
+                  context_len_l=14, context_len_u=0, workdir=None):
+    """Calculate accessibility of the sites with CONTRAfold
+
+    Accessibility is the difference of log partition function of the
+    fragment with the site (and context_len_l upstream, context_len_u downstream)
+    constrained to be unpaired and the unconstrained one.
+
+    Args:
+        sites (list): list of Site
+        utrs (dict): UTR sequences by id
+
+    Kwargs:
+        contrabin (str): path to CONTRAfold binary
+        context (int): length of the sequence to fold on each side of the site
+        context_len_l (int): length of unpaired region upstream of the site
+        context_len_u (int): length of unpaired region downstream of the site
+        workdir (str): directory for temporary files
+
+    Returns: OrderedDict of accessibility by site key
+
+    """
+    utrs = as_dict(utrs)
+    scores = OrderedDict((site_key(site), None) for site in sites)
+    fragments = OrderedDict()
+    for site in sites:
+        fragment_id = ",".join(str(c) for c in [site.id, site.beg, site.end])
+        # the same site can be targeted by several miRNAs and it is enough to fold it once
+        fragments.setdefault(fragment_id, []).append(site)
+
+    dirpath = tempfile.mkdtemp(prefix="contrafold_", dir=workdir)
+    try:
+        folded = 0
+        for fragment_id, fragment_sites in fragments.iteritems():
+            site = fragment_sites[0]
+            if site.id not in utrs:
+                continue
+            mrnasequ = utrs[site.id]
+            coor_len = site.end - site.beg
+            lower_index = context - context_len_l
+            upper_index = context + context_len_u + coor_len
+            mrna_fragment = mrnasequ[site.beg - context:site.end + context]
+            if len(mrnasequ) >= upper_index and lower_index >= 0 \
+                    and len(mrna_fragment) == 2 * context + coor_len:
+                with open(os.path.join(dirpath, fragment_id + ".bpseq"), 'w') as mrnainput:
+                    bpseq = []
+                    for i in range(1, len(mrna_fragment) + 1):
+                        if i >= lower_index + 1 and i <= upper_index:
+                            bpseq.append('%i\t%s\t%i' % (i, mrna_fragment[i - 1], 0))
+                        else:
+                            bpseq.append('%i\t%s\t%i' % (i, mrna_fragment[i - 1], -1))
+                    mrnainput.write("\n".join(bpseq))
+                folded += 1
+        if folded == 0:
+            return scores
+
+        inputs = os.path.join(dirpath, "*.bpseq")
+        unwinded = run_contrafold("%s predict %s --constraints --partition" % (contrabin, inputs))
+        winded = run_contrafold("%s predict %s --partition" % (contrabin, inputs))
+        runstats.count('folds', len(unwinded) + len(winded))
+        for (fragment_id, unw), (fragment_id_w, w) in izip(unwinded, winded):
+            for site in fragments[fragment_id]:
+                scores[site_key(site)] = unw - w
+    finally:
+        shutil.rmtree(dirpath, ignore_errors=True)
+    return scores
+
+
+def run_contrafold(command):
+    """Run CONTRAfold and parse log partition coefficients
+
+    Returns: list of (name of the bpseq file without extension, coefficient)
+
+    """
+    contrarun = subprocess.Popen(command,
+                                 shell=True,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+    stdout, stderr = contrarun.communicate()
+    return [(os.path.basename(line.split()[4]).split(".bpseq")[0], float(line.split()[-1]))
+            for line in stdout.splitlines()]
+
+
+def flanks_composition(sites, utrs, context_len=50):
+    """Calculate nucleotide composition of the flanks of the sites
+
+    Args:
+        sites (list): list of Site
+        utrs (dict): UTR sequences by id
+
+    Kwargs:
+        context_len (int): length of the flank on each side
+
+    Returns: OrderedDict of (G, A, C, U) fractions by site key
+
+    """
+    utrs = as_dict(utrs)
+    scores = OrderedDict()
+    for site in sites:
+        scores[site_key(site)] = None
+        if site.id not in utrs:
+            continue
+        mrnasequ = utrs[site.id]
+        coorlen = site.end - site.beg
+        lower_seq = mrnasequ[site.beg - context_len: site.beg]
+        upper_seq = mrnasequ[site.end: site.end + context_len]
+        seq_len = (len(lower_seq) + len(upper_seq) + coorlen)
+        if site.beg - context_len >= 0 and site.end <= len(mrnasequ) \
+                and seq_len == (2 * context_len + coorlen):
+            scores[site_key(site)] = calculate_flanks_composition(lower_seq, upper_seq)
+        else:
+            sys.stderr.write("Flanks out of boarders\n")
+    return scores
+
+
+def calculate_flanks_composition(lower_seq, upper_seq):
+    """Fractions of G, A, C and T/U in the flanks"""
+    extr_seq = lower_seq + upper_seq
+    extr_seq = extr_seq.upper().replace('U', 'T')
+    length = float(len(extr_seq))
+    return (extr_seq.count('G') / length,
+            extr_seq.count('A') / length,
+            extr_seq.count('C') / length,
+            extr_seq.count('T') / length)
+
+
+def distances_to_boundary(sites, utrs):
+    """Calculate distance of the sites to the closest end of the UTR
+
+    Returns: OrderedDict of distances by site key
+
+    """
+    utrs = as_dict(utrs)
+    scores = OrderedDict()
+    for site in sites:
+        if site.id in utrs:
+            scores[site_key(site)] = distance_to_boundary(len(utrs[site.id]), site.beg)
+        else:
+            scores[site_key(site)] = None
+    return scores
+
+
+def compute_features(sites, utrs, mirnas, mirzabin="MIRZA", contrabin="contrafold",
+                     context=50, context_len_l=14, context_len_u=0, conservation=None,
+                     workdir=None):
+    """Calculate all features of the sites used by the models
+
+    Args:
+        sites (list): list of Site (e.g. from mirzag.scan_seeds)
+        utrs (dict, list of (id, sequence) or path to fasta): UTR sequences
+        mirnas (dict, list of (id, sequence) or path to fasta): miRNA sequences
+
+    Kwargs:
+        mirzabin (str): path to MIRZA binary
+        contrabin (str): path to CONTRAfold binary
+        context (int): length of the context sequences
+        context_len_l (int): length of unpaired region upstream of the site
+        context_len_u (int): length of unpaired region downstream of the site
+        conservation (mirzag.conservation.Conservation): tree and alignments to
+            calculate conservation with, defaults to None (not calculated)
+        workdir (str): directory for temporary files
+
+    Returns: OrderedDict of dicts of features (see FEATURES) by site key
+
+    """
+    if not is_executable(mirzabin):
+        raise Exception("Path to MIRZA is invalid (%s)!" % mirzabin)
+    if not is_executable(contrabin):
+        raise Exception("Path to CONTRAfold is invalid (%s)!" % contrabin)
+    utrs = as_dict(utrs)
+    mirnas = as_dict(mirnas)
+    hybrids = mirza_hybrids(sites, mirnas, mirzabin, context, workdir)
+    access = accessibility(sites, utrs, contrabin, context, context_len_l, context_len_u, workdir)
+    flanks = flanks_composition(sites, utrs, context)
+    distances = distances_to_boundary(sites, utrs)
+
+    features = OrderedDict()
+    for site in sites:
+        key = site_key(site)
+        composition = flanks[key] or (None, None, None, None)
+        record = hybrids[key]
+        bls = None
+        if conservation is not None and record is not None:
+            bls = conservation.branch_length_score(record, mirnas[site.mirna], mirzabin, workdir)
+        features[key] = {'ContraScoreTargetSite': access[key],
+                         'MIRZAscore': record.score if record is not None else None,
+                         'MIRZABranchLengthScoreFill': bls,
+                         'distToBoundary': distances[key],
+                         'flanksG': composition[0],
+                         'flanksA': composition[1],
+                         'flanksC': composition[2],
+                         'flanksU': composition[3]}
+    return features
+
+
+def read_features(coords, accessibility, mirza, flanks, distance):
+    """Read features of the sites from the outputs of the pipeline scripts
+
+    Outputs in the columnar format (see mirzag/columnar.py) are joined on
+    the key columns, the keys are formatted only for the returned dict.
+
+    Args:
+        coords (str): coordinate file with the sites
+        accessibility (str): output of rg_calculate_contrafold.py
+        mirza (str): output of rg_calculate_MIRZA.py
+        flanks (str): output of rg_calculate_flanks_composition.py
+        distance (str): output of rg_calculate_distance.py
+
+    Returns: dict of dicts of features (as strings or floats) by site key
+
+    """
+    key_columns = columnar.is_columnar(coords)
+    if key_columns:
+        data = {site[:4]: {} for site in read_sites(coords, context=False)}
+    else:
+        data = {site_key(site): {} for site in read_sites(coords, context=False)}
+    for sid, (ascore,) in site_values(accessibility, key_columns):
+        if sid in data:
+            data[sid].update({'ContraScoreTargetSite': ascore})
+    for sid, (score, bls) in site_values(mirza, key_columns):
+        if sid in data:
+            data[sid].update({'MIRZAscore': score,
+                              'MIRZABranchLengthScoreFill': bls})
+    for sid, (dist,) in site_values(distance, key_columns):
+        if sid in data:
+            data[sid].update({'distToBoundary': dist})
+    for sid, (flanks_g, flanks_a, flanks_c, flanks_u) in site_values(flanks, key_columns):
+        if sid in data:
+            data[sid].update({'flanksG': flanks_g,
+                              'flanksU': flanks_u})
+    if key_columns:
+        data = {"%s,%s,%i,%i" % key: features for key, features in data.iteritems()}
+    return data
+
+
+def site_values(path, key_columns=False):
+    """Site keys and values from the output of a pipeline script in either format
+
+    Args:
+        path (str): gzipped table with the site key in the first column or columnar file
+
+    Kwargs:
+        key_columns (bool): return keys as tuples of id, miRNA, begin and end
+            instead of "id,miRNA,begin,end"
+
+    Returns: generator of (key, tuple of values)
+
+    """
+    if columnar.is_columnar(path):
+        for row in columnar.read_rows(path):
+            yield (row[:4] if key_columns else "%s,%s,%i,%i" % row[:4]), row[4:]
+    else:
+        with gzip.open(path) as f:
+            for row in csv.reader(f, delimiter='\t'):
+                if key_columns:
+                    mrnaid, mirna, beg, end = row[0].split(",")
+                    yield (mrnaid, mirna, int(beg), int(end)), tuple(row[1:])
+                else:
+                    yield row[0], tuple(row[1:])
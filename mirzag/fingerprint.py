@@ -0,0 +1,177 @@
+"""
+Fingerprints of the inputs of a run, used to reuse results of a previous
+run for the miRNAs that did not change (incremental runs).
+
+A run fingerprint covers everything that is shared by all miRNAs: models,
+settings of the tasks and the protocol. Each miRNA has its own fingerprint
+(id and the 21 nucleotides used by the pipeline) and so does each UTR
+(its sequence). The manifest (fingerprints.json in the output directory)
+keeps the run fingerprint, the UTR fingerprints and the miRNA fingerprints
+of each chunk.
+"""
+
+__license__ = "GPL"
+
+import os
+import json
+import shutil
+import hashlib
+
+from mirzag.models import registry_paths
+
+MANIFEST_NAME = "fingerprints.json"
+
+# outputs of the stages of the seed protocol for each chunk (file name is chunk + suffix)
+ARTIFACT_SUFFIXES = ['.fa', '.seedcount', '.mirza', '.contrafold', '.flanks', '.distance', '.patch', '.score',
+                     '.sites', '.sites.index', '.sweep', '.models']
+
+# settings that change how the jobs are run but not the results (sequences
+# are compared one by one)
+EXECUTION_SETTINGS = ['motifs', 'seqs', 'template', 'executer', 'mirnas_per_chunk',
+                      'chunks_per_job', 'node_cache_dir', 'node_cache_size', 'cost_model',
+                      'job_priorities', 'learn_resources', 'mem_margin', 'mem_escalation',
+                      'mem_min', 'mem_max', 'mem_resources', 'queue_limits', 'queue', 'mem_req', 'modules',
+                      'batch_size', 'compress_level', 'compress_threads', 'columnar_codec',
+                      'zygote', 'zygote_socket', 'zygote_idle_timeout', 'results_database',
+                      'collect_timeout', 'collect_queue', 'collect_mem_req']
+
+# sequences and genes of UTRs that changed since the previous run (not .fa
+# as the chunks of miRNAs) and suffix of the chunks calculated for them
+UPDATE_SEQS = "utrs.update.fasta"
+UPDATE_GENES = "utrs.update.genes"
+UPDATE_SUFFIX = ".update"
+
+
+def mirna_fingerprint(mirid, seq):
+    """Fingerprint of the miRNA: id and first 21 nucleotides as used by MIRZA"""
+    seq = str(seq)[:21].upper().replace("U", "T")
+    return hashlib.sha1("%s\t%s" % (mirid, seq)).hexdigest()
+
+
+def sequence_fingerprints(seqs):
+    """Fingerprints of the sequences by id"""
+    return {seqid: hashlib.sha1(str(seq).upper().replace("U", "T")).hexdigest()
+            for seqid, seq in seqs.iteritems()}
+
+
+def gene_id(seqid, split_by=None, index_after_split=0):
+    """Gene of the UTR as used when duplicated sites are filtered"""
+    return seqid.split(split_by)[index_after_split] if split_by else seqid
+
+
+def changed_genes(previous, current, split_by=None, index_after_split=0):
+    """Genes with UTRs that were added, removed or changed
+
+    Sites are filtered per gene so all UTRs of such genes have to be scanned
+    again.
+
+    Args:
+        previous (dict): fingerprints of UTRs by id of the previous run
+        current (dict): fingerprints of UTRs by id
+
+    Kwargs:
+        split_by (str): split UTR id by this string to get gene id
+        index_after_split (int): column to take after split, 0 based
+
+    Returns: set of gene ids
+
+    """
+    return set(gene_id(seqid, split_by, index_after_split)
+               for seqid in set(previous) | set(current)
+               if previous.get(seqid) != current.get(seqid))
+
+
+def file_digest(path, blocksize=1 << 20):
+    """SHA1 of the content of the file"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(blocksize), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def result_settings(settings):
+    """Settings of the config that influence the results"""
+    if isinstance(settings, dict):
+        return {key: result_settings(value) for key, value in settings.iteritems()
+                if key not in EXECUTION_SETTINGS}
+    return settings
+
+
+def run_fingerprint(settings, protocol="seed", version=None):
+    """Fingerprint of the inputs shared by all miRNAs of the run
+
+    Args:
+        settings (dict): config file read with ConfigObj
+
+    Kwargs:
+        protocol (str): protocol of MIRZA-G
+        version (str): version of the pipeline
+
+    Returns: str
+
+    """
+    general = settings['general']
+    files = {'model_with_bls': file_digest(general['model_with_bls']),
+             'model_without_bls': file_digest(general['model_without_bls'])}
+    # registries of the models scored next to the GLMs
+    for path in registry_paths(general):
+        files['models:' + path] = file_digest(path)
+    if general.get('run_only_MIRZA', 'yes') == 'no':
+        tree = settings['tasks']['CalculateMIRZA'].get('phylogenetic_tree')
+        if tree is not None and os.path.isfile(tree):
+            files['phylogenetic_tree'] = file_digest(tree)
+    description = {'files': files,
+                   'settings': result_settings(settings),
+                   'protocol': protocol,
+                   'version': version}
+    return hashlib.sha1(json.dumps(description, sort_keys=True)).hexdigest()
+
+
+def load_manifest(output_dir):
+    """Load the manifest of the previous run, None if there is none"""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as infile:
+            return json.load(infile)
+    except ValueError:
+        return None
+
+
+def save_manifest(output_dir, manifest):
+    """Save the manifest (atomically, it is read by the next run)"""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", 'w') as outfile:
+        json.dump(manifest, outfile, indent=1, sort_keys=True)
+    os.rename(path + ".tmp", path)
+
+
+def is_chunk_finished(output_dir, chunk):
+    """Was the last stage of the chunk finished successfully"""
+    score = os.path.join(output_dir, chunk + ".score")
+    try:
+        with open(score + ".stats.json") as infile:
+            return os.path.exists(score) and json.load(infile).get('status') == "ok"
+    except (IOError, ValueError):
+        return False
+
+
+def read_genes(path):
+    """Read set of gene ids (one per line)"""
+    with open(path) as infile:
+        return set(line.strip() for line in infile if line.strip())
+
+
+def remove_chunk(output_dir, chunk):
+    """Remove all outputs of the chunk (with their run statistics and digests)"""
+    for name in [chunk, chunk + UPDATE_SUFFIX]:
+        for suffix in ARTIFACT_SUFFIXES:
+            for path in [os.path.join(output_dir, name + suffix),
+                         os.path.join(output_dir, name + suffix + ".stats.json"),
+                         os.path.join(output_dir, name + suffix + ".digest")]:
+                if os.path.exists(path):
+                    os.remove(path)
+        # journal of the unfinished MIRZA job (see mirzag/journal.py)
+        shutil.rmtree(os.path.join(output_dir, name + ".mirza.journal"), ignore_errors=True)
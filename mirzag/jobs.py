@@ -0,0 +1,174 @@
+"""
+Job graph of the analysis built in memory and submitted in one pass.
+
+run_analysis.py adds all groups and jobs of the run to a :class:`JobGraph`
+(jobs depend on other :class:`Job` objects, not on ids of the scheduler)
+and then submits the graph. Consecutive jobs of one stage with the same
+cluster options are packed by `chunks_per_job` (1, i.e. no packing, if
+not set) into a single cluster job, so the number of client calls (and of
+jobs waiting in the queue) drops accordingly. Memory requests (e.g.
+learned for each chunk, see mirzag/resources.py) only have to be of the
+same power of two: the pack asks for the largest request of its jobs.
+"""
+
+__license__ = "GPL"
+
+import math
+
+from mirzag import cache
+from mirzag.nodecache import parse_size
+
+DEFAULT_CHUNKS_PER_JOB = 1
+# resources (-l name=size) with the memory of the job
+MEMORY_RESOURCES = ('membycore', 'h_vmem', 'mem_free')
+
+
+class Job(object):
+
+    """Job of the graph, id is known after the submission"""
+
+    def __init__(self, command, settings, output=None, key=None):
+        self.command = command
+        self.settings = settings
+        self.output = output
+        self.key = key
+        self.id = None
+
+    @property
+    def name(self):
+        return self.settings.get('name')
+
+    @property
+    def dependencies(self):
+        return [job for job in self.settings.get('dependencies', []) if job is not None]
+
+
+class JobGraph(object):
+
+    """Groups and jobs of the run in the order in which they are submitted
+
+    Args:
+        pipeline_dir (str): directory of the pipeline (for the digest records)
+
+    Kwargs:
+        chunks_per_job (int): number of consecutive jobs of a stage run by one cluster job
+
+    """
+
+    def __init__(self, pipeline_dir, chunks_per_job=DEFAULT_CHUNKS_PER_JOB):
+        self.pipeline_dir = pipeline_dir
+        self.chunks_per_job = max(1, int(chunks_per_job))
+        self.entries = []
+
+    @property
+    def jobs(self):
+        return [entry for entry in self.entries if isinstance(entry, Job)]
+
+    def start_group(self, settings):
+        self.entries.append(('start', settings))
+
+    def end_group(self):
+        self.entries.append(('end', None))
+
+    def job(self, command, settings, output=None, key=None, cacheable=True):
+        """Add the job unless its output is cached (see mirzag/cache.py)
+
+        Args:
+            command (str): command of the job
+            settings (dict): settings of the job for Jobber, dependencies are Jobs
+
+        Kwargs:
+            output (str): output of the job, a digest record is saved for it
+            key (str): key of the job
+            cacheable (bool): can the job be skipped if its output is cached
+
+        Returns: Job or None if the job was skipped
+
+        """
+        if output is not None and cacheable and cache.is_cached(output, key):
+            return None
+        job = Job(command, settings, output, key)
+        self.entries.append(job)
+        return job
+
+    def submit(self, jobber):
+        """Submit groups and jobs with Jobber, returns number of submitted cluster jobs"""
+        submitted = 0
+        pack = []
+        for entry in self.entries + [None]:
+            if pack and (not isinstance(entry, Job)
+                         or len(pack) == self.chunks_per_job
+                         or _packing_key(entry) != _packing_key(pack[0])):
+                self._submit_pack(jobber, pack)
+                submitted += 1
+                pack = []
+            if isinstance(entry, Job):
+                pack.append(entry)
+            elif entry is not None and entry[0] == 'start':
+                jobber.startGroup(entry[1])
+            elif entry is not None:
+                jobber.endGroup()
+        return submitted
+
+    def _submit_pack(self, jobber, pack):
+        commands = []
+        dependencies = []
+        for job in pack:
+            if job.output is not None:
+                # stale output must not be taken for the new one (e.g. by rg_collect_results.py)
+                cache.remove_output(job.output)
+                commands.append(cache.with_record(job.command, self.pipeline_dir, job.output, job.key))
+            else:
+                commands.append(job.command)
+            for dependency in job.dependencies:
+                if dependency.id not in dependencies:
+                    dependencies.append(dependency.id)
+        settings = dict(pack[0].settings)
+        settings['dependencies'] = dependencies
+        if 'options' in settings:
+            settings['options'] = _pack_options([job.settings.get('options', []) for job in pack])
+        if len(commands) == 1:
+            command = commands[0]
+        else:
+            # each chunk runs in its own subshell, the job fails with the first failed chunk
+            command = "set -e\n" + "\n".join("(\n%s\n)" % command.rstrip() for command in commands)
+        job_id = jobber.job(command, settings)
+        for job in pack:
+            job.id = job_id
+
+
+def _packing_key(job):
+    # chunks are ordered by cost, so the first job of the pack has the highest priority
+    options = job.settings.get('options', [])
+    memory = [_memory_mb(option) for option in options if _memory_mb(option) is not None]
+    return (job.name,
+            [option for option in options if option[0] != 'p' and _memory_mb(option) is None],
+            int(math.ceil(math.log(max(memory), 2))) if memory else None)
+
+
+def _memory_mb(option):
+    """Memory in MB of the option, None if it is not a memory request"""
+    if option[0] != 'l' or "=" not in option[1]:
+        return None
+    name, value = option[1].split("=", 1)
+    if name not in MEMORY_RESOURCES:
+        return None
+    return max(parse_size(value) / 1024.0 ** 2, 1.0)
+
+
+def _pack_options(options):
+    """Options of the first job of the pack with the largest memory requests of all its jobs"""
+    largest = {}
+    for job_options in options:
+        for option in job_options:
+            memory = _memory_mb(option)
+            if memory is not None:
+                name = option[1].split("=", 1)[0]
+                largest[name] = max(largest.get(name, 0), memory)
+    packed = []
+    for option in options[0]:
+        if _memory_mb(option) is not None:
+            name = option[1].split("=", 1)[0]
+            option = (option[0], "%s=%iM" % (name, int(math.ceil(largest[name]))))
+        packed.append(option)
+    return packed
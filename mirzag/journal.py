@@ -0,0 +1,78 @@
+"""
+Journal of batches for long running stages that can be preempted.
+
+The input is processed in batches and the results of each batch are
+committed to the journal directory atomically (written to a temporary file
+and renamed). When the job is started again, batches already in the
+journal are skipped. The journal is valid only for the same input and
+settings: it keeps their fingerprint and is cleared if it does not match.
+At the end the batches are concatenated into the output and the journal is
+removed.
+"""
+
+__license__ = "GPL"
+
+import os
+import json
+import errno
+import shutil
+
+FINGERPRINT_NAME = "fingerprint.json"
+
+
+class Journal(object):
+
+    """Journal of batches in the directory
+
+    Args:
+        path (str): journal directory (must survive the job, i.e. not in $TMPDIR)
+        fingerprint (str): fingerprint of the input and settings of the job
+
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        if self.read_fingerprint() != fingerprint:
+            self.clear()
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(os.path.join(path, FINGERPRINT_NAME + ".tmp"), 'w') as outfile:
+            json.dump({'fingerprint': fingerprint}, outfile)
+        os.rename(os.path.join(path, FINGERPRINT_NAME + ".tmp"), os.path.join(path, FINGERPRINT_NAME))
+
+    def read_fingerprint(self):
+        try:
+            with open(os.path.join(self.path, FINGERPRINT_NAME)) as infile:
+                return json.load(infile).get('fingerprint')
+        except (IOError, ValueError):
+            return None
+
+    def batch_path(self, index):
+        return os.path.join(self.path, "batch_%06i" % index)
+
+    def is_done(self, index):
+        """Was the batch committed"""
+        return os.path.exists(self.batch_path(index))
+
+    def commit(self, index, lines):
+        """Save the results of the batch atomically"""
+        path = self.batch_path(index)
+        with open(path + ".tmp", 'w') as outfile:
+            for line in lines:
+                outfile.write(line)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.rename(path + ".tmp", path)
+
+    def concatenate(self, outfile, batches):
+        """Write the results of the batches in order into the open output file"""
+        for index in xrange(batches):
+            with open(self.batch_path(index)) as infile:
+                shutil.copyfileobj(infile, outfile)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,154 @@
+"""
+Running MIRZA and parsing its output
+"""
+
+__license__ = "GPL"
+
+import os
+import sys
+import shutil
+import tempfile
+import itertools
+import subprocess
+from collections import namedtuple
+
+from mirzag import runstats
+
+# one hybrid reported by MIRZA: mRNA 3'->5' as in the output
+MirzaRecord = namedtuple('MirzaRecord', ['mrna', 'mirna', 'score', 'mirna_hybrid', 'hybrid', 'mrna_hybrid'])
+
+
+def run_mirza(mrnas, mirnas, mirzabin="MIRZA", update='noupdate', context_len=None,
+              workdir=None, prefix="mirza_"):
+    """Hybridize every mRNA fragment with every miRNA in one MIRZA run
+
+    Args:
+        mrnas (list): list of (id, sequence) of mRNA fragments, all of the same length
+        mirnas (dict): miRNA sequences by id
+
+    Kwargs:
+        mirzabin (str): path to MIRZA binary
+        update (str): update prior probability? defaults to noupdate
+        context_len (int): skip fragments of other length, defaults to None
+        workdir (str): directory for MIRZA input files, defaults to system temporary
+        prefix (str): prefix of the temporary directory
+
+    Returns: str, output of MIRZA
+
+    Raises an Exception when MIRZA fails (e.g. it was killed for its
+    memory), so a partial output is never taken for sites without hybrids.
+
+    """
+    if context_len is not None:
+        for key, value in mrnas:
+            if len(value) != context_len:
+                sys.stderr.write("Skipped %s because of wrong length\n" % key)
+        mrnas = [(key, value) for key, value in mrnas if len(value) == context_len]
+    if not mrnas or not mirnas:
+        return ""
+    tmpdir = tempfile.mkdtemp(prefix=prefix, dir=workdir)
+    try:
+        mrna_path = os.path.join(tmpdir, 'mirza_mrna_input.fa')
+        mirna_path = os.path.join(tmpdir, 'mirza_mirna_input.fa')
+        expr_path = os.path.join(tmpdir, 'mirza_mirna_expressions.fa')
+        try:
+            with open(mrna_path, 'w') as mrnainput:
+                for key, value in mrnas:
+                    mrnainput.write('>%s\n%s\n' % (key, value))
+            # MIRZA does not like dashes in the miRNA ids
+            with open(mirna_path, 'w') as mirnainput, open(expr_path, 'w') as expressions:
+                for mirid, mirseq in sorted(mirnas.items()):
+                    mirnainput.write('>%s\n%s\n' % (mirid.replace('-', ''), mirseq))
+                    expressions.write('%s\t1\n' % (mirid))
+        except IOError:
+            raise IOError('Cannot write into the MIRZA input files')
+        runstats.count('mirza_runs')
+        runstats.count('mirza_records', len(mrnas) * len(mirnas))
+        mirza_command = [mirzabin, expr_path, mrna_path, mirna_path,
+                         str(len(mrnas[0][1])), update]
+        mirzarun = subprocess.Popen(mirza_command,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        stdout, stderr = mirzarun.communicate()
+        if mirzarun.returncode != 0:
+            raise Exception("MIRZA exited with code %i: %s" % (mirzarun.returncode, stderr))
+        return stdout
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def get_mirna_id(header, mirnas):
+    """Get the id of the miRNA from the header of MIRZA record
+
+    Args:
+        header (str): header line of MIRZA record (starts with >)
+        mirnas (dict): miRNAs sequences by miRNA id that were given to MIRZA
+
+    Returns: str
+
+    """
+    if len(mirnas) == 1:
+        return mirnas.keys()[0]
+    # MIRZA reports the miRNA as written in the fasta file i.e. without dashes
+    mirid = header.split()[4][1:]
+    if mirid in mirnas:
+        return mirid
+    for mirnaid in mirnas:
+        if mirnaid.replace('-', '') == mirid:
+            return mirnaid
+    raise Exception("Unknown miRNA %s in MIRZA output" % mirid)
+
+
+def parse_mirza_output(output, mirnas):
+    """Parse records from MIRZA output
+
+    Args:
+        output (str): output of MIRZA
+        mirnas (dict): miRNAs sequences by miRNA id that were given to MIRZA
+
+    Yields: MirzaRecord
+
+    """
+    for key, group in itertools.groupby(output.splitlines(), lambda x: x == ""):
+        if key:
+            continue
+        header = None
+        mirhyb = hyb = mrhyb = None
+        for line in group:
+            if line.startswith(">"):
+                header = line
+            elif line.startswith("miRNA"):
+                mirhyb = line.split("\t")[1].split(" ")[0]
+            elif line.startswith("A L"):
+                hyb = line.split("\t")[1].rstrip()
+            elif line.startswith("mRNA"):
+                mrhyb = line.split("\t")[1].split(" ")[0]
+        if header is None:
+            continue
+        yield MirzaRecord(header.split()[0][1:],
+                          get_mirna_id(header, mirnas),
+                          float(header.split()[-1]),
+                          mirhyb,
+                          hyb,
+                          mrhyb)
+
+
+def is_executable(program):
+    """
+    Check if the path/binary provided is valid executable
+    """
+    def is_exe(fpath):
+        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
+
+    fpath, fname = os.path.split(program)
+    if fpath:
+        if is_exe(program):
+            return True
+    else:
+        for path in os.environ["PATH"].split(os.pathsep):
+            path = path.strip('"')
+            exe_file = os.path.join(path, program)
+            if is_exe(exe_file):
+                return True
+
+    return False
@@ -0,0 +1,166 @@
+"""
+Registry of the models of the probabilities of the sites.
+
+The merge scores the sites with the two GLMs of the pipeline (statsmodels
+pickles of model_with_bls and model_without_bls). To evaluate other
+models (e.g. retrained ones) on the same features, their coefficients are
+kept in a registry: a JSON file with a list of models, each with a name,
+the intercept, the coefficients of the features (columns of the features
+as in mirzag.scoring, MIRZAscore as its logarithm) and the scaling factor
+of the inverse logit (see mirzag.scoring.scaled_logit_inverse)::
+
+    {"models": [{"name": "without_bls",
+                 "intercept": -3.10242,
+                 "coefficients": {"MIRZAscore": 0.251635, ...},
+                 "scaling_factor": 0.24}]}
+
+The registry loads without statsmodels (bin/rg-export-models.py exports
+the pickles into it, data/glm-models.json has the models of the
+pipeline). Probabilities of all models are calculated in one product of
+the matrix of the features with the matrix of the coefficients.
+"""
+
+__license__ = "GPL"
+
+import json
+from collections import OrderedDict
+
+DEFAULT_SCALING_FACTOR = 0.24
+
+
+class Model(object):
+
+    """Coefficients of one model
+
+    Args:
+        name (str): name of the model (of its column in the outputs)
+        intercept (float): intercept of the linear predictor
+        coefficients (dict): coefficients by column of the features
+
+    Kwargs:
+        scaling_factor (float): scaling of the inverse logit
+
+    """
+
+    def __init__(self, name, intercept, coefficients, scaling_factor=DEFAULT_SCALING_FACTOR):
+        self.name = str(name)
+        self.intercept = float(intercept)
+        self.coefficients = OrderedDict((str(column), float(value)) for column, value in coefficients.items())
+        self.scaling_factor = float(scaling_factor)
+
+    @classmethod
+    def from_glm(cls, name, glm, scaling_factor=DEFAULT_SCALING_FACTOR):
+        """Model from the fitted statsmodels GLM (or the path to its pickle), intercept first"""
+        from mirzag.scoring import load_model
+        params = load_model(glm).params
+        columns = params.keys().tolist()
+        return cls(name, params.values[0], OrderedDict(zip(columns[1:], params.values[1:])), scaling_factor)
+
+    def to_dict(self):
+        return OrderedDict([('name', self.name),
+                            ('intercept', self.intercept),
+                            ('coefficients', self.coefficients),
+                            ('scaling_factor', self.scaling_factor)])
+
+    def __repr__(self):
+        return "Model(%r, %i features)" % (self.name, len(self.coefficients))
+
+
+def load_registry(path):
+    """Models of the registry
+
+    Returns: list of Model
+
+    """
+    with open(path) as infile:
+        try:
+            registry = json.load(infile, object_pairs_hook=OrderedDict)
+            models = [Model(entry['name'], entry['intercept'], entry['coefficients'],
+                            entry.get('scaling_factor', DEFAULT_SCALING_FACTOR))
+                      for entry in registry['models']]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError("Invalid registry of models %s: %s" % (path, str(e)))
+    return models
+
+
+def save_registry(path, models):
+    """Write the models into the registry"""
+    with open(path, 'w') as outfile:
+        json.dump({'models': [model.to_dict() for model in models]}, outfile, indent=1, separators=(',', ': '))
+        outfile.write("\n")
+
+
+def load_models(paths):
+    """Models of the registries, in their order
+
+    Args:
+        paths (list): registries (or one comma-separated str), models that
+                      are loaded already are kept
+
+    Returns: list of Model
+
+    """
+    if isinstance(paths, basestring):
+        paths = [path for path in paths.split(",") if path]
+    models = []
+    for path in paths:
+        if isinstance(path, Model):
+            models.append(path)
+        else:
+            models.extend(load_registry(path))
+    names = [model.name for model in models]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError("Models with the same name: %s" % ", ".join(duplicates))
+    return models
+
+
+def registry_paths(general):
+    """Registries of the general setting models of the config (list or comma-separated str)"""
+    paths = general.get('models', [])
+    if isinstance(paths, basestring):
+        paths = paths.split(",")
+    return [path.strip() for path in paths if path.strip()]
+
+
+def probabilities(data, models):
+    """Probabilities of the sites from each of the models
+
+    The features used by any of the models form one matrix which is
+    multiplied with the coefficients of all models at once. A probability
+    is missing (NaN) when a feature used by its model is missing.
+
+    Args:
+        data (pandas.DataFrame): features of the sites (columns as in mirzag.scoring)
+        models (list): list of Model
+
+    Returns: numpy.ndarray with a row per site and a column per model
+
+    """
+    import numpy as np
+    if not models:
+        return np.zeros((len(data), 0))
+    columns = []
+    for model in models:
+        for feature in model.coefficients:
+            if feature not in data:
+                raise ValueError("Model %s uses unknown feature %s" % (model.name, feature))
+            if feature not in columns:
+                columns.append(feature)
+    features = data[columns].astype(np.float).values.reshape(len(data), len(columns))
+    weights = np.zeros((len(columns), len(models)))
+    uses = np.zeros((len(columns), len(models)))
+    for j, model in enumerate(models):
+        for feature, value in model.coefficients.iteritems():
+            weights[columns.index(feature), j] = value
+            uses[columns.index(feature), j] = 1.0
+    missing = np.isnan(features)
+    linear = np.where(missing, 0.0, features).dot(weights) + np.array([model.intercept for model in models])
+    linear[missing.astype(np.float).dot(uses) > 0] = np.nan
+    scaled = np.array([model.scaling_factor for model in models]) * np.exp(linear)
+    return scaled / (scaled + 1.0)
+
+
+def column(model):
+    """Column of the probabilities of the model in the scored sites"""
+    return "Probability %s" % (model if isinstance(model, basestring) else model.name)
@@ -0,0 +1,173 @@
+"""
+Node-local cache of the inputs shared by the jobs (UTRs, miRNAs).
+
+Jobs on the cluster copy their inputs to $TMPDIR. Large inputs shared by
+all jobs are instead copied once per node into a cache directory (e.g. on
+local scratch) under their content digest, calculated by run_analysis.py
+when the jobs are generated. The copy is made under a lock and renamed
+into place, so concurrent jobs on the node wait for one copy instead of
+making their own, and the copy is checked against the digest. Jobs link
+the cached file into $TMPDIR (hard link when the cache is on the same file
+system, symbolic link otherwise). The least recently used files are
+removed when the cache grows over its size limit, but not while a job
+holds the shared lock of the file: while it is being linked and, for a
+symbolic link, as long as the job runs.
+"""
+
+__license__ = "GPL"
+
+import os
+import errno
+import time
+import fcntl
+import hashlib
+
+LOCK_SUFFIX = ".lock"
+TMP_SUFFIX = ".tmp"
+
+_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """Size in bytes of the size given as e.g. 500M or 20G"""
+    size = str(size).strip().upper().rstrip("B")
+    if size and size[-1] in _UNITS:
+        return int(float(size[:-1]) * _UNITS[size[-1]])
+    return int(size)
+
+
+def fetch(source, digest, cache_dir, link, max_size=None):
+    """Link the cached copy of the source, copy it into the cache first if needed
+
+    The file is used under a shared lock, so it is not evicted while it is
+    linked. A hard link keeps the content even if the file is evicted later,
+    a symbolic link does not: then the lock is returned as a lease, which
+    has to stay open as long as the link is used (see hold).
+
+    Args:
+        source (str): path to the input on the shared file system
+        digest (str): content digest of the input (name of the cached file)
+        cache_dir (str): node-local cache directory
+        link (str): path of the link to make (e.g. seqs.fa in $TMPDIR)
+
+    Kwargs:
+        max_size (int): size of the cache in bytes, None for no limit
+
+    Returns: tuple of True if the input was already cached and the lease
+             (open lock file) for a symbolic link, None for a hard link
+
+    """
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    cached = os.path.join(cache_dir, digest)
+    hit = True
+    lock = open(cached + LOCK_SUFFIX, 'a')
+    try:
+        while True:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            if os.path.exists(cached):
+                break
+            # the lock is released before it is taken exclusively, so the file
+            # is checked again under the shared lock after the copy
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # another job could have copied it while we waited for the lock
+                if not os.path.exists(cached):
+                    hit = False
+                    copy_checked(source, cached + TMP_SUFFIX, digest)
+                    os.rename(cached + TMP_SUFFIX, cached)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        # time of the last use for the eviction (which waits for the shared lock)
+        os.utime(cached, None)
+        if os.path.lexists(link):
+            os.remove(link)
+        try:
+            os.link(cached, link)
+            lease = None
+        except OSError:
+            os.symlink(cached, link)
+            lease = lock
+    except BaseException:
+        lock.close()
+        raise
+    if lease is None:
+        lock.close()
+    if max_size is not None:
+        evict(cache_dir, max_size, keep=[digest])
+    return hit, lease
+
+
+def copy_checked(source, target, digest, blocksize=1 << 20):
+    """Copy the source and check the content digest of the copy (SHA1 as in mirzag.cache)"""
+    sha1 = hashlib.sha1()
+    with open(source, 'rb') as infile:
+        with open(target, 'wb') as outfile:
+            for block in iter(lambda: infile.read(blocksize), ''):
+                sha1.update(block)
+                outfile.write(block)
+    if sha1.hexdigest() != digest:
+        os.remove(target)
+        raise IOError("Copy of %s does not match its digest %s (it changed since the jobs were generated)" % (source, digest))
+
+
+def hold(lease, pid, interval=5.0):
+    """Keep the lease in a background process until the process pid (the job) exits"""
+    if os.fork() != 0:
+        # the lock stays with the open file in the child
+        lease.close()
+        return
+    try:
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        while True:
+            try:
+                os.kill(pid, 0)
+            except OSError as e:
+                if e.errno != errno.EPERM:
+                    break
+            time.sleep(interval)
+    finally:
+        os._exit(0)
+
+
+def evict(cache_dir, max_size, keep=()):
+    """Remove the least recently used files until the cache fits in max_size bytes
+
+    Returns: list of removed digests
+
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(LOCK_SUFFIX) or name.endswith(TMP_SUFFIX) or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for mtime, size, name in entries)
+    removed = []
+    for mtime, size, name in sorted(entries):
+        if total <= max_size:
+            break
+        if name in keep:
+            continue
+        with open(os.path.join(cache_dir, name + LOCK_SUFFIX), 'a') as lock:
+            # a file that is being copied or linked, or used through a symbolic link, is not removed
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                continue
+            try:
+                os.remove(os.path.join(cache_dir, name))
+                total -= size
+                removed.append(name)
+            except OSError:
+                pass
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    return removed
@@ -0,0 +1,105 @@
+"""
+The seed protocol of MIRZA-G run in one process: seed matches, features,
+probabilities and per gene scores without intermediate files.
+"""
+
+__license__ = "GPL"
+
+import os
+
+from mirzag.fasta import as_dict
+from mirzag.seeds import scan_seeds
+from mirzag.features import compute_features
+from mirzag.scoring import score, per_gene_scores, load_model
+from mirzag.models import load_models, registry_paths
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "data")
+MODEL_WITH_BLS = os.path.join(DATA_DIR, "glm-with-bls.bin")
+MODEL_WITHOUT_BLS = os.path.join(DATA_DIR, "glm-without-bls.bin")
+
+
+def predict(utrs, mirnas, mirzabin="MIRZA", contrabin="contrafold",
+            model_bls=MODEL_WITH_BLS, model_nobls=MODEL_WITHOUT_BLS,
+            how="TargetScan", context=50, context_len_l=14, context_len_u=0,
+            split_by=None, index_after_split=0, threshold=0.12, conservation=None,
+            workdir=None, models=()):
+    """Predict targets of miRNAs in UTRs with the seed protocol
+
+    The same settings as in the [general] and [tasks] sections of the
+    config file are accepted.
+
+    Args:
+        utrs (dict, list of (id, sequence) or path to fasta): UTR sequences
+        mirnas (dict, list of (id, sequence) or path to fasta): miRNA sequences
+
+    Kwargs:
+        mirzabin (str): path to MIRZA binary
+        contrabin (str): path to CONTRAfold binary
+        model_bls (str or model): model with branch length score
+        model_nobls (str or model): model without branch length score
+        how (str): definition of the seed
+        context (int): length of the context of the sites
+        context_len_l (int): length of unpaired region upstream of the site
+        context_len_u (int): length of unpaired region downstream of the site
+        split_by (str): split UTR id by this string to get gene id
+        index_after_split (int): column to take after split, 0 based
+        threshold (float): minimal probability of a site to be summed per gene
+        conservation (mirzag.conservation.Conservation): tree and alignments,
+            defaults to None (conservation is not calculated)
+        workdir (str): directory for temporary files of MIRZA and CONTRAfold
+        models (list or str): models of the registry (mirzag.models.Model) or
+            paths of the registries, their probabilities are added to the sites
+
+    Returns: tuple of pandas.DataFrame with sites and list of per gene scores
+             (gene id, miRNA, score without conservation, score with conservation)
+
+    """
+    utrs = as_dict(utrs, to_dna=True)
+    mirnas = as_dict(mirnas, to_dna=True)
+    sites = scan_seeds(utrs, mirnas, how=how, context=context, split_by=split_by,
+                       index_after_split=index_after_split)
+    features = compute_features(sites, utrs, mirnas, mirzabin=mirzabin, contrabin=contrabin,
+                                context=context, context_len_l=context_len_l,
+                                context_len_u=context_len_u, conservation=conservation,
+                                workdir=workdir)
+    models = load_models(models)
+    scored = score(features, load_model(model_bls), load_model(model_nobls),
+                   only_mirza=conservation is None, models=models)
+    return scored, per_gene_scores(scored, threshold, split_by, index_after_split)
+
+
+def settings_from_config(settings):
+    """Make keyword arguments of predict from the config of the pipeline
+
+    Args:
+        settings (dict): config file read with ConfigObj
+
+    Returns: dict
+
+    """
+    general = settings['general']
+    tasks = settings.get('tasks', {})
+    seed_settings = tasks.get('CalculateSeedMatches', {})
+    contrafold_settings = tasks.get('CalculateCONTRAfold', {})
+    kwargs = {'mirzabin': general['mirza_binary'],
+              'contrabin': general['contrafold_binary'],
+              'model_bls': general.get('model_with_bls', MODEL_WITH_BLS),
+              'model_nobls': general.get('model_without_bls', MODEL_WITHOUT_BLS),
+              'how': seed_settings.get('how', 'TargetScan'),
+              'context': int(seed_settings.get('context', 50)),
+              'context_len_l': int(contrafold_settings.get('contextLen_L', 14)),
+              'context_len_u': int(contrafold_settings.get('contextLen_U', 0)),
+              'split_by': general.get('split_by', "NONE"),
+              'index_after_split': int(general.get('index_after_split', 0)),
+              'threshold': float(tasks.get('MergeAndCollect', {}).get('threshold', 0.12)),
+              'models': registry_paths(general)}
+    if general.get('run_only_MIRZA', 'yes') == 'no':
+        # imported here because dendropy is needed only for conservation
+        from mirzag.conservation import Conservation
+        mirza_settings = tasks.get('CalculateMIRZA', {})
+        kwargs['conservation'] = Conservation(mirza_settings['phylogenetic_tree'],
+                                              mirza_settings['alignment_directory'],
+                                              ref_org=mirza_settings.get('reference_organism', 'hg19'),
+                                              threshold=float(mirza_settings.get('threshold', 50)),
+                                              context_len=int(mirza_settings.get('context_length', 50)))
+    return kwargs
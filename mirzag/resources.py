@@ -0,0 +1,146 @@
+"""
+Memory and queue of each job of the analysis predicted from the past runs.
+
+With the general setting learn_resources = yes, run_analysis.py asks for
+memory and queue of each job by the prediction of the cost
+model (see mirzag/costmodel.py) for the number of sites of its chunk,
+instead of the static mem_req and queue of the task. Memory is requested
+with a safety margin and rounded up, the queue is the first of
+queue_limits (queue:seconds) that fits the predicted run time. Requested
+resources are kept in the output directory (resources.json): if the same
+job has to be submitted again because it did not finish (e.g. it was
+killed for exceeding its memory), its memory is multiplied by
+mem_escalation. The escalation happens only when the run is started
+again (e.g. with --incremental): jobs killed by the scheduler are not
+submitted again within the same run.
+
+Memory is requested with each of the resources of mem_resources
+(membycore by default, e.g. h_vmem and mem_free on clusters which enforce
+them).
+"""
+
+__license__ = "GPL"
+
+import os
+import json
+import math
+
+from mirzag import runstats
+from mirzag.nodecache import parse_size
+from mirzag.jobs import DEFAULT_CHUNKS_PER_JOB, MEMORY_RESOURCES
+
+RESOURCES_NAME = "resources.json"
+
+# memory is requested in steps of this many MB
+MEMORY_STEP_MB = 256
+
+# resources of the scheduler the memory is requested with
+DEFAULT_MEMORY_RESOURCES = ['membycore']
+
+
+def parse_queue_limits(limits):
+    """List of (queue, seconds) from e.g. ['short.q:1800', 'long.q:86400'] sorted by the limit"""
+    if isinstance(limits, basestring):
+        limits = limits.split(",")
+    queues = []
+    for limit in limits:
+        queue, seconds = limit.strip().rsplit(":", 1)
+        queues.append((queue, float(seconds)))
+    return sorted(queues, key=lambda queue: queue[1])
+
+
+def parse_memory_resources(resources):
+    """List of memory resources from e.g. ['h_vmem', 'mem_free'] or 'h_vmem, mem_free'"""
+    if isinstance(resources, basestring):
+        resources = resources.split(",")
+    resources = [resource.strip() for resource in resources if resource.strip()]
+    for resource in resources:
+        if resource not in MEMORY_RESOURCES:
+            raise ValueError("Unknown memory resource %s (one of %s)" % (resource, ", ".join(MEMORY_RESOURCES)))
+    return resources or list(DEFAULT_MEMORY_RESOURCES)
+
+
+class Resources(object):
+
+    """Resources of the jobs of one run
+
+    Args:
+        model (CostModel): cost model with the fits of the stages
+        general (dict): general settings of the config
+        output_dir (str): output directory of the run
+
+    """
+
+    def __init__(self, model, general, output_dir):
+        self.model = model
+        self.enabled = general.get('learn_resources', 'no') == 'yes'
+        self.margin = float(general.get('mem_margin', 1.3))
+        self.escalation = float(general.get('mem_escalation', 2.0))
+        self.mem_min_mb = parse_size(general.get('mem_min', '512M')) / 1024 ** 2
+        self.mem_max_mb = parse_size(general.get('mem_max', '64G')) / 1024 ** 2
+        self.queue_limits = parse_queue_limits(general.get('queue_limits', []))
+        self.memory_resources = parse_memory_resources(general.get('mem_resources', DEFAULT_MEMORY_RESOURCES))
+        self.chunks_per_job = int(general.get('chunks_per_job', DEFAULT_CHUNKS_PER_JOB))
+        self.path = os.path.join(output_dir, RESOURCES_NAME)
+        self.requested = {}
+        if os.path.exists(self.path):
+            with open(self.path) as infile:
+                self.requested = json.load(infile)
+
+    def options(self, task_settings, stage, output, key, sites):
+        """Queue and memory options of the job
+
+        Args:
+            task_settings (dict): settings of the task (static queue and mem_req)
+            stage (str): stage of the run statistics (name of the script)
+            output (str): output of the job
+            key (str): key of the job (see mirzag/cache.py)
+            sites (float): number of sites of the chunk, None if unknown
+
+        Returns: list of options for Jobber
+
+        """
+        queue = task_settings.get('queue', 'short.q')
+        memory = task_settings.get('mem_req', '2G')
+        if self.enabled:
+            rss_kb = self.model.predict_memory(stage, sites)
+            if rss_kb is not None:
+                memory_mb = self.memory_mb(rss_kb / 1024.0 * self.margin, output, key)
+                memory = "%iM" % memory_mb
+                self.requested[output] = {'key': key, 'mem_mb': memory_mb}
+            wall_time = self.model.predict([stage], sites)
+            if wall_time is not None and self.queue_limits:
+                queue = self.queue(wall_time * self.margin * self.chunks_per_job, queue)
+        return [('q', queue)] + [('l', "%s=%s" % (resource, memory)) for resource in self.memory_resources]
+
+    def memory_mb(self, memory_mb, output, key):
+        """Round up the memory and escalate it if the job did not finish with the previous request"""
+        previous = self.requested.get(output)
+        if previous is not None and previous.get('key') == key and not is_finished(output):
+            memory_mb = max(memory_mb, previous['mem_mb'] * self.escalation)
+        memory_mb = int(math.ceil(memory_mb / MEMORY_STEP_MB) * MEMORY_STEP_MB)
+        return min(max(memory_mb, self.mem_min_mb), self.mem_max_mb)
+
+    def queue(self, wall_time, default):
+        """First queue with the limit above the run time, the longest if none"""
+        for queue, limit in self.queue_limits:
+            if wall_time <= limit:
+                return queue
+        return self.queue_limits[-1][0] if self.queue_limits else default
+
+    def save(self):
+        """Save requested memory (atomically, it is read when the jobs are generated again)"""
+        if not self.enabled:
+            return
+        with open(self.path + ".tmp", 'w') as outfile:
+            json.dump(self.requested, outfile, indent=1, sort_keys=True)
+        os.rename(self.path + ".tmp", self.path)
+
+
+def is_finished(output):
+    """Did the job finish successfully (according to its run statistics)"""
+    try:
+        with open(runstats.sidecar_path(output)) as infile:
+            return json.load(infile).get('status') == "ok"
+    except (IOError, ValueError):
+        return False
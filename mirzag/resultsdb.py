@@ -0,0 +1,220 @@
+"""
+Database of the results for gene- and miRNA-centric queries.
+
+With the general setting results_database the per gene scores are loaded
+into a SQLite database by rg_collect_results.py, next to the final table,
+as soon as the chunks are merged. Scores are indexed by gene, by miRNA and
+score and by score, so "top targets of a miRNA" or "miRNAs targeting a
+gene" do not scan the whole table (MIRZA_G_pipeline.py query). Sites of
+the chunks merged with the per site output (general setting site_output)
+are loaded as well, indexed by gene and by miRNA and probability.
+
+Each chunk is loaded in one transaction and its rows are replaced when it
+is collected again (e.g. in an incremental run), rows of chunks that are
+not part of the run anymore are removed when all chunks are collected.
+The database can be queried while it is written: it keeps the default
+rollback journal (WAL needs shared memory, which does not work on the
+network filesystems of the clusters), so a query waits for the transaction
+of a chunk to finish.
+"""
+
+__license__ = "GPL"
+
+import time
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    rows INTEGER NOT NULL,
+    loaded REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scores (
+    gene TEXT NOT NULL,
+    mirna TEXT NOT NULL,
+    score REAL,
+    score_with_conservation REAL,
+    chunk INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scores_gene ON scores (gene, score DESC);
+CREATE INDEX IF NOT EXISTS scores_mirna ON scores (mirna, score DESC);
+CREATE INDEX IF NOT EXISTS scores_score ON scores (score DESC);
+CREATE INDEX IF NOT EXISTS scores_chunk ON scores (chunk);
+CREATE TABLE IF NOT EXISTS sites (
+    gene TEXT NOT NULL,
+    id TEXT NOT NULL,
+    mirna TEXT NOT NULL,
+    beg INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    flanks_u REAL,
+    flanks_g REAL,
+    accessibility REAL,
+    distance REAL,
+    log_mirza_score REAL,
+    conservation REAL,
+    probability REAL,
+    probability_with_conservation REAL,
+    chunk INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sites_gene ON sites (gene, probability DESC);
+CREATE INDEX IF NOT EXISTS sites_mirna ON sites (mirna, probability DESC);
+CREATE INDEX IF NOT EXISTS sites_chunk ON sites (chunk);
+"""
+COLUMNS = ('gene', 'mirna', 'score', 'score_with_conservation')
+ORDER_COLUMNS = ('score', 'score_with_conservation')
+# the columns of the per site output (mirzag.columnar.SITE_SCORES)
+SITE_COLUMNS = ('gene', 'id', 'mirna', 'beg', 'end', 'flanks_u', 'flanks_g', 'accessibility', 'distance',
+                'log_mirza_score', 'conservation', 'probability', 'probability_with_conservation')
+SITE_ORDER_COLUMNS = ('probability', 'probability_with_conservation')
+
+
+def connect(path):
+    """Open (and create) the database"""
+    connection = sqlite3.connect(path, timeout=60)
+    # ids are kept as they are in the final table (not as unicode)
+    connection.text_factory = str
+    # databases created in WAL mode keep it until it is changed
+    connection.execute("PRAGMA journal_mode=DELETE")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def load_chunk(connection, chunk, rows, sites=()):
+    """Replace the scores (and sites) of the chunk
+
+    Args:
+        connection (sqlite3.Connection): database
+        chunk (str): name of the chunk
+        rows (iterable): tuples of gene, miRNA, score and score with conservation (NaN or None if missing)
+
+    Kwargs:
+        sites (iterable): tuples of the columns of the per site output
+
+    Returns: number of loaded rows
+
+    """
+    with connection:
+        connection.execute("INSERT OR IGNORE INTO chunks (name, rows, loaded) VALUES (?, 0, 0)", (chunk,))
+        chunk_id, = connection.execute("SELECT id FROM chunks WHERE name = ?", (chunk,)).fetchone()
+        connection.execute("DELETE FROM scores WHERE chunk = ?", (chunk_id,))
+        cursor = connection.executemany("INSERT INTO scores VALUES (?, ?, ?, ?, ?)",
+                                        ((gene, mirna, _value(score), _value(with_conservation), chunk_id)
+                                         for gene, mirna, score, with_conservation in rows))
+        count = cursor.rowcount
+        connection.execute("DELETE FROM sites WHERE chunk = ?", (chunk_id,))
+        connection.executemany("INSERT INTO sites VALUES (%s)" % ", ".join(["?"] * (len(SITE_COLUMNS) + 1)),
+                               (site[:5] + tuple(_value(value) for value in site[5:]) + (chunk_id,)
+                                for site in sites))
+        connection.execute("UPDATE chunks SET rows = ?, loaded = ? WHERE id = ?", (count, time.time(), chunk_id))
+    return count
+
+
+def keep_chunks(connection, chunks):
+    """Remove the scores of the chunks that are not in the list
+
+    Returns: names of the removed chunks
+
+    """
+    with connection:
+        connection.execute("CREATE TEMP TABLE IF NOT EXISTS current_chunks (name TEXT PRIMARY KEY)")
+        connection.execute("DELETE FROM current_chunks")
+        connection.executemany("INSERT OR IGNORE INTO current_chunks VALUES (?)", ((chunk,) for chunk in chunks))
+        removed = [name for name, in connection.execute("SELECT name FROM chunks WHERE name NOT IN (SELECT name FROM current_chunks)")]
+        for table in ("scores", "sites"):
+            connection.execute("DELETE FROM %s WHERE chunk IN (SELECT id FROM chunks WHERE name NOT IN (SELECT name FROM current_chunks))" % table)
+        connection.execute("DELETE FROM chunks WHERE name NOT IN (SELECT name FROM current_chunks)")
+    return removed
+
+
+def query(connection, gene=None, mirna=None, min_score=None, order_by='score', limit=None):
+    """Per gene scores of the gene and/or the miRNA, best first
+
+    Kwargs:
+        gene (str): only scores of the gene
+        mirna (str): only scores of the miRNA
+        min_score (float): only scores (of the order_by column) of at least this value
+        order_by (str): score or score_with_conservation
+        limit (int): at most so many scores, None for all
+
+    Returns: list of tuples of gene, miRNA, score and score with conservation (None if missing)
+
+    """
+    if order_by not in ORDER_COLUMNS:
+        raise ValueError("Unknown order %s, use one of: %s" % (order_by, ", ".join(ORDER_COLUMNS)))
+    return _select(connection, "scores", COLUMNS, gene, mirna, min_score, order_by, "gene, mirna", limit)
+
+
+def query_sites(connection, gene=None, mirna=None, min_probability=None, order_by='probability', limit=None):
+    """Sites of the gene and/or the miRNA, most probable first
+
+    Kwargs:
+        gene (str): only sites in the gene
+        mirna (str): only sites of the miRNA
+        min_probability (float): only sites with probability (of the order_by column) of at least this value
+        order_by (str): probability or probability_with_conservation
+        limit (int): at most so many sites, None for all
+
+    Returns: list of tuples of SITE_COLUMNS (None if missing)
+
+    """
+    if order_by not in SITE_ORDER_COLUMNS:
+        raise ValueError("Unknown order %s, use one of: %s" % (order_by, ", ".join(SITE_ORDER_COLUMNS)))
+    return _select(connection, "sites", SITE_COLUMNS, gene, mirna, min_probability, order_by, "gene, mirna, id, beg", limit)
+
+
+def _select(connection, table, columns, gene, mirna, minimum, order_by, ties, limit):
+    conditions = []
+    parameters = []
+    if gene is not None:
+        conditions.append("gene = ?")
+        parameters.append(gene)
+    if mirna is not None:
+        conditions.append("mirna = ?")
+        parameters.append(mirna)
+    if minimum is not None:
+        conditions.append("%s >= ?" % order_by)
+        parameters.append(minimum)
+    sql = "SELECT %s FROM %s" % (", ".join(columns), table)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    # missing values (NULL) sort as the lowest, so they come last
+    sql += " ORDER BY %s DESC, %s" % (order_by, ties)
+    if limit is not None:
+        sql += " LIMIT ?"
+        parameters.append(limit)
+    return connection.execute(sql, parameters).fetchall()
+
+
+def summary(connection):
+    """Numbers of chunks, scores, genes and miRNAs in the database"""
+    chunks, = connection.execute("SELECT COUNT(*) FROM chunks").fetchone()
+    scores, = connection.execute("SELECT COUNT(*) FROM scores").fetchone()
+    genes, = connection.execute("SELECT COUNT(DISTINCT gene) FROM scores").fetchone()
+    mirnas, = connection.execute("SELECT COUNT(DISTINCT mirna) FROM scores").fetchone()
+    sites, = connection.execute("SELECT COUNT(*) FROM sites").fetchone()
+    return {'chunks': chunks, 'scores': scores, 'genes': genes, 'mirnas': mirnas, 'sites': sites}
+
+
+def format_rows(rows):
+    """Rows of the query as TSV (as in the final table)"""
+    return "".join("%s\t%s\t%s\t%s\n" % (gene, mirna,
+                                         'NaN' if score is None else "%f" % score,
+                                         'NaN' if with_conservation is None else str(with_conservation))
+                   for gene, mirna, score, with_conservation in rows)
+
+
+def format_sites(rows):
+    """Sites of the query as TSV with a header"""
+    lines = ["#" + "\t".join(SITE_COLUMNS) + "\n"]
+    for site in rows:
+        lines.append("\t".join([str(value) for value in site[:5]]
+                               + ['NaN' if value is None else "%.7g" % value for value in site[5:]]) + "\n")
+    return "".join(lines)
+
+
+def _value(value):
+    """Missing value (NaN) as NULL"""
+    if value is None or value != value:
+        return None
+    return float(value)
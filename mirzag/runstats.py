@@ -0,0 +1,274 @@
+"""
+Record resources used by the pipeline scripts and report them per stage.
+
+Each script wraps its main in :func:`track` and a small JSON file
+(output + '.stats.json') is written next to the output with wall time,
+CPU time, peak memory, I/O and number of processed items.
+"""
+
+__license__ = "GPL"
+
+import os
+import sys
+import json
+import glob
+import time
+import socket
+import resource
+from contextlib import contextmanager
+
+SIDECAR_SUFFIX = ".stats.json"
+
+# tracker of the running script, used by count()
+_current = None
+
+
+class RunStats(object):
+
+    """Resources used by one run of a pipeline script"""
+
+    def __init__(self, stage, output, chunk=None):
+        self.stage = stage
+        self.output = output
+        self.chunk = chunk
+        self.items = {}
+        self.status = "running"
+        self._start_wall = None
+        self._start_usage = None
+        self._start_children = None
+        self._start_io = None
+        self.record = {}
+
+    def start(self):
+        self._start_wall = time.time()
+        self._start_usage = resource.getrusage(resource.RUSAGE_SELF)
+        self._start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._start_io = read_proc_io()
+
+    def count(self, name, number=1):
+        self.items[name] = self.items.get(name, 0) + number
+
+    def stop(self, status="ok"):
+        end_wall = time.time()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io = read_proc_io()
+        self.status = status
+        self.record = {'stage': self.stage,
+                       'chunk': self.chunk,
+                       'output': self.output,
+                       'host': socket.gethostname(),
+                       'status': status,
+                       'start': self._start_wall,
+                       'end': end_wall,
+                       'wall_time': end_wall - self._start_wall,
+                       'cpu_time': (usage.ru_utime - self._start_usage.ru_utime) +
+                                   (usage.ru_stime - self._start_usage.ru_stime),
+                       'children_cpu_time': (children.ru_utime - self._start_children.ru_utime) +
+                                            (children.ru_stime - self._start_children.ru_stime),
+                       # ru_maxrss is in kilobytes on Linux
+                       'max_rss_kb': usage.ru_maxrss,
+                       'children_max_rss_kb': children.ru_maxrss,
+                       'bytes_read': None,
+                       'bytes_written': None,
+                       'output_bytes': file_size(self.output),
+                       'items': self.items}
+        if io is not None and self._start_io is not None:
+            self.record['bytes_read'] = io['rchar'] - self._start_io['rchar']
+            self.record['bytes_written'] = io['wchar'] - self._start_io['wchar']
+        return self.record
+
+    def save(self, path=None):
+        if path is None:
+            path = sidecar_path(self.output)
+        with open(path, 'w') as outfile:
+            json.dump(self.record, outfile, indent=1, sort_keys=True)
+
+
+@contextmanager
+def track(script, output, chunk=None, sidecar=None):
+    """Track resources of the code in the block and save them in JSON sidecar
+
+    Args:
+        script (str): path to the script (its name is used as stage name)
+        output (str): main output of the script, sidecar is saved next to it
+
+    Kwargs:
+        chunk (str): name of the chunk processed, defaults to output name
+        sidecar (str): path to the JSON file, defaults to output + '.stats.json'
+
+    Yields: RunStats
+
+    """
+    global _current
+    stage = os.path.splitext(os.path.basename(script))[0]
+    if chunk is None:
+        chunk = os.path.splitext(os.path.basename(output))[0]
+    stats = RunStats(stage, output, chunk)
+    _current = stats
+    stats.start()
+    status = "failed"
+    try:
+        yield stats
+        status = "ok"
+    except SystemExit as e:
+        status = "ok" if e.code in (None, 0) else "failed"
+        raise
+    finally:
+        _current = None
+        stats.stop(status)
+        try:
+            stats.save(sidecar)
+        except (IOError, OSError) as e:
+            sys.stderr.write("Cannot save run statistics: %s\n" % str(e))
+
+
+def count(name, number=1):
+    """Add number of processed items to the statistics of running script"""
+    if _current is not None:
+        _current.count(name, number)
+
+
+def sidecar_path(output):
+    return output + SIDECAR_SUFFIX
+
+
+def read_proc_io():
+    """Read I/O counters of the process (Linux only), None if not available"""
+    try:
+        with open("/proc/self/io") as f:
+            return {k.strip(): int(v) for k, v in (l.split(":") for l in f if ":" in l)}
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+
+#
+# Report
+#
+
+def load_records(directory):
+    """Load all JSON sidecars from the directory (recursively)"""
+    records = []
+    for root, dirs, files in os.walk(directory):
+        for name in sorted(files):
+            if name.endswith(SIDECAR_SUFFIX):
+                try:
+                    with open(os.path.join(root, name)) as f:
+                        record = json.load(f)
+                except ValueError:
+                    sys.stderr.write("Corrupted statistics file %s\n" % os.path.join(root, name))
+                    continue
+                # chunk name is taken from file name because in the cluster mode
+                # the scripts write to a temporary file named output
+                record['chunk'] = os.path.splitext(name[:-len(SIDECAR_SUFFIX)])[0]
+                records.append(record)
+    return records
+
+
+def percentile(values, perc):
+    """Nearest-rank percentile of the list of values"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    rank = int(round(perc / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def summarize_stages(records):
+    """Aggregate records per stage
+
+    Returns: list of dicts sorted by total wall time (descending)
+
+    """
+    stages = {}
+    for rec in records:
+        stages.setdefault(rec['stage'], []).append(rec)
+    summary = []
+    for stage, recs in stages.iteritems():
+        walls = [r['wall_time'] for r in recs]
+        rss = [max(r.get('max_rss_kb') or 0, r.get('children_max_rss_kb') or 0) for r in recs]
+        items = {}
+        for r in recs:
+            for name, number in r.get('items', {}).iteritems():
+                items[name] = items.get(name, 0) + number
+        summary.append({'stage': stage,
+                        'jobs': len(recs),
+                        'failed': len([r for r in recs if r.get('status') != 'ok']),
+                        'wall_total': sum(walls),
+                        'wall_p50': percentile(walls, 50),
+                        'wall_p90': percentile(walls, 90),
+                        'wall_p99': percentile(walls, 99),
+                        'wall_max': max(walls),
+                        'cpu_total': sum((r.get('cpu_time') or 0) + (r.get('children_cpu_time') or 0) for r in recs),
+                        'rss_p90_kb': percentile(rss, 90),
+                        'rss_max_kb': max(rss),
+                        'bytes_read': sum(r.get('bytes_read') or 0 for r in recs),
+                        'bytes_written': sum(r.get('bytes_written') or 0 for r in recs),
+                        'items': items})
+    return sorted(summary, key=lambda s: s['wall_total'], reverse=True)
+
+
+def critical_path(records):
+    """Find the chain of jobs that determined the length of the run
+
+    Starting from the job that finished last we go back to the job that
+    finished last before it started (the one that released it).
+
+    Returns: list of records in order of execution
+
+    """
+    recs = sorted([r for r in records if r.get('start') is not None],
+                  key=lambda r: r['end'])
+    if not recs:
+        return []
+    path = [recs[-1]]
+    while True:
+        current = path[-1]
+        before = [r for r in recs if r['end'] <= current['start']]
+        if not before:
+            break
+        path.append(before[-1])
+    return path[::-1]
+
+
+def format_report(records):
+    """Make a text report from the records"""
+    lines = []
+    mb = 1024.0 * 1024.0
+    lines.append("Per stage (times in seconds, memory and I/O in MB):")
+    header = "%-62s %5s %6s %9s %8s %8s %8s %8s %9s %8s %9s %9s  %s"
+    lines.append(header % ("stage", "jobs", "failed", "wall", "p50", "p90", "p99", "max",
+                           "cpu", "rss_p90", "read", "written", "items"))
+    for s in summarize_stages(records):
+        lines.append("%-62s %5i %6i %9.1f %8.1f %8.1f %8.1f %8.1f %9.1f %8.1f %9.1f %9.1f  %s" % (
+                     s['stage'], s['jobs'], s['failed'], s['wall_total'], s['wall_p50'],
+                     s['wall_p90'], s['wall_p99'], s['wall_max'], s['cpu_total'],
+                     (s['rss_p90_kb'] or 0) / 1024.0, s['bytes_read'] / mb, s['bytes_written'] / mb,
+                     ", ".join("%s=%i" % (k, v) for k, v in sorted(s['items'].iteritems()))))
+    lines.append("")
+    lines.append("Per chunk (wall time in seconds):")
+    chunks = {}
+    for rec in records:
+        chunks.setdefault(rec['chunk'], {})
+        chunks[rec['chunk']][rec['stage']] = chunks[rec['chunk']].get(rec['stage'], 0) + rec['wall_time']
+    for chunk, stages in sorted(chunks.iteritems(), key=lambda c: sum(c[1].values()), reverse=True):
+        lines.append("%-40s %9.1f  %s" % (chunk, sum(stages.values()),
+                                          ", ".join("%s=%.1f" % (k, v) for k, v in sorted(stages.iteritems()))))
+    lines.append("")
+    path = critical_path(records)
+    if path:
+        lines.append("Critical path (%.1f seconds from first start to last end):" % (path[-1]['end'] - path[0]['start']))
+        previous_end = None
+        for rec in path:
+            waited = rec['start'] - previous_end if previous_end is not None else 0.0
+            lines.append("  %-62s %-40s %9.1f (waited %.1f)" % (rec['stage'], rec['chunk'],
+                                                                rec['wall_time'], waited))
+            previous_end = rec['end']
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,375 @@
+"""
+Probabilities of the target sites from the MIRZA-G models and per gene scores
+"""
+
+__license__ = "GPL"
+
+from mirzag import runstats
+from mirzag.models import probabilities, column as model_column
+
+#
+# Mapping from column names to pretty names
+#
+COLUMNS_MAP = {'ContraScoreTargetSite': 'Accessibility',
+               'ID': "ID",
+               'MIRZABranchLengthScoreFill': "Conservation",
+               'MIRZAscore': 'MIRZAscore',
+               'distToBoundary': 'Distance to boundary',
+               'flanksG': 'Flanks G',
+               'flanksU': 'Flanks U',
+               'hybrid': "Hybrid",
+               'miRNA': 'miRNA',
+               'precise_type': 'Precise type',
+               'probability_with_bls': "Probability with conservation",
+               'probability_without_bls': "Probability without conservation",
+               'seed_beg': 'Seed start',
+               'seed_end': 'Seed end',
+               'type': 'Type'}
+#
+# Columns order
+#
+COLUMNS_ORDER = ['ID',
+                 'miRNA',
+                 'seed_beg',
+                 'seed_end',
+                 'flanksU',
+                 'flanksG',
+                 'ContraScoreTargetSite',
+                 'distToBoundary',
+                 'MIRZAscore',
+                 'MIRZABranchLengthScoreFill',
+                 'probability_without_bls',
+                 'probability_with_bls']
+
+
+def load_model(model):
+    """Load the model from pickle unless it is loaded already"""
+    if isinstance(model, basestring):
+        import pandas as pd
+        return pd.read_pickle(model)
+    return model
+
+
+def score(features, model_bls, model_nobls, only_mirza=True, models=()):
+    """Add probabilities from the models to the features of sites
+
+    Args:
+        features (dict): dicts of features by site key "id,miRNA,begin,end"
+                         (e.g. from mirzag.compute_features)
+        model_bls (str or model): model with branch length score (or path to it)
+        model_nobls (str or model): model without branch length score (or path to it)
+
+    Kwargs:
+        only_mirza (bool): do not calculate probability with conservation
+        models (list): models of the registry (mirzag.models.Model), their
+                       probabilities are added as columns "Probability <name>"
+
+    Returns: pandas.DataFrame with pretty column names (see COLUMNS_MAP),
+             empty if there is no sites
+
+    """
+    # pandas and numpy are imported here to keep import of the package light
+    # for the scripts that do not need them
+    import numpy as np
+    import pandas as pd
+    data = pd.DataFrame(features).T.replace("NA", np.nan)
+    # missing features are None which would make the columns objects
+    data = data.fillna(value=np.nan)
+    runstats.count('sites', len(data))
+    if len(data) == 0:
+        return pd.DataFrame(columns=[COLUMNS_MAP[col] for col in COLUMNS_ORDER] + [model_column(model) for model in models])
+    for column in ['ContraScoreTargetSite', 'MIRZAscore', 'MIRZABranchLengthScoreFill',
+                   'distToBoundary', 'flanksG', 'flanksU']:
+        if column not in data:
+            data[column] = np.nan
+
+    data['ID'] = [i.split(',')[0] for i in data.index]
+    data['miRNA'] = [i.split(',')[1] for i in data.index]
+    data['seed_beg'] = [i.split(',')[2] for i in data.index]
+    data['seed_end'] = [i.split(',')[3] for i in data.index]
+    data['MIRZAscore'] = np.log(data['MIRZAscore'].astype(np.float))
+    data['const'] = 1.0
+
+    model_bls = load_model(model_bls)
+    model_nobls = load_model(model_nobls)
+
+    #
+    # extract columns...
+    #
+    columns_bls = model_bls.params.keys().tolist()[1:]
+    columns_nobls = model_nobls.params.keys().tolist()[1:]
+
+    #
+    # ...and predict and scale probabilities
+    #
+    if not only_mirza:
+        mydot = dot_product(data[['const'] + columns_bls].astype(np.float).values, model_bls.params.values)
+        data['probability_with_bls'] = scaled_logit_inverse(mydot)
+    else:
+        data['probability_with_bls'] = np.nan
+    mydot = dot_product(data[['const'] + columns_nobls].astype(np.float).values, model_nobls.params.values)
+    data['probability_without_bls'] = scaled_logit_inverse(mydot)
+    if models:
+        models_probabilities = probabilities(data, models)
+
+    data = data[COLUMNS_ORDER]
+    data.columns = [COLUMNS_MAP[col] for col in data.columns]
+    for index, model in enumerate(models):
+        data[model_column(model)] = models_probabilities[:, index]
+    return data
+
+
+def per_gene_scores(scored, threshold=0.12, split_by=None, column=0):
+    """Sum probabilities of sites above threshold per gene and miRNA
+
+    Args:
+        scored (pandas.DataFrame): sites with probabilities (from score)
+
+    Kwargs:
+        threshold (float): minimal probability of a site to be summed
+        split_by (str): split ID by this string to get gene id, defaults to
+                        None (ID is used)
+        column (int): column to take after split, 0 based
+
+    Returns: list of (gene id, miRNA, score without conservation,
+             score with conservation or None)
+
+    """
+    data_with_conserved = {}
+    data_without_conserved = {}
+    for gid, mirna, without, withc in zip(scored["ID"],
+                                          scored["miRNA"],
+                                          scored["Probability without conservation"],
+                                          scored["Probability with conservation"]):
+        key = (gid.split(split_by)[column] if split_by else gid, mirna)
+        if not is_null(without) and float(without) >= threshold:
+            data_without_conserved[key] = data_without_conserved.get(key, 0.0) + float(without)
+        if not is_null(withc) and float(withc) >= threshold:
+            data_with_conserved[key] = data_with_conserved.get(key, 0.0) + float(withc)
+    runstats.count('genes', len(data_without_conserved))
+    return [(key[0], key[1], value, data_with_conserved.get(key))
+            for key, value in data_without_conserved.iteritems()]
+
+
+def per_gene_sweep(scored, thresholds, split_by=None, column=0):
+    """Per gene scores (as in per_gene_scores) for several thresholds at once
+
+    Args:
+        scored (pandas.DataFrame): sites with probabilities (from score)
+        thresholds (list): minimal probabilities of a site to be summed
+
+    Kwargs:
+        split_by (str): split ID by this string to get gene id, defaults to
+                        None (ID is used)
+        column (int): column to take after split, 0 based
+
+    Returns: tuple of sorted thresholds and list of (gene id, miRNA, scores
+             without conservation, scores with conservation) with a score
+             for each threshold (see sweep_scores)
+
+    """
+    keys = [(gid.split(split_by)[column] if split_by else gid, mirna)
+            for gid, mirna in zip(scored["ID"], scored["miRNA"])]
+    return sweep_scores(keys,
+                        scored["Probability without conservation"],
+                        scored["Probability with conservation"],
+                        thresholds)
+
+
+def sweep_scores(keys, without, with_conservation, thresholds):
+    """Sum probabilities of sites per key for each threshold in one pass
+
+    Each probability is placed, by binary search in the sorted thresholds,
+    in the bin of the number of thresholds it passes. The bins are summed
+    per key and the cumulative sum of the bins from the highest threshold
+    down gives the sum of probabilities above each threshold.
+
+    Args:
+        keys (list): (gene id, miRNA) of the sites
+        without (list): probabilities without conservation (NaN if missing)
+        with_conservation (list): probabilities with conservation (NaN if missing)
+        thresholds (list): minimal probabilities of a site to be summed
+
+    Returns: tuple of sorted thresholds and list of (gene id, miRNA, scores
+             without conservation, scores with conservation) for the keys
+             with a site above the lowest threshold; a score with
+             conservation is None if no site passes its threshold
+
+    """
+    import numpy as np
+    thresholds = sorted(set(float(threshold) for threshold in thresholds))
+    names, key_codes = _key_codes(keys)
+    if not names:
+        return thresholds, []
+    bins = len(thresholds) + 1
+    sums = []
+    counts = []
+    for values in (without, with_conservation):
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        passed = np.searchsorted(thresholds, values[valid], side='right')
+        index = key_codes[valid] * bins + passed
+        # probability passes threshold i if it is in bin i + 1 or higher
+        binned = np.bincount(index, weights=values[valid], minlength=len(names) * bins).reshape(len(names), bins)
+        sums.append(np.cumsum(binned[:, ::-1], axis=1)[:, ::-1][:, 1:])
+        binned = np.bincount(index, minlength=len(names) * bins).reshape(len(names), bins)
+        counts.append(np.cumsum(binned[:, ::-1], axis=1)[:, ::-1][:, 1:])
+    genes = []
+    for code, (gene, mirna) in enumerate(names):
+        if counts[0][code, 0] == 0:
+            continue
+        genes.append((gene, mirna,
+                      [float(value) for value in sums[0][code]],
+                      [float(value) if count else None for value, count in zip(sums[1][code], counts[1][code])]))
+    return thresholds, genes
+
+
+def per_gene_model_scores(scored, models, threshold=0.12, split_by=None, column=0):
+    """Sum probabilities of sites above threshold per gene and miRNA for each model
+
+    Args:
+        scored (pandas.DataFrame): sites with probabilities of the models (from score)
+        models (list): models of the registry (or their names)
+
+    Kwargs:
+        threshold (float): minimal probability of a site to be summed
+        split_by (str): split ID by this string to get gene id, defaults to
+                        None (ID is used)
+        column (int): column to take after split, 0 based
+
+    Returns: list of (gene id, miRNA, scores) with a score for each model
+             (None if no site passes the threshold) for the keys with a
+             score of any model
+
+    """
+    import numpy as np
+    names, key_codes = _key_codes([(gid.split(split_by)[column] if split_by else gid, mirna)
+                                   for gid, mirna in zip(scored["ID"], scored["miRNA"])])
+    if not names or not models:
+        return []
+    sums = []
+    counts = []
+    for model in models:
+        values = np.asarray(scored[model_column(model)], dtype=np.float64)
+        # NaN does not pass the threshold
+        passed = np.zeros(len(values), dtype=bool)
+        passed[~np.isnan(values)] = values[~np.isnan(values)] >= threshold
+        sums.append(np.bincount(key_codes[passed], weights=values[passed], minlength=len(names)))
+        counts.append(np.bincount(key_codes[passed], minlength=len(names)))
+    genes = []
+    for code, (gene, mirna) in enumerate(names):
+        if not any(count[code] for count in counts):
+            continue
+        genes.append((gene, mirna, [float(total[code]) if count[code] else None
+                                    for total, count in zip(sums, counts)]))
+    return genes
+
+
+def model_lines(models, genes):
+    """Lines of the table of the per gene scores of the models with a header
+
+    Returns: generator of str
+
+    """
+    yield "#%s\n" % "\t".join(["gene", "miRNA"] + [getattr(model, 'name', model) for model in models])
+    for gene, mirna, values in genes:
+        yield "%s\n" % "\t".join([gene, mirna] + ['NaN' if value is None else str(value) for value in values])
+
+
+def sweep_lines(thresholds, genes):
+    """Lines of the table of the sweep (as returned by sweep_scores) with a header
+
+    Scores are formatted as in the per gene table: one column per threshold
+    without conservation, then one per threshold with conservation.
+
+    Returns: generator of str
+
+    """
+    yield "#%s\n" % "\t".join(["gene", "miRNA"]
+                               + ["score@%g" % threshold for threshold in thresholds]
+                               + ["score_with_conservation@%g" % threshold for threshold in thresholds])
+    for gene, mirna, values, with_conservation_values in genes:
+        yield "%s\n" % "\t".join([gene, mirna]
+                                 + ["%f" % value for value in values]
+                                 + ['NaN' if value is None else str(value) for value in with_conservation_values])
+
+
+def site_scores(scored, split_by=None, column=0):
+    """Sites with their features and probabilities for the per site output
+
+    Args:
+        scored (pandas.DataFrame): sites with probabilities (from score)
+
+    Kwargs:
+        split_by (str): split ID by this string to get gene id, defaults to
+                        None (ID is used)
+        column (int): column to take after split, 0 based
+
+    Returns: list of tuples of the columns of mirzag.columnar.SITE_SCORES
+             sorted by gene, miRNA and position (None if missing)
+
+    """
+    rows = []
+    for values in zip(*[scored[name] for name in ["ID", "miRNA", "Seed start", "Seed end",
+                                                   "Flanks U", "Flanks G", "Accessibility",
+                                                   "Distance to boundary", "MIRZAscore", "Conservation",
+                                                   "Probability without conservation",
+                                                   "Probability with conservation"]]):
+        gid, mirna, beg, end = values[:4]
+        rows.append((gid.split(split_by)[column] if split_by else gid, gid, mirna, int(beg), int(end))
+                    + tuple(None if is_null(value) else float(value) for value in values[4:]))
+    rows.sort(key=lambda row: (row[0], row[2], row[3], row[4], row[1]))
+    return rows
+
+
+def _key_codes(keys):
+    """Unique keys in the order of appearance and the code of each key
+
+    Returns: tuple of list and numpy.ndarray
+
+    """
+    import numpy as np
+    codes = {}
+    names = []
+    for key in keys:
+        if key not in codes:
+            codes[key] = len(names)
+            names.append(key)
+    return names, np.asarray([codes[key] for key in keys], dtype=np.int64)
+
+
+def is_null(value):
+    """Is the value None or NaN"""
+    return value is None or value != value
+
+
+def scaled_logit_inverse(probability, scaling_factor=0.24):
+    """This is inversed logit function with implemented
+    scaling in the same time. It is equivalent of predicting
+    probabilities with statsmodels and taking scale_prob after
+
+    Args:
+        probability (@todo): @todo
+
+    Kwargs:
+        scaling_factor (@todo): @todo
+
+    Returns: @todo
+
+    """
+    import numpy as np
+    return (scaling_factor*np.exp(probability))/(scaling_factor*np.exp(probability)+1.0)
+
+
+def dot_product(x, y):
+    """A dot product of the matrix and the vecotr
+
+    Args:
+        x (np.array): numpy array of vectors of length y
+        y (np.array): one dimensional numpy array
+
+    Returns: np.array
+
+    """
+    import numpy as np
+    return np.asarray([np.dot(i, y) for i in x])
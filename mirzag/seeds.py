@@ -0,0 +1,122 @@
+"""
+Search for miRNA seed matches in UTR sequences
+"""
+
+__license__ = "GPL"
+
+import re
+import string
+
+from mirzag.fasta import as_dict
+from mirzag.sites import Site, SiteTable
+
+SEED_DEFINITIONS = ("ElMMo", "TargetScan", "6-mer")
+# complement of the (ambiguous) DNA nucleotides as in Biopython
+_COMPLEMENT = string.maketrans("ACGTMRWSYKVHDBXNacgtmrwsykvhdbxn",
+                               "TGCAKYWSRMBDHVXNtgcakywsrmbdhvxn")
+
+
+def reverse_complement(seq):
+    """Reverse complement of the DNA sequence"""
+    return seq.translate(_COMPLEMENT)[::-1]
+
+
+def seed_regex(mirna, how="TargetScan"):
+    """Regular expression matching the miRNA seed in the target
+
+    Args:
+        mirna (str): miRNA sequence (DNA alphabet)
+
+    Kwargs:
+        how (str): definition of the seed: ElMMo (1-7 or 2-8),
+                   TargetScan (2-8 or 2-7 followed by A) or 6-mer (2-7)
+
+    Returns: str
+
+    """
+    mirna = str(mirna)
+    if how == "ElMMo":
+        return r"%s|%s" % (reverse_complement(mirna[0:7]), reverse_complement(mirna[1:8]))
+    elif how == "TargetScan":
+        return r"%s|%s" % (reverse_complement(mirna[1:8]), reverse_complement(mirna[1:7]) + 'A')
+    elif how == "6-mer":
+        return r"%s" % (reverse_complement(mirna[1:7]))
+    raise ValueError("Unknown seed definition %s, use one of: %s" % (how, ", ".join(SEED_DEFINITIONS)))
+
+
+def get_indices(desired_length, beg, end):
+    """Calculate upper and lower index based on what size we want and what are the coordinates"""
+    lower_index = beg - ((desired_length - (end - beg))//2 + (desired_length - (end - beg))%2)
+    upper_index = end + ((desired_length - (end - beg))//2)
+    return lower_index, upper_index
+
+
+def distance_to_boundary(mrna_len, begpos):
+    """Calculate distance to the closest boundary"""
+    return begpos if begpos < (mrna_len - begpos) else (mrna_len - begpos)
+
+
+def iter_seed_matches(utrs, mirnas, how="TargetScan", context=50):
+    """Find seed matches of every miRNA in every UTR
+
+    Args:
+        utrs (OrderedDict): UTR sequences by id (DNA alphabet)
+        mirnas (OrderedDict): miRNA sequences by id (DNA alphabet)
+
+    Kwargs:
+        how (str): definition of the seed, see seed_regex
+        context (int): length of the sequence around the match to report
+
+    Yields: Site
+
+    """
+    for mirid, mirseq in mirnas.iteritems():
+        regex = re.compile(seed_regex(mirseq, how))
+        for seqid, seq in utrs.iteritems():
+            for match in regex.finditer(seq):
+                beg, end = match.span()
+                lower_index, upper_index = get_indices(context, beg, end)
+                if upper_index >= len(seq):
+                    mrna = seq[-1 * context:]
+                elif lower_index < 0:
+                    mrna = seq[:context]
+                else:
+                    mrna = seq[lower_index:upper_index]
+                if len(mrna) == context:
+                    yield Site(seqid, mirid, beg, end, mrna)
+
+
+def scan_seeds(utrs, mirnas, how="TargetScan", context=50, split_by=None,
+               index_after_split=0):
+    """Find putative target sites of miRNAs in UTRs
+
+    Sites of the same miRNA with identical context sequence in UTRs of the
+    same gene (id split by split_by and taken from index_after_split column)
+    are reported only once.
+
+    Args:
+        utrs (dict, list of (id, sequence) or path to fasta): UTR sequences
+        mirnas (dict, list of (id, sequence) or path to fasta): miRNA sequences
+
+    Kwargs:
+        how (str): definition of the seed, see seed_regex
+        context (int): length of the sequence around the match to report
+        split_by (str): split UTR id by this string to get gene id, defaults
+                        to None (UTR id is used)
+        index_after_split (int): column to take after split, 0 based
+
+    Returns: SiteTable (contexts are kept as offsets in the UTRs)
+
+    """
+    utrs = as_dict(utrs, to_dna=True)
+    mirnas = as_dict(mirnas, to_dna=True)
+    seen = set()
+    sites = SiteTable(utrs)
+    for site in iter_seed_matches(utrs, mirnas, how, context):
+        gene = site.id.split(split_by)[index_after_split] if split_by else site.id
+        key = (gene, site.mirna, site.seq)
+        if key in seen:
+            continue
+        seen.add(key)
+        sites.append(site)
+    return sites
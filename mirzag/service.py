@@ -0,0 +1,360 @@
+"""
+Long-running prediction service of MIRZA-G.
+
+UTR sequences, models and (if conservation is calculated) the phylogenetic
+tree and alignments are loaded once. Requests with miRNA/siRNA sequences
+are put into a queue from which a dispatcher takes them in batches: all
+miRNAs of a batch are predicted together (one MIRZA and one CONTRAfold run)
+by one of the workers of the pool and the results are split back per
+request.
+
+The service listens on localhost HTTP (POST /predict, GET /status) or on a
+Unix socket (one JSON request per line, one JSON response per line).
+"""
+
+__license__ = "GPL"
+
+import os
+import re
+import sys
+import json
+import time
+import Queue
+import threading
+import traceback
+import SocketServer
+import BaseHTTPServer
+from multiprocessing.pool import ThreadPool
+
+from mirzag.fasta import as_dict
+from mirzag.pipeline import predict, settings_from_config, MODEL_WITH_BLS, MODEL_WITHOUT_BLS
+from mirzag.scoring import load_model, is_null
+from mirzag.models import load_models
+
+syserr = sys.stderr.write
+
+# MIRZA uses the first 21 nucleotides, shorter miRNAs are dropped by the pipeline
+# (rg_prepare_mirnas_for_mirza_and_split.py) and would come back without genes
+MIRNA_LENGTH = 21
+SEQUENCE_PATTERN = re.compile(r"^[ACGTUacgtu]{%i,}$" % MIRNA_LENGTH)
+
+
+class RequestError(Exception):
+
+    """Invalid request of the client"""
+
+
+class PendingRequest(object):
+
+    """Request waiting in the queue for its batch"""
+
+    def __init__(self, mirnas, sites=False):
+        self.mirnas = mirnas
+        self.sites = sites
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise RequestError("Request timed out")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class PredictionService(object):
+
+    """Resident data and workers answering prediction requests"""
+
+    def __init__(self, utrs, workers=2, batch_size=20, batch_wait=0.05, verbose=False, **settings):
+        """
+        Args:
+            utrs (dict, list of (id, sequence) or path to fasta): UTR sequences
+
+        Kwargs:
+            workers (int): number of batches processed in parallel
+            batch_size (int): maximal number of miRNAs in one batch
+            batch_wait (float): time in seconds to wait for more requests
+                                before the batch is started
+            verbose (bool): be loud
+            settings: keyword arguments of mirzag.predict
+
+        """
+        self.utrs = as_dict(utrs, to_dna=True)
+        self.settings = dict(settings)
+        self.settings['model_bls'] = load_model(self.settings.get('model_bls', MODEL_WITH_BLS))
+        self.settings['model_nobls'] = load_model(self.settings.get('model_nobls', MODEL_WITHOUT_BLS))
+        self.settings['models'] = load_models(self.settings.get('models', ()))
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.verbose = verbose
+        self.stats = {'started': time.time(),
+                      'requests': 0,
+                      'mirnas': 0,
+                      'batches': 0,
+                      'failed_batches': 0,
+                      'busy_time': 0.0}
+        # batches are counted by the workers of the pool
+        self.stats_lock = threading.Lock()
+        self.queue = Queue.Queue()
+        self.pool = ThreadPool(workers)
+        self.dispatcher = threading.Thread(target=self._dispatch, name="dispatcher")
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+
+    @classmethod
+    def from_config(cls, settings, **kwargs):
+        """Make service from the config of the pipeline (read with ConfigObj)"""
+        service_settings = settings_from_config(settings)
+        service_settings.update(kwargs)
+        return cls(settings['general']['seqs'], **service_settings)
+
+    def submit(self, mirnas, sites=False):
+        """Put request into the queue
+
+        Args:
+            mirnas (dict or list of (id, sequence)): miRNA or siRNA sequences
+
+        Kwargs:
+            sites (bool): report also the sites
+
+        Returns: PendingRequest
+
+        """
+        request = PendingRequest(check_mirnas(mirnas), sites)
+        self.queue.put(request)
+        return request
+
+    def predict(self, mirnas, sites=False, timeout=None):
+        """Predict targets of the miRNAs and wait for the result
+
+        Returns: dict with list of genes and (if requested) list of sites
+
+        """
+        return self.submit(mirnas, sites).wait(timeout)
+
+    def status(self):
+        with self.stats_lock:
+            status = dict(self.stats)
+        status.update({'uptime': time.time() - self.stats['started'],
+                       'utrs': len(self.utrs),
+                       'queued': self.queue.qsize(),
+                       'conservation': self.settings.get('conservation') is not None})
+        return status
+
+    def close(self):
+        self.queue.put(None)
+        self.pool.close()
+        self.pool.join()
+
+    def _dispatch(self):
+        """Collect requests into batches and give them to the workers"""
+        while True:
+            request = self.queue.get()
+            if request is None:
+                return
+            batch = [request]
+            size = len(request.mirnas)
+            deadline = time.time() + self.batch_wait
+            while size < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except Queue.Empty:
+                    break
+                if request is None:
+                    self.queue.put(None)
+                    break
+                batch.append(request)
+                size += len(request.mirnas)
+            self.pool.apply_async(self._run_batch, (batch,))
+
+    def _run_batch(self, batch):
+        """Predict all miRNAs of the batch at once and split the results"""
+        start = time.time()
+        # miRNAs get ids unique in the batch because requests can use the same ids
+        mirnas = {}
+        names = {}
+        for i, request in enumerate(batch):
+            for j, (mirid, seq) in enumerate(request.mirnas.iteritems()):
+                batch_id = "q%im%i" % (i, j)
+                mirnas[batch_id] = seq
+                names[batch_id] = (i, mirid)
+        try:
+            scored, genes = predict(self.utrs, mirnas, **self.settings)
+            results = [{'genes': [], 'sites': [] if request.sites else None} for request in batch]
+            for gene, batch_id, without, withc in genes:
+                i, mirid = names[batch_id]
+                results[i]['genes'].append({'gene': gene,
+                                            'mirna': mirid,
+                                            'score': without,
+                                            'score_with_conservation': withc})
+            if any(request.sites for request in batch):
+                columns = list(scored.columns)
+                for values in scored.itertuples(index=False):
+                    site = dict(zip(columns, [None if is_null(v) else v for v in values]))
+                    i, mirid = names[site['miRNA']]
+                    if batch[i].sites:
+                        site['miRNA'] = mirid
+                        results[i]['sites'].append(to_json_types(site))
+            for request, result in zip(batch, results):
+                if result['sites'] is None:
+                    del result['sites']
+                request.result = result
+        except Exception, e:
+            syserr(traceback.format_exc())
+            with self.stats_lock:
+                self.stats['failed_batches'] += 1
+            for request in batch:
+                request.error = e
+        finally:
+            with self.stats_lock:
+                self.stats['batches'] += 1
+                self.stats['requests'] += len(batch)
+                self.stats['mirnas'] += len(mirnas)
+                self.stats['busy_time'] += time.time() - start
+            if self.verbose:
+                syserr("Batch of %i requests (%i miRNAs) in %.2f s\n" % (len(batch), len(mirnas), time.time() - start))
+            for request in batch:
+                request.done.set()
+
+
+def check_mirnas(mirnas):
+    """Check miRNAs of the request
+
+    Returns: dict of sequences by id
+
+    Raises: RequestError
+
+    """
+    try:
+        pairs = mirnas.items() if isinstance(mirnas, dict) else list(mirnas)
+        checked = as_dict(pairs)
+    except (TypeError, ValueError):
+        raise RequestError("miRNAs should be given as {id: sequence} or [[id, sequence], ...]")
+    if not checked:
+        raise RequestError("No miRNAs in the request")
+    if len(checked) < len(pairs):
+        ids = [str(mirid) for mirid, seq in pairs]
+        raise RequestError("Duplicated miRNA ids: %s" % ", ".join(sorted(set(mirid for mirid in ids if ids.count(mirid) > 1))))
+    for mirid, seq in checked.iteritems():
+        if not SEQUENCE_PATTERN.match(seq):
+            raise RequestError("Sequence of %s is not a nucleotide sequence of length at least %i" % (mirid, MIRNA_LENGTH))
+    return checked
+
+
+def to_json_types(site):
+    """Convert numpy values of the site to python types"""
+    converted = {}
+    for key, value in site.iteritems():
+        if hasattr(value, 'item'):
+            value = value.item()
+        converted[key] = value
+    return converted
+
+
+def handle_message(service, message):
+    """Answer one request of the client
+
+    Args:
+        service (PredictionService): the service
+        message (dict): {"command": "predict", "mirnas": ..., "sites": false}
+                        or {"command": "status"}
+
+    Returns: tuple of HTTP-like status code and response
+
+    """
+    try:
+        command = message.get('command', 'predict')
+        if command == 'status':
+            return 200, service.status()
+        elif command == 'predict':
+            if 'mirnas' not in message:
+                raise RequestError("Missing mirnas in the request")
+            return 200, service.predict(message['mirnas'], bool(message.get('sites', False)))
+        raise RequestError("Unknown command %s" % command)
+    except RequestError, e:
+        return 400, {'error': str(e)}
+    except Exception, e:
+        return 500, {'error': "%s: %s" % (e.__class__.__name__, str(e))}
+
+
+class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """POST /predict with JSON request, GET /status"""
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/status":
+            self.respond(*handle_message(self.server.service, {'command': 'status'}))
+        else:
+            self.respond(404, {'error': "Unknown path %s" % self.path})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/predict":
+            self.respond(404, {'error': "Unknown path %s" % self.path})
+            return
+        try:
+            length = int(self.headers.getheader('content-length', 0))
+            message = json.loads(self.rfile.read(length))
+            if not isinstance(message, dict):
+                raise ValueError("Request should be a JSON object")
+        except ValueError, e:
+            self.respond(400, {'error': "Invalid JSON: %s" % str(e)})
+            return
+        message['command'] = 'predict'
+        self.respond(*handle_message(self.server.service, message))
+
+    def respond(self, code, response):
+        body = json.dumps(response)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.service.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class SocketHandler(SocketServer.StreamRequestHandler):
+
+    """One JSON request per line, one JSON response per line"""
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+                if not isinstance(message, dict):
+                    raise ValueError("Request should be a JSON object")
+                code, response = handle_message(self.server.service, message)
+            except ValueError, e:
+                code, response = 400, {'error': "Invalid JSON: %s" % str(e)}
+            response['status'] = code
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, socket_path=None, host="127.0.0.1", port=8750):
+    """Make HTTP server on host:port or Unix socket server if socket_path is given"""
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixServer(socket_path, SocketHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), HTTPHandler)
+    server.service = service
+    return server
@@ -0,0 +1,209 @@
+"""
+Putative target sites passed between the stages of the pipeline.
+
+A site is a seed match of a miRNA in a UTR. In files (*.seedcount) sites
+are kept as gzipped, tab-separated rows: id, miRNA, begin, end and the
+context sequence; the stages identify a site by "id,miRNA,begin,end".
+Sites can be also kept in the columnar format (see mirzag/columnar.py).
+
+In memory the sites of a chunk are kept in a SiteTable: ids of UTRs and
+miRNAs are interned and coded, coordinates are kept in arrays and context
+sequences as offsets into the UTRs (or into one buffer of the table), which
+takes some 30 bytes per site (plus the context if it is not in the UTRs)
+instead of some 400 bytes of a tuple with its strings.
+"""
+
+__license__ = "GPL"
+
+import sys
+import gzip
+from array import array
+from itertools import izip
+from collections import namedtuple
+
+from mirzag import columnar
+from mirzag import compress
+
+# begin is 0-based and end 1-based as in bed files
+Site = namedtuple('Site', ['id', 'mirna', 'beg', 'end', 'seq'])
+
+
+def site_key(site):
+    """Identifier of the site used in the outputs of the stages"""
+    return "%s,%s,%i,%i" % (site.id, site.mirna, site.beg, site.end)
+
+
+# where the context of the site in SiteTable is kept
+_NO_CONTEXT, _IN_UTR, _IN_BUFFER = 0, 1, 2
+
+
+class SiteTable(object):
+
+    """Compact read-only list of Site
+
+    Ids of UTRs and miRNAs are interned and kept as codes, coordinates in
+    arrays and the context sequence of a site as its offset in the UTR, if
+    the UTRs are given and contain it, or in the buffer of the table.
+    Sites are made again when they are accessed.
+
+    Kwargs:
+        utrs (dict): UTR sequences by id the contexts are looked up in
+        context (bool): keep the context sequences (not needed by most stages)
+
+    """
+
+    def __init__(self, utrs=None, context=True):
+        self.utrs = utrs
+        self.context = context
+        # names of UTRs and miRNAs by code (shared with the slices of the table)
+        self.names = []
+        self.codes = {}
+        self.ids = array('i')
+        self.mirnas = array('i')
+        self.begs = array('i')
+        self.ends = array('i')
+        self.stores = array('b')
+        self.offsets = array('i')
+        self.lengths = array('i')
+        self.buffer = array('c')
+
+    def code(self, name):
+        """Code of the UTR or miRNA id"""
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def append(self, site):
+        seqid, mirna, beg, end, seq = site
+        self.ids.append(self.code(seqid))
+        self.mirnas.append(self.code(mirna))
+        self.begs.append(beg)
+        self.ends.append(end)
+        store, offset, length = _NO_CONTEXT, 0, 0
+        if seq is not None and self.context:
+            length = len(seq)
+            utr = self.utrs.get(seqid) if self.utrs is not None else None
+            # the context covers the site
+            offset = utr.find(seq, max(0, end - length), beg + length) if utr is not None else -1
+            if offset >= 0:
+                store = _IN_UTR
+            else:
+                store, offset = _IN_BUFFER, len(self.buffer)
+                self.buffer.fromstring(seq)
+        self.stores.append(store)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def extend(self, sites):
+        for site in sites:
+            self.append(site)
+
+    def get_context(self, index):
+        store = self.stores[index]
+        offset = self.offsets[index]
+        if store == _IN_UTR:
+            return self.utrs[self.names[self.ids[index]]][offset:offset + self.lengths[index]]
+        if store == _IN_BUFFER:
+            return self.buffer[offset:offset + self.lengths[index]].tostring()
+        return None
+
+    def utr_ids(self):
+        """Ids of the UTRs of the sites"""
+        return set(self.names[code] for code in set(self.ids))
+
+    def mirna_ids(self):
+        """Ids of the miRNAs of the sites"""
+        return set(self.names[code] for code in set(self.mirnas))
+
+    def __len__(self):
+        return len(self.begs)
+
+    def __iter__(self):
+        names = self.names
+        for index, (seqid, mirna, beg, end) in enumerate(izip(self.ids, self.mirnas, self.begs, self.ends)):
+            yield Site(names[seqid], names[mirna], beg, end, self.get_context(index))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            table = SiteTable(self.utrs, self.context)
+            # codes do not change, so the slice shares the names
+            table.names = self.names
+            table.codes = self.codes
+            for position in xrange(*index.indices(len(self))):
+                table.ids.append(self.ids[position])
+                table.mirnas.append(self.mirnas[position])
+                table.begs.append(self.begs[position])
+                table.ends.append(self.ends[position])
+                store = self.stores[position]
+                offset = self.offsets[position]
+                if store == _IN_BUFFER:
+                    offset = len(table.buffer)
+                    table.buffer.fromstring(self.get_context(position))
+                table.stores.append(store)
+                table.offsets.append(offset)
+                table.lengths.append(self.lengths[position])
+            return table
+        if index < 0:
+            index += len(self)
+        return Site(self.names[self.ids[index]],
+                    self.names[self.mirnas[index]],
+                    self.begs[index],
+                    self.ends[index],
+                    self.get_context(index))
+
+
+def read_sites(path, zipped=True, context=True, utrs=None):
+    """Read coordinate file into table of sites
+
+    Several miRNAs can be given in the miRNA column separated by comma, in
+    such case one site per miRNA is returned. The sequence column is optional.
+    Files in the columnar format are recognized and read as well.
+
+    Args:
+        path (str): path to the coordinate file
+
+    Kwargs:
+        zipped (bool): is the file gzipped
+        context (bool): keep the context sequences of the sites
+        utrs (dict): UTR sequences by id the contexts are looked up in
+
+    Returns: SiteTable
+
+    """
+    sites = SiteTable(utrs, context)
+    try:
+        if zipped and columnar.is_columnar(path):
+            sites.extend(columnar.read_rows(path))
+            return sites
+        handle = gzip.open(path, 'rb') if zipped else open(path, 'r')
+    except IOError:
+        raise IOError('Cannot read from coordinate file %s' % (path))
+    with handle:
+        for line in handle:
+            fields = line.rstrip().split()
+            if not fields:
+                continue
+            try:
+                beg, end = int(fields[2]), int(fields[3])
+            except IndexError:
+                sys.stderr.write("IndexError in coordinate file, line: %s\n" % (' '.join(fields)))
+                continue
+            except ValueError:
+                raise ValueError("Wrong coordinates: %s" % " ".join(fields))
+            seq = fields[4] if len(fields) > 4 else None
+            for mirna in fields[1].split(","):
+                sites.append(Site(fields[0], mirna, beg, end, seq))
+    return sites
+
+
+def write_sites(path, sites, fmt="tsv"):
+    """Write sites into gzipped coordinate file (or columnar file with fmt columnar)"""
+    if fmt == "columnar":
+        with columnar.Writer(path, columnar.SITES) as writer:
+            writer.write_rows(sites)
+        return
+    with compress.open_output(path) as outfile:
+        for site in sites:
+            outfile.write("%s\t%s\t%i\t%i\t%s\n" % site)
@@ -0,0 +1,406 @@
+"""
+Node-local zygote: a resident process that runs the jobs of the stages in
+forks of itself.
+
+Every job of the pipeline starts a new interpreter which imports its script
+and reads the UTRs again. With the general setting zygote = yes the
+commands of the stages are run through the client (scripts/rg_zygote.py).
+It connects to the zygote of the node over a Unix socket and sends the
+command with its working directory, environment and standard streams (as
+file descriptors). The zygote has the modules of the stages imported and
+keeps the fasta files given with --preload in memory (see
+mirzag.fasta.preload), so the fork made for the job (copy-on-write) starts
+at once and read_fasta of these files, or of links to them (e.g. from the
+node cache), does not read them again. The exit status of the job is sent
+back to the client, which exits with it.
+
+When the zygote is not running, the client starts it in the background and
+runs the job itself. The zygote exits after idle_timeout seconds without
+jobs, and as soon as a module of the pipeline it imported changed (e.g.
+the pipeline was updated): the job is then run by the client and the next
+one starts a new zygote. Scripts of the stages are compiled again when
+they change. Forked jobs run outside of the job of the scheduler, so its
+accounting and limits do not apply to them, and a scheduler that kills all
+processes of a finished job kills also the zygote (jobs then run as
+without it).
+"""
+
+__license__ = "GPL"
+
+import os
+import imp
+import sys
+import json
+import time
+import errno
+import fcntl
+import signal
+import socket
+import struct
+import hashlib
+import tempfile
+import threading
+import traceback
+import subprocess
+import _multiprocessing
+
+from mirzag.fasta import preload
+
+PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ZYGOTE_SCRIPT = os.path.join(PIPELINE_DIR, "scripts", "rg_zygote.py")
+DEFAULT_IDLE_TIMEOUT = 600
+LOCK_SUFFIX = ".lock"
+LOG_SUFFIX = ".log"
+# modules imported lazily by the stages, imported by the zygote if available
+LAZY_MODULES = ['numpy', 'pandas', 'dendropy']
+
+_LENGTH = struct.Struct('<I')
+
+
+def default_socket(pipeline_dir=PIPELINE_DIR):
+    """Socket of the zygote of the user and of this copy of the pipeline on the node"""
+    return os.path.join("/tmp", "mirzag_zygote_%i_%s.sock" % (os.getuid(),
+                                                              hashlib.sha1(pipeline_dir).hexdigest()[:10]))
+
+
+def is_python_command(command):
+    """Is the command a python script that can run in the zygote"""
+    return len(command) > 1 and os.path.basename(command[0]).startswith("python") and command[1].endswith(".py")
+
+
+def run(socket_path, command, preload_paths=()):
+    """Run the command in a fork of the zygote
+
+    Args:
+        socket_path (str): Unix socket of the zygote
+        command (list): python, the script and its arguments
+
+    Kwargs:
+        preload_paths (list): fasta files kept in memory by the zygote for the jobs
+
+    Returns: exit status of the job, None if the zygote is not running (or refused the job)
+
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+        request = json.dumps({'argv': command[1:],
+                              'cwd': os.getcwd(),
+                              'env': dict(os.environ),
+                              'preload': [os.path.abspath(path) for path in preload_paths]})
+        connection.sendall(_LENGTH.pack(len(request)) + request)
+        for fd in (0, 1, 2):
+            _send_fd(connection, fd)
+    except socket.error:
+        connection.close()
+        return None
+    try:
+        response = _read_line(connection)
+    finally:
+        connection.close()
+    if not response:
+        sys.stderr.write("Job was lost by the zygote %s\n" % socket_path)
+        return 1
+    return json.loads(response)['status']
+
+
+def start(socket_path, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """Start the zygote in the background, unless it is already running or starting
+
+    Returns: True if it was started
+
+    """
+    with open(socket_path + LOCK_SUFFIX, 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            # the zygote holds the lock as long as it runs
+            return False
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    with open(os.devnull) as devnull:
+        with open(socket_path + LOG_SUFFIX, 'a') as log:
+            subprocess.Popen([sys.executable, ZYGOTE_SCRIPT,
+                              "--serve",
+                              "--socket", socket_path,
+                              "--idle-timeout", str(idle_timeout)],
+                             stdin=devnull, stdout=log, stderr=log, close_fds=True,
+                             cwd="/", preexec_fn=os.setsid)
+    return True
+
+
+class Zygote(object):
+
+    """Resident process forking the jobs of the stages
+
+    Args:
+        socket_path (str): Unix socket to listen on
+
+    Kwargs:
+        idle_timeout (float): exit after so many seconds without jobs
+        verbose (bool): be loud
+
+    """
+
+    def __init__(self, socket_path, idle_timeout=DEFAULT_IDLE_TIMEOUT, verbose=False):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.verbose = verbose
+        self.listener = None
+        self.children = set()
+        # compiled scripts and their modification times by path
+        self.scripts = {}
+        # modification times of the imported modules of the pipeline by path
+        self.modules = {}
+        self.last_job = time.time()
+
+    def serve(self):
+        """Preload the modules and fork the jobs until the zygote is idle
+
+        Returns: False if another zygote serves the socket
+
+        """
+        with open(self.socket_path + LOCK_SUFFIX, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return False
+            signal.signal(signal.SIGTERM, _terminate)
+            try:
+                self.preload_modules()
+                # socket of a zygote that was killed
+                if os.path.exists(self.socket_path):
+                    os.remove(self.socket_path)
+                self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                umask = os.umask(0077)
+                try:
+                    self.listener.bind(self.socket_path)
+                finally:
+                    os.umask(umask)
+                self.listener.listen(64)
+                self.listener.settimeout(1.0)
+                self.log("Zygote %i serves %s\n" % (os.getpid(), self.socket_path))
+                self.loop()
+            finally:
+                if self.listener is not None:
+                    self.listener.close()
+                    if os.path.exists(self.socket_path):
+                        os.remove(self.socket_path)
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        self.log("Zygote %i stopped\n" % os.getpid())
+        return True
+
+    def loop(self):
+        self.last_job = time.time()
+        while True:
+            self.reap()
+            if not self.children and time.time() - self.last_job > self.idle_timeout:
+                return
+            try:
+                connection, _ = self.listener.accept()
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            self.last_job = time.time()
+            connection.settimeout(None)
+            if self.is_stale():
+                self.log("Modules of the pipeline changed, zygote %i exits\n" % os.getpid())
+                self.refuse(connection)
+                return
+            self.fork_job(connection)
+
+    def preload_modules(self):
+        """Import the modules of the stages (their scripts are compiled and their top level is run)"""
+        from mirzag.costmodel import ANALYSIS_STAGES
+        for stage in ANALYSIS_STAGES:
+            path = os.path.join(PIPELINE_DIR, "scripts", stage + ".py")
+            exec self.compile(path) in {'__name__': 'zygote_' + stage, '__file__': path}
+        for name in LAZY_MODULES:
+            try:
+                __import__(name)
+            except ImportError:
+                pass
+        self.modules = pipeline_modules()
+
+    def is_stale(self):
+        """Did a module of the pipeline imported by the zygote change since it was imported"""
+        for path, mtime in self.modules.iteritems():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def refuse(self, connection):
+        """Tell the client to run the job itself"""
+        try:
+            _read_exactly(connection, _LENGTH.unpack(_read_exactly(connection, _LENGTH.size))[0])
+            connection.sendall(json.dumps({'status': None}) + "\n")
+        except (socket.error, IOError):
+            pass
+        finally:
+            connection.close()
+
+    def compile(self, path):
+        """Code of the script, compiled again if the script changed"""
+        mtime = os.path.getmtime(path)
+        if path not in self.scripts or self.scripts[path][0] != mtime:
+            with open(path, 'rU') as infile:
+                self.scripts[path] = (mtime, compile(infile.read(), path, 'exec'))
+        return self.scripts[path][1]
+
+    def fork_job(self, connection):
+        try:
+            request = json.loads(_read_exactly(connection, _LENGTH.unpack(_read_exactly(connection, _LENGTH.size))[0]))
+            for path in request['preload']:
+                try:
+                    if preload(path):
+                        self.log("Preloaded %s\n" % path)
+                except IOError as e:
+                    self.log("Cannot preload %s: %s\n" % (path, str(e)))
+        except (socket.error, IOError, ValueError, KeyError) as e:
+            self.log("Invalid request: %s\n" % str(e))
+            connection.close()
+            return
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self.listener.close()
+                status = self.run_job(connection, request)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status if 0 <= status < 256 else 1)
+        self.children.add(pid)
+        connection.close()
+
+    def run_job(self, connection, request):
+        """Run the script of the request in this fork
+
+        Returns: exit status of the script
+
+        """
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # own process group so the job is killed with its subprocesses when the client goes away
+        os.setpgid(0, 0)
+        fds = [_multiprocessing.recvfd(connection.fileno()) for _ in xrange(3)]
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        tempfile.tempdir = None
+        watcher = threading.Thread(target=_watch, args=(connection,))
+        watcher.daemon = True
+        watcher.start()
+        status = run_script(self.compile(request['argv'][0]), request['argv'])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        connection.sendall(json.dumps({'status': status}) + "\n")
+        return status
+
+    def reap(self):
+        for pid in list(self.children):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                done = pid
+            if done:
+                self.children.discard(pid)
+
+    def log(self, message):
+        if self.verbose:
+            sys.stderr.write(time.strftime("[%Y-%m-%d %H:%M:%S] ") + message)
+
+
+def pipeline_modules():
+    """Modification times of the source files of the imported modules of the pipeline by path"""
+    modules = {}
+    for module in sys.modules.values():
+        path = getattr(module, '__file__', None)
+        if not path:
+            continue
+        path = os.path.abspath(os.path.splitext(path)[0] + ".py")
+        if path.startswith(os.path.join(PIPELINE_DIR, "mirzag") + os.sep) and os.path.exists(path):
+            modules[path] = os.path.getmtime(path)
+    return modules
+
+
+def run_script(code, argv):
+    """Run the compiled script as __main__ with the arguments
+
+    Returns: exit status
+
+    """
+    module = imp.new_module('__main__')
+    module.__file__ = argv[0]
+    sys.modules['__main__'] = module
+    sys.argv = list(argv)
+    try:
+        exec code in module.__dict__
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        sys.stderr.write("%s\n" % e.code)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
+
+
+def _watch(connection):
+    """Kill the job and its subprocesses when the client goes away (e.g. killed by the scheduler)"""
+    try:
+        data = connection.recv(1)
+    except socket.error:
+        data = ""
+    if not data:
+        os.killpg(os.getpgid(0), signal.SIGTERM)
+
+
+def _send_fd(connection, fd):
+    try:
+        os.fstat(fd)
+    except OSError:
+        # closed standard stream of the client
+        with open(os.devnull, 'r+') as devnull:
+            _multiprocessing.sendfd(connection.fileno(), devnull.fileno())
+        return
+    _multiprocessing.sendfd(connection.fileno(), fd)
+
+
+def _read_exactly(connection, size):
+    data = []
+    while size > 0:
+        chunk = connection.recv(size)
+        if not chunk:
+            raise IOError("Connection closed")
+        data.append(chunk)
+        size -= len(chunk)
+    return "".join(data)
+
+
+def _read_line(connection):
+    data = []
+    while True:
+        chunk = connection.recv(4096)
+        if not chunk:
+            break
+        data.append(chunk)
+        if chunk.endswith("\n"):
+            break
+    return "".join(data)
@@ -9,6 +9,19 @@ from jinja2 import Template
 from Jobber import JobClient
 from argparse import ArgumentParser, RawTextHelpFormatter
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mirzag import fingerprint
+from mirzag import cache
+from mirzag import jobs
+from mirzag import runstats
+from mirzag import costmodel
+from mirzag import columnar
+from mirzag import fasta
+from mirzag import compress
+from mirzag import zygote
+from mirzag.resources import Resources
+from mirzag.models import registry_paths
+
 parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
 parser.add_argument("-v",
                     "--verbose",
@@ -61,385 +74,622 @@ def main(options):
     with open(template) as tmpl:
         template = Template(tmpl.read())
 
+    # The jobs are collected in memory and submitted at the end (see mirzag/jobs.py). The command of each
+    # stage is rendered once: paths of the chunk are left as {chunk}, {mirnas} and {chunk_seqs} and filled
+    # in for each chunk.
+    graph = jobs.JobGraph(pip_dir, settings['general'].get('chunks_per_job', jobs.DEFAULT_CHUNKS_PER_JOB))
+    drmaa = settings['general'].get('executer', 'drmaa') == 'drmaa'
+    # intermediate files are gzipped TSV or columnar (see mirzag/columnar.py), the final output is always TSV
+    intermediate_format = settings['general'].get('intermediate_format', 'tsv')
+    if intermediate_format not in columnar.FORMATS:
+        raise Exception("Unknown intermediate_format %s, use one of: %s" % (intermediate_format, ", ".join(columnar.FORMATS)))
+    # outputs of the stages are compressed in blocks, on compress_threads threads (see mirzag/compress.py)
+    compress_options = "--compress-level %s --compress-threads %s --codec %s" % (settings['general'].get('compress_level', compress.DEFAULT_LEVEL),
+                                                                               settings['general'].get('compress_threads', 1),
+                                                                               settings['general'].get('columnar_codec', 'zlib'))
+    # inputs shared by all jobs are copied once per node if the node cache is set up
+    node_cache = {'cache_script': os.path.join(pip_dir, "scripts/rg_node_cache.py"),
+                  'cache_dir': settings['general'].get('node_cache_dir', None),
+                  'cache_size': settings['general'].get('node_cache_size', None)}
+    # with zygote = yes the stages run in forks of the node-local zygote which keeps their modules
+    # imported and the UTRs in memory (see mirzag/zygote.py)
+    zygote_client = None
+    if settings['general'].get('zygote', 'no') == 'yes':
+        zygote_client = "python %s --socket %s --idle-timeout %s" % (os.path.join(pip_dir, "scripts/rg_zygote.py"),
+                                                                     settings['general'].get('zygote_socket', zygote.default_socket(pip_dir)),
+                                                                     settings['general'].get('zygote_idle_timeout', zygote.DEFAULT_IDLE_TIMEOUT))
+
+    # chunks are submitted from the one predicted to take longest (see mirzag/costmodel.py), the model
+    # learns also from the statistics of the previous run in the output directory
+    cost_model = costmodel.CostModel.load(settings['general'].get('cost_model', None))
+    cost_model.update(runstats.load_records(options.input_dir), options.input_dir)
+    use_priorities = drmaa and settings['general'].get('job_priorities', 'no') == 'yes'
+    # memory and queue of each job are predicted by the model as well if learn_resources is set
+    resources = Resources(cost_model, settings['general'], options.input_dir)
+    sites = {}
+    costs = {}
+
     files_to_run = {}
+    chunk_seqs = {}
+    patches = {}
+    # keys of the jobs by chunk and output (see mirzag/cache.py), if seed matches of the chunk
+    # are calculated and jobs calculating its features (the merge waits only for them)
+    keys = {}
+    scheduled = {}
+    feature_jobs = {}
     if options.protocol == "seed":
-        seed_count_group = jobber.startGroup({'name': 'SeedCount'})
-        for f in glob.glob(options.input_dir + "/*.fa"):
+        graph.start_group({'name': 'SeedCount'})
+        #
+        # Calculate seed matches
+        #
+        seed_count_settings = settings['tasks']['CalculateSeedMatches']
+        seed_count_script = 'scripts/rg_count_miRNA_seeds_and_filter_duplicates.py'
+        seed_count_command = """python {script} \\
+                                    --motifs {input} \\
+                                    --seqs {seqs} \\
+                                    --output {output} \\
+                                    --how {how} \\
+                                    --context {context} \\
+                                    --split-by "{split_by}" \\
+                                    --index-after-split {index_after_split} \\
+                                    --format {format} \\
+                                    {compress} \\
+                                    -v
+                      """
+        seed_count_fields = {'script': os.path.join(pip_dir, seed_count_script),
+                             'format': intermediate_format,
+                             'compress': compress_options,
+                             'how': seed_count_settings.get('how', 'TargetScan'),
+                             'split_by': settings['general'].get('split_by', "NONE"),
+                             'index_after_split': settings['general'].get('index_after_split', 0),
+                             'context': seed_count_settings.get('context', 50)}
+        #
+        # If there is template use it for command
+        #
+        if drmaa:
+            seed_count_fields.update({'input': 'mirnas.fa',
+                                      'seqs': 'seqs.fa',
+                                      'output': 'output'})
+            seed_count_command = render_stage(template, seed_count_settings, node_cache,
+                                              zygote=zygote_client,
+                                              command=seed_count_command.format(**seed_count_fields),
+                                              copy={'{mirnas}': 'mirnas.fa'},
+                                              shared={'{chunk_seqs}': ('seqs.fa', '{chunk_seqs_digest}')},
+                                              moveback={'output': '{chunk}.seedcount',
+                                                        'output.stats.json': '{chunk}.seedcount.stats.json'})
+        else:
+            seed_count_fields.update({'input': '{mirnas}',
+                                      'seqs': '{chunk_seqs}',
+                                      'output': '{chunk}.seedcount'})
+            seed_count_command = in_zygote(zygote_client, seed_count_command.format(**seed_count_fields), ['{chunk_seqs}'])
+        seed_count_command = str(seed_count_command)
+
+        # chunks reused from the previous run (see --incremental) are not calculated again,
+        # unless UTRs changed: then only UTRs of the changed genes are calculated and
+        # patched into the chunk before the merge
+        manifest = fingerprint.load_manifest(options.input_dir) or {'chunks': {}}
+        chunks = glob.glob(options.input_dir + "/*.fa")
+        for f in chunks:
             input_name = os.path.splitext(f)[0]
-
-            #
-            # Calculate seed matches
-            #
-            seed_count_settings = settings['tasks']['CalculateSeedMatches']
-            seed_count_script = 'scripts/rg_count_miRNA_seeds_and_filter_duplicates.py'
-            seed_count_command = """python {script} \\
-                                        --motifs {input} \\
-                                        --seqs {seqs} \\
-                                        --output {output} \\
-                                        --how {how} \\
-                                        --context {context} \\
-                                        --split-by "{split_by}" \\
-                                        --index-after-split {index_after_split} \\
-                                        -v
-                          """
-            #
-            # If there is template use it for command
-            #
-            if settings['general'].get('executer', 'drmaa') == 'drmaa':
-                #
-                # Copy files by default to the tmp directory
-                #
-                copy_dir = "$TMPDIR"
-                copy_files = {f: 'mirnas.fa',
-                              settings['general']['seqs']: 'seqs.fa'}
-                moveback = {'output': input_name + ".seedcount"}
-
-                seed_command_rendered = template.render(modules=seed_count_settings.get('modules', None),
-                                                   command=seed_count_command,
-                                                   copy=copy_files,
-                                                   moveback=moveback,
-                                                   copydir=copy_dir)
-                seed_count_command = str(seed_command_rendered).format(**{'script': os.path.join(pip_dir, seed_count_script),
-                                               'input': 'mirnas.fa',
-                                               'seqs': 'seqs.fa',
-                                               'output': 'output',
-                                               'how': seed_count_settings.get('how', 'TargetScan'),
-                                                'split_by': settings['general'].get('split_by', "NONE"),
-                                               'index_after_split': settings['general'].get('index_after_split', 0),
-                                               'context': seed_count_settings.get('context', 50)})
+            sites[input_name] = cost_model.chunk_sites(input_name + ".seedcount", f)
+            costs[input_name] = cost_model.predict(costmodel.ANALYSIS_STAGES, sites[input_name]) or 0.0
+        max_cost = max(costs.values() or [0.0])
+        for f in sorted(chunks, key=lambda f: (-costs[os.path.splitext(f)[0]], f)):
+            input_name = os.path.splitext(f)[0]
+            chunk_info = manifest['chunks'].get(os.path.basename(input_name), {})
+            if chunk_info.get('reused', False):
+                if not chunk_info.get('patch', False):
+                    # results of runs before the digest records were introduced are finished as well
+                    if not cache.is_recorded(input_name + ".score"):
+                        cache.save_record(input_name + ".score", None)
+                    continue
+                patches[input_name + fingerprint.UPDATE_SUFFIX] = input_name
+                sites[input_name + fingerprint.UPDATE_SUFFIX] = sites[input_name]
+                costs[input_name + fingerprint.UPDATE_SUFFIX] = costs[input_name]
+                input_name = input_name + fingerprint.UPDATE_SUFFIX
+                chunk_seqs[input_name] = os.path.join(options.input_dir, fingerprint.UPDATE_SEQS)
             else:
-                seed_count_command = str(seed_count_command).format(**{'script': os.path.join(pip_dir, seed_count_script),
-                                               'input': f,
-                                               'seqs': settings['general']['seqs'],
-                                               'output': input_name + ".seedcount",
-                                               'how': seed_count_settings.get('how', 'TargetScan'),
-                                                'split_by': settings['general'].get('split_by', "NONE"),
-                                               'index_after_split': settings['general'].get('index_after_split', 0),
-                                               'context': seed_count_settings.get('context', 50)})
-            seed_count_id = jobber.job(seed_count_command,
+                chunk_seqs[input_name] = settings['general']['seqs']
+
+            command = seed_count_command.format(mirnas=f, **chunk_fields(input_name, chunk_seqs))
+            keys[input_name] = {'seedcount': cache.job_key('SeedCount', command,
+                                                           inputs=[os.path.join(pip_dir, seed_count_script),
+                                                                   f,
+                                                                   chunk_seqs[input_name]])}
+            seed_count_job = graph.job(command,
                                        {'name': 'SeedCount',
                                         'uniqueId': True,
-                                        'options': [('q', seed_count_settings.get('queue', 'short.q')),
-                                                    ('l', "membycore=%s" % seed_count_settings.get('mem_req', '2G'))]
-                                        })
-            files_to_run[input_name] = seed_count_id
+                                        'options': resources.options(seed_count_settings, stage_name(seed_count_script), input_name + ".seedcount", keys[input_name]['seedcount'], sites[input_name]) + priority(costs[input_name], max_cost, use_priorities)
+                                        },
+                                       input_name + ".seedcount",
+                                       keys[input_name]['seedcount'])
+            files_to_run[input_name] = seed_count_job
+            scheduled[input_name] = seed_count_job is not None
+            feature_jobs[input_name] = []
 
-        jobber.endGroup()
+        graph.end_group()
 
     if options.protocol == 'scan':
         for f in glob.glob(options.input_dir + "/*.seedcount"):
             input_name = os.path.splitext(f)[0]
             files_to_run[input_name] = None
-
-    features_group_id = jobber.startGroup({'name': "Features_Group"})
+            chunk_seqs[input_name] = settings['general']['seqs']
+            keys[input_name] = {'seedcount': cache.input_digest(f)}
+            scheduled[input_name] = False
+            feature_jobs[input_name] = []
+            sites[input_name] = cost_model.chunk_sites(f)
+            costs[input_name] = cost_model.predict(costmodel.ANALYSIS_STAGES, sites[input_name]) or 0.0
+        max_cost = max(costs.values() or [0.0])
+
+    # the feature stages read only the UTRs and miRNAs of their sites through the index of the fasta
+    # file (see mirzag/fasta.py), made here once and shipped to the jobs on the cluster with the file
+    seqs_shared = {'{chunk_seqs}': ('seqs.fa', '{chunk_seqs_digest}')}
+    if all([fasta.ensure_index(path) for path in set(chunk_seqs.values())]):
+        seqs_shared['{chunk_seqs}' + fasta.INDEX_SUFFIX] = ('seqs.fa' + fasta.INDEX_SUFFIX, '{chunk_seqs_index_digest}')
+    motifs = settings['general']['motifs']
+    motifs_shared = {motifs: ('motifs.fa', cache.input_digest(motifs))}
+    if fasta.ensure_index(motifs):
+        motifs_shared[motifs + fasta.INDEX_SUFFIX] = ('motifs.fa' + fasta.INDEX_SUFFIX, cache.input_digest(motifs + fasta.INDEX_SUFFIX))
+
+    graph.start_group({'name': "Features_Group"})
 
     #
     # MIRZA
     #
-    mirza_group = jobber.startGroup({'name': 'MIRZA'})
-    for input_name, seed_count_id in files_to_run.iteritems():
-        #
-        # Create group for each file in order to calculate features
-        #
-        mirza_settings = settings['tasks']['CalculateMIRZA']
-        mirza_script = 'scripts/rg_calculate_MIRZA.py'
-        calculate_mirza_command = """python {script} \\
-                        --out {output} \\
-                        --seq {seqs} \\
-                        --coords {input} \\
-                        --motifs {motifs} \\
-                        --contextLen {context} \\
-                        --reforg {reforg} \\
-                        --tree {tree} \\
-                        --mln-dir {mlndir} \\
-                        --threshold {threshold} \\
-                        --onlyMIRZA {onlymirza} \\
-                        --mirzabin {mirzabin} \\
-                        -v
-                  """
-
-        if settings['general'].get('executer', 'drmaa') == 'drmaa':
-            #
-            # Copy files by default to the tmp directory
-            #
-            copy_dir = "$TMPDIR"
-            copy_files = {input_name + ".seedcount": 'input.seedcount',
-                          settings['general']['seqs']: 'seqs.fa',
-                          settings['general']['motifs']: 'motifs.fa'}
-            moveback = {'output': input_name + ".mirza"}
-
-            calculate_mirza_command_rendered = template.render(modules=mirza_settings.get('modules', None),
-                                                               command=calculate_mirza_command,
-                                                               copy=copy_files,
-                                                               moveback=moveback,
-                                                               copydir=copy_dir)
-            calculate_mirza_command = str(calculate_mirza_command_rendered).format(**{'script': os.path.join(pip_dir, mirza_script),
-                                'output': 'output',
-                                'input': "input.seedcount",
-                                'seqs': 'seqs.fa',
-                                'motifs': 'motifs.fa',
-                                'context': mirza_settings.get('context_length', 50),
-                                'reforg': mirza_settings.get('reference_organism', 'any/path'),
-                                'tree': mirza_settings.get('phylogenetic_tree', 'any/path'),
-                                'mlndir': mirza_settings.get('alignment_directory', 'any/path'),
-                                'threshold': mirza_settings.get('threshold', 50),
-                                'onlymirza': settings['general'].get('run_only_MIRZA', "yes"),
-                                'mirzabin': settings['general']['mirza_binary'],
-                                })
-        else:
-            calculate_mirza_command = str(calculate_mirza_command).format(**{'script': os.path.join(pip_dir, mirza_script),
-                                'output': input_name + ".mirza",
-                                'input': input_name + ".seedcount",
-                                'seqs': settings['general']['seqs'],
-                                'motifs': settings['general']['motifs'],
-                                'context': mirza_settings.get('context_length', 50),
-                                'reforg': mirza_settings.get('reference_organism', 'any/path'),
-                                'tree': mirza_settings.get('phylogenetic_tree', 'any/path'),
-                                'mlndir': mirza_settings.get('alignment_directory', 'any/path'),
-                                'threshold': mirza_settings.get('threshold', 50),
-                                'onlymirza': settings['general'].get('run_only_MIRZA', "yes"),
-                                'mirzabin': settings['general']['mirza_binary'],
-                                })
-
-        calculate_mirza_id = jobber.job(calculate_mirza_command, {
+    graph.start_group({'name': 'MIRZA'})
+    mirza_settings = settings['tasks']['CalculateMIRZA']
+    mirza_script = 'scripts/rg_calculate_MIRZA.py'
+    calculate_mirza_command = """python {script} \\
+                    --out {output} \\
+                    --seq {seqs} \\
+                    --coords {input} \\
+                    --motifs {motifs} \\
+                    --contextLen {context} \\
+                    --reforg {reforg} \\
+                    --tree {tree} \\
+                    --mln-dir {mlndir} \\
+                    --threshold {threshold} \\
+                    --onlyMIRZA {onlymirza} \\
+                    --mirzabin {mirzabin} \\
+                    --batch-size {batch_size} \\
+                    --journal {journal} \\
+                    --format {format} \\
+                    {compress} \\
+                    -v
+              """
+    # the journal of finished batches is kept next to the output so a preempted job can continue
+    mirza_fields = {'script': os.path.join(pip_dir, mirza_script),
+                    'format': intermediate_format,
+                    'compress': compress_options,
+                    'context': mirza_settings.get('context_length', 50),
+                    'reforg': mirza_settings.get('reference_organism', 'any/path'),
+                    'tree': mirza_settings.get('phylogenetic_tree', 'any/path'),
+                    'mlndir': mirza_settings.get('alignment_directory', 'any/path'),
+                    'threshold': mirza_settings.get('threshold', 50),
+                    'onlymirza': settings['general'].get('run_only_MIRZA', "yes"),
+                    'mirzabin': settings['general']['mirza_binary'],
+                    'batch_size': mirza_settings.get('batch_size', 1000),
+                    'journal': '{chunk}.mirza.journal'}
+    if drmaa:
+        mirza_fields.update({'output': 'output',
+                             'input': "input.seedcount",
+                             'seqs': 'seqs.fa',
+                             'motifs': 'motifs.fa'})
+        calculate_mirza_command = render_stage(template, mirza_settings, node_cache,
+                                               zygote=zygote_client,
+                                               command=calculate_mirza_command.format(**mirza_fields),
+                                               copy={'{chunk}.seedcount': 'input.seedcount'},
+                                               shared=dict(seqs_shared, **motifs_shared),
+                                               moveback={'output': '{chunk}.mirza',
+                                                         'output.stats.json': '{chunk}.mirza.stats.json'})
+    else:
+        mirza_fields.update({'output': '{chunk}.mirza',
+                             'input': '{chunk}.seedcount',
+                             'seqs': '{chunk_seqs}',
+                             'motifs': settings['general']['motifs']})
+        calculate_mirza_command = in_zygote(zygote_client, calculate_mirza_command.format(**mirza_fields), ['{chunk_seqs}'])
+    calculate_mirza_command = str(calculate_mirza_command)
+
+    for input_name in by_cost(files_to_run, costs):
+        seed_count_job = files_to_run[input_name]
+        command = calculate_mirza_command.format(**chunk_fields(input_name, chunk_seqs))
+        keys[input_name]['mirza'] = cache.job_key('CalculateMIRZA', command,
+                                                     inputs=[os.path.join(pip_dir, mirza_script),
+                                                             chunk_seqs[input_name],
+                                                             settings['general']['motifs']],
+                                                     upstream=[keys[input_name]['seedcount']])
+        calculate_mirza_job = graph.job(command, {
                                           'name': 'CalculateMIRZA',
-                                          'dependencies': [seed_count_id] if seed_count_id is not None else [],
-                                           'options': [('q', mirza_settings.get('queue', 'short.q')),
-                                                       ('l', "membycore=%s" % mirza_settings.get('mem_req', '2G'))],
-                                          'uniqueId': True})
-
-    jobber.endGroup()
+                                          'dependencies': [seed_count_job],
+                                           'options': resources.options(mirza_settings, stage_name(mirza_script), input_name + ".mirza", keys[input_name]['mirza'], sites[input_name]) + priority(costs[input_name], max_cost, use_priorities),
+                                          'uniqueId': True},
+                                   input_name + ".mirza",
+                                   keys[input_name]['mirza'],
+                                   # the job is cached only if its seed matches are
+                                   cacheable=seed_count_job is None)
+        if calculate_mirza_job is not None:
+            feature_jobs[input_name].append(calculate_mirza_job)
+
+    graph.end_group()
     #
     # Contrafold
     #
-    contrafold_group = jobber.startGroup({'name': 'CONTRAfold'})
-    for input_name, seed_count_id in files_to_run.iteritems():
-        contrafold_settings = settings['tasks']['CalculateCONTRAfold']
-        contrafold_script = 'scripts/rg_calculate_contrafold.py'
-        contrafold_command = """python {script} \\
-                                    --out {output} \\
-                                    --seq {seqs} \\
-                                    --coords {input} \\
-                                    --contextLen_L {contextlen_l} \\
-                                    --contextLen_U {contextlen_u} \\
-                                    --context {context} \\
-                                    --contrabin {contrabin} \\
-                                    -v
-                              """
-        if settings['general'].get('executer', 'drmaa') == 'drmaa':
-            #
-            # Copy files by default to the tmp directory
-            #
-            copy_dir = "$TMPDIR"
-            copy_files = {input_name + ".seedcount": 'input.seedcount',
-                          settings['general']['seqs']: 'seqs.fa'}
-            moveback = {'output': input_name + ".contrafold"}
-
-            contrafold_command_rendered = template.render(modules=contrafold_settings.get('modules', None),
-                                                          command=contrafold_command,
-                                                          copy=copy_files,
-                                                          moveback=moveback,
-                                                          copydir=copy_dir)
-            contrafold_command = str(contrafold_command_rendered).format(**{'script': os.path.join(pip_dir, contrafold_script),
-                                    'output': "output",
-                                    'input': "input.seedcount",
-                                    'seqs': 'seqs.fa',
-                                    'context': contrafold_settings.get('context', 50),
-                                    'contextlen_l': contrafold_settings.get('contextLen_L', 14),
-                                    'contextlen_u': contrafold_settings.get('contextLen_U', 0),
-                                    'contrabin': settings['general']['contrafold_binary']
-                                     })
-        else:
-            contrafold_command = str(contrafold_command).format(**{'script': os.path.join(pip_dir, contrafold_script),
-                                    'output': input_name + ".contrafold",
-                                    'input': input_name + ".seedcount",
-                                    'seqs': settings['general']['seqs'],
-                                    'context': contrafold_settings.get('context', 50),
-                                    'contextlen_l': contrafold_settings.get('contextLen_L', 14),
-                                    'contextlen_u': contrafold_settings.get('contextLen_U', 0),
-                                    'contrabin': settings['general']['contrafold_binary']
-                                     })
-
-        calculate_contrafold_id = jobber.job(contrafold_command, {
-                                          'name': 'CalculateCONTRAfold',
-                                          'dependencies': [seed_count_id] if seed_count_id is not None else [],
-                                           'options': [('q', contrafold_settings.get('queue', 'short.q')),
-                                                       ('l', "membycore=%s" % contrafold_settings.get('mem_req', '2G'))],
-                                          'uniqueId': True})
-    jobber.endGroup()
-    #
-    # Flanks
-    #
-    flanks_group = jobber.startGroup({'name': 'Flanks'})
-    for input_name, seed_count_id in files_to_run.iteritems():
-        calculate_flanks_settings = settings['tasks']['CalculateFlanks']
-        flanks_script = 'scripts/rg_calculate_flanks_composition.py'
-        flanks_command = """python {script} \\
+    graph.start_group({'name': 'CONTRAfold'})
+    contrafold_settings = settings['tasks']['CalculateCONTRAfold']
+    contrafold_script = 'scripts/rg_calculate_contrafold.py'
+    contrafold_command = """python {script} \\
                                 --out {output} \\
                                 --seq {seqs} \\
                                 --coords {input} \\
-                                --contextLen {context} \\
+                                --contextLen_L {contextlen_l} \\
+                                --contextLen_U {contextlen_u} \\
+                                --context {context} \\
+                                --contrabin {contrabin} \\
+                                --format {format} \\
+                                {compress} \\
                                 -v
                           """
-        if settings['general'].get('executer', 'drmaa') == 'drmaa':
-            #
-            # Copy files by default to the tmp directory
-            #
-            copy_dir = "$TMPDIR"
-            copy_files = {input_name + ".seedcount": 'input.seedcount',
-                          settings['general']['seqs']: 'seqs.fa'}
-            moveback = {'output': input_name + ".flanks"}
-
-            flanks_command_rendered = template.render(modules=calculate_flanks_settings.get('modules', None),
-                                                          command=flanks_command,
-                                                          copy=copy_files,
-                                                          moveback=moveback,
-                                                          copydir=copy_dir)
-
-            flanks_command = str(flanks_command_rendered).format(**{'script': os.path.join(pip_dir, flanks_script),
-                                       'output': "output",
-                                       'input': "input.seedcount",
-                                       'seqs': 'seqs.fa',
-                                       'context': calculate_flanks_settings.get('context_length', 50),
-                                     })
-        else:
-            flanks_command = str(flanks_command).format(**{'script': os.path.join(pip_dir, flanks_script),
-                                       'output': input_name + ".flanks",
-                                       'input': input_name + ".seedcount",
-                                       'seqs': settings['general']['seqs'],
-                                       'context': calculate_flanks_settings.get('context_length', 50),
-                                     })
-        calculate_flanks_id = jobber.job(flanks_command, {
+    contrafold_fields = {'script': os.path.join(pip_dir, contrafold_script),
+                         'format': intermediate_format,
+                         'compress': compress_options,
+                         'context': contrafold_settings.get('context', 50),
+                         'contextlen_l': contrafold_settings.get('contextLen_L', 14),
+                         'contextlen_u': contrafold_settings.get('contextLen_U', 0),
+                         'contrabin': settings['general']['contrafold_binary']}
+    if drmaa:
+        contrafold_fields.update({'output': "output",
+                                  'input': "input.seedcount",
+                                  'seqs': 'seqs.fa'})
+        contrafold_command = render_stage(template, contrafold_settings, node_cache,
+                                          zygote=zygote_client,
+                                          command=contrafold_command.format(**contrafold_fields),
+                                          copy={'{chunk}.seedcount': 'input.seedcount'},
+                                          shared=seqs_shared,
+                                          moveback={'output': '{chunk}.contrafold',
+                                                    'output.stats.json': '{chunk}.contrafold.stats.json'})
+    else:
+        contrafold_fields.update({'output': '{chunk}.contrafold',
+                                  'input': '{chunk}.seedcount',
+                                  'seqs': '{chunk_seqs}'})
+        contrafold_command = in_zygote(zygote_client, contrafold_command.format(**contrafold_fields), ['{chunk_seqs}'])
+    contrafold_command = str(contrafold_command)
+
+    for input_name in by_cost(files_to_run, costs):
+        seed_count_job = files_to_run[input_name]
+        command = contrafold_command.format(**chunk_fields(input_name, chunk_seqs))
+        keys[input_name]['contrafold'] = cache.job_key('CalculateCONTRAfold', command,
+                                                     inputs=[os.path.join(pip_dir, contrafold_script),
+                                                             chunk_seqs[input_name]],
+                                                     upstream=[keys[input_name]['seedcount']])
+        calculate_contrafold_job = graph.job(command, {
+                                          'name': 'CalculateCONTRAfold',
+                                          'dependencies': [seed_count_job],
+                                           'options': resources.options(contrafold_settings, stage_name(contrafold_script), input_name + ".contrafold", keys[input_name]['contrafold'], sites[input_name]) + priority(costs[input_name], max_cost, use_priorities),
+                                          'uniqueId': True},
+                                   input_name + ".contrafold",
+                                   keys[input_name]['contrafold'],
+                                   cacheable=seed_count_job is None)
+        if calculate_contrafold_job is not None:
+            feature_jobs[input_name].append(calculate_contrafold_job)
+    graph.end_group()
+    #
+    # Flanks
+    #
+    graph.start_group({'name': 'Flanks'})
+    calculate_flanks_settings = settings['tasks']['CalculateFlanks']
+    flanks_script = 'scripts/rg_calculate_flanks_composition.py'
+    flanks_command = """python {script} \\
+                            --out {output} \\
+                            --seq {seqs} \\
+                            --coords {input} \\
+                            --contextLen {context} \\
+                            --format {format} \\
+                            {compress} \\
+                            -v
+                      """
+    flanks_fields = {'script': os.path.join(pip_dir, flanks_script),
+                     'format': intermediate_format,
+                     'compress': compress_options,
+                     'context': calculate_flanks_settings.get('context_length', 50)}
+    if drmaa:
+        flanks_fields.update({'output': "output",
+                              'input': "input.seedcount",
+                              'seqs': 'seqs.fa'})
+        flanks_command = render_stage(template, calculate_flanks_settings, node_cache,
+                                      zygote=zygote_client,
+                                      command=flanks_command.format(**flanks_fields),
+                                      copy={'{chunk}.seedcount': 'input.seedcount'},
+                                      shared=seqs_shared,
+                                      moveback={'output': '{chunk}.flanks',
+                                                'output.stats.json': '{chunk}.flanks.stats.json'})
+    else:
+        flanks_fields.update({'output': '{chunk}.flanks',
+                              'input': '{chunk}.seedcount',
+                              'seqs': '{chunk_seqs}'})
+        flanks_command = in_zygote(zygote_client, flanks_command.format(**flanks_fields), ['{chunk_seqs}'])
+    flanks_command = str(flanks_command)
+
+    for input_name in by_cost(files_to_run, costs):
+        seed_count_job = files_to_run[input_name]
+        command = flanks_command.format(**chunk_fields(input_name, chunk_seqs))
+        keys[input_name]['flanks'] = cache.job_key('CalculateFlanks', command,
+                                                     inputs=[os.path.join(pip_dir, flanks_script),
+                                                             chunk_seqs[input_name]],
+                                                     upstream=[keys[input_name]['seedcount']])
+        calculate_flanks_job = graph.job(command, {
                                           'name': 'CalculateFlanks',
-                                          'dependencies': [seed_count_id] if seed_count_id is not None else [],
-                                           'options': [('q', calculate_flanks_settings.get('queue', 'short.q')),
-                                                       ('l', "membycore=%s" % calculate_flanks_settings.get('mem_req', '2G'))],
-                                          'uniqueId': True})
-
-    jobber.endGroup()
+                                          'dependencies': [seed_count_job],
+                                           'options': resources.options(calculate_flanks_settings, stage_name(flanks_script), input_name + ".flanks", keys[input_name]['flanks'], sites[input_name]) + priority(costs[input_name], max_cost, use_priorities),
+                                          'uniqueId': True},
+                                   input_name + ".flanks",
+                                   keys[input_name]['flanks'],
+                                   cacheable=seed_count_job is None)
+        if calculate_flanks_job is not None:
+            feature_jobs[input_name].append(calculate_flanks_job)
+
+    graph.end_group()
     #
     # Distance
     #
-    distance_group = jobber.startGroup({'name': 'Distance'})
-    for input_name, seed_count_id in files_to_run.iteritems():
-        calculate_distance_settings = settings['tasks']['CalculateDistance']
-        distance_script = 'scripts/rg_calculate_distance.py'
-        distance_command = """python {script} \\
-                                --out {output} \\
-                                --seq {seqs} \\
-                                --coords {input} \\
-                                -v
-                          """
-        if settings['general'].get('executer', 'drmaa') == 'drmaa':
-            #
-            # Copy files by default to the tmp directory
-            #
-            copy_dir = "$TMPDIR"
-            copy_files = {input_name + ".seedcount": 'input.seedcount',
-                          settings['general']['seqs']: 'seqs.fa'}
-            moveback = {'output': input_name + ".distance"}
-
-            distance_command_rendered = template.render(modules=calculate_distance_settings.get('modules', None),
-                                                          command=distance_command,
-                                                          copy=copy_files,
-                                                          moveback=moveback,
-                                                          copydir=copy_dir)
-
-            distance_command = str(distance_command_rendered).format(**{'script': os.path.join(pip_dir, distance_script),
-                                         'output': "output",
-                                         'input': "input.seedcount",
-                                         'seqs': "seqs.fa",
-                                        })
-        else:
-            distance_command = str(distance_command).format(**{'script': os.path.join(pip_dir, distance_script),
-                                         'output': input_name + ".distance",
-                                         'input': input_name + ".seedcount",
-                                         'seqs': settings['general']['seqs'],
-                                        })
-        calculate_distance_id = jobber.job(distance_command, {
+    graph.start_group({'name': 'Distance'})
+    calculate_distance_settings = settings['tasks']['CalculateDistance']
+    distance_script = 'scripts/rg_calculate_distance.py'
+    distance_command = """python {script} \\
+                            --out {output} \\
+                            --seq {seqs} \\
+                            --coords {input} \\
+                            --format {format} \\
+                            {compress} \\
+                            -v
+                      """
+    distance_fields = {'script': os.path.join(pip_dir, distance_script),
+                       'format': intermediate_format,
+                       'compress': compress_options}
+    if drmaa:
+        distance_fields.update({'output': "output",
+                                'input': "input.seedcount",
+                                'seqs': "seqs.fa"})
+        distance_command = render_stage(template, calculate_distance_settings, node_cache,
+                                        zygote=zygote_client,
+                                        command=distance_command.format(**distance_fields),
+                                        copy={'{chunk}.seedcount': 'input.seedcount'},
+                                        shared=seqs_shared,
+                                        moveback={'output': '{chunk}.distance',
+                                                  'output.stats.json': '{chunk}.distance.stats.json'})
+    else:
+        distance_fields.update({'output': '{chunk}.distance',
+                                'input': '{chunk}.seedcount',
+                                'seqs': '{chunk_seqs}'})
+        distance_command = in_zygote(zygote_client, distance_command.format(**distance_fields), ['{chunk_seqs}'])
+    distance_command = str(distance_command)
+
+    for input_name in by_cost(files_to_run, costs):
+        seed_count_job = files_to_run[input_name]
+        command = distance_command.format(**chunk_fields(input_name, chunk_seqs))
+        keys[input_name]['distance'] = cache.job_key('CalculateDistance', command,
+                                                     inputs=[os.path.join(pip_dir, distance_script),
+                                                             chunk_seqs[input_name]],
+                                                     upstream=[keys[input_name]['seedcount']])
+        calculate_distance_job = graph.job(command, {
                                           'name': 'CalculateDistance',
-                                          'dependencies': [seed_count_id] if seed_count_id is not None else [],
-                                           'options': [('q', calculate_distance_settings.get('queue', 'short.q')),
-                                                       ('l', "membycore=%s" % calculate_distance_settings.get('mem_req', '2G'))],
-                                          'uniqueId': True})
-    jobber.endGroup()
-    jobber.endGroup()
+                                          'dependencies': [seed_count_job],
+                                           'options': resources.options(calculate_distance_settings, stage_name(distance_script), input_name + ".distance", keys[input_name]['distance'], sites[input_name]) + priority(costs[input_name], max_cost, use_priorities),
+                                          'uniqueId': True},
+                                   input_name + ".distance",
+                                   keys[input_name]['distance'],
+                                   cacheable=seed_count_job is None)
+        if calculate_distance_job is not None:
+            feature_jobs[input_name].append(calculate_distance_job)
+    graph.end_group()
+    graph.end_group()
     #
     # Merge and add probabilities
     #
-    add_probability_group = jobber.startGroup({'name': 'MergeAndAddProbability'})
-    for input_name, seed_count_id in files_to_run.iteritems():
-
-        merge_script = 'scripts/rg_merge_results_add_probability_and_calculate_per_gene_score.py'
-        merge_settings = settings['tasks']['MergeAndCollect']
-        merge_inputs_local = ",".join([input_name + ".contrafold",
-                                 input_name + ".mirza",
-                                 input_name + ".flanks",
-                                 input_name + ".distance"])
-        merge_command = """python {script} \\
-                            --output {output} \\
-                            --inputs {inputs} \\
-                            --coords {coords} \\
-                            --model-bls {model_bls} \\
-                            --model-nobls {model_nobls} \\
-                            --only-mirza {onlymirza} \\
-                            --threshold {threshold} \\
-                            --split-by "{split_by}" \\
-                            --colum {column} \\
-                            -v
-                  """
-        if settings['general'].get('executer', 'drmaa') == 'drmaa':
-            #
-            # Copy files by default to the tmp directory
-            #
-            copy_dir = "$TMPDIR"
-            copy_files  = {input_name + ".contrafold": "contrafold",
-                           input_name + ".mirza": "mirza",
-                           input_name + ".flanks": "flanks",
-                           input_name + ".distance": "distance",
-                           input_name + ".seedcount": "input.seedcount"}
-            moveback = {'output': input_name + ".score"}
-
-            merge_command_rendered = template.render(modules=merge_settings.get('modules', None),
-                                                     command=merge_command,
-                                                     copy=copy_files,
-                                                     moveback=moveback,
-                                                     copydir=copy_dir)
-
-            merge_command = str(merge_command_rendered).format(**{'script': os.path.join(pip_dir, merge_script),
-                                      'output': "output",
-                                      'inputs': "contrafold,mirza,flanks,distance",
-                                      'coords': "input.seedcount",
-                                      'model_bls':   settings['general']['model_with_bls'],
-                                      'model_nobls': settings['general']['model_without_bls'],
-                                      'onlymirza': settings['general'].get('run_only_MIRZA', 'yes'),
-                                      'threshold': merge_settings.get('threshold', 0.12),
-                                      'split_by':  settings['general'].get('split_by', "NOTHING"),
-                                      'column':    settings['general'].get('index_after_split', 0),
-                                     })
-        else:
-            merge_command = str(merge_command).format(**{'script': os.path.join(pip_dir, merge_script),
-                                      'output': input_name + ".score",
-                                      'inputs': merge_inputs_local,
-                                      'coords': input_name + ".seedcount",
-                                      'model_bls':   settings['general']['model_with_bls'],
-                                      'model_nobls': settings['general']['model_without_bls'],
-                                      'onlymirza': settings['general'].get('run_only_MIRZA', 'yes'),
-                                      'threshold': merge_settings.get('threshold', 0.12),
-                                      'split_by':  settings['general'].get('split_by', "NOTHING"),
-                                      'column':    settings['general'].get('index_after_split', 0),
-                                     })
-        merge_id = jobber.job(merge_command, {
-                                          'name': 'MergeAndCollect',
-                                          'dependencies': [features_group_id],
-                                           'options': [('q', merge_settings.get('queue', 'short.q')),
-                                                       ('l', "membycore=%s" % merge_settings.get('mem_req', '2G'))],
-                                          'uniqueId': True})
-
-    jobber.endGroup()
+    graph.start_group({'name': 'MergeAndAddProbability'})
+    merge_script = 'scripts/rg_merge_results_add_probability_and_calculate_per_gene_score.py'
+    merge_settings = settings['tasks']['MergeAndCollect']
+    merge_command = """python {script} \\
+                        --output {output} \\
+                        --inputs {inputs} \\
+                        --coords {coords} \\
+                        --model-bls {model_bls} \\
+                        --model-nobls {model_nobls} \\
+                        --only-mirza {onlymirza} \\
+                        --threshold {threshold} \\
+                        --split-by "{split_by}" \\
+                        --colum {column} \\
+                        --format {format} \\
+                        {compress} {sites} {sweep} {models} {stats} \\
+                        -v
+              """
+    # with site_output = yes the merge writes also the sites with their features and probabilities
+    # (columnar, with index by gene) to <chunk>.sites
+    site_output = settings['general'].get('site_output', 'no') == 'yes'
+    # with thresholds the merge writes also per gene scores for each of them to <chunk>.sweep
+    thresholds = merge_settings.get('thresholds', [])
+    if isinstance(thresholds, basestring):
+        thresholds = thresholds.split(",")
+    thresholds = ",".join(str(threshold).strip() for threshold in thresholds)
+    # with models (registries of mirzag/models.py) the merge writes also per gene scores of each model
+    # to <chunk>.models
+    models = registry_paths(settings['general'])
+    merge_fields = {'script': os.path.join(pip_dir, merge_script),
+                    'format': intermediate_format,
+                    'compress': compress_options,
+                    'model_bls':   settings['general']['model_with_bls'],
+                    'model_nobls': settings['general']['model_without_bls'],
+                    'onlymirza': settings['general'].get('run_only_MIRZA', 'yes'),
+                    'threshold': merge_settings.get('threshold', 0.12),
+                    'split_by':  settings['general'].get('split_by', "NOTHING"),
+                    'column':    settings['general'].get('index_after_split', 0)}
+    merge_moveback = {'output': '{chunk}.score'}
+    if drmaa:
+        # statistics are written next to the chunk at once (not moved back), so rg_collect_results.py
+        # sees a failed merge instead of waiting for its scores
+        merge_fields.update({'output': "output",
+                             'stats': "--stats-output {chunk}.score.stats.json",
+                             'inputs': "contrafold,mirza,flanks,distance",
+                             'coords': "input.seedcount",
+                             'sites': "--sites-output sites" if site_output else "",
+                             'sweep': "--thresholds %s --sweep-output sweep" % thresholds if thresholds else "",
+                             'models': "--models %s --models-output models" % ",".join(models) if models else ""})
+        if thresholds:
+            merge_moveback['sweep'] = '{chunk}.sweep'
+        if models:
+            merge_moveback['models'] = '{chunk}.models'
+        if site_output:
+            merge_moveback.update({'sites': '{chunk}.sites',
+                                   'sites' + columnar.INDEX_SUFFIX: '{chunk}.sites' + columnar.INDEX_SUFFIX})
+        merge_command = render_stage(template, merge_settings, node_cache,
+                                     zygote=zygote_client,
+                                     command=merge_command.format(**merge_fields),
+                                     copy={'{chunk}.contrafold': "contrafold",
+                                           '{chunk}.mirza': "mirza",
+                                           '{chunk}.flanks': "flanks",
+                                           '{chunk}.distance': "distance",
+                                           '{chunk}.seedcount': "input.seedcount"},
+                                     shared={},
+                                     moveback=merge_moveback)
+    else:
+        merge_fields.update({'output': '{chunk}.score',
+                             'stats': "",
+                             'inputs': "{chunk}.contrafold,{chunk}.mirza,{chunk}.flanks,{chunk}.distance",
+                             'coords': '{chunk}.seedcount',
+                             'sites': "--sites-output {chunk}.sites" if site_output else "",
+                             'sweep': "--thresholds %s --sweep-output {chunk}.sweep" % thresholds if thresholds else "",
+                             'models': "--models %s --models-output {chunk}.models" % ",".join(models) if models else ""})
+        merge_command = in_zygote(zygote_client, merge_command.format(**merge_fields), [])
+    merge_command = str(merge_command)
+
+    for input_name in by_cost(files_to_run, costs):
+        seed_count_job = files_to_run[input_name]
+        merge_dependencies = feature_jobs[input_name]
+        chunk_keys = keys[input_name]
+        # patched chunk changes in place so it is always merged again
+        cacheable = not scheduled[input_name] and not feature_jobs[input_name] and input_name not in patches
+        if input_name in patches:
+            patch_script = 'scripts/rg_patch_chunk.py'
+            patch_command = "python %s --chunk %s --update %s --genes %s --split-by \"%s\" --index-after-split %s %s -v" % (os.path.join(pip_dir, patch_script),
+                                                                                                              patches[input_name],
+                                                                                                              input_name,
+                                                                                                              os.path.join(options.input_dir, fingerprint.UPDATE_GENES),
+                                                                                                              settings['general'].get('split_by', "NONE"),
+                                                                                                              settings['general'].get('index_after_split', 0),
+                                                                                                              compress_options)
+            patch_job = graph.job(patch_command, {'name': 'PatchChunk',
+                                                  'dependencies': feature_jobs[input_name],
+                                                  'uniqueId': True})
+            merge_dependencies = [patch_job]
+            input_name = patches[input_name]
+
+        command = merge_command.format(chunk=input_name)
+        merge_key = cache.job_key('MergeAndCollect', command,
+                                  inputs=[os.path.join(pip_dir, merge_script),
+                                          settings['general']['model_with_bls'],
+                                          settings['general']['model_without_bls']] + models,
+                                  upstream=[chunk_keys[name] for name in ['seedcount', 'mirza', 'contrafold', 'flanks', 'distance']])
+        graph.job(command, {
+                              'name': 'MergeAndCollect',
+                              'dependencies': merge_dependencies,
+                               'options': resources.options(merge_settings, stage_name(merge_script), input_name + ".score", merge_key, sites[input_name]) + priority(costs[input_name], max_cost, use_priorities),
+                              'uniqueId': True},
+                  input_name + ".score",
+                  merge_key,
+                  cacheable=cacheable)
+
+    graph.end_group()
+    submitted = graph.submit(jobber)
+    resources.save()
+    if options.verbose:
+        sys.stderr.write("Submitted %i jobs of the analysis in %i cluster jobs\n" % (len(graph.jobs), submitted))
     jobber.endGroup()
     jobber.launch(options.group_id)
 
+def render_stage(template, stage_settings, node_cache, command, copy, shared, moveback, zygote=None):
+    """Render the template for the command of a stage
+
+    Args:
+        template (Template): template of the job
+        stage_settings (dict): settings of the task
+        node_cache (dict): script, directory and size of the node cache (see mirzag/nodecache.py)
+        command (str): command of the stage
+        copy (dict): files copied to the tmp directory by their names there
+        shared (dict): inputs shared by all jobs: tuples of name and content digest by path
+        moveback (dict): outputs moved back from the tmp directory
+
+    Kwargs:
+        zygote (str): command of the client of the zygote, None to run the command as it is
+
+    Returns: str
+
+    """
+    copy = dict(copy)
+    cached = {}
+    for path, (name, digest) in shared.iteritems():
+        if node_cache['cache_dir']:
+            cached[path] = (name, digest)
+        else:
+            copy[path] = name
+    if zygote is not None:
+        # the zygote preloads the cached inputs, the links to them in $TMPDIR are the same files
+        # (copies of the inputs are not, so without the node cache only the modules are preloaded)
+        zygote = zygote_client_command(zygote, [os.path.join(node_cache['cache_dir'], digest)
+                                                for name, digest in sorted(cached.values())
+                                                if not name.endswith(fasta.INDEX_SUFFIX)])
+    return template.render(modules=stage_settings.get('modules', None),
+                           command=command,
+                           copy=copy,
+                           cached=cached,
+                           moveback=moveback,
+                           copydir="$TMPDIR",
+                           zygote=zygote,
+                           **node_cache)
+
+
+def zygote_client_command(zygote_client, preload):
+    """Command of the client of the zygote with the fasta files it preloads"""
+    return zygote_client + "".join(" --preload %s" % path for path in preload)
+
+
+def in_zygote(zygote_client, command, preload):
+    """Command run through the client of the zygote (see mirzag/zygote.py), the command itself without zygote"""
+    if zygote_client is None:
+        return command
+    return "%s -- %s" % (zygote_client_command(zygote_client, preload), command)
+
+
+def stage_name(script):
+    """Stage of the run statistics of the script (see mirzag/runstats.py)"""
+    return os.path.splitext(os.path.basename(script))[0]
+
+
+def by_cost(files_to_run, costs):
+    """Chunks from the one predicted to take longest"""
+    return sorted(files_to_run, key=lambda input_name: (-costs[input_name], input_name))
+
+
+def priority(cost, max_cost, use_priorities):
+    """Scheduler priority of the job by the predicted cost of its chunk
+
+    Users can only lower priorities of their jobs (-p of qsub from -1023 to 0),
+    so the most expensive chunk gets 0 and the cheapest ones the lowest.
+
+    Returns: list of options of the job
+
+    """
+    if not use_priorities or not max_cost:
+        return []
+    return [('p', -int(round(1023 * (1.0 - cost / max_cost))))]
+
+
+def chunk_fields(input_name, chunk_seqs):
+    """Paths of the chunk left in the rendered commands of the stages"""
+    return {'chunk': input_name,
+            'chunk_seqs': chunk_seqs[input_name],
+            'chunk_seqs_digest': cache.input_digest(chunk_seqs[input_name]),
+            'chunk_seqs_index_digest': cache.input_digest(chunk_seqs[input_name] + fasta.INDEX_SUFFIX)}
+
+
 if __name__ == '__main__':
     try:
         options = parser.parse_args()
@@ -80,7 +80,8 @@ def main(options):
                           settings['general']['seqs']: 'seqs.fa',
                           os.path.join(options.input_dir, "mirnas.expression"): 'expressions',
                           settings['general']['motifs']: 'motifs.fa'}
-            moveback = {'output': input_name + ".mirzascan"}
+            moveback = {'output': input_name + ".mirzascan",
+                        'output.stats.json': input_name + ".mirzascan.stats.json"}
 
             seed_command_rendered = template.render(modules=scan_settings.get('modules', None),
                                                command=scan_command,
@@ -142,7 +143,8 @@ def main(options):
         #
         copy_dir = "$TMPDIR"
         copy_files = {os.path.join(options.input_dir, "scan_results.tab"): 'input'}
-        moveback = {'output': os.path.join(options.input_dir, "scan_result.filtered")}
+        moveback = {'output': os.path.join(options.input_dir, "scan_result.filtered"),
+                    'output.stats.json': os.path.join(options.input_dir, "scan_result.filtered.stats.json")}
 
         filter_results_command_rendered = template.render(modules=filter_results_settings.get('modules', None),
                                            command=filter_results_command,
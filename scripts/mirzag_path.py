@@ -0,0 +1,16 @@
+"""
+Make the mirzag package (in the main directory of the pipeline, next to
+this directory) importable by the scripts: import this module before
+importing mirzag. bin/mirzag_path.py is a link to this module, the
+directory of the pipeline is found from the path of the link.
+"""
+
+__license__ = "GPL"
+
+import os
+import sys
+
+PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if PIPELINE_DIR not in sys.path:
+    sys.path.insert(0, PIPELINE_DIR)
@@ -19,6 +19,9 @@ from itertools import starmap, izip
 from operator import mul
 from argparse import ArgumentParser
 
+import mirzag_path
+from mirzag import runstats
+
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("-v",
                     "--verbose",
@@ -92,6 +95,7 @@ def main(options):
     if options.verbose:
         syserr("Adding constant to data\n")
     df['const'] = 1.0
+    runstats.count('sites', len(df.index))
 
 
     model_bls =   sm.load(options.model_bls)
@@ -187,7 +191,8 @@ if __name__ == '__main__':
             start_time = time.time()
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        main(options)
+        with runstats.track(__file__, options.output):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
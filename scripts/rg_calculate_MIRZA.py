@@ -2,6 +2,10 @@
 """
 Calculate MIRZA interaction energy and MIRZA-based Branch Length Score (conservation) for the provided
 coordinates of putative targets.
+
+Sites are processed in batches and the results of every batch are committed
+to a journal (see mirzag/journal.py), so a job that was killed or preempted
+continues from the last finished batch when it is started again.
 """
 
 __date_ = "2014-05-29"
@@ -14,17 +18,24 @@ import os
 import re
 import sys
 import time
-import gzip
-import dendropy
-import itertools
+import json
+import hashlib
 import traceback
-import subprocess
-import cPickle as cpickle
-import pandas as pd
-from numpy import mean, median, abs
-from Bio import SeqIO
+from itertools import izip
 from argparse import ArgumentParser
 
+import mirzag_path
+from mirzag import runstats
+from mirzag import read_sites, read_fasta
+from mirzag.sites import site_key, SiteTable
+from mirzag.journal import Journal
+from mirzag import columnar
+from mirzag.fingerprint import file_digest
+from mirzag.features import mirza_hybrids
+from mirzag.mirza import is_executable
+from mirzag.conservation import Conservation
+from mirzag import compress
+
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("-v",
                     "--verbose",
@@ -90,7 +101,24 @@ parser.add_argument('--reforg',
                     action="store",
                     default="hg19",
                     help="Reference organism to which alignments are performed: default: hg19")
+parser.add_argument('--batch-size',
+                    type=int,
+                    dest='batch_size',
+                    default=1000,
+                    action='store',
+                    help="Number of sites in one batch committed to the journal, default: 1000")
+parser.add_argument('--journal',
+                    dest='journal',
+                    action="store",
+                    default=None,
+                    help="Directory of the journal of finished batches (must outlive the job), default: output + .journal")
+parser.add_argument('--format',
+                    dest='format',
+                    choices=columnar.FORMATS,
+                    default='tsv',
+                    help="Format of the output: gzipped tsv or columnar (see mirzag/columnar.py), default: tsv")
 
+compress.add_arguments(parser)
 
 # redefine a functions for writing to stdout and stderr to save some writting
 syserr = sys.stderr.write
@@ -99,216 +127,123 @@ sysout = sys.stdout.write
 
 def main(options):
     """Main logic of the script"""
+    compress.configure_from(options)
     # Check if path to MIRZA is valid
     if not is_executable(options.mirzabin):
         raise Exception("Path to MIRZA is invalid (%s)! Please define it with --mirzabin option." % options.mirzabin)
     if options.verbose:
         syserr("Reading coordinate file\n")
-    coords = read_coordinates(options.coords, True)
-
-    if options.verbose:
-        syserr("Reading mRNA sequences\n")
-    mRNAseqs = read_fasta_to_dict(options.seq)
+    coords = read_sites(options.coords)
+    runstats.count('sites', len(coords))
 
     if options.verbose:
         syserr("Reading miRNA sequences\n")
-    miRNAseqs = read_fasta_to_dict(options.motifs)
+    miRNAseqs = read_fasta(options.motifs, ids=coords.mirna_ids())
 
     if options.onlymirza != 'yes':
         if options.verbose:
             syserr("Preparing alignments and phylogenetic tree\n")
-
-        phylo_tree = read_phylogenetic_tree(options.tree)
-        multiple_alignment_dict = read_multiple_alignments(phylo_tree,
-                                                           options.mln_dir,
-                                                           coords)
-        mirhomologues = make_homologues_mirnas(phylo_tree, miRNAseqs)
-
-    with gzip.open(options.out, 'wb') as outfile:
-        if options.verbose:
-            syserr("Collecting sequences\n")
-        mRNA_sequences = [cor[-1] for cor in coords]
-        mRNA_ids = ["%s,%s,%s" % (cor[0], cor[2], cor[3]) for cor in coords]
-        number_of_coords = len(set([cor[1] for cor in coords])) == 1
-        if number_of_coords > 1:
-            raise Exception("More than mirna in coordinate file")
-        if number_of_coords == 0:
-            syserr("There is no coordinates. Exit.")
-            sys.exit()
-
-        miRNAseq = miRNAseqs[list(set([cor[1] for cor in coords]))[0]][:21]
-        miRNAid = list(set([cor[1] for cor in coords]))[0]
-
-        if options.verbose:
-            syserr("Running MIRZA\n")
-        results = calculate_mirza(mRNA_sequences, mRNA_ids, miRNAseq, miRNAid)
-
-        if options.verbose:
-            syserr("Collecting results\n")
-        for key, group in itertools.groupby(results.splitlines(), lambda x: x == ""):
-            if not key:
-                proper_group = False
-                for line in group:
-                    if line.startswith(">"):
-                        mRNAid = line.split()[0][1:].split(",")[0]
-                        beg = line.split()[0][1:].split(",")[1]
-                        end = line.split()[0][1:].split(",")[2]
-                        score = float(line.split()[-1])
-                        proper_group = True
-                    # elif line.startswith("miRNA"):
-                    #     mirhyb = line.split("\t")[1].split(" ")[0]
-                    # elif line.startswith("A L"):
-                    #     hyb = line.split("\t")[1].rstrip()
-                    elif line.startswith("mRNA"):
-                        mrhyb = line.split("\t")[1].split(" ")[0]
-                if proper_group:
-                    if len(miRNAseq) < 21:
-                        outtext = '%s,%s,%s,%s\t%s\t%s\t%s\t%s\t%s\n' % (mRNAid,
-                                                                         miRNAid,
-                                                                         beg,
-                                                                         end,
-                                                                         "NA",
-                                                                         "NA",
-                                                                         "NA",
-                                                                         "NA",
-                                                                         "NA")
-                        outfile.write(outtext)
-                        continue
-
-                    # hybrids = [mirhyb, hyb, mrhyb]
-                    # mirseq, hybseq, mrhybseq, mrpos = get_hybrid_vector(hybrids)
-                    # canonical, type_of_site = is_canonical([mirseq, hybseq, mrhybseq])
-                    if options.onlymirza != 'yes':
-                        try:
-                            mln_frag = multiple_alignment_dict[mRNAid]
-                            qd = calculate_conservation(phylotree=phylo_tree,
-                                                        mrna_frag=mrhyb.replace("-", "")[::-1],
-                                                        mrnaid=mRNAid,
-                                                        mirna=mirhomologues,
-                                                        mirname=miRNAid,
-                                                        mln_dict=mln_frag,
-                                                        ref_org=options.reforg,
-                                                        threshold=options.thr,
-                                                        mrna_len=options.contextLen)
-                            qd = str(qd)
-                        except KeyError, e:
-                            qd = "NA"
-                            sys.stderr.write("KeyError:  " + str(e) + "\n")
-                            sys.stderr.write("Trace:  "
-                                             + traceback.format_exc()
-                                             + "\n")
-                            # raise KeyError
-                    else:
-                        qd = "NA"
-                    outtext = '%s,%s,%s,%s\t%f\t%s\n' % (mRNAid,
-                                                                     miRNAid,
-                                                                     beg,
-                                                                     end,
-                                                                     score,
-                                                                     # ":".join(hybrids),
-                                                                     qd)
-                                                                     # "canonical" if canonical else "non-canonical",
-                                                                     # type_of_site)
-                    outfile.write(outtext)
-    clean()
-
-
-
-def calculate_mirza(mRNAseqs, mRNAids, miRNAseq, miRNAid, update='noupdate',
-        context_len=50):
-    """Get the mirza results
-
-    Args:
-        mRNAseqs (@todo): @todo
-        mRNAids (@todo): @todo
-        miRNAseq (@todo): @todo
-        miRNAid (@todo): @todo
-
-    Kwargs:
-        update (str): update prior probability? defaults to noupdate
-
-    Returns: @todo
-
-    """
-    MIRZAbin = options.mirzabin
-    assert len(mRNAseqs) == len(mRNAids)
-
-    try:
-        mrnainput = open(options.coords + 'mirza_mrna_input' + '.fa', 'w')
-        mirnainput = open(options.coords + 'mirza_mirna_input' + '.fa', 'w')
-        expressions = open(options.coords + 'mirza_mirna_expressions' + '.fa', 'w')
-    except IOError:
-        raise('Cannot write files for MIRZA input')
-
-    # get the paths for the files
-    mrna_path = os.path.abspath(mrnainput.name)
-    mirna_path = os.path.abspath(mirnainput.name)
-    expr_path = os.path.abspath(expressions.name)
-
+        conservation = Conservation(options.tree,
+                                    options.mln_dir,
+                                    ref_org=options.reforg,
+                                    threshold=options.thr,
+                                    context_len=options.contextLen)
+
+    if len(coords) == 0:
+        if options.format == 'columnar':
+            columnar.Writer(options.out, columnar.MIRZA).close()
+        else:
+            compress.open_output(options.out).close()
+        syserr("There is no coordinates. Exit.")
+        sys.exit()
     #
-    # write sequences to files
+    # The same site is reported once (with its first occurrence)
     #
-    try:
-        for key, value in zip(mRNAids, mRNAseqs):
-            if len(value) != context_len:
-                sys.stderr.write("Skipped %s because of wrong length\n" % key)
+    seen = set()
+    unique = SiteTable()
+    for site in coords:
+        if site[:4] not in seen:
+            seen.add(site[:4])
+            unique.append(site)
+    coords = unique
+    batch_size = max(1, options.batch_size)
+    batches = [coords[index:index + batch_size] for index in xrange(0, len(coords), batch_size)]
+    journal = Journal(options.journal or options.out + ".journal", journal_fingerprint(options))
+    workdir = os.path.dirname(os.path.abspath(options.coords))
+    for index, batch in enumerate(batches):
+        if journal.is_done(index):
+            if options.verbose:
+                syserr("Batch %i of %i already done\n" % (index + 1, len(batches)))
+            continue
+        #
+        # Each site goes to MIRZA only once and all miRNAs of the batch
+        # are hybridized in one MIRZA run
+        #
+        if options.verbose:
+            syserr("Running MIRZA on batch %i of %i\n" % (index + 1, len(batches)))
+        hybrids = mirza_hybrids(batch,
+                                miRNAseqs,
+                                mirzabin=options.mirzabin,
+                                context_len=options.contextLen,
+                                workdir=workdir)
+        results = []
+        for site, record in izip(batch, hybrids.itervalues()):
+            if record is None:
+                results.append((site, None, None))
                 continue
-            mrnainput.write('>%s\n%s\n' % (key, value))
-        mirnainput.write('>%s\n%s\n' % (miRNAid.replace('-', ''), miRNAseq))
-        expressions.write('%s\t1' % (miRNAid))
-        mrnainput.close()
-        mirnainput.close()
-        expressions.close()
-    except IOError:
-        raise IOError('Cannot write into the MIRZA input files')
-    #
-    # Run MIRZA with these files
-    #
-    mirza_command = MIRZAbin + ' ' + expr_path + ' ' + mrna_path + ' ' + mirna_path + ' '\
-        + str(len(mRNAseqs[0])) + ' ' + update
-    mirzarun = subprocess.Popen(mirza_command, shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = mirzarun.communicate()
-    return stdout
-
-
-def calculate_mirza_for_mln(mRNAseqs, mRNAids, miRNAseq, miRNAid,
-        update='noupdate', context_len=50):
-    """Get the mirza results
-
-    Args:
-        mRNAseqs (@todo): @todo
-        mRNAids (@todo): @todo
-        miRNAseq (@todo): @todo
-        miRNAid (@todo): @todo
-
-    Kwargs:
-        update (str): update prior probability? defaults to noupdate
-
-    Returns: @todo
-
-    """
-    #
-    # Get MIRZA results
-    #
-    stdout = calculate_mirza(mRNAseqs,
-                             mRNAids,
-                             miRNAseq,
-                             miRNAid,
-                             update,
-                             context_len)
+            qd = None
+            if options.onlymirza != 'yes':
+                try:
+                    qd = conservation.branch_length_score(record,
+                                                          miRNAseqs[record.mirna],
+                                                          mirzabin=options.mirzabin,
+                                                          workdir=workdir)
+                except KeyError, e:
+                    sys.stderr.write("KeyError:  " + str(e) + "\n")
+                    sys.stderr.write("Trace:  "
+                                     + traceback.format_exc()
+                                     + "\n")
+            results.append((site, record.score, qd))
+        if options.format == 'columnar':
+            journal.commit(index, [columnar.encode_block(columnar.MIRZA,
+                                                         [site[:4] + (score, qd) for site, score, qd in results])])
+        else:
+            journal.commit(index, [format_result(site, score, qd) for site, score, qd in results])
 
-    #
-    # Parse results into dictionary
-    out_dict = {}
-    for line in stdout.split("\n"):
-        if line.startswith(">"):
-            l = line.split()
-            try:
-                out_dict[l[0][1:]] = float(l[-1])
-            except TypeError, e:
-                raise e
-    return out_dict
+    if options.verbose:
+        syserr("Collecting results\n")
+    if options.format == 'columnar':
+        with open(options.out, 'wb') as outfile:
+            outfile.write(columnar.header(columnar.MIRZA))
+            journal.concatenate(outfile, len(batches))
+    else:
+        with compress.open_output(options.out) as outfile:
+            journal.concatenate(outfile, len(batches))
+    journal.clear()
+
+
+def format_result(site, score, qd):
+    """Line of the gzipped output"""
+    if score is None:
+        return '%s\t%s\t%s\n' % (site_key(site), "NA", "NA")
+    return '%s\t%f\t%s\n' % (site_key(site), score, "NA" if qd is None else str(qd))
+
+
+def journal_fingerprint(options):
+    """Fingerprint of the input and settings, batches of other runs are not reused"""
+    fingerprint = {'coords': file_digest(options.coords),
+                   'motifs': file_digest(options.motifs),
+                   'batch_size': options.batch_size,
+                   'format': options.format,
+                   'codec': options.codec,
+                   'onlymirza': options.onlymirza,
+                   'threshold': options.thr,
+                   'context_len': options.contextLen,
+                   'reforg': options.reforg,
+                   'tree': options.tree,
+                   'mln_dir': options.mln_dir,
+                   'mirzabin': options.mirzabin}
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True)).hexdigest()
 
 
 def get_hybrid_vector(hyb):
@@ -342,260 +277,6 @@ def get_hybrid_vector(hyb):
     return mirseq, hybseq, mrseq, hybpos
 
 
-def extend_seq(mrnaseq, mrna_frag, total_length=50):
-    """Extend the sequence from both ends
-
-    Args:
-        mrnaseq (str): sequence (with gaps) to extend from
-        mrna_frag (str): sequence (with gaps) for extension
-
-    Kwargs:
-        total_length (int): length to extend to
-
-    Returns: @todo
-
-    """
-    #
-    # Prepare sequences with no gaps
-    #
-    mrnaseq_nogap = mrnaseq.replace("-", "")
-    mrna_frag_nogap = mrna_frag.replace("-", "")
-    #
-    # check if the sequence is shorter
-    #
-    if len(mrna_frag_nogap) > total_length:
-        syserr("mrnaseq_nogap: ", mrnaseq_nogap)
-        syserr("mrna_frag_nogap: ", mrna_frag_nogap)
-        syserr("mrnaseq: ", mrnaseq)
-        syserr("mrna_frag: ", mrna_frag)
-        raise Exception(
-            "Check your sequences maybe you should shrink, not extend them")
-    span = re.search(mrna_frag_nogap, mrnaseq_nogap).span()
-
-    # Decide which type of extension to do
-    gap_pos_mean = mean([i for i, x in enumerate(mrna_frag) if x == "-"])
-    list_median = median([i for i in range(len(mrna_frag))])
-
-    # this ratio gives us relative position of the gaps
-    ratio = gap_pos_mean / list_median
-
-    # Based on the ratio do the extension of the sequence
-    if ratio > 0.5 and ratio < 1.5:  # extend both sides
-        li = span[0]
-        ui = span[1]
-        length = ui - li
-        if length > total_length:
-            return -1
-        elif length == total_length:
-            return mrnaseq_nogap[li:ui]
-        else:
-            dif = total_length - length
-            quot = dif // 2  # this is explicit integer division
-            l_ext = li - quot  # TODO check if they are not lower than 0
-            u_ext = ui + (dif - quot)
-            if (l_ext < 0) or (u_ext > len(mrnaseq_nogap) - 1):
-                return "NA"
-            else:
-                return mrnaseq_nogap[l_ext:u_ext]
-    elif ratio <= 0.5:  # extend left - it means upstream (5'end)
-        li = span[0]
-        ui = span[1]
-        length = ui - li
-        dif = total_length - len(mrna_frag_nogap)
-        if (li - dif < 0):
-            return mrnaseq_nogap[:ui + abs(li - dif)]
-        else:
-            return mrnaseq_nogap[li - dif:ui]
-    elif ratio >= 1.5:  # extend right - it means downstream (3'end)
-        li = span[0]
-        ui = span[1]
-        length = ui - li
-        dif = total_length - len(mrna_frag_nogap)
-        # if there is noting to extend to the right
-        if ui + dif > len(mrnaseq_nogap):
-            return mrnaseq_nogap[li - ((ui + dif) - len(mrnaseq_nogap)):]
-        else:
-            return mrnaseq_nogap[li:ui + dif]
-
-
-def shrink_seq(mrnaseq, mrna_frag, mrna_frag_target, total_length=50):
-    """Extend the sequence from both ends
-
-    Args:
-        mrnaseq (str): sequence (with gaps) to extend from
-        mrna_frag (str): sequence (with gaps) for extension
-        mrna_frag_target (str): sequence of the target mRNA
-
-    Kwargs:
-        total_length (int): length to extend to
-
-    Returns: @todo
-
-    """
-    # Prepare sequences with no gaps
-    mrnaseq_nogap = mrnaseq.replace("-", "")
-    mrna_frag_nogap = mrna_frag.replace("-", "")
-    if len(mrna_frag_nogap) < total_length:
-        syserr(mrna_frag_nogap)
-        syserr(mrnaseq)
-        syserr(mrna_frag)
-        syserr(mrna_frag_target)
-        raise Exception(
-            "Check your sequences maybe you should extend, not shrink them")
-    span = re.search(mrna_frag_nogap, mrnaseq_nogap).span()
-
-    # Decide which type of extension to do
-    gap_pos_mean = mean(
-        [i for i, x in enumerate(mrna_frag_target) if x == "-"])
-    list_median = median([i for i in range(len(mrna_frag_target))])
-
-    # this ratio gives us relative position of the gaps
-    ratio = gap_pos_mean / list_median
-
-    # Based on the ratio do the shrinkage of the sequence
-    if ratio > 0.5 and ratio < 1.5:  # extend both sides
-        li = span[0]
-        ui = span[1]
-        length = ui - li
-        if length < total_length:
-            return -1
-        elif length == total_length:
-            return mrnaseq_nogap[li:ui]
-        else:
-            dif = abs(total_length - length)
-            quot = dif // 2  # this is explicit integer division
-            l_ext = li + quot
-            u_ext = ui - (dif - quot)
-            if (u_ext < 0) or (u_ext > len(mrnaseq_nogap) - 1):
-                return "NA"
-            else:
-                return mrnaseq_nogap[l_ext:u_ext]
-    elif ratio <= 0.5:  # trim left - it means upstream (5'end)
-        li = span[0]
-        ui = span[1]
-        length = ui - li
-        dif = len(mrna_frag_nogap) - total_length
-        return mrnaseq_nogap[li + dif:ui]
-    elif ratio >= 1.5:  # extend right - it means downstream (3'end)
-        li = span[0]
-        ui = span[1]
-        length = ui - li
-        dif = len(mrna_frag_nogap) - total_length
-        return mrnaseq_nogap[li:ui - dif]
-
-
-def scale(x, minimum, maximum):
-    """Scale number from 0 to 1
-
-    Args:
-        x (float): number to scale
-        minimum (float): minimum for the set
-        maximum (float): maximum for the set
-
-    Returns: float
-
-    """
-    return (x - minimum) / (maximum - minimum)
-
-
-def calculate_conservation(phylotree, mrna_frag, mrnaid, mirna, mirname,
-                           mln_dict, mrna_len, ref_org='hg19', threshold=50):
-    """Calculate conservation
-
-    Args:
-        phylotree (@todo): @todo
-        mrna_frag (@todo): @todo
-        mrnaid (@todo): @todo
-        mirna (@todo): @todo
-        mirname (@todo): @todo
-        mln_dict (@todo): @todo
-        mrna_len (@todo): @todo
-
-    Kwargs:
-        ref_org (@todo): @todo
-        threshold (@todo): @todo
-
-    Returns: float
-
-    """
-    #
-    # calculate total branch lengths of the tree
-    #
-    tree = dendropy.Tree(phylotree)
-    min_score = dendropy.Tree(phylotree)
-    min_score.retain_taxa_with_labels([ref_org])
-    total_branch_length = tree.length()
-    min_s = min_score.length() / total_branch_length
-    #
-    # get the dictionary with the homologous fragments
-    #
-    reg_pattern = re.compile("-*".join(list(mrna_frag)))
-    queries_dict = {}
-    for org in mln_dict.keys():
-        TSeq = mln_dict[org][0]
-        QSeq = mln_dict[org][1]
-        match = re.search(reg_pattern, TSeq)
-        if match != None and len(QSeq.replace("-", "")) >= mrna_len:
-            span = match.span()
-            tseq = TSeq[span[0]:span[1]]  # those are sequences with gaps
-            qseq = QSeq[span[0]:span[1]]
-            # Decide if we need to shrink or expand sequences
-            if len(qseq.replace("-", "")) < mrna_len:
-                myseq = extend_seq(QSeq, qseq, total_length=mrna_len)
-                queries_dict[org] = myseq
-                try:
-                    assert len(myseq) == mrna_len or myseq == "NA"
-                except AssertionError:
-                    message = "Error in extend_seq"
-                    raise Exception(message)
-            elif len(qseq.replace("-", "")) > mrna_len:
-                myseq = shrink_seq(QSeq, qseq, tseq, total_length=mrna_len)
-                queries_dict[org] = myseq
-                assert len(myseq) == mrna_len or myseq == "NA"
-            else:
-                if "-" in qseq:
-                    myseq = qseq.replace("-", "")
-                    assert len(myseq) == mrna_len or myseq == "NA"
-                else:
-                    myseq = qseq
-                queries_dict[org] = myseq
-        else:
-            queries_dict[org] = "NA"
-            myseq = "NA"
-    #
-    # for each found sequence calculate MIRZAscore
-    #
-    results_dict = {}
-    mrnas_dict = {}
-    for horg in queries_dict.keys():
-        if queries_dict[horg] != "NA":  # and mirna[mirname][horg] != "-" * 21:
-            mrnas_dict[horg] = queries_dict[horg]
-        else:
-            results_dict[horg] = "NA"
-
-    if len(mrnas_dict.keys()) > 0:
-        results_to_join_dict = calculate_mirza_for_mln(mrnas_dict.values(),
-                                                       mrnas_dict.keys(),
-                                                       mirna[mirname][horg],
-                                                       mirname,
-                                                       update='noupdate',
-                                                       context_len=mrna_len)
-    else:
-        results_to_join_dict = {}
-    #
-    # Join the dictionaries with scores and with NAs
-    #
-    results_dict = dict(results_to_join_dict.items() + results_dict.items())
-
-    # get the list of names where the mirza score is above threshold
-    names = [i for i in results_dict.keys() if
-             ((results_dict[i] >= threshold) and results_dict[i] != "NA")]
-    tree.retain_taxa_with_labels(names + [ref_org])
-    branch_length = tree.length()
-    conservation = scale(branch_length / float(total_branch_length), min_s, 1)
-    return conservation
-
-
 def is_canonical(hybrids):
     """
     is_cannonical checks if seed is in the mRNA fragment provided and if this
@@ -646,148 +327,6 @@ def is_canonical(hybrids):
             return False, "unknown"
 
 
-def read_coordinates(path_to_file, zipped=False):
-    """Read coordinate file into list
-
-    Args:
-        path_to_file (@todo): @todo
-
-    Returns: list of lists
-
-    """
-    coords = []
-    if options.verbose:
-        syserr("Reading sequences from coordinate file %s\n" % (path_to_file))
-    try:
-        if zipped:
-            corfile = gzip.open(path_to_file, 'rb')
-        else:
-            corfile = open(path_to_file, 'r')
-    except IOError:
-        raise IOError('Cannot read from coordinate file %s' % (path_to_file))
-    for coord in corfile:
-        coord = coord.rstrip().split()
-        try:
-            coords.append([coord[0], coord[1], int(coord[2]), int(coord[3]), coord[4]])
-        except IndexError:
-            syserr("IndexError in coordinate file, line: %s\n" % (' '.join(coord)))
-        except ValueError, e:
-            syserr(str(e) + "\n")
-
-    return coords
-
-
-def read_fasta_to_dict(path_to_file):
-    """Read fasta file into dictionary
-
-    Args:
-        path_to_file (@todo): @todo
-
-    Returns: @todo
-
-    """
-    if options.verbose:
-        syserr("Reading sequences from %s \n" % (path_to_file))
-    try:
-        seq_obj = open(path_to_file, 'Ur')
-        seqs = {}
-        for seq in SeqIO.parse(seq_obj, 'fasta'):
-            seqs[str(seq.id)] = str(seq.seq)
-    except IOError:
-        raise IOError('Cannot read from %s' % (path_to_file))
-
-    return seqs
-
-
-def read_phylogenetic_tree(path_to_file):
-    """Read phylogenetic tree
-
-    Args:
-        path_to_file (@todo): @todo
-
-    Returns: @todo
-
-    """
-    try:
-        phylo_tree = dendropy.Tree()
-        phylo_tree.read_from_path(path_to_file, "newick")
-    except IOError:
-        raise IOError("Cannot open phylogenetic tree %s" % path_to_file)
-
-    return phylo_tree
-
-
-def read_multiple_alignments(tree, directory_path, coordinates):
-    """Read MLN files into dict
-
-    Args:
-        tree (@todo): @todo
-        directory_path (@todo): @todo
-        coordinates (@todo): @todo
-
-    Returns: @todo
-
-    """
-    multiple_alignment_dict = {}
-    for coord in coordinates:
-        try:
-            handle = open(os.path.join(directory_path, coord[0]), 'rb')
-            multiple_alignment_dict[coord[0]] = cpickle.load(handle)
-        except Exception, e:
-            syserr("No alignment for %s, going on without it.\n" % coord[0])
-            syserr(str(e) + "\n")
-
-    return multiple_alignment_dict
-
-
-def make_homologues_mirnas(phylogenetic_tree, mirna_seqs):
-    """Make DataFrame with miRNAs for different species
-
-    Args:
-        phylogenetic_tree (@todo): @todo
-        mirna_seqs (@todo): @todo
-
-    Returns: @todo
-
-    """
-    species = [leaf.taxon.label for leaf in phylogenetic_tree.leaf_iter()]
-    mirhomologues = pd.DataFrame({sp: {mirid: mirna_seqs[mirid][:21]
-                                       for mirid in mirna_seqs.keys()}
-                                  for sp in species}).transpose()
-    return mirhomologues
-
-
-def clean():
-    """Remove files after calculation
-    """
-    try:
-        os.unlink(options.coords + 'mirza_mrna_input' + '.fa')
-        os.unlink(options.coords + 'mirza_mirna_input' + '.fa')
-        os.unlink(options.coords + 'mirza_mirna_expressions' + '.fa')
-    except:
-        pass
-
-
-def is_executable(program):
-    """
-    Check if the path/binary provided is valid executable
-    """
-    def is_exe(fpath):
-        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
-
-    fpath, fname = os.path.split(program)
-    if fpath:
-        if is_exe(program):
-            return True
-    else:
-        for path in os.environ["PATH"].split(os.pathsep):
-            path = path.strip('"')
-            exe_file = os.path.join(path, program)
-            if is_exe(exe_file):
-                return True
-
-    return False
-
 if __name__ == '__main__':
     try:
         try:
@@ -798,7 +337,8 @@ if __name__ == '__main__':
             start_time = time.time()
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        main(options)
+        with runstats.track(__file__, options.out):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
@@ -10,16 +10,22 @@ __email__ = "r.gumienny@unibas.ch"
 __license__ = "GPL"
 
 # imports
+import os
 import re
 import sys
 import time
-import gzip
 import subprocess
 from sys import exit
-from Bio import SeqIO
 from os.path import abspath
 from argparse import ArgumentParser, RawTextHelpFormatter
 
+import mirzag_path
+from mirzag import runstats
+from mirzag import read_sites, read_fasta
+from mirzag.features import distances_to_boundary
+from mirzag import columnar
+from mirzag import compress
+
 parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
 parser.add_argument("-v",
                     "--verbose",
@@ -37,7 +43,10 @@ parser.add_argument('--coords', default='coords.tab', dest='coords',
 parser.add_argument('--contextLen', type=int, dest='contextLen', default=50,
                      action='store', help='length of the \
         context sequence serounding binding site')
+parser.add_argument('--format', dest='format', choices=columnar.FORMATS,
+                    default='tsv', help='format of the output: gzipped tsv or columnar')
 
+compress.add_arguments(parser)
 
 # redefine a functions for writing to stdout and stderr to save some writting
 syserr = sys.stderr.write
@@ -46,72 +55,33 @@ sysout = sys.stdout.write
 
 def main(options):
     """Main logic of the script"""
-    coords = []
+    compress.configure_from(options)
     if options.verbose == True:
             print "Reading sequences from coordinate file %s" % (options.coords)
-    try:
-        corfile = gzip.open(options.coords, 'rb')
-    except IOError:
-        raise IOError('Cannot read from coordinate file %s' % (options.coords))
+    coords = read_sites(options.coords, context=False)
+    runstats.count('sites', len(coords))
 
-    for c in corfile:
-        try:
-            c = c.rstrip().split()
-            coords.append([c[0], int(c[2]), int(c[3]), c[1]])
-        except ValueError, e:
-            raise ValueError("Wrong coordinates: %s" % " ".join(c))
-
-
-    # Read mRNA sequences into hash table: {id:sequence}
+    # Read mRNA sequences of the sites into hash table: {id:sequence}
     if options.verbose == True:
             print "Reading sequences from mRNA file %s" % (options.seq)
-    try:
-        seq_obj = open(options.seq, 'Ur')
-    except IOError:
-        raise IOError('Cannot read from mRNA file %s' % (options.seq))
-
-    mRNAseqs = {}
-    for seq in SeqIO.parse(seq_obj, 'fasta'):
-        mRNAseqs[str(seq.id)] = str(seq.seq)
+    mRNAseqs = read_fasta(options.seq, ids=coords.utr_ids())
 
+    if options.format == 'columnar':
+        with columnar.Writer(options.out, columnar.DISTANCE) as writer:
+            writer.write_rows(columnar.site_rows(coords, distances_to_boundary(coords, mRNAseqs), 1))
+        return
 
     # Open output file and write first lines
     try:
-        outfile = gzip.open(options.out, 'wb')
+        outfile = compress.open_output(options.out)
     except IOError:
         raise IOError("Connot open output file %s" % (options.out))
     # outfile.write('#siteID\tdistToBoundary\n')
 
-    # Iterate through the binding coordinates to calculate their score
-    if options.verbose == True:
-            print "Calculating average G content... "
-    for (mrnaid, lowerix, upperix, mirnas) in coords:
-        if mrnaid in mRNAseqs:
-            mrnasequ = mRNAseqs[mrnaid]
-            score = calculate_distance_to_boundary(len(mrnasequ), lowerix)
-            for mirna in mirnas.split(","):
-                outtext = '%s,%s,%i,%i\t%s\n' % (mrnaid,
-                                                 mirna,
-                                                 lowerix,
-                                                 upperix,
-                                                 score)
-                outfile.write(outtext)
-        else:
-            for mirna in mirnas.split(","):
-                outtext = '%s,%s,%i,%i\t%s\n' % (mrnaid,
-                                                 mirna,
-                                                 lowerix,
-                                                 upperix,
-                                                 "NA")
-                outfile.write(outtext)
-
-
-    outfile.close()
-
-
+    with outfile:
+        for site_id, distance in distances_to_boundary(coords, mRNAseqs).iteritems():
+            outfile.write('%s\t%s\n' % (site_id, "NA" if distance is None else distance))
 
-def calculate_distance_to_boundary(mRNAlen, begpos):
-        return str(begpos if begpos < (mRNAlen - begpos) else (mRNAlen - begpos))
 
 if __name__ == '__main__':
     try:
@@ -125,7 +95,8 @@ if __name__ == '__main__':
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" %
                    start_date)
-        main(options)
+        with runstats.track(__file__, options.out):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" %
                    (time.time() - start_time,
@@ -17,6 +17,11 @@ import time
 from collections import defaultdict
 from argparse import ArgumentParser
 
+import mirzag_path
+from mirzag import runstats
+from mirzag import compress
+from mirzag.scoring import sweep_scores, sweep_lines
+
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("-v",
                     "--verbose",
@@ -37,6 +42,10 @@ parser.add_argument("--threshold",
                     type=float,
                     default=0.12,
                     help="Threshold for summing, defaults to 0.12")
+parser.add_argument("--thresholds",
+                    dest="thresholds",
+                    default=None,
+                    help="Comma-separated thresholds: write scores for each of them (with a header)\ninstead of for --threshold, defaults to None")
 parser.add_argument("--split-by",
                     dest="split_by",
                     default="|",
@@ -51,6 +60,7 @@ parser.add_argument("--name",
                     default="GeneID",
                     help="Name of the id eg. gene, transcript etc , defaults to GeneID")
 
+compress.add_arguments(parser)
 
 # redefine a functions for writing to stdout and stderr to save some writting
 syserr = sys.stderr.write
@@ -59,6 +69,10 @@ sysout = sys.stdout.write
 
 def main(options):
     """Main logic of the script"""
+    compress.configure_from(options)
+    if options.thresholds is not None:
+        sweep(options)
+        return
     data_with_conserved = {}
     data_without_conserved = {}
     if options.verbose:
@@ -77,9 +91,10 @@ def main(options):
                         if key not in data_with_conserved:
                             data_with_conserved[key] = 0.0
                         data_with_conserved[key] += float(row[11])
+    runstats.count('genes', len(data_without_conserved))
     if options.verbose:
         syserr("Writing output\n")
-    with gzip.open(options.output, 'wb') as o:
+    with compress.open_output(options.output) as o:
         # o.write("%s\t%s\t%s\t%s\n" % (options.name, 'miRNA', 'Total score without conservation', 'Total score with conservation'))
         for key, value in data_without_conserved.iteritems():
             myid, mirna = key.split(",")
@@ -90,6 +105,28 @@ def main(options):
             o.write("%s\t%s\t%f\t%s\n" % (myid, mirna, value, with_conservation_value))
 
 
+def sweep(options):
+    """Per gene scores for all thresholds in one pass over the sites"""
+    keys = []
+    without = []
+    with_conservation = []
+    if options.verbose:
+        syserr("Reading Data:\n")
+    with gzip.open(options.input) as infile:
+        for row in csv.reader(infile, delimiter='\t'):
+            if row[0] != 'ID':
+                keys.append((row[0].split(options.split_by)[options.column], row[1]))
+                without.append(float(row[10]))
+                with_conservation.append(float(row[11]))
+    thresholds, genes = sweep_scores(keys, without, with_conservation,
+                                     [float(threshold) for threshold in options.thresholds.split(",")])
+    runstats.count('genes', len(genes))
+    if options.verbose:
+        syserr("Writing output\n")
+    with compress.open_output(options.output) as o:
+        o.writelines(sweep_lines(thresholds, genes))
+
+
 if __name__ == '__main__':
     try:
         try:
@@ -101,7 +138,8 @@ if __name__ == '__main__':
             start_time = time.time()
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        main(options)
+        with runstats.track(__file__, options.output):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Collect per gene scores of the chunks into the final table as soon as
+the chunks are merged. Chunks are appended in the order in which they
+finish so partial results are available while the rest of the run is
+still calculated. Chunks merged in the columnar format are exported to TSV
+here. With --database the scores are loaded also into the results database
+(see mirzag/resultsdb.py). With --sweep-output the per gene scores for the
+thresholds of the sweep (<chunk>.sweep) and with --models-output the per
+gene scores of the models of the registries (<chunk>.models) are collected
+into tables of their own.
+"""
+
+__license__ = "GPL"
+
+# imports
+import os
+import sys
+import glob
+import json
+import time
+import gzip
+import shutil
+from itertools import izip
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import mirzag_path
+from mirzag import runstats
+from mirzag import cache
+from mirzag import fingerprint
+from mirzag import columnar
+from mirzag import resultsdb
+
+# seconds without a finished chunk after which the collection gives up
+DEFAULT_TIMEOUT = 86400
+# outputs of the jobs of each chunk, the collection stops when one of them failed
+STAGE_SUFFIXES = ['.seedcount', '.mirza', '.contrafold', '.flanks', '.distance', '.score']
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+parser.add_argument("-v",
+                    "--verbose",
+                    dest="verbose",
+                    action="store_true",
+                    default=False,
+                    help="Be loud!")
+parser.add_argument("--input-dir",
+                    dest="input_dir",
+                    required=True,
+                    help="Output directory of the run with *.score files")
+parser.add_argument("--output",
+                    dest="output",
+                    required=True,
+                    help="Final table")
+parser.add_argument("--chunks-from",
+                    dest="chunks_from",
+                    default="manifest",
+                    choices=("manifest", "seedcount"),
+                    help="Take names of the chunks from the manifest of the run (seed protocol) or from\n*.seedcount files (scan protocol), defaults to manifest")
+parser.add_argument("--poll",
+                    dest="poll",
+                    type=float,
+                    default=30.0,
+                    help="Seconds between checks for finished chunks, defaults to 30")
+parser.add_argument("--timeout",
+                    dest="timeout",
+                    type=float,
+                    default=DEFAULT_TIMEOUT,
+                    help="Give up after this many seconds without a finished chunk, defaults to %i" % DEFAULT_TIMEOUT)
+parser.add_argument("--database",
+                    dest="database",
+                    default=None,
+                    help="Load the scores also into this SQLite database, defaults to None")
+parser.add_argument("--sweep-output",
+                    dest="sweep_output",
+                    default=None,
+                    help="Collect also per gene scores for the thresholds of the sweep into this table,\ndefaults to None")
+parser.add_argument("--models-output",
+                    dest="models_output",
+                    default=None,
+                    help="Collect also per gene scores of the models of the registries into this table,\ndefaults to None")
+
+
+# redefine a functions for writing to stdout and stderr to save some writting
+syserr = sys.stderr.write
+sysout = sys.stdout.write
+
+
+def main(options):
+    """Main logic of the script"""
+    chunks = list_chunks(options.input_dir, options.chunks_from)
+    pending = set(chunks)
+    if options.verbose:
+        syserr("Waiting for %i chunks\n" % len(pending))
+    database = resultsdb.connect(options.database) if options.database is not None else None
+    last_progress = time.time()
+    # tables of the chunks collected next to the final table by suffix
+    tables = dict((suffix, open(path + ".partial", 'w'))
+                  for suffix, path in ((".sweep", options.sweep_output), (".models", options.models_output))
+                  if path is not None)
+    # partial results are available in output.partial until all chunks are collected
+    with open(options.output + ".partial", 'w') as outfile:
+        while pending:
+            finished = sorted(chunk for chunk in pending
+                              if cache.is_recorded(os.path.join(options.input_dir, chunk + ".score")))
+            for chunk in finished:
+                copy_scores(os.path.join(options.input_dir, chunk + ".score"), outfile)
+                if database is not None:
+                    sites_path = os.path.join(options.input_dir, chunk + ".sites")
+                    resultsdb.load_chunk(database, chunk, read_scores(os.path.join(options.input_dir, chunk + ".score")),
+                                         columnar.read_rows(sites_path) if os.path.exists(sites_path) else ())
+                for suffix, table in tables.iteritems():
+                    copy_table(os.path.join(options.input_dir, chunk + suffix), table)
+                pending.remove(chunk)
+                runstats.count('chunks')
+            failed = sorted((chunk, suffix) for chunk in pending for suffix in STAGE_SUFFIXES
+                            if job_failed(os.path.join(options.input_dir, chunk + suffix)))
+            if failed:
+                raise Exception("Jobs of %i chunks failed: %s" % (len(set(chunk for chunk, suffix in failed)),
+                                                                  ", ".join(chunk + suffix for chunk, suffix in failed)))
+            if finished:
+                outfile.flush()
+                for table in tables.itervalues():
+                    table.flush()
+                last_progress = time.time()
+                if options.verbose:
+                    syserr("Collected %i chunks, %i to go\n" % (len(finished), len(pending)))
+            elif options.timeout is not None and time.time() - last_progress > options.timeout:
+                raise Exception("No chunk finished in %i seconds, still missing: %s" % (options.timeout,
+                                                                                          ", ".join(sorted(pending))))
+            if pending:
+                time.sleep(options.poll)
+    os.rename(options.output + ".partial", options.output)
+    for table in tables.itervalues():
+        table.close()
+        os.rename(table.name, table.name[:-len(".partial")])
+    if database is not None:
+        removed = resultsdb.keep_chunks(database, chunks)
+        if options.verbose:
+            syserr("Database %s: %s\n" % (options.database, ", ".join("%i %s" % (count, name)
+                                                                     for name, count in sorted(resultsdb.summary(database).items()))))
+            if removed:
+                syserr("Removed %i chunks that are not in the run from the database\n" % len(removed))
+        database.close()
+
+
+def copy_scores(path, outfile):
+    """Append per gene scores of the chunk (gzipped TSV or columnar) to the output as TSV"""
+    if not columnar.is_columnar(path):
+        with gzip.open(path) as infile:
+            shutil.copyfileobj(infile, outfile)
+        return
+    with columnar.Reader(path) as reader:
+        for ids, mirnas, values, with_conservation_values in reader.blocks():
+            # the same formatting as in the gzipped TSV of the merge
+            outfile.write("".join("%s\t%s\t%f\t%s\n" % (myid, mirna, value,
+                                                         'NaN' if columnar.is_missing(with_conservation_value) else str(with_conservation_value))
+                                  for myid, mirna, value, with_conservation_value in izip(ids, mirnas, values, with_conservation_values)))
+
+
+def job_failed(output):
+    """Did the job with the output fail (its run statistics say so)
+
+    Statistics of jobs that failed in a previous run are removed when the
+    run is submitted (MIRZA_G_pipeline.py).
+
+    """
+    try:
+        with open(output + runstats.SIDECAR_SUFFIX) as infile:
+            record = json.load(infile)
+    except (IOError, ValueError):
+        return False
+    return record.get('status') == 'failed'
+
+
+def copy_table(path, outfile):
+    """Append the gzipped table of the chunk to the output (its header only to an empty output)"""
+    with gzip.open(path) as infile:
+        line = infile.readline()
+        if line.startswith("#"):
+            if outfile.tell() == 0:
+                outfile.write(line)
+        else:
+            outfile.write(line)
+        shutil.copyfileobj(infile, outfile)
+
+
+def read_scores(path):
+    """Per gene scores of the chunk (gzipped TSV or columnar)
+
+    Returns: generator of tuples of id, miRNA, score and score with conservation (NaN if missing)
+
+    """
+    if columnar.is_columnar(path):
+        for row in columnar.read_rows(path):
+            yield row
+        return
+    with gzip.open(path) as infile:
+        for line in infile:
+            myid, mirna, value, with_conservation_value = line.rstrip("\n").split("\t")
+            yield myid, mirna, float(value), float(with_conservation_value)
+
+
+def list_chunks(input_dir, chunks_from="manifest"):
+    """Names of the chunks of the run"""
+    if chunks_from == "manifest":
+        manifest = fingerprint.load_manifest(input_dir)
+        if manifest is None:
+            raise Exception("There is no manifest in %s" % input_dir)
+        return manifest['chunks'].keys()
+    return [os.path.splitext(os.path.basename(path))[0]
+            for path in glob.glob(os.path.join(input_dir, "*.seedcount"))]
+
+
+if __name__ == '__main__':
+    try:
+        try:
+            options = parser.parse_args()
+        except Exception, e:
+            parser.print_help()
+            sys.exit()
+        if options.verbose:
+            start_time = time.time()
+            start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
+            syserr("############## Started script on %s ##############\n" %
+                   start_date)
+        with runstats.track(__file__, options.output,
+                            sidecar=os.path.join(options.input_dir, "rg_collect_results.stats.json")):
+            main(options)
+        if options.verbose:
+            syserr("### Successfully finished in %i seconds, on %s ###\n" %
+                   (time.time() - start_time,
+                    time.strftime("%d-%m-%Y at %H:%M:%S")))
+    except KeyboardInterrupt:
+        syserr("Interrupted by user after %i seconds!\n" %
+               (time.time() - start_time))
+        sys.exit(-1)
@@ -11,9 +11,13 @@ __license__ = "GPL"
 import sys
 import time
 import re
-import gzip
 from argparse import ArgumentParser
-from Bio import SeqIO, Seq
+
+import mirzag_path
+from mirzag import runstats
+from mirzag import compress
+from mirzag import read_fasta
+from mirzag.seeds import SEED_DEFINITIONS, seed_regex, iter_seed_matches
 
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("-v",
@@ -27,7 +31,7 @@ parser.add_argument("--motifs",
 parser.add_argument("--seqs",
                     help="Sequences for scaning eg. 3' UTRs")
 parser.add_argument("--how",
-                    choices=("ElMMo", "TargetScan", "6-mer"),
+                    choices=SEED_DEFINITIONS,
                     default="TargetScan",
                     help="What definition for seed to use")
 parser.add_argument("--coords",
@@ -44,6 +48,7 @@ parser.add_argument("--context",
                     default=50,
                     help="Context for sequence to print, defaults to 50")
 
+compress.add_arguments(parser)
 
 # redefine a functions for writing to stdout and stderr to save some writting
 syserr = sys.stderr.write
@@ -51,118 +56,23 @@ sysout = sys.stdout.write
 
 def main(options):
     """Main logic of the script"""
-    motifs = {str(rec.id):Seq.Seq(str(rec.seq).upper().replace('U','T')) for rec in SeqIO.parse(options.motifs, 'fasta')}
-    seqs = {str(rec.id):str(rec.seq).upper().replace('U','T') for rec in SeqIO.parse(options.seqs, 'fasta')}
+    compress.configure_from(options)
+    motifs = read_fasta(options.motifs, to_dna=True)
+    seqs = read_fasta(options.seqs, to_dna=True)
+    runstats.count('mirnas', len(motifs))
+    runstats.count('sequences', len(seqs))
 
-    with gzip.open(options.output, 'wb') as out:
+    with compress.open_output(options.output) as out:
         if options.coords:
-            for mirid, mir in motifs.iteritems():
-                if options.how == "ElMMo":
-                    # ElMMo definition of the seed
-                    regex = r"%s|%s" %(str(motifs[mirid][0:7].reverse_complement()),str(motifs[mirid][1:8].reverse_complement()))
-                    for seqid, seq in seqs.iteritems():
-                        for match in re.finditer(regex, seq):
-                            dist_to_boundary = calculate_distance_to_boundary(len(seq), match.span()[0])
-                            if dist_to_boundary < 50:
-                                continue
-                            lowerIndex, upperIndex = get_indices(options.context,
-                                    match.span()[0],
-                                    match.span()[1])
-                            if upperIndex >= len(seq):
-                                mRNA = seq[-1 * options.context:]
-                            elif lowerIndex < 0:
-                                mRNA = seq[:options.context]
-                            else:
-                                mRNA = seq[lowerIndex:upperIndex]
-                            if len(mRNA) == options.context:
-                                out.write("%s\t%s\t%i\t%i\t%s\n" % (seqid,
-                                                                    mirid,
-                                                                    match.span()[0],
-                                                                    match.span()[1],
-                                                                    mRNA))
-                            else:
-                                continue
-                if options.how == "TargetScan":
-                    # TargetScan definition of the seed
-                    regex = r"%s|%s" %(str(motifs[mirid][1:8].reverse_complement()), str(motifs[mirid][1:7].reverse_complement()) + 'A')
-                    for seqid, seq in seqs.iteritems():
-                        for match in re.finditer(regex, seq):
-                            dist_to_boundary = calculate_distance_to_boundary(len(seq), match.span()[0])
-                            if dist_to_boundary < 50:
-                                continue
-                            lowerIndex, upperIndex = get_indices(options.context,
-                                                                 match.span()[0],
-                                                                 match.span()[1])
-                            if upperIndex >= len(seq):
-                                mRNA = seq[-1 * options.context:]
-                            elif lowerIndex < 0:
-                                mRNA = seq[:options.context]
-                            else:
-                                mRNA = seq[lowerIndex:upperIndex]
-                            if len(mRNA) == options.context:
-                                out.write("%s\t%s\t%i\t%i\t%s\n" % (seqid,
-                                                                    mirid,
-                                                                    match.span()[0],
-                                                                    match.span()[1],
-                                                                    mRNA))
-                            else:
-                                continue
-                if options.how == "6-mer":
-                    # 6-mer
-                    regex = r"%s" %(str(motifs[mirid][1:7].reverse_complement()))
-                    for seqid, seq in seqs.iteritems():
-                        for match in re.finditer(regex, seq):
-                            dist_to_boundary = calculate_distance_to_boundary(len(seq), match.span()[0])
-                            if dist_to_boundary < 50:
-                                continue
-                            lowerIndex, upperIndex = get_indices(options.context,
-                                                                 match.span()[0],
-                                                                 match.span()[1])
-                            if upperIndex >= len(seq):
-                                mRNA = seq[-1 * options.context:]
-                            elif lowerIndex < 0:
-                                mRNA = seq[:options.context]
-                            else:
-                                mRNA = seq[lowerIndex:upperIndex]
-                            if len(mRNA) == options.context:
-                                out.write("%s\t%s\t%i\t%i\t%s\n" % (seqid,
-                                                                    mirid,
-                                                                    match.span()[0],
-                                                                    match.span()[1],
-                                                                    mRNA))
-                            else:
-                                continue
+            for site in iter_seed_matches(seqs, motifs, options.how, options.context):
+                out.write("%s\t%s\t%i\t%i\t%s\n" % site)
         else:
             for mirid, mir in motifs.iteritems():
-                if options.how == "ElMMo":
-                    # ElMMo definition of the seed
-                    regex = r"%s|%s" %(str(motifs[mirid][0:7].reverse_complement()),str(motifs[mirid][1:8].reverse_complement()))
-                    for seqid, seq in seqs.iteritems():
-                        for match in re.finditer(regex, seq):
-                            out.write("%s\t%s\t%i\t%i\t%s\t%s\n" % (seqid, mirid, match.span()[0], match.span()[1], regex, match.group()))
-                if options.how == "TargetScan":
-                    # TargetScan definition of the seed
-                    regex = r"%s|%s" %(str(motifs[mirid][1:8].reverse_complement()),str(motifs[mirid][1:7].reverse_complement()) + 'A')
-                    for seqid, seq in seqs.iteritems():
-                        for match in re.finditer(regex, seq):
-                            out.write("%s\t%s\t%i\t%i\t%s\t%s\n" % (seqid, mirid, match.span()[0], match.span()[1], regex, match.group()))
-                if options.how == "6-mer":
-                    # 6-mer
-                    regex = r"%s" %(str(motifs[mirid][1:7].reverse_complement()))
-                    for seqid, seq in seqs.iteritems():
-                        for match in re.finditer(regex, seq):
-                            out.write("%s\t%s\t%i\t%i\t%s\t%s\n" % (seqid, mirid, match.span()[0], match.span()[1], regex, match.group()))
-
-
-def get_indices(desired_length, beg, end):
-    """Calculate upper and lower index based on what size we want and what are the coordinates"""
-    lower_index = beg - ((desired_length - (end - beg))//2 + (desired_length - (end - beg))%2)
-    upper_index = end + ((desired_length - (end - beg))//2)
-    return lower_index, upper_index
+                regex = seed_regex(mir, options.how)
+                for seqid, seq in seqs.iteritems():
+                    for match in re.finditer(regex, seq):
+                        out.write("%s\t%s\t%i\t%i\t%s\t%s\n" % (seqid, mirid, match.span()[0], match.span()[1], regex, match.group()))
 
-def calculate_distance_to_boundary(mRNAlen, begpos):
-    "Calculate distance to the closest boundary"
-    return str(begpos if begpos < (mRNAlen - begpos) else (mRNAlen - begpos))
 
 if __name__ == '__main__':
     start_time = time.time()
@@ -175,7 +85,8 @@ if __name__ == '__main__':
         if options.verbose:
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        main(options)
+        with runstats.track(__file__, options.output):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
@@ -10,11 +10,14 @@ __license__ = "GPL"
 # imports
 import sys
 import time
-import re
-import gzip
-import pandas as pd
 from argparse import ArgumentParser
-from Bio import SeqIO, Seq
+
+import mirzag_path
+from mirzag import runstats
+from mirzag import Site, scan_seeds, read_fasta, write_sites
+from mirzag.seeds import SEED_DEFINITIONS
+from mirzag.columnar import FORMATS
+from mirzag import compress
 
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("-v",
@@ -28,7 +31,7 @@ parser.add_argument("--motifs",
 parser.add_argument("--seqs",
                     help="Sequences for scaning eg. 3' UTRs")
 parser.add_argument("--how",
-                    choices=("ElMMo", "TargetScan", "6-mer"),
+                    choices=SEED_DEFINITIONS,
                     default="TargetScan",
                     help="What definition for seed to use")
 parser.add_argument("--output",
@@ -49,7 +52,13 @@ parser.add_argument("--index-after-split",
                     type=int,
                     required=True,
                     help="After split take this column as new id, 0 based")
+parser.add_argument("--format",
+                    dest="format",
+                    choices=FORMATS,
+                    default="tsv",
+                    help="Format of the output: gzipped tsv or columnar (see mirzag/columnar.py), defaults to tsv")
 
+compress.add_arguments(parser)
 
 # redefine a functions for writing to stdout and stderr to save some writting
 syserr = sys.stderr.write
@@ -57,117 +66,27 @@ sysout = sys.stdout.write
 
 def main(options):
     """Main logic of the script"""
-    motifs = {str(rec.id):Seq.Seq(str(rec.seq).upper().replace('U','T')) for rec in SeqIO.parse(options.motifs, 'fasta')}
-    seqs = {str(rec.id):str(rec.seq).upper().replace('U','T') for rec in SeqIO.parse(options.seqs, 'fasta')}
-
-    data = []
-    for mirid, mir in motifs.iteritems():
-        for_empty_data_mir = mirid
-        if options.how == "ElMMo":
-            # ElMMo definition of the seed
-            regex = r"%s|%s" %(str(motifs[mirid][0:7].reverse_complement()),str(motifs[mirid][1:8].reverse_complement()))
-            for seqid, seq in seqs.iteritems():
-                for_empty_data_id = seqid
-                for_empty_data_seq = seq[:options.context]
-                for match in re.finditer(regex, seq):
-                    dist_to_boundary = calculate_distance_to_boundary(len(seq), match.span()[0])
-                    if dist_to_boundary < 50:
-                        continue
-                    lowerIndex, upperIndex = get_indices(options.context,
-                            match.span()[0],
-                            match.span()[1])
-                    if upperIndex >= len(seq):
-                        mRNA = seq[-1 * options.context:]
-                    elif lowerIndex < 0:
-                        mRNA = seq[:options.context]
-                    else:
-                        mRNA = seq[lowerIndex:upperIndex]
-                    if len(mRNA) == options.context:
-                        data.append((seqid,
-                                     mirid,
-                                     match.span()[0],
-                                     match.span()[1],
-                                     mRNA))
-                    else:
-                        continue
-        if options.how == "TargetScan":
-            # TargetScan definition of the seed
-            regex = r"%s|%s" %(str(motifs[mirid][1:8].reverse_complement()), str(motifs[mirid][1:7].reverse_complement()) + 'A')
-            for seqid, seq in seqs.iteritems():
-                for_empty_data_id = seqid
-                for_empty_data_seq = seq[:options.context]
-                for match in re.finditer(regex, seq):
-                    dist_to_boundary = calculate_distance_to_boundary(len(seq), match.span()[0])
-                    if dist_to_boundary < 50:
-                        continue
-                    lowerIndex, upperIndex = get_indices(options.context,
-                                                         match.span()[0],
-                                                         match.span()[1])
-                    if upperIndex >= len(seq):
-                        mRNA = seq[-1 * options.context:]
-                    elif lowerIndex < 0:
-                        mRNA = seq[:options.context]
-                    else:
-                        mRNA = seq[lowerIndex:upperIndex]
-                    if len(mRNA) == options.context:
-                        data.append((seqid,
-                                     mirid,
-                                     match.span()[0],
-                                     match.span()[1],
-                                     mRNA))
-                    else:
-                        continue
-        if options.how == "6-mer":
-            # 6-mer
-            regex = r"%s" %(str(motifs[mirid][1:7].reverse_complement()))
-            for seqid, seq in seqs.iteritems():
-                for_empty_data_id = seqid
-                for_empty_data_seq = seq[:options.context]
-                for match in re.finditer(regex, seq):
-                    dist_to_boundary = calculate_distance_to_boundary(len(seq), match.span()[0])
-                    if dist_to_boundary < 50:
-                        continue
-                    lowerIndex, upperIndex = get_indices(options.context,
-                                                         match.span()[0],
-                                                         match.span()[1])
-                    if upperIndex >= len(seq):
-                        mRNA = seq[-1 * options.context:]
-                    elif lowerIndex < 0:
-                        mRNA = seq[:options.context]
-                    else:
-                        mRNA = seq[lowerIndex:upperIndex]
-                    if len(mRNA) == options.context:
-                        data.append((seqid,
-                                     mirid,
-                                     match.span()[0],
-                                     match.span()[1],
-                                     mRNA))
-                    else:
-                        continue
+    compress.configure_from(options)
+    motifs = read_fasta(options.motifs, to_dna=True)
+    seqs = read_fasta(options.seqs, to_dna=True)
 
-    names = ['id', 'mirna', 'beg', 'end', 'seq']
-    if not data:
-        data = [(for_empty_data_id, for_empty_data_mir, 60, 67, for_empty_data_seq)]
-    data = pd.DataFrame(data, columns=names)
-    data['newid'] = [i.split(options.split_by)[options.index_after_split] for i in data.id]
-    ndf = data.drop_duplicates(cols=['newid', 'mirna', 'seq'])
-    with gzip.open(options.output, 'wb') as o:
-        ndf[names].to_csv(o, header=False, index=False, sep='\t')
+    sites = scan_seeds(seqs,
+                       motifs,
+                       how=options.how,
+                       context=options.context,
+                       split_by=options.split_by,
+                       index_after_split=options.index_after_split)
+    runstats.count('mirnas', len(motifs))
+    runstats.count('sequences', len(seqs))
+    runstats.count('sites', len(sites))
+    if not sites:
+        # the following stages expect at least one site
+        seqid, seq = seqs.items()[-1]
+        sites = [Site(seqid, motifs.keys()[-1], 60, 67, seq[:options.context])]
+    write_sites(options.output, sites, options.format)
     if options.verbose:
-        syserr("Filtering:\n")
-        syserr(" - number of coordinates before: %i\n" % len(data.index))
-        syserr(" - number of coordinates after : %i\n" % len(ndf.index))
-
-
-def get_indices(desired_length, beg, end):
-    """Calculate upper and lower index based on what size we want and what are the coordinates"""
-    lower_index = beg - ((desired_length - (end - beg))//2 + (desired_length - (end - beg))%2)
-    upper_index = end + ((desired_length - (end - beg))//2)
-    return lower_index, upper_index
+        syserr("Number of coordinates after filtering: %i\n" % len(sites))
 
-def calculate_distance_to_boundary(mRNAlen, begpos):
-    "Calculate distance to the closest boundary"
-    return str(begpos if begpos < (mRNAlen - begpos) else (mRNAlen - begpos))
 
 if __name__ == '__main__':
     start_time = time.time()
@@ -180,7 +99,8 @@ if __name__ == '__main__':
         if options.verbose:
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        main(options)
+        with runstats.track(__file__, options.output):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
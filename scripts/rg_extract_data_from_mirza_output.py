@@ -14,9 +14,12 @@ import sys
 import time
 import errno
 import itertools
-from Bio import SeqIO
 from argparse import ArgumentParser, RawTextHelpFormatter
 
+import mirzag_path
+from mirzag import runstats
+from mirzag.fasta import iter_fasta
+
 parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
 parser.add_argument("-v",
                     "--verbose",
@@ -51,14 +54,13 @@ sysout = sys.stdout.write
 def main(options):
     """Main logic of the script"""
     with open(options.seqs) as f:
-        seqs = {}
-        for rec in SeqIO.parse(f, 'fasta'):
-            seqs[str(rec.id)] = str(rec.seq)
+        seqs = dict(iter_fasta(f))
 
     results = {}
     try:
         for key, group in itertools.groupby(sys.stdin, lambda x: x == "\n"):
             if not key:
+                runstats.count('mirza_records')
                 proper_group = False
                 for line in group:
                     if line.startswith(">"):
@@ -112,6 +114,7 @@ def main(options):
         if e.errno == errno.EPIPE:
             pass
 
+    runstats.count('sites', len(results))
     with open(options.output, 'w') as outfile:
         for key, val in results.iteritems():
             outtext = "%s\t%s\n" % (key, "\t".join(str(i) for i in val))
@@ -214,7 +217,8 @@ if __name__ == '__main__':
             start_time = time.time()
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        main(options)
+        with runstats.track(__file__, options.output):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
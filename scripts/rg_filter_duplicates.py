@@ -11,10 +11,13 @@ __license__ = "GPL"
 # imports
 import sys
 import time
-import gzip
 import pandas as pd
 from argparse import ArgumentParser
 
+import mirzag_path
+from mirzag import runstats
+from mirzag import compress
+
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("-v",
                     "--verbose",
@@ -40,6 +43,7 @@ parser.add_argument("--output",
                     required=True,
                     help="Output name")
 
+compress.add_arguments(parser)
 
 # redefine a functions for writing to stdout and stderr to save some writting
 syserr = sys.stderr.write
@@ -48,12 +52,15 @@ sysout = sys.stdout.write
 
 def main(options):
     """Main logic of the script"""
+    compress.configure_from(options)
     names = ['id', 'mirna', 'beg', 'end', 'seq']
     df = pd.read_table(options.coords, names=names, compression='gzip')
     df['newid'] = [i.split(options.split_by)[options.index_after_split] for i in df.id]
-    ndf = df.drop_duplicates(cols=['newid', 'mirna', 'seq'])
-    with gzip.open(options.output, 'wb') as o:
-        ndf[names].to_csv(o, header=False, index=False, sep='\t')
+    ndf = df.drop_duplicates(subset=['newid', 'mirna', 'seq'])
+    runstats.count('raw_sites', len(df.index))
+    runstats.count('sites', len(ndf.index))
+    with compress.open_output(options.output) as o:
+        o.write(ndf[names].to_csv(None, header=False, index=False, sep='\t'))
     if options.verbose:
         syserr("Filtered %s\n" % options.coords)
         syserr(" - number of coordinates before: %i\n" % len(df.index))
@@ -70,7 +77,8 @@ if __name__ == '__main__':
             start_time = time.time()
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        main(options)
+        with runstats.track(__file__, options.output):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
@@ -15,6 +15,9 @@ import gzip
 import pandas as pd
 from argparse import ArgumentParser
 
+import mirzag_path
+from mirzag import runstats
+
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("-v",
                     "--verbose",
@@ -52,7 +55,9 @@ def main(options):
     names_to_save = ['id', 'mirna', 'beg', 'end', 'seq']
     df = pd.read_table(options.coords, names=names)
     df['newid'] = [i.split(options.split_by)[options.index_after_split] for i in df.id]
-    ndf = df.drop_duplicates(cols=['newid', 'mirna', 'seq'])
+    ndf = df.drop_duplicates(subset=['newid', 'mirna', 'seq'])
+    runstats.count('raw_sites', len(df.index))
+    runstats.count('sites', len(ndf.index))
     with open(options.output, 'wb') as o:
         ndf[names_to_save].to_csv(o, header=False, index=False, sep='\t')
     if options.verbose:
@@ -71,7 +76,8 @@ if __name__ == '__main__':
             start_time = time.time()
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        main(options)
+        with runstats.track(__file__, options.output):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
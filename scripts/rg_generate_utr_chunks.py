@@ -12,10 +12,13 @@ __license__ = "GPL"
 import os
 import sys
 import time
-from Bio import SeqIO
 from contextlib import contextmanager
 from argparse import ArgumentParser, RawTextHelpFormatter
 
+import mirzag_path
+from mirzag import runstats
+from mirzag.fasta import iter_fasta
+
 parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
 parser.add_argument("-v",
                     "--verbose",
@@ -61,8 +64,9 @@ def main(options):
         size_count = 0
         files_count = 0
         with smart_open(options.input) as infile:
-            for rec in SeqIO.parse(infile, 'fasta'):
-                windows = slide_windows(str(rec.seq),
+            for seqid, seq in iter_fasta(infile):
+                runstats.count('sequences')
+                windows = slide_windows(seq,
                                         options.window_size,
                                         options.slide_size)
                 for part_mrna, winpos, winpos_tup in windows:
@@ -73,7 +77,7 @@ def main(options):
                         outfile = open(os.path.join(options.output_dir,
                                                     "part_%i.fa" % files_count), 'w')
                     if len(part_mrna) == options.window_size:
-                        outfile.write(">%s:%s\n%s\n" % (str(rec.id), winpos, part_mrna))
+                        outfile.write(">%s:%s\n%s\n" % (seqid, winpos, part_mrna))
                         size_count += 1
     except Exception, e:
         raise e
@@ -81,6 +85,8 @@ def main(options):
         if outfile is not None:
             outfile.close()
 
+    runstats.count('windows', size_count)
+    runstats.count('files', files_count)
     if options.verbose:
         syserr("File was split into %i chunks.\n" % files_count)
 
@@ -152,7 +158,8 @@ if __name__ == '__main__':
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" %
                    start_date)
-        main(options)
+        with runstats.track(__file__, options.output_dir, sidecar=os.path.join(options.output_dir, "rg_generate_utr_chunks.stats.json")):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" %
                    (time.time() - start_time,
@@ -9,16 +9,19 @@ __email__ = "r.gumienny@unibas.ch"
 __license__ = "GPL"
 
 # imports
-import gc
 import sys
-import csv
 import time
-import gzip
-import pandas as pd
-import numpy as np
-import statsmodels.api as sm
 from argparse import ArgumentParser
 
+import mirzag_path
+from mirzag import runstats
+from mirzag import score, per_gene_scores
+from mirzag.scoring import site_scores, per_gene_sweep, sweep_lines, per_gene_model_scores, model_lines
+from mirzag.models import load_models
+from mirzag.features import read_features
+from mirzag import columnar
+from mirzag import compress
+
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("-v",
                     "--verbose",
@@ -63,7 +66,37 @@ parser.add_argument("--name",
                     dest="name",
                     default="GeneID",
                     help="Name of the id eg. gene, transcript etc , defaults to GeneID")
-
+parser.add_argument("--format",
+                    dest="format",
+                    choices=columnar.FORMATS,
+                    default="tsv",
+                    help="Format of the output: gzipped tsv or columnar (see mirzag/columnar.py), defaults to tsv")
+parser.add_argument("--thresholds",
+                    dest="thresholds",
+                    default=None,
+                    help="Comma-separated thresholds of the sweep: per gene scores for each of them\nare written to --sweep-output, defaults to None")
+parser.add_argument("--sweep-output",
+                    dest="sweep_output",
+                    default=None,
+                    help="Gzipped table of the sweep (with --thresholds), defaults to output + .sweep")
+parser.add_argument("--models",
+                    dest="models",
+                    default=None,
+                    help="Comma-separated registries of models (see mirzag/models.py): per gene scores of\neach model are written to --models-output, defaults to None")
+parser.add_argument("--models-output",
+                    dest="models_output",
+                    default=None,
+                    help="Gzipped table of the per gene scores of the models (with --models), defaults\nto output + .models")
+parser.add_argument("--sites-output",
+                    dest="sites_output",
+                    default=None,
+                    help="Write also sites with their features and probabilities (columnar, with index by gene)\nto this file, defaults to None")
+parser.add_argument("--stats-output",
+                    dest="stats_output",
+                    default=None,
+                    help="Run statistics of the merge (also when it fails), defaults to output + .stats.json")
+
+compress.add_arguments(parser)
 
 # redefine a functions for writing to stdout and stderr to save some writting
 syserr = sys.stderr.write
@@ -74,227 +107,62 @@ class EmptyDataException(Exception): pass
 
 def main(options):
     """Main logic of the script"""
-    #
-    # Define mapping from column names to pretty names
-    #
-    columns_map = {'ContraScoreTargetSite': 'Accessibility',
-                   'ID': "ID",
-                   'MIRZABranchLengthScoreFill': "Conservation",
-                   'MIRZAscore': 'MIRZAscore',
-                   'distToBoundary': 'Distance to boundary',
-                   'flanksG': 'Flanks G',
-                   'flanksU': 'Flanks U',
-                   'hybrid': "Hybrid",
-                   'miRNA': 'miRNA',
-                   'precise_type': 'Precise type',
-                   'probability_with_bls': "Probability with conservation",
-                   'probability_without_bls': "Probability without conservation",
-                   'seed_beg': 'Seed start',
-                   'seed_end': 'Seed end',
-                   'type': 'Type'}
-    #
-    # Define columns order
-    #
-    columns_order = ['ID',
-                     'miRNA',
-                     'seed_beg',
-                     'seed_end',
-                     'flanksU',
-                     'flanksG',
-                     'ContraScoreTargetSite',
-                     'distToBoundary',
-                     'MIRZAscore',
-                     'MIRZABranchLengthScoreFill',
-                     'probability_without_bls',
-                     'probability_with_bls']
+    compress.configure_from(options)
     #
     # read the data and clean it a little
     #
     accessibility, mirza, flanks, distance = options.inputs.split(",")
 
     if options.verbose:
-        syserr("Preparing coordinates\n")
-    with gzip.open(options.coords) as gcor:
-        data = {",".join(row[:-1]): {} for row in csv.reader(gcor, delimiter='\t')}
-
-    if options.verbose:
-        syserr(" - Adding Accessibility\n")
-    for (id, ascore) in csv.reader(gzip.open(accessibility), delimiter='\t'):
-        # print id, ascore
-        if id in data:
-            data[id].update({'ContraScoreTargetSite': ascore})
-
-    if options.verbose:
-        syserr(" - Adding MIRZA\n")
-    for (id, score, bls) in csv.reader(gzip.open(mirza), delimiter='\t'):
-        if id in data:
-            data[id].update({'MIRZAscore': score,
-                             'MIRZABranchLengthScoreFill': bls})
-
-    if options.verbose:
-        syserr(" - Adding Distance\n")
-    for (id, dist) in csv.reader(gzip.open(distance), delimiter='\t'):
-        if id in data:
-            data[id].update({'distToBoundary': dist})
-
-    if options.verbose:
-        syserr(" - Adding Flanks\n")
-    for (id, flanksG, flanksA, flanksC, flanksU) in csv.reader(gzip.open(flanks), delimiter='\t'):
-        if id in data:
-            data[id].update({'flanksG': flanksG,
-                             'flanksU': flanksU})
-    #
-    # if options.verbose:
-    #     syserr("Converting dictionary to data\n")
-    # # for the testing reasons lets save the dataframe
-    # if options.verbose:
-    #     syserr(" - Saving data\n")
-    # save(data, os.path.join(options.output_dir, "chunk_%i.bin" % (counter + 1)))
-    data = pd.DataFrame(data).T.replace("NA", np.nan)
-    gc.collect()
-
-    if options.verbose:
-        syserr("Adding additional columns:\n")
-    if options.verbose:
-        syserr(" - id\n")
-    data['ID'] = [i.split(',')[0] for i in data.index]
-    if options.verbose:
-        syserr(" - miRNA\n")
-    data['miRNA'] = [i.split(',')[1] for i in data.index]
-    if options.verbose:
-        syserr(" - seed beginning\n")
-    data['seed_beg'] = [i.split(',')[2] for i in data.index]
-    if options.verbose:
-        syserr("seed end\n")
-    data['seed_end'] = [i.split(',')[3] for i in data.index]
-
-    if options.verbose:
-        syserr("Transforming MIRZA to log space\n")
-
-    if len(data) == 0:
-        with gzip.open(options.output, 'wb') as handler:
-            pass
-        raise EmptyDataException("Empty DataFrame - exiting")
-
-    data['MIRZAscore'] = np.log(data['MIRZAscore'].astype(np.float))
-
-
-    if options.verbose:
-        syserr("Adding constant to data\n")
-    data['const'] = 1.0
-    # import ipdb; ipdb.set_trace()
-
-    model_bls = pd.read_pickle(options.model_bls)
-    model_nobls = pd.read_pickle(options.model_nobls)
-
-    #
-    # extract columns...
-    #
-    columns_bls = model_bls.params.keys().tolist()[1:]
-    columns_nobls = model_nobls.params.keys().tolist()[1:]
+        syserr("Reading features\n")
+    data = read_features(options.coords, accessibility, mirza, flanks, distance)
 
-    #
-    # ...and predict and scale probabilities
-    #
     if options.verbose:
-        syserr("Adding probability to data\n - with BLS\n")
-    if options.only_mirza == 'no':
+        syserr("Adding probabilities\n")
+    models = load_models(options.models) if options.models is not None else []
+    data = score(data, options.model_bls, options.model_nobls,
+                 only_mirza=options.only_mirza != 'no', models=models)
+    if options.sites_output is not None:
         if options.verbose:
-            syserr("    > doing dot product\n")
-        mydot = dot_product(data[['const'] + columns_bls].astype(np.float).values, model_bls.params.values)
+            syserr("Writing sites\n")
+        columnar.write_indexed(options.sites_output, columnar.SITE_SCORES,
+                               site_scores(data, options.split_by, options.column))
+    if options.thresholds is not None:
         if options.verbose:
-            syserr("    > scaling probability\n")
-        data['probability_with_bls'] = scaled_logit_inverse(mydot)
-    else:
+            syserr("Calculating per gene scores for thresholds %s\n" % options.thresholds)
+        thresholds, sweep = per_gene_sweep(data, [float(threshold) for threshold in options.thresholds.split(",")],
+                                           options.split_by, options.column)
+        with compress.open_output(options.sweep_output or options.output + ".sweep") as o:
+            o.writelines(sweep_lines(thresholds, sweep))
+    if models:
         if options.verbose:
-            syserr("    > adding only NaN because only-mirza = yes\n")
-        data['probability_with_bls'] = np.nan
-
-    if options.verbose:
-        syserr(" - without BLS\n")
-    if options.verbose:
-        syserr("    > doing dot product\n")
-    mydot = dot_product(data[['const'] + columns_nobls].astype(np.float).values, model_nobls.params.values)
-    if options.verbose:
-        syserr("    > scaling probability\n")
-    data['probability_without_bls'] = scaled_logit_inverse(mydot)
-
-    #
-    # reorder columns
-    #
-    if options.verbose:
-        syserr("Reordering columns\n")
-    data = data[columns_order]
-    #
-    # and rename columns
-    #
-    data.columns = [columns_map[col] for col in data.columns]
-
+            syserr("Calculating per gene scores of models %s\n" % ", ".join(model.name for model in models))
+        with compress.open_output(options.models_output or options.output + ".models") as o:
+            o.writelines(model_lines(models, per_gene_model_scores(data, models, options.threshold,
+                                                                   options.split_by, options.column)))
+    if len(data) == 0:
+        if options.format == 'columnar':
+            columnar.Writer(options.output, columnar.SCORE).close()
+        else:
+            with compress.open_output(options.output) as handler:
+                pass
+        raise EmptyDataException("Empty DataFrame - exiting")
 
-    data_with_conserved = {}
-    data_without_conserved = {}
     if options.verbose:
         syserr("Calculating per gene score\n")
-    for index, row in data.iterrows():
-        key = "%s,%s" % (row["ID"].split(options.split_by)[options.column], row["miRNA"])
-        if not pd.isnull(row["Probability without conservation"]):
-            if float(row["Probability without conservation"]) >= options.threshold:
-                if key not in data_without_conserved:
-                    data_without_conserved[key] = 0.0
-                data_without_conserved[key] += float(row["Probability without conservation"])
-        if not pd.isnull(row["Probability with conservation"]):
-            if float(row["Probability with conservation"]) >= options.threshold:
-                if key not in data_with_conserved:
-                    data_with_conserved[key] = 0.0
-                data_with_conserved[key] += float(row["Probability with conservation"])
+    genes = per_gene_scores(data, options.threshold, options.split_by, options.column)
     if options.verbose:
         syserr("Writing output\n")
-    with gzip.open(options.output, 'wb') as o:
+    if options.format == 'columnar':
+        with columnar.Writer(options.output, columnar.SCORE) as writer:
+            writer.write_rows(genes)
+        return
+    with compress.open_output(options.output) as o:
         # o.write("%s\t%s\t%s\t%s\n" % (options.name, 'miRNA', 'Total score without conservation', 'Total score with conservation'))
-        for key, value in data_without_conserved.iteritems():
-            myid, mirna = key.split(",")
-            try:
-                with_conservation_value = str(data_with_conserved[key])
-            except KeyError:
-                with_conservation_value = 'NaN'
-            o.write("%s\t%s\t%f\t%s\n" % (myid, mirna, value, with_conservation_value))
-
-
-    # if options.verbose:
-    #     syserr("Saving file\n")
-    # import ipdb; ipdb.set_trace()
-    # with gzip.open(options.output, 'wb') as handler:
-    #     data.to_csv(handler, sep='\t', index=None, na_rep="NaN", header=None)
-
-
-def scaled_logit_inverse(probability, scaling_factor=0.24):
-    """This is inversed logit function with implemented
-    scaling in the same time. It is equivalent of predicting
-    probabilities with statsmodels and taking scale_prob after
-
-    Args:
-        probability (@todo): @todo
-
-    Kwargs:
-        scaling_factor (@todo): @todo
+        for myid, mirna, value, with_conservation_value in genes:
+            o.write("%s\t%s\t%f\t%s\n" % (myid, mirna, value,
+                                            'NaN' if with_conservation_value is None else str(with_conservation_value)))
 
-    Returns: @todo
-
-    """
-    return (scaling_factor*np.exp(probability))/(scaling_factor*np.exp(probability)+1.0)
-
-
-def dot_product(x, y):
-    """A dot product of the matrix and the vecotr
-
-    Args:
-        x (np.array): numpy array of vectors of length y
-        y (np.array): one dimensional numpy array
-
-    Returns: np.array
-
-    """
-    return np.asarray([np.dot(i, y) for i in x])
 
 if __name__ == '__main__':
     try:
@@ -307,10 +175,11 @@ if __name__ == '__main__':
             start_time = time.time()
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        try:
-            main(options)
-        except EmptyDataException, e:
-            syserr(str(e) + "\n")
+        with runstats.track(__file__, options.output, sidecar=options.stats_output):
+            try:
+                main(options)
+            except EmptyDataException, e:
+                syserr(str(e) + "\n")
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
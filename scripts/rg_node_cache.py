@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Link a shared input of the job from the node-local cache, copying it into
+the cache first if this node does not have it yet (see mirzag/nodecache.py).
+"""
+
+__license__ = "GPL"
+
+# imports
+import os
+import sys
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import mirzag_path
+from mirzag import nodecache
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+parser.add_argument("--source",
+                    dest="source",
+                    required=True,
+                    help="Input on the shared file system")
+parser.add_argument("--digest",
+                    dest="digest",
+                    required=True,
+                    help="Content digest of the input")
+parser.add_argument("--cache-dir",
+                    dest="cache_dir",
+                    required=True,
+                    help="Node-local cache directory")
+parser.add_argument("--max-size",
+                    dest="max_size",
+                    default=None,
+                    help="Size of the cache (e.g. 20G), least recently used files are removed above it, defaults to None (no limit)")
+parser.add_argument("--link",
+                    dest="link",
+                    required=True,
+                    help="Link to make to the cached input")
+
+
+def main(options):
+    """Main logic of the script"""
+    hit, lease = nodecache.fetch(options.source,
+                                 options.digest,
+                                 options.cache_dir,
+                                 options.link,
+                                 nodecache.parse_size(options.max_size) if options.max_size else None)
+    if lease is not None:
+        # the symbolic link is used by the rest of the job (the shell that runs this script)
+        nodecache.hold(lease, os.getppid())
+    sys.stderr.write("%s %s from the node cache\n" % (options.link, "linked" if hit else "copied and linked"))
+
+
+if __name__ == '__main__':
+    try:
+        options = parser.parse_args()
+    except Exception, e:
+        parser.print_help()
+        sys.exit()
+    main(options)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Patch the results of a chunk from the previous run with the results
+calculated for UTRs of the genes that changed since then: sites and
+features of the changed genes are removed from the coordinate and
+feature files of the chunk and replaced with the new ones.
+"""
+
+__license__ = "GPL"
+
+# imports
+import os
+import sys
+import json
+import time
+import gzip
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import mirzag_path
+from mirzag import runstats
+from mirzag import fingerprint
+from mirzag import columnar
+from mirzag import compress
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+parser.add_argument("-v",
+                    "--verbose",
+                    dest="verbose",
+                    action="store_true",
+                    default=False,
+                    help="Be loud!")
+parser.add_argument("--chunk",
+                    dest="chunk",
+                    required=True,
+                    help="Path to the chunk without extension (e.g. output/mirnas_part_1)")
+parser.add_argument("--update",
+                    dest="update",
+                    required=True,
+                    help="Path to the chunk calculated for changed UTRs without extension")
+parser.add_argument("--genes",
+                    dest="genes",
+                    required=True,
+                    help="File with ids of the changed genes (one per line)")
+parser.add_argument("--split-by",
+                    dest="split_by",
+                    required=True,
+                    help="Split id by the string")
+parser.add_argument("--index-after-split",
+                    dest="index_after_split",
+                    type=int,
+                    required=True,
+                    help="After split take this column as new id, 0 based")
+
+# outputs of the stages that are patched (.score is calculated by the merge afterwards)
+PATCHED_SUFFIXES = ['.seedcount', '.mirza', '.contrafold', '.flanks', '.distance']
+compress.add_arguments(parser)
+
+# redefine a functions for writing to stdout and stderr to save some writting
+syserr = sys.stderr.write
+sysout = sys.stdout.write
+
+
+def main(options):
+    """Main logic of the script"""
+    compress.configure_from(options)
+    genes = fingerprint.read_genes(options.genes)
+    # without sites in the changed UTRs seed counting writes a placeholder site
+    use_update = update_has_sites(options.update + ".seedcount")
+    for suffix in PATCHED_SUFFIXES:
+        removed, added = patch(options.chunk + suffix,
+                               options.update + suffix if use_update else None,
+                               genes,
+                               options.split_by,
+                               options.index_after_split)
+        runstats.count('removed', removed)
+        runstats.count('added', added)
+        if options.verbose:
+            syserr("%s: removed %i and added %i rows\n" % (options.chunk + suffix, removed, added))
+    for suffix in PATCHED_SUFFIXES:
+        for path in [options.update + suffix, options.update + suffix + runstats.SIDECAR_SUFFIX]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def update_has_sites(seedcount):
+    """Check in the run statistics of seed counting if any site was found"""
+    try:
+        with open(runstats.sidecar_path(seedcount)) as infile:
+            return json.load(infile)['items'].get('sites', 1) > 0
+    except (IOError, ValueError, KeyError):
+        return True
+
+
+def patch(path, update, genes, split_by, index_after_split):
+    """Replace rows of the changed genes in the gzipped table
+
+    The first column of the table is UTR id or site key "id,miRNA,begin,end".
+    Tables in the columnar format are patched by patch_columnar.
+
+    Args:
+        path (str): table of the chunk, replaced in place
+        update (str): table calculated for changed UTRs, None to only remove rows
+        genes (set): ids of the changed genes
+        split_by (str): split UTR id by this string to get gene id
+        index_after_split (int): column to take after split, 0 based
+
+    Returns: tuple of number of removed and added rows
+
+    """
+    if columnar.is_columnar(path):
+        return patch_columnar(path, update, genes, split_by, index_after_split)
+    removed = 0
+    added = 0
+    with compress.open_output(path + ".tmp") as outfile:
+        with gzip.open(path, 'rb') as infile:
+            for line in infile:
+                seqid = line.split("\t", 1)[0].split(",", 1)[0]
+                if fingerprint.gene_id(seqid, split_by, index_after_split) in genes:
+                    removed += 1
+                else:
+                    outfile.write(line)
+        if update is not None:
+            with gzip.open(update, 'rb') as infile:
+                for line in infile:
+                    outfile.write(line)
+                    added += 1
+    os.rename(path + ".tmp", path)
+    return removed, added
+
+
+def patch_columnar(path, update, genes, split_by, index_after_split):
+    """Replace rows of the changed genes in the columnar table (the first column is UTR id)"""
+    removed = 0
+    added = 0
+    with columnar.Reader(path) as reader:
+        with columnar.Writer(path + ".tmp", reader.columns) as writer:
+            for row in reader:
+                if fingerprint.gene_id(row[0], split_by, index_after_split) in genes:
+                    removed += 1
+                else:
+                    writer.write(row)
+            if update is not None:
+                if not columnar.is_columnar(update):
+                    raise Exception("%s is not in the columnar format of %s" % (update, path))
+                for row in columnar.read_rows(update):
+                    writer.write(row)
+                    added += 1
+    os.rename(path + ".tmp", path)
+    return removed, added
+
+
+if __name__ == '__main__':
+    try:
+        try:
+            options = parser.parse_args()
+        except Exception, e:
+            parser.print_help()
+            sys.exit()
+        if options.verbose:
+            start_time = time.time()
+            start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
+            syserr("############## Started script on %s ##############\n" %
+                   start_date)
+        with runstats.track(__file__, options.chunk + ".seedcount", sidecar=options.chunk + ".patch.stats.json"):
+            main(options)
+        if options.verbose:
+            syserr("### Successfully finished in %i seconds, on %s ###\n" %
+                   (time.time() - start_time,
+                    time.strftime("%d-%m-%Y at %H:%M:%S")))
+    except KeyboardInterrupt:
+        syserr("Interrupted by user after %i seconds!\n" %
+               (time.time() - start_time))
+        sys.exit(-1)
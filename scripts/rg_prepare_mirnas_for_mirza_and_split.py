@@ -3,7 +3,10 @@
 Prepare miRNA fasta file for MIRZA i.e. for each miRNA sequence
 check if it is 21 nucleotide long and if not eliminate it. It
 also replaces all u or U into T. In the same time it splits miRNAs
-into separate files.
+into separate files (or into chunks of several miRNAs that are
+processed together by MIRZA). With a run fingerprint only miRNAs
+that were not calculated in the previous run are split and UTRs of
+genes that changed since then are prepared for the patch of the others.
 """
 
 __date__ = "2014-12-13"
@@ -13,11 +16,17 @@ __license__ = "GPL"
 
 # imports
 import os
+import re
 import sys
+import glob
 import time
-from Bio import SeqIO
 from argparse import ArgumentParser, RawTextHelpFormatter
 
+import mirzag_path
+from mirzag import runstats
+from mirzag import fingerprint
+from mirzag.fasta import read_fasta, iter_fasta
+
 parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
 parser.add_argument("-v",
                     "--verbose",
@@ -33,6 +42,28 @@ parser.add_argument("--output-dir",
                     dest="output_dir",
                     default="Output",
                     help="Directory for split files, defaults to Output")
+parser.add_argument("--mirnas-per-file",
+                    dest="mirnas_per_file",
+                    type=int,
+                    default=1,
+                    help="Number of miRNAs per split file. With 1 each file is named by the miRNA id,\notherwise files are named mirnas_part_N.fa, defaults to 1")
+parser.add_argument("--seqs",
+                    dest="seqs",
+                    default=None,
+                    help="UTR sequences of the run. With run fingerprint only UTRs of genes that changed since\nthe previous run are calculated for the reused miRNAs")
+parser.add_argument("--split-by",
+                    dest="split_by",
+                    default=None,
+                    help="Split UTR id by the string to get gene id")
+parser.add_argument("--index-after-split",
+                    dest="index_after_split",
+                    type=int,
+                    default=0,
+                    help="After split take this column as gene id, 0 based, defaults to 0")
+parser.add_argument("--run-fingerprint",
+                    dest="run_fingerprint",
+                    default=None,
+                    help="Fingerprint of UTRs, models and settings of the run. If given, results of the previous\nrun in the output directory are reused for unchanged miRNAs and a manifest is saved")
 
 
 # redefine a functions for writing to stdout and stderr to save some writting
@@ -42,15 +73,151 @@ sysout = sys.stdout.write
 
 def main(options):
     """Main logic of the script"""
+    if options.mirnas_per_file < 1:
+        raise Exception("Number of miRNAs per file must be positive")
+    mirnas = []
     with open(options.input) as infile:
-        for rec in SeqIO.parse(infile, 'fasta'):
-            if len(rec.seq) < 21:
-                syserr("mi/siRNA %s is shorter than 21 nucleotides. " % (rec.id) + \
+        for seqid, seq in iter_fasta(infile):
+            if len(seq) < 21:
+                syserr("mi/siRNA %s is shorter than 21 nucleotides. " % (seqid) + \
                         "It will be removed from the list.\n")
-            else:
-                with open(os.path.join(options.output_dir, str(rec.id) + ".fa"), 'w') as outfile:
-                    outfile.write(">%s\n%s\n" % (rec.id,
-                                                 str(rec.seq)[:21].upper().replace("U", "T")))
+                continue
+            mirnas.append((seqid, seq[:21].upper().replace("U", "T")))
+
+    reused = {}
+    restarted = {}
+    utrs = None
+    genes = set()
+    if options.run_fingerprint is not None:
+        if options.seqs is not None:
+            seqs = read_fasta(options.seqs, to_dna=True)
+            utrs = fingerprint.sequence_fingerprints(seqs)
+        reused, restarted = reuse_chunks(mirnas, options.output_dir, options.run_fingerprint, utrs=utrs,
+                                         exclude=[options.input], verbose=options.verbose)
+        if reused and utrs is not None:
+            previous_utrs = fingerprint.load_manifest(options.output_dir)['utrs']
+            genes = fingerprint.changed_genes(previous_utrs, utrs, options.split_by, options.index_after_split)
+            write_update(options.output_dir, seqs, genes, options.split_by, options.index_after_split)
+            if genes:
+                for chunk in reused:
+                    # results of the chunk are valid again only after the patch and the merge
+                    for path in [os.path.join(options.output_dir, chunk + ".score"),
+                                 os.path.join(options.output_dir, chunk + ".score.stats.json")]:
+                        if os.path.exists(path):
+                            os.remove(path)
+    done = set(mirid for chunk_mirnas in reused.itervalues() for mirid in chunk_mirnas)
+    # unfinished chunks keep their miRNAs so that finished jobs can be skipped (see mirzag/cache.py)
+    kept = set(mirid for chunk_mirnas in restarted.itervalues() for mirid in chunk_mirnas)
+    pending = [(mirid, seq) for mirid, seq in mirnas if mirid not in done and mirid not in kept]
+
+    # new chunks are numbered after the chunks that are kept
+    first_part = 1 + max([int(chunk.split("_")[-1]) for chunk in reused.keys() + restarted.keys()
+                          if re.match(r"^mirnas_part_\d+$", chunk)] or [0])
+    chunks = {}
+    for i in range(0, len(pending), options.mirnas_per_file):
+        chunk_mirnas = pending[i:i + options.mirnas_per_file]
+        if options.mirnas_per_file == 1:
+            chunk = chunk_mirnas[0][0]
+        else:
+            chunk = "mirnas_part_%i" % (first_part + i // options.mirnas_per_file)
+        with open(os.path.join(options.output_dir, chunk + ".fa"), 'w') as outfile:
+            for mirid, seq in chunk_mirnas:
+                outfile.write(">%s\n%s\n" % (mirid, seq))
+        chunks[chunk] = chunk_mirnas
+    runstats.count('mirnas', len(pending) + len(kept))
+    runstats.count('reused_mirnas', len(done))
+
+    if options.run_fingerprint is not None:
+        manifest = {'run': options.run_fingerprint, 'utrs': utrs, 'chunks': {}}
+        for chunk, chunk_mirnas in reused.iteritems():
+            manifest['chunks'][chunk] = {'mirnas': chunk_mirnas, 'reused': True, 'patch': bool(genes)}
+        for chunk, chunk_mirnas in restarted.iteritems():
+            manifest['chunks'][chunk] = {'mirnas': chunk_mirnas, 'reused': False}
+        for chunk, chunk_mirnas in chunks.iteritems():
+            manifest['chunks'][chunk] = {'mirnas': {mirid: fingerprint.mirna_fingerprint(mirid, seq)
+                                                    for mirid, seq in chunk_mirnas},
+                                         'reused': False}
+        fingerprint.save_manifest(options.output_dir, manifest)
+        if options.verbose:
+            syserr("Reused results of %i miRNAs, %i miRNAs to calculate\n" % (len(done), len(pending) + len(kept)))
+            if genes:
+                syserr("UTRs of %i genes changed, results of reused miRNAs will be patched\n" % len(genes))
+
+
+def reuse_chunks(mirnas, output_dir, run_fingerprint, utrs=None, exclude=(), verbose=False):
+    """Find chunks of the previous run that can be reused and remove the others
+
+    A chunk is reused if the run fingerprint did not change, all its miRNAs
+    are still in the input with the same sequence and it was finished. If
+    fingerprints of UTRs are given the previous run must have them too
+    (changed UTRs are then patched, see write_update). Such chunks that
+    did not finish are kept to be calculated again.
+
+    Args:
+        mirnas (list): list of (id, sequence) of miRNAs
+        output_dir (str): output directory of the run
+        run_fingerprint (str): fingerprint of the run (see mirzag.fingerprint)
+
+    Kwargs:
+        utrs (dict): fingerprints of UTRs by id
+        exclude (list): fasta files in the output directory that are not chunks
+        verbose (bool): be loud
+
+    Returns: tuple of dicts of reused and unfinished chunks with dict of
+             miRNA fingerprints by id
+
+    """
+    current = {mirid: fingerprint.mirna_fingerprint(mirid, seq) for mirid, seq in mirnas}
+    manifest = fingerprint.load_manifest(output_dir) or {'run': None, 'chunks': {}}
+    # chunks of a run without manifest are never reused
+    exclude = set(os.path.abspath(path) for path in exclude)
+    previous = dict((os.path.splitext(os.path.basename(path))[0], None)
+                    for path in glob.glob(os.path.join(output_dir, "*.fa"))
+                    if os.path.abspath(path) not in exclude)
+    previous.update(manifest['chunks'])
+    comparable = manifest['run'] == run_fingerprint and (utrs is None or manifest.get('utrs') is not None)
+    reused = {}
+    restarted = {}
+    for chunk, info in previous.iteritems():
+        unchanged = comparable and info is not None \
+            and all(current.get(mirid) == mirfp for mirid, mirfp in info['mirnas'].iteritems())
+        if unchanged and fingerprint.is_chunk_finished(output_dir, chunk):
+            reused[chunk] = info['mirnas']
+        elif unchanged and os.path.exists(os.path.join(output_dir, chunk + ".fa")):
+            restarted[chunk] = info['mirnas']
+        else:
+            if verbose:
+                syserr("Removing outdated results of %s\n" % chunk)
+            fingerprint.remove_chunk(output_dir, chunk)
+    return reused, restarted
+
+
+def write_update(output_dir, seqs, genes, split_by, index_after_split):
+    """Write UTRs and ids of the changed genes for the patch of reused chunks
+
+    Args:
+        output_dir (str): output directory of the run
+        seqs (dict): UTR sequences by id
+        genes (set): ids of the changed genes
+        split_by (str): split UTR id by this string to get gene id
+        index_after_split (int): column to take after split, 0 based
+
+    """
+    seqs_path = os.path.join(output_dir, fingerprint.UPDATE_SEQS)
+    genes_path = os.path.join(output_dir, fingerprint.UPDATE_GENES)
+    if not genes:
+        for path in [seqs_path, genes_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        return
+    with open(seqs_path, 'w') as outfile:
+        for seqid, seq in seqs.iteritems():
+            if fingerprint.gene_id(seqid, split_by, index_after_split) in genes:
+                outfile.write(">%s\n%s\n" % (seqid, seq))
+    with open(genes_path, 'w') as outfile:
+        for gene in sorted(genes):
+            outfile.write("%s\n" % gene)
+
 
 if __name__ == '__main__':
     try:
@@ -64,7 +231,8 @@ if __name__ == '__main__':
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" %
                    start_date)
-        main(options)
+        with runstats.track(__file__, options.output_dir, sidecar=os.path.join(options.output_dir, "rg_prepare_mirnas_for_mirza_and_split.stats.json")):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" %
                    (time.time() - start_time,
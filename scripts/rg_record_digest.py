@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+"""
+Save the digest record of the output of a finished job so that the job
+is skipped when the jobs are generated again (see mirzag/cache.py).
+"""
+
+__license__ = "GPL"
+
+# imports
+import sys
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import mirzag_path
+from mirzag import cache
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+parser.add_argument("--output",
+                    dest="output",
+                    required=True,
+                    help="Output of the job")
+parser.add_argument("--key",
+                    dest="key",
+                    required=True,
+                    help="Key of the job")
+
+
+def main(options):
+    """Main logic of the script"""
+    cache.save_record(options.output, options.key)
+
+
+if __name__ == '__main__':
+    try:
+        options = parser.parse_args()
+    except Exception, e:
+        parser.print_help()
+        sys.exit()
+    main(options)
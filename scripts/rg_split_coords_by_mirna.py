@@ -15,6 +15,9 @@ import gzip
 from collections import defaultdict
 from argparse import ArgumentParser, RawTextHelpFormatter
 
+import mirzag_path
+from mirzag import runstats
+
 parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
 parser.add_argument("-v",
                     "--verbose",
@@ -74,12 +77,14 @@ def main(options):
     if options.gzip:
         with open(options.input) as infile:
             for line in infile:
+                runstats.count('sites')
                 filename = options.prefix + line.split("\t")[options.column] + options.suffix
                 with gzip.open(filename, 'ab') as outfile:
                     outfile.write(line)
     else:
         with open(options.input) as infile:
             for line in infile:
+                runstats.count('sites')
                 filename = options.prefix + line.split("\t")[options.column] + options.suffix
                 with open(filename, 'a') as outfile:
                     outfile.write(line)
@@ -95,7 +100,8 @@ if __name__ == '__main__':
             start_time = time.time()
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        main(options)
+        with runstats.track(__file__, options.input, sidecar=options.prefix + "rg_split_coords_by_mirna.stats.json"):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
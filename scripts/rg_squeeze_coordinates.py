@@ -12,10 +12,13 @@ __license__ = "GPL"
 import sys
 import csv
 import time
-import gzip
 from collections import defaultdict
 from argparse import ArgumentParser
 
+import mirzag_path
+from mirzag import runstats
+from mirzag import compress
+
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("-v",
                     "--verbose",
@@ -30,6 +33,7 @@ parser.add_argument("--output",
                     dest="output",
                     help="output.tab")
 
+compress.add_arguments(parser)
 
 # redefine a functions for writing to stdout and stderr to save some writting
 syserr = sys.stderr.write
@@ -38,12 +42,14 @@ sysout = sys.stdout.write
 
 def main(options):
     """Main logic of the script"""
+    compress.configure_from(options)
     data = defaultdict(list)
     with open(options.input) as f:
         for sid, mirna, beg, end, seq in csv.reader(f, delimiter='\t'):
             data[','.join([sid, beg])].append(mirna)
+            runstats.count('sites')
 
-    with gzip.open(options.output, 'wb') as o:
+    with compress.open_output(options.output) as o:
         for key, value in data.iteritems():
             sid, beg = key.split(",")
             beg = int(beg)
@@ -60,7 +66,8 @@ if __name__ == '__main__':
             start_time = time.time()
             start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
             syserr("############## Started script on %s ##############\n" % start_date)
-        main(options)
+        with runstats.track(__file__, options.output):
+            main(options)
         if options.verbose:
             syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
     except KeyboardInterrupt:
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Run the command of a stage in a fork of the node-local zygote, which has
+the modules of the stages imported and the UTRs in memory (see
+mirzag/zygote.py). If the zygote is not running, it is started in the
+background and the command is run as usual.
+
+    rg_zygote.py --socket SOCKET --preload seqs.fa -- python rg_calculate_distance.py ...
+
+With --serve the zygote itself is run.
+"""
+
+__license__ = "GPL"
+
+# imports
+import os
+import sys
+from argparse import ArgumentParser, RawTextHelpFormatter, REMAINDER
+
+import mirzag_path
+from mirzag import zygote
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+parser.add_argument("-v",
+                    "--verbose",
+                    dest="verbose",
+                    action="store_true",
+                    default=False,
+                    help="Be loud!")
+parser.add_argument("--socket",
+                    dest="socket",
+                    default=zygote.default_socket(),
+                    help="Unix socket of the zygote, defaults to one per user and copy of the pipeline in /tmp")
+parser.add_argument("--preload",
+                    dest="preload",
+                    action="append",
+                    default=[],
+                    help="Fasta file kept in memory by the zygote for the jobs, can be given many times")
+parser.add_argument("--idle-timeout",
+                    dest="idle_timeout",
+                    type=float,
+                    default=zygote.DEFAULT_IDLE_TIMEOUT,
+                    help="Zygote exits after so many seconds without jobs, defaults to %i" % zygote.DEFAULT_IDLE_TIMEOUT)
+parser.add_argument("--serve",
+                    dest="serve",
+                    action="store_true",
+                    default=False,
+                    help="Run the zygote")
+parser.add_argument("command",
+                    nargs=REMAINDER,
+                    help="Command to run (after --)")
+
+
+def main(options):
+    """Main logic of the script"""
+    if options.serve:
+        zygote.Zygote(options.socket, options.idle_timeout, options.verbose).serve()
+        return
+    command = options.command[1:] if options.command[:1] == ["--"] else options.command
+    if not command:
+        parser.error("Command to run is required")
+    status = None
+    if zygote.is_python_command(command):
+        status = zygote.run(options.socket, command, options.preload)
+        if status is None and zygote.start(options.socket, options.idle_timeout) and options.verbose:
+            sys.stderr.write("Zygote started on %s\n" % options.socket)
+    if status is None:
+        os.execvp(command[0], command)
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    try:
+        options = parser.parse_args()
+    except Exception, e:
+        parser.print_help()
+        sys.exit()
+    main(options)
@@ -17,15 +17,30 @@ module load {{ mymodule }}
 {% endfor -%}
 {% endif %}
 # go to $TMPDIR
-{% if copy -%}
+{% if copy or cached -%}
 cd {{ copydir }}
-
+{% endif %}
+{% if copy -%}
 # Copy files to tmp directory
 {% for from, to in copy.iteritems() -%}
 cp -v {{ from }} {{ to }}
 {% endfor %}
 {% endif %}
+{% if cached -%}
+# Link shared files from the node cache (copied there once per node)
+{% for from, to in cached.iteritems() -%}
+python {{ cache_script }} --source {{ from }} --digest {{ to[1] }} --cache-dir {{ cache_dir }} {% if cache_size %}--max-size {{ cache_size }} {% endif %}--link {{ to[0] }}
+{% endfor %}
+{% endif %}
+{% if moveback -%}
+# statistics are moved back also when the command fails (a failed job stops the collection of the results)
+trap '{% for from, to in moveback.iteritems() if from.endswith(".stats.json") %}mv {{ from }} {{ to }} 2> /dev/null || true; {% endfor %}' EXIT
+{% endif %}
 #command to execute
+{% if zygote -%}
+# (in a fork of the node-local zygote, see mirzag/zygote.py)
+{{ zygote }} -- \
+{% endif -%}
 {{ command }}
 
 # move files back to server (usually output file)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Benchmark the start-up time of the scripts run by the jobs of the pipeline.
+
+Every job starts a new interpreter and imports its script, so with thousands
+of short jobs per run the time of the imports adds up. For each script the
+time of importing it in a fresh interpreter (without running main) is
+measured a number of times and the median, minus the median of an empty
+interpreter, is reported together with the heavy modules (Biopython,
+pandas, numpy, dendropy) pulled in by the import. The results can be saved
+as a baseline and compared to a previously saved one.
+"""
+
+__license__ = "GPL"
+
+# imports
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_DIR = os.path.dirname(TESTS_DIR)
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+parser.add_argument("-v",
+                    "--verbose",
+                    dest="verbose",
+                    action="store_true",
+                    default=False,
+                    help="Be loud!")
+parser.add_argument("--scripts",
+                    dest="scripts",
+                    default=None,
+                    help="Comma-separated names of the scripts to benchmark, defaults to the scripts of the jobs")
+parser.add_argument("--repeats",
+                    dest="repeats",
+                    type=int,
+                    default=5,
+                    help="Number of imports of each script, defaults to 5")
+parser.add_argument("--baseline-dir",
+                    dest="baseline_dir",
+                    default=os.path.join(TESTS_DIR, "baselines"),
+                    help="Directory with baselines, defaults to tests/baselines")
+parser.add_argument("--save-baseline",
+                    dest="save_baseline",
+                    default=None,
+                    help="Save the results as a baseline with this name")
+parser.add_argument("--compare",
+                    dest="compare",
+                    default=None,
+                    help="Compare the results with the baseline with this name")
+parser.add_argument("--tolerance",
+                    dest="tolerance",
+                    type=float,
+                    default=0.2,
+                    help="Relative slowdown reported as regression, defaults to 0.2")
+
+
+# redefine a functions for writing to stdout and stderr to save some writting
+syserr = sys.stderr.write
+sysout = sys.stdout.write
+
+# scripts started by the jobs of the seed and scan protocols
+SCRIPTS = ["rg_prepare_mirnas_for_mirza_and_split.py",
+           "rg_count_miRNA_seeds_and_filter_duplicates.py",
+           "rg_calculate_MIRZA.py",
+           "rg_calculate_contrafold.py",
+           "rg_calculate_flanks_composition.py",
+           "rg_calculate_distance.py",
+           "rg_merge_results_add_probability_and_calculate_per_gene_score.py",
+           "rg_collect_results.py",
+           "rg_generate_utr_chunks.py",
+           "rg_extract_data_from_mirza_output.py"]
+HEAVY_MODULES = ["Bio", "pandas", "numpy", "dendropy"]
+
+# import the script as a module (its main is not run) and report heavy modules
+IMPORT_CODE = """
+import os, sys, imp, json
+sys.argv = [sys.argv[1]]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+imp.load_source('startup_benchmark', sys.argv[0])
+json.dump([m for m in %r if m in sys.modules], sys.stdout)
+""" % HEAVY_MODULES
+
+
+def main(options):
+    """Main logic of the script"""
+    scripts = options.scripts.split(",") if options.scripts else SCRIPTS
+    empty, _ = time_command([sys.executable, "-c", "pass"], options.repeats)
+    results = []
+    for name in scripts:
+        if options.verbose:
+            syserr("Importing %s\n" % name)
+        median, heavy = time_command([sys.executable, "-c", IMPORT_CODE,
+                                      os.path.join(PIPELINE_DIR, "scripts", name)],
+                                     options.repeats)
+        results.append({'script': name,
+                        'median': median,
+                        'import': max(median - empty, 0.0),
+                        'heavy_modules': json.loads(heavy)})
+
+    sysout(format_results(results, empty))
+    if options.compare is not None:
+        with open(os.path.join(options.baseline_dir, options.compare + ".json")) as f:
+            baseline = json.load(f)
+        sysout(compare_results(results, baseline['results'], options.tolerance))
+    if options.save_baseline is not None:
+        if not os.path.isdir(options.baseline_dir):
+            os.makedirs(options.baseline_dir)
+        path = os.path.join(options.baseline_dir, options.save_baseline + ".json")
+        with open(path, 'w') as f:
+            json.dump({'name': options.save_baseline,
+                       'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+                       'host': socket.gethostname(),
+                       'python': sys.version.split()[0],
+                       'options': {'repeats': options.repeats},
+                       'interpreter': empty,
+                       'results': results}, f, indent=1, sort_keys=True)
+        if options.verbose:
+            syserr("Baseline saved in %s\n" % path)
+
+
+def time_command(args, repeats):
+    """Median wall time of the command and its output (of the last run)
+
+    Returns: tuple of float and str
+
+    """
+    times = []
+    output = ""
+    for _ in xrange(max(repeats, 1)):
+        start = time.time()
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=PIPELINE_DIR)
+        output, error = process.communicate()
+        times.append(time.time() - start)
+        if process.returncode != 0:
+            raise Exception("Command %s failed:\n%s" % (" ".join(args[:1] + args[3:]), error))
+    times.sort()
+    return times[len(times) // 2], output
+
+
+def format_results(results, empty):
+    """Make a text table from the results"""
+    lines = ["Empty interpreter: %.3f s" % empty]
+    for result in results:
+        lines.append("%-66s %7.3f s  %s" % (result['script'],
+                                            result['import'],
+                                            ", ".join(result['heavy_modules']) or "-"))
+    lines.append("%-66s %7.3f s" % ("total", sum(result['import'] for result in results)))
+    return "\n".join(lines) + "\n"
+
+
+def compare_results(results, baseline, tolerance):
+    """Compare import times with the baseline and mark regressions"""
+    lines = ["Comparison with baseline (current / baseline):"]
+    baseline = {r['script']: r for r in baseline}
+    for result in results:
+        if result['script'] not in baseline:
+            lines.append("%s: not in baseline" % result['script'])
+            continue
+        previous = baseline[result['script']]['import']
+        ratio = result['import'] / previous if previous > 0 else float('inf')
+        lines.append("  %-66s %6.2fx%s" % (result['script'], ratio,
+                                           "  REGRESSION" if ratio > 1.0 + tolerance else ""))
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == '__main__':
+    try:
+        try:
+            options = parser.parse_args()
+        except Exception, e:
+            parser.print_help()
+            sys.exit()
+        if options.verbose:
+            start_time = time.time()
+            start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
+            syserr("############## Started script on %s ##############\n" % start_date)
+        main(options)
+        if options.verbose:
+            syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
+    except KeyboardInterrupt:
+        syserr("Interrupted by user after %i seconds!\n" % (time.time() - start_time))
+        sys.exit(-1)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Generate synthetic 3'UTR and miRNA sequences for testing and benchmarking
+the pipeline. The UTR headers follow the transcript|gene|name convention
+of the test data (split by "|" and take column 1 to get genes). Additional
+seed matches can be planted into UTRs to control the number of sites.
+"""
+
+__license__ = "GPL"
+
+# imports
+import os
+import sys
+import time
+import random
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+parser.add_argument("-v",
+                    "--verbose",
+                    dest="verbose",
+                    action="store_true",
+                    default=False,
+                    help="Be loud!")
+parser.add_argument("--output-dir",
+                    dest="output_dir",
+                    required=True,
+                    help="Directory to write utrs.fa and mirnas.fa to")
+parser.add_argument("--utrs",
+                    dest="utrs",
+                    type=int,
+                    default=100,
+                    help="Number of UTR sequences, defaults to 100")
+parser.add_argument("--utr-length",
+                    dest="utr_length",
+                    type=int,
+                    default=1500,
+                    help="Mean length of UTRs (uniform from half to 1.5 times of it), defaults to 1500")
+parser.add_argument("--transcripts-per-gene",
+                    dest="transcripts_per_gene",
+                    type=int,
+                    default=1,
+                    help="Number of UTRs that share gene id, defaults to 1")
+parser.add_argument("--mirnas",
+                    dest="mirnas",
+                    type=int,
+                    default=10,
+                    help="Number of miRNAs, defaults to 10")
+parser.add_argument("--sites-per-mirna",
+                    dest="sites_per_mirna",
+                    type=int,
+                    default=0,
+                    help="Number of 8-mer seed matches planted into UTRs for each miRNA, defaults to 0")
+parser.add_argument("--seed",
+                    dest="seed",
+                    type=int,
+                    default=1234,
+                    help="Seed for random number generator, defaults to 1234")
+
+
+# redefine a functions for writing to stdout and stderr to save some writting
+syserr = sys.stderr.write
+sysout = sys.stdout.write
+
+NUCLEOTIDES = "ACGT"
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'U': 'A'}
+
+
+def main(options):
+    """Main logic of the script"""
+    utrs, mirnas = generate(utrs=options.utrs,
+                            utr_length=options.utr_length,
+                            transcripts_per_gene=options.transcripts_per_gene,
+                            mirnas=options.mirnas,
+                            sites_per_mirna=options.sites_per_mirna,
+                            seed=options.seed)
+    if not os.path.isdir(options.output_dir):
+        os.makedirs(options.output_dir)
+    write_fasta(os.path.join(options.output_dir, "utrs.fa"), utrs)
+    write_fasta(os.path.join(options.output_dir, "mirnas.fa"), mirnas)
+    if options.verbose:
+        syserr("Wrote %i UTRs (%i nt) and %i miRNAs to %s\n" % (len(utrs),
+                                                                sum(len(s) for i, s in utrs),
+                                                                len(mirnas),
+                                                                options.output_dir))
+
+
+def generate(utrs=100, utr_length=1500, transcripts_per_gene=1, mirnas=10,
+             sites_per_mirna=0, seed=1234):
+    """Generate random UTRs and miRNAs
+
+    Kwargs:
+        utrs (int): number of UTRs
+        utr_length (int): mean length of UTR
+        transcripts_per_gene (int): number of UTRs with the same gene id
+        mirnas (int): number of miRNAs
+        sites_per_mirna (int): number of 8-mer sites to plant per miRNA
+        seed (int): seed for random number generator
+
+    Returns: tuple of lists of (id, sequence) for UTRs and miRNAs
+
+    """
+    rand = random.Random(seed)
+    mirna_records = []
+    for i in range(mirnas):
+        seq = "".join(rand.choice(NUCLEOTIDES) for j in range(22))
+        mirna_records.append(("syn-miR-%i-5p" % (i + 1), seq.replace("T", "U")))
+
+    utr_seqs = []
+    for i in range(utrs):
+        length = rand.randint(max(utr_length // 2, 150), max(utr_length * 3 // 2, 150))
+        utr_seqs.append([rand.choice(NUCLEOTIDES) for j in range(length)])
+
+    # 8-mer site: reverse complement of the seed (2-8) followed by A
+    for mirid, mirseq in mirna_records:
+        site = reverse_complement(mirseq[1:8]) + "A"
+        for j in range(sites_per_mirna if utrs else 0):
+            utr = rand.choice(utr_seqs)
+            # keep sites away from the ends - they are skipped by the pipeline anyway
+            pos = rand.randint(60, len(utr) - 60 - len(site))
+            utr[pos:pos + len(site)] = list(site)
+
+    utr_records = []
+    for i, seq in enumerate(utr_seqs):
+        gene = i // max(transcripts_per_gene, 1) + 1
+        utr_records.append(("SYNT%07i|SYNG%07i|GENE%i" % (i + 1, gene, gene), "".join(seq)))
+    return utr_records, mirna_records
+
+
+def reverse_complement(seq):
+    return "".join(COMPLEMENT[n] for n in reversed(seq.upper()))
+
+
+def write_fasta(path, records, width=80):
+    with open(path, 'w') as outfile:
+        for rid, seq in records:
+            outfile.write(">%s\n" % rid)
+            for i in range(0, len(seq), width):
+                outfile.write("%s\n" % seq[i:i + width])
+
+
+if __name__ == '__main__':
+    try:
+        try:
+            options = parser.parse_args()
+        except Exception, e:
+            parser.print_help()
+            sys.exit()
+        if options.verbose:
+            start_time = time.time()
+            start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
+            syserr("############## Started script on %s ##############\n" % start_date)
+        main(options)
+        if options.verbose:
+            syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
+    except KeyboardInterrupt:
+        syserr("Interrupted by user after %i seconds!\n" % (time.time() - start_time))
+        sys.exit(-1)
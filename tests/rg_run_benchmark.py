@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+"""
+Benchmark the seed protocol of the pipeline on synthetic data.
+
+For each size (number of UTRs x number of miRNAs) synthetic data is generated
+and all stages are run locally (without Jobber) with the stand-in MIRZA and
+CONTRAfold binaries from tests/bin (unless other binaries are given). Time
+of every job, stage and of the whole pipeline is measured and the results can
+be saved as a baseline and compared to a previously saved one.
+"""
+
+__license__ = "GPL"
+
+# imports
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import shutil
+import socket
+import subprocess
+from multiprocessing.pool import ThreadPool
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import rg_generate_synthetic_data
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, PIPELINE_DIR)
+from mirzag import runstats
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+parser.add_argument("-v",
+                    "--verbose",
+                    dest="verbose",
+                    action="store_true",
+                    default=False,
+                    help="Be loud!")
+parser.add_argument("--sizes",
+                    dest="sizes",
+                    default="100x5,500x20,2000x50",
+                    help="Comma-separated sizes to benchmark as UTRSxMIRNAS, defaults to 100x5,500x20,2000x50")
+parser.add_argument("--utr-length",
+                    dest="utr_length",
+                    type=int,
+                    default=1500,
+                    help="Mean length of synthetic UTRs, defaults to 1500")
+parser.add_argument("--sites-per-mirna",
+                    dest="sites_per_mirna",
+                    type=int,
+                    default=20,
+                    help="Number of seed matches planted per miRNA, defaults to 20")
+parser.add_argument("--mirnas-per-chunk",
+                    dest="mirnas_per_chunk",
+                    type=int,
+                    default=1,
+                    help="Number of miRNAs per chunk (as in config), defaults to 1")
+parser.add_argument("--jobs",
+                    dest="jobs",
+                    type=int,
+                    default=1,
+                    help="Number of jobs run in parallel, defaults to 1")
+parser.add_argument("--mirza-binary",
+                    dest="mirza_binary",
+                    default=os.path.join(TESTS_DIR, "bin", "MIRZA"),
+                    help="MIRZA binary, defaults to the stand-in from tests/bin")
+parser.add_argument("--contrafold-binary",
+                    dest="contrafold_binary",
+                    default=os.path.join(TESTS_DIR, "bin", "contrafold"),
+                    help="CONTRAfold binary, defaults to the stand-in from tests/bin")
+parser.add_argument("--mirza-latency",
+                    dest="mirza_latency",
+                    type=float,
+                    default=0.0,
+                    help="Seconds spent per record by the stand-in MIRZA, defaults to 0")
+parser.add_argument("--contrafold-latency",
+                    dest="contrafold_latency",
+                    type=float,
+                    default=0.0,
+                    help="Seconds spent per fold by the stand-in CONTRAfold, defaults to 0")
+parser.add_argument("--work-dir",
+                    dest="work_dir",
+                    default="benchmark",
+                    help="Directory for data and outputs, defaults to benchmark")
+parser.add_argument("--baseline-dir",
+                    dest="baseline_dir",
+                    default=os.path.join(TESTS_DIR, "baselines"),
+                    help="Directory with baselines, defaults to tests/baselines")
+parser.add_argument("--save-baseline",
+                    dest="save_baseline",
+                    default=None,
+                    help="Save the results as a baseline with this name")
+parser.add_argument("--compare",
+                    dest="compare",
+                    default=None,
+                    help="Compare the results with the baseline with this name")
+parser.add_argument("--tolerance",
+                    dest="tolerance",
+                    type=float,
+                    default=0.2,
+                    help="Relative slowdown reported as regression, defaults to 0.2")
+parser.add_argument("--keep",
+                    dest="keep",
+                    action="store_true",
+                    default=False,
+                    help="Keep the data and outputs")
+
+
+# redefine a functions for writing to stdout and stderr to save some writting
+syserr = sys.stderr.write
+sysout = sys.stdout.write
+
+SETTINGS = {'context': 50,
+            'how': 'TargetScan',
+            'split_by': '|',
+            'index_after_split': 1,
+            'contextLen_L': 14,
+            'contextLen_U': 0,
+            'threshold': 0.12,
+            'run_only_MIRZA': 'yes'}
+
+
+def main(options):
+    """Main logic of the script"""
+    results = []
+    for size in options.sizes.split(","):
+        utrs, mirnas = [int(i) for i in size.lower().split("x")]
+        size_dir = os.path.join(options.work_dir, size)
+        if os.path.exists(size_dir):
+            shutil.rmtree(size_dir)
+        os.makedirs(os.path.join(size_dir, "output"))
+        if options.verbose:
+            syserr("Benchmarking %i UTRs x %i miRNAs\n" % (utrs, mirnas))
+        utr_records, mirna_records = rg_generate_synthetic_data.generate(utrs=utrs,
+                                                                        utr_length=options.utr_length,
+                                                                        mirnas=mirnas,
+                                                                        sites_per_mirna=options.sites_per_mirna)
+        rg_generate_synthetic_data.write_fasta(os.path.join(size_dir, "utrs.fa"), utr_records)
+        rg_generate_synthetic_data.write_fasta(os.path.join(size_dir, "mirnas.fa"), mirna_records)
+        result = run_pipeline(size_dir, options)
+        result.update({'size': size, 'utrs': utrs, 'mirnas': mirnas})
+        results.append(result)
+        if not options.keep:
+            shutil.rmtree(size_dir)
+
+    sysout(format_results(results))
+    if options.compare is not None:
+        with open(os.path.join(options.baseline_dir, options.compare + ".json")) as f:
+            baseline = json.load(f)
+        sysout(compare_results(results, baseline['results'], options.tolerance))
+    if options.save_baseline is not None:
+        if not os.path.isdir(options.baseline_dir):
+            os.makedirs(options.baseline_dir)
+        path = os.path.join(options.baseline_dir, options.save_baseline + ".json")
+        with open(path, 'w') as f:
+            json.dump({'name': options.save_baseline,
+                       'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+                       'host': socket.gethostname(),
+                       'python': sys.version.split()[0],
+                       'options': {k: v for k, v in vars(options).items()
+                                   if k not in ('save_baseline', 'compare', 'verbose', 'keep',
+                                                    'work_dir', 'baseline_dir')},
+                       'results': results}, f, indent=1, sort_keys=True)
+        if options.verbose:
+            syserr("Baseline saved in %s\n" % path)
+
+
+def run_pipeline(size_dir, options):
+    """Run all stages of the seed protocol like run_analysis.py does locally
+
+    Returns: dict with timings
+
+    """
+    output_dir = os.path.join(size_dir, "output")
+    seqs = os.path.join(size_dir, "utrs.fa")
+    motifs = os.path.join(size_dir, "mirnas.fa")
+    env = dict(os.environ)
+    env['MIRZA_FAKE_LATENCY'] = str(options.mirza_latency)
+    env['CONTRAFOLD_FAKE_LATENCY'] = str(options.contrafold_latency)
+    python = sys.executable
+    script = lambda name: os.path.join(PIPELINE_DIR, "scripts", name)
+
+    waves = {}
+    jobs = []
+    start = time.time()
+
+    split = [python, script("rg_prepare_mirnas_for_mirza_and_split.py"),
+             "--input", motifs,
+             "--output-dir", output_dir,
+             "--mirnas-per-file", str(options.mirnas_per_chunk)]
+    waves['SplitMiRNAs'], done = run_wave([('SplitMiRNAs', split)], output_dir, env, options.jobs)
+    jobs.extend(done)
+
+    chunks = [os.path.splitext(f)[0] for f in sorted(glob.glob(os.path.join(output_dir, "*.fa")))]
+    commands = []
+    for chunk in chunks:
+        commands.append(('SeedCount', [python, script("rg_count_miRNA_seeds_and_filter_duplicates.py"),
+                                       "--motifs", chunk + ".fa",
+                                       "--seqs", seqs,
+                                       "--output", chunk + ".seedcount",
+                                       "--how", SETTINGS['how'],
+                                       "--context", str(SETTINGS['context']),
+                                       "--split-by", SETTINGS['split_by'],
+                                       "--index-after-split", str(SETTINGS['index_after_split'])]))
+    waves['SeedCount'], done = run_wave(commands, output_dir, env, options.jobs)
+    jobs.extend(done)
+
+    commands = []
+    for chunk in chunks:
+        commands.append(('CalculateMIRZA', [python, script("rg_calculate_MIRZA.py"),
+                                            "--out", chunk + ".mirza",
+                                            "--seq", seqs,
+                                            "--coords", chunk + ".seedcount",
+                                            "--motifs", motifs,
+                                            "--contextLen", str(SETTINGS['context']),
+                                            "--onlyMIRZA", SETTINGS['run_only_MIRZA'],
+                                            "--mirzabin", options.mirza_binary]))
+        commands.append(('CalculateCONTRAfold', [python, script("rg_calculate_contrafold.py"),
+                                                 "--out", chunk + ".contrafold",
+                                                 "--seq", seqs,
+                                                 "--coords", chunk + ".seedcount",
+                                                 "--contextLen_L", str(SETTINGS['contextLen_L']),
+                                                 "--contextLen_U", str(SETTINGS['contextLen_U']),
+                                                 "--context", str(SETTINGS['context']),
+                                                 "--contrabin", options.contrafold_binary]))
+        commands.append(('CalculateFlanks', [python, script("rg_calculate_flanks_composition.py"),
+                                             "--out", chunk + ".flanks",
+                                             "--seq", seqs,
+                                             "--coords", chunk + ".seedcount",
+                                             "--contextLen", str(SETTINGS['context'])]))
+        commands.append(('CalculateDistance', [python, script("rg_calculate_distance.py"),
+                                               "--out", chunk + ".distance",
+                                               "--seq", seqs,
+                                               "--coords", chunk + ".seedcount"]))
+    waves['Features'], done = run_wave(commands, output_dir, env, options.jobs)
+    jobs.extend(done)
+
+    commands = []
+    for chunk in chunks:
+        commands.append(('MergeAndCollect', [python, script("rg_merge_results_add_probability_and_calculate_per_gene_score.py"),
+                                             "--output", chunk + ".score",
+                                             "--inputs", ",".join([chunk + ".contrafold",
+                                                                   chunk + ".mirza",
+                                                                   chunk + ".flanks",
+                                                                   chunk + ".distance"]),
+                                             "--coords", chunk + ".seedcount",
+                                             "--model-bls", os.path.join(PIPELINE_DIR, "data", "glm-with-bls.bin"),
+                                             "--model-nobls", os.path.join(PIPELINE_DIR, "data", "glm-without-bls.bin"),
+                                             "--only-mirza", SETTINGS['run_only_MIRZA'],
+                                             "--threshold", str(SETTINGS['threshold']),
+                                             "--split-by", SETTINGS['split_by'],
+                                             "--column", str(SETTINGS['index_after_split'])]))
+    waves['MergeAndCollect'], done = run_wave(commands, output_dir, env, options.jobs)
+    jobs.extend(done)
+
+    wave_start = time.time()
+    with open(os.path.join(size_dir, "mirza_g_results_seed.tab"), 'w') as outfile:
+        for chunk in chunks:
+            with gzip.open(chunk + ".score") as infile:
+                shutil.copyfileobj(infile, outfile)
+    waves['MergeResults'] = time.time() - wave_start
+    total = time.time() - start
+
+    stages = {}
+    for stage, wall in jobs:
+        stats = stages.setdefault(stage, {'jobs': 0, 'wall_sum': 0.0, 'wall_max': 0.0})
+        stats['jobs'] += 1
+        stats['wall_sum'] += wall
+        stats['wall_max'] = max(stats['wall_max'], wall)
+    sites = 0
+    for chunk in chunks:
+        with gzip.open(chunk + ".seedcount") as f:
+            sites += sum(1 for line in f)
+    return {'chunks': len(chunks),
+            'sites': sites,
+            'total_wall': total,
+            'waves': waves,
+            'stages': stages,
+            'runstats': runstats.summarize_stages(runstats.load_records(output_dir))}
+
+
+def run_wave(commands, output_dir, env, jobs):
+    """Run commands in parallel and wait for all of them
+
+    Returns: tuple of wall time of the wave and list of (stage, wall time)
+
+    """
+    def run(command):
+        stage, args = command
+        log_path = os.path.join(output_dir, "%s.%i.log" % (stage, abs(hash(tuple(args)))))
+        job_start = time.time()
+        with open(log_path, 'w') as log:
+            returncode = subprocess.call(args, stdout=log, stderr=subprocess.STDOUT, env=env)
+        if returncode != 0:
+            raise Exception("Job %s failed, see %s" % (stage, log_path))
+        return stage, time.time() - job_start
+
+    wave_start = time.time()
+    pool = ThreadPool(max(jobs, 1))
+    try:
+        done = pool.map(run, commands)
+    finally:
+        pool.close()
+        pool.join()
+    return time.time() - wave_start, done
+
+
+def format_results(results):
+    """Make a text table from the results"""
+    lines = []
+    for result in results:
+        lines.append("%s: %i chunks, %i sites, total %.2f s" % (result['size'],
+                                                                 result['chunks'],
+                                                                 result['sites'],
+                                                                 result['total_wall']))
+        for stage, stats in sorted(result['stages'].items()):
+            lines.append("  %-22s %5i jobs %9.2f s (max %.2f s)" % (stage, stats['jobs'],
+                                                                    stats['wall_sum'],
+                                                                    stats['wall_max']))
+    return "\n".join(lines) + "\n"
+
+
+def compare_results(results, baseline, tolerance):
+    """Compare stage times with the baseline and mark regressions"""
+    lines = ["Comparison with baseline (current / baseline):"]
+    baseline = {r['size']: r for r in baseline}
+    for result in results:
+        if result['size'] not in baseline:
+            lines.append("%s: not in baseline" % result['size'])
+            continue
+        base = baseline[result['size']]
+        pairs = [('total', result['total_wall'], base['total_wall'])]
+        for stage, stats in sorted(result['stages'].items()):
+            if stage in base['stages']:
+                pairs.append((stage, stats['wall_sum'], base['stages'][stage]['wall_sum']))
+        for name, current, previous in pairs:
+            ratio = current / previous if previous > 0 else float('inf')
+            lines.append("  %-10s %-22s %6.2fx%s" % (result['size'], name, ratio,
+                                                      "  REGRESSION" if ratio > 1.0 + tolerance else ""))
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == '__main__':
+    try:
+        try:
+            options = parser.parse_args()
+        except Exception, e:
+            parser.print_help()
+            sys.exit()
+        if options.verbose:
+            start_time = time.time()
+            start_date = time.strftime("%d-%m-%Y at %H:%M:%S")
+            syserr("############## Started script on %s ##############\n" % start_date)
+        main(options)
+        if options.verbose:
+            syserr("### Successfully finished in %i seconds, on %s ###\n" % (time.time() - start_time, time.strftime("%d-%m-%Y at %H:%M:%S")))
+    except KeyboardInterrupt:
+        syserr("Interrupted by user after %i seconds!\n" % (time.time() - start_time))
+        sys.exit(-1)
@@ -0,0 +1,84 @@
+"""
+Tests of the content-hash cache of the outputs of the jobs (mirzag.cache).
+"""
+
+__license__ = "GPL"
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mirzag import cache
+
+PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(cache.__file__)))
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "chunk.mirza")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_output(self, content):
+        with open(self.output, 'w') as outfile:
+            outfile.write(content)
+
+    def test_is_cached(self):
+        self.assertFalse(cache.is_cached(self.output, "k1"))
+        self.write_output("result\n")
+        self.assertFalse(cache.is_cached(self.output, "k1"))
+        cache.save_record(self.output, "k1")
+        self.assertTrue(cache.is_cached(self.output, "k1"))
+        self.assertTrue(cache.is_recorded(self.output))
+        # the job changed
+        self.assertFalse(cache.is_cached(self.output, "k2"))
+        # the output changed
+        self.write_output("another result\n")
+        self.assertFalse(cache.is_cached(self.output, "k1"))
+        self.assertFalse(cache.is_recorded(self.output))
+
+    def test_unreadable_record(self):
+        self.write_output("result\n")
+        with open(cache.digest_path(self.output), 'w') as outfile:
+            outfile.write("{")
+        self.assertIsNone(cache.read_record(self.output))
+        self.assertFalse(cache.is_cached(self.output, "k1"))
+
+    def test_remove_output(self):
+        self.write_output("result\n")
+        cache.save_record(self.output, "k1")
+        with open(self.output + ".stats.json", 'w') as outfile:
+            outfile.write("{}")
+        cache.remove_output(self.output)
+        self.assertEqual(os.listdir(self.directory), [])
+        # nothing to remove
+        cache.remove_output(self.output)
+
+    def test_job_key(self):
+        self.write_output("input\n")
+        key = cache.job_key("MIRZA", "run  --input %s" % self.output, [self.output], ["upstream"])
+        self.assertEqual(key, cache.job_key("MIRZA", "run --input %s" % self.output, [self.output], ["upstream"]))
+        self.assertNotEqual(key, cache.job_key("MIRZA", "run --input %s" % self.output, [self.output], ["other"]))
+        self.assertNotEqual(key, cache.job_key("CONTRAfold", "run --input %s" % self.output, [self.output], ["upstream"]))
+        self.write_output("changed input\n")
+        self.assertNotEqual(key, cache.job_key("MIRZA", "run --input %s" % self.output, [self.output], ["upstream"]))
+
+    def test_with_record(self):
+        command = cache.with_record("printf 'result\\n' > %s" % self.output, PIPELINE_DIR, self.output, "k1")
+        self.assertEqual(subprocess.call(command, shell=True), 0)
+        self.assertTrue(cache.is_cached(self.output, "k1"))
+
+    def test_no_record_of_failed_command(self):
+        command = cache.with_record("printf 'part' > %s && false" % self.output, PIPELINE_DIR, self.output, "k1")
+        self.assertNotEqual(subprocess.call(command, shell=True), 0)
+        self.assertTrue(os.path.exists(self.output))
+        self.assertFalse(os.path.exists(cache.digest_path(self.output)))
+
+
+if __name__ == '__main__':
+    unittest.main()
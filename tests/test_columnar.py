@@ -0,0 +1,130 @@
+"""
+Tests of the columnar format of the intermediate files (mirzag.columnar).
+"""
+
+__license__ = "GPL"
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from mirzag import columnar
+from mirzag import compress
+
+
+def float32(value):
+    """The value as stored in a float32 column"""
+    return struct.unpack('<f', struct.pack('<f', value))[0]
+
+
+def mirza_rows(count):
+    return [("UTR%i|GENE%i" % (i, i // 3), "miR-%i" % (i % 4), i, i + 7, 1.0 / (i + 3), None if i % 5 else 0.1 * i)
+            for i in range(count)]
+
+
+class ColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "chunk.mirza")
+
+    def tearDown(self):
+        compress.configure()
+        shutil.rmtree(self.directory)
+
+    def assertRowsEqual(self, found, rows):
+        self.assertEqual(len(found), len(rows))
+        for read, written in zip(found, rows):
+            self.assertEqual(read[:4], written[:4])
+            self.assertIsInstance(read[0], str)
+            for value, expected in zip(read[4:], written[4:]):
+                if expected is None:
+                    self.assertTrue(columnar.is_missing(value))
+                else:
+                    self.assertEqual(value, float32(expected))
+
+    def test_round_trip(self):
+        rows = mirza_rows(25)
+        with columnar.Writer(self.path, columnar.MIRZA, block_rows=7) as writer:
+            writer.write_rows(rows)
+        self.assertTrue(columnar.is_columnar(self.path))
+        self.assertEqual(columnar.count_rows(self.path), len(rows))
+        self.assertRowsEqual(list(columnar.read_rows(self.path)), rows)
+
+    def test_round_trip_on_threads(self):
+        compress.configure(level=1, threads=3)
+        rows = mirza_rows(40)
+        with columnar.Writer(self.path, columnar.MIRZA, block_rows=4) as writer:
+            writer.write_rows(rows)
+        with columnar.Reader(self.path) as reader:
+            self.assertEqual(reader.columns, columnar.MIRZA)
+            self.assertEqual(len(reader.block_offsets()), 10)
+        self.assertRowsEqual(list(columnar.read_rows(self.path)), rows)
+
+    def test_encoded_blocks(self):
+        rows = mirza_rows(10)
+        with columnar.Writer(self.path, columnar.MIRZA) as writer:
+            writer.write_block(columnar.encode_block(columnar.MIRZA, rows[:6]))
+            writer.write_rows(rows[6:])
+        self.assertRowsEqual(list(columnar.read_rows(self.path)), rows)
+
+    def test_float64_scores(self):
+        rows = [("GENE1", "miR-1", 1.0 / 3, float('nan')), ("GENE2", "miR-1", 0.1, 2.0 / 7)]
+        with columnar.Writer(self.path, columnar.SCORE) as writer:
+            writer.write_rows(rows)
+        found = list(columnar.read_rows(self.path))
+        self.assertEqual(found[0][:3], rows[0][:3])
+        self.assertTrue(columnar.is_missing(found[0][3]))
+        self.assertEqual(found[1], rows[1])
+
+    def test_not_columnar(self):
+        with open(self.path, 'w') as outfile:
+            outfile.write("UTR1\tmiR-1\t1\t8\t10.0\tNaN\n")
+        self.assertFalse(columnar.is_columnar(self.path))
+        self.assertRaises(IOError, columnar.Reader, self.path)
+
+
+class IndexedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "chunk.sites")
+        # genes of the sites out of order, some of them in more than one block
+        self.rows = [("GENE%i" % (i * 7 % 5), "UTR%i" % i, "miR-%i" % (i % 2), i, i + 7,
+                      0.5, 0.25, None, 100.0 + i, 1.0 / (i + 1), None, 0.1 * i, float('nan'))
+                     for i in range(23)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_rows_of_each_key(self):
+        self.assertEqual(columnar.write_indexed(self.path, columnar.SITE_SCORES, self.rows, block_rows=3),
+                         len(self.rows))
+        self.assertTrue(os.path.exists(self.path + columnar.INDEX_SUFFIX))
+        for gene in sorted(set(row[0] for row in self.rows)):
+            expected = [row for row in self.rows if row[0] == gene]
+            found = list(columnar.read_indexed(self.path, gene))
+            self.assertEqual([row[:5] for row in found], [row[:5] for row in expected])
+            for read, written in zip(found, expected):
+                for value, value_written, (name, kind) in zip(read[5:], written[5:], columnar.SITE_SCORES[5:]):
+                    if value_written is None or value_written != value_written:
+                        self.assertTrue(columnar.is_missing(value))
+                    elif kind == 'float32':
+                        self.assertEqual(value, float32(value_written))
+                    else:
+                        self.assertEqual(value, value_written)
+
+    def test_rows_sorted_by_key(self):
+        columnar.write_indexed(self.path, columnar.SITE_SCORES, self.rows, block_rows=4)
+        genes = [row[0] for row in columnar.read_rows(self.path)]
+        self.assertEqual(genes, sorted(genes))
+
+    def test_unknown_key(self):
+        columnar.write_indexed(self.path, columnar.SITE_SCORES, self.rows)
+        self.assertEqual(list(columnar.read_indexed(self.path, "GENE99")), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
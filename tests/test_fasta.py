@@ -0,0 +1,91 @@
+"""
+Tests of the reading of sequences through the index of the fasta file (mirzag.fasta).
+"""
+
+__license__ = "GPL"
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from mirzag import fasta
+
+
+def write_fasta(path, records, width, newline="\n"):
+    with open(path, 'wb') as outfile:
+        for title, seq in records:
+            outfile.write(">%s%s" % (title, newline))
+            for start in range(0, len(seq), width):
+                outfile.write(seq[start:start + width] + newline)
+
+
+class IndexedFastaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "utrs.fa")
+        rand = random.Random(7)
+        # lengths below, at and above multiples of the line width
+        self.records = [("UTR%i|GENE%i description %i" % (i, i, i),
+                         "".join(rand.choice("ACGUacgu") for j in range(length)))
+                        for i, length in enumerate([1, 9, 10, 11, 20, 57, 3])]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_fetch(self):
+        expected = fasta.read_fasta(self.path)
+        with fasta.IndexedFasta(self.path) as indexed:
+            self.assertEqual(indexed.keys(), expected.keys())
+            for seqid, seq in expected.iteritems():
+                self.assertEqual(indexed.length(seqid), len(seq))
+                self.assertEqual(indexed.fetch(seqid), seq)
+                for start in range(len(seq) + 1):
+                    for end in (start, start + 1, start + 10, None, -1):
+                        self.assertEqual(indexed.fetch(seqid, start, end), seq[start:end])
+
+    def test_fetch_as_read_fasta(self):
+        write_fasta(self.path, self.records, 10)
+        self.check_fetch()
+        self.assertTrue(os.path.exists(self.path + fasta.INDEX_SUFFIX))
+
+    def test_fetch_with_windows_newlines(self):
+        write_fasta(self.path, self.records, 10, newline="\r\n")
+        self.check_fetch()
+
+    def test_read_ids(self):
+        write_fasta(self.path, self.records, 10)
+        expected = fasta.read_fasta(self.path, to_dna=True)
+        ids = ["UTR5|GENE5", "UTR1|GENE1", "unknown"]
+        self.assertEqual(fasta.read_fasta(self.path, to_dna=True, ids=ids),
+                         type(expected)((seqid, seq) for seqid, seq in expected.iteritems() if seqid in ids))
+
+    def test_build_index(self):
+        write_fasta(self.path, self.records, 10)
+        index = fasta.build_index(self.path)
+        self.assertEqual(index["UTR0|GENE0"], (1, len(">UTR0|GENE0 description 0\n"), 1, 2))
+        self.assertEqual(index["UTR5|GENE5"][0], 57)
+        self.assertEqual(index["UTR5|GENE5"][2:], (10, 11))
+        self.assertTrue(fasta.ensure_index(self.path))
+        self.assertEqual(fasta.read_index(self.path), index)
+
+    def test_stale_index_is_built_again(self):
+        write_fasta(self.path, self.records, 10)
+        self.assertTrue(fasta.ensure_index(self.path))
+        self.records.insert(0, ("UTR9|GENE9", "ACGT" * 5))
+        write_fasta(self.path, self.records, 6)
+        self.check_fetch()
+        self.assertEqual(fasta.read_index(self.path), fasta.build_index(self.path))
+
+    def test_file_that_cannot_be_indexed(self):
+        with open(self.path, 'w') as outfile:
+            outfile.write(">UTR1\nACGTACGT\nACG\nACGTAC\n>UTR2\nAC GT\n")
+        self.assertRaises(ValueError, fasta.build_index, self.path)
+        self.assertRaises(ValueError, fasta.IndexedFasta, self.path)
+        self.assertEqual(fasta.read_fasta(self.path, ids=["UTR2"]).items(), [("UTR2", "ACGT")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""
+Tests of the packing of the jobs of the graph into cluster jobs (mirzag.jobs).
+"""
+
+__license__ = "GPL"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mirzag import cache
+from mirzag import jobs
+
+
+class RecordingJobber(object):
+
+    """Records the calls of the client of Jobber, ids of the jobs are their numbers"""
+
+    def __init__(self):
+        self.calls = []
+
+    def startGroup(self, settings):
+        self.calls.append(('start', settings['name']))
+
+    def endGroup(self):
+        self.calls.append(('end',))
+
+    def job(self, command, settings):
+        job_id = "job%i" % len(self.submitted)
+        self.calls.append(('job', command, settings))
+        return job_id
+
+    @property
+    def submitted(self):
+        return [call[1:] for call in self.calls if call[0] == 'job']
+
+
+def stage_job(graph, name, command, memory="2G", queue="short.q", priority=None, dependencies=()):
+    options = [('q', queue), ('l', "membycore=%s" % memory)]
+    if priority is not None:
+        options.append(('p', priority))
+    return graph.job(command, {'name': name, 'options': options, 'dependencies': list(dependencies)})
+
+
+class JobGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.jobber = RecordingJobber()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_no_packing_by_default(self):
+        graph = jobs.JobGraph(self.directory)
+        for i in range(3):
+            stage_job(graph, "MIRZA", "run %i" % i)
+        self.assertEqual(graph.submit(self.jobber), 3)
+        self.assertEqual([command for command, settings in self.jobber.submitted], ["run 0", "run 1", "run 2"])
+
+    def test_consecutive_jobs_are_packed(self):
+        graph = jobs.JobGraph(self.directory, chunks_per_job=2)
+        added = [stage_job(graph, "MIRZA", "run %i" % i, priority=-i) for i in range(5)]
+        self.assertEqual(graph.submit(self.jobber), 3)
+        commands = [command for command, settings in self.jobber.submitted]
+        self.assertEqual(commands[0], "set -e\n(\nrun 0\n)\n(\nrun 1\n)")
+        self.assertEqual(commands[2], "run 4")
+        self.assertEqual([job.id for job in added], ["job0", "job0", "job1", "job1", "job2"])
+        # the pack takes the priority of its first job
+        self.assertIn(('p', -2), self.jobber.submitted[1][1]['options'])
+
+    def test_packs_end_with_groups_and_stages(self):
+        graph = jobs.JobGraph(self.directory, chunks_per_job=10)
+        graph.start_group({'name': "chunk"})
+        stage_job(graph, "MIRZA", "mirza 1")
+        stage_job(graph, "MIRZA", "mirza 2", queue="long.q")
+        stage_job(graph, "CONTRAfold", "contrafold")
+        graph.end_group()
+        stage_job(graph, "CONTRAfold", "contrafold 2")
+        self.assertEqual(graph.submit(self.jobber), 4)
+        self.assertEqual([call[0] if call[0] != 'job' else call[1] for call in self.jobber.calls],
+                         ['start', "mirza 1", "mirza 2", "contrafold", 'end', "contrafold 2"])
+
+    def test_memory_of_the_same_power_of_two_is_packed(self):
+        graph = jobs.JobGraph(self.directory, chunks_per_job=10)
+        stage_job(graph, "MIRZA", "run 1", memory="600M")
+        stage_job(graph, "MIRZA", "run 2", memory="1000M")
+        stage_job(graph, "MIRZA", "run 3", memory="1100M")
+        self.assertEqual(graph.submit(self.jobber), 2)
+        self.assertEqual(self.jobber.submitted[0][1]['options'], [('q', "short.q"), ('l', "membycore=1000M")])
+        self.assertEqual(self.jobber.submitted[1][1]['options'], [('q', "short.q"), ('l', "membycore=1100M")])
+
+    def test_packing_key(self):
+        graph = jobs.JobGraph(self.directory)
+        first = stage_job(graph, "MIRZA", "run", memory="3G", priority=0)
+        second = stage_job(graph, "MIRZA", "run", memory="2049M", priority=-100)
+        self.assertEqual(jobs._packing_key(first), jobs._packing_key(second))
+        self.assertEqual(jobs._packing_key(first), ("MIRZA", [('q', "short.q")], 12))
+        self.assertNotEqual(jobs._packing_key(first), jobs._packing_key(stage_job(graph, "MIRZA", "run", memory="2G")))
+        self.assertNotEqual(jobs._packing_key(first), jobs._packing_key(stage_job(graph, "MIRZA", "run", memory="3G", queue="long.q")))
+
+    def test_pack_options(self):
+        self.assertEqual(jobs._pack_options([[('q', "short.q"), ('l', "membycore=1G"), ('l', "h_vmem=3G"), ('p', 0)],
+                                             [('q', "short.q"), ('l', "membycore=1500M"), ('l', "h_vmem=2G"), ('p', -5)]]),
+                         [('q', "short.q"), ('l', "membycore=1500M"), ('l', "h_vmem=3072M"), ('p', 0)])
+
+    def test_dependencies_are_ids_of_packs(self):
+        graph = jobs.JobGraph(self.directory, chunks_per_job=2)
+        upstream = [stage_job(graph, "Seed count", "count %i" % i) for i in range(2)]
+        stage_job(graph, "MIRZA", "run 0", dependencies=upstream[:1])
+        stage_job(graph, "MIRZA", "run 1", dependencies=upstream[1:] + [None])
+        graph.submit(self.jobber)
+        self.assertEqual(self.jobber.submitted[1][1]['dependencies'], ["job0"])
+
+    def test_outputs_are_recorded_and_cached_jobs_skipped(self):
+        output = os.path.join(self.directory, "chunk.mirza")
+        graph = jobs.JobGraph(self.directory)
+        with open(output, 'w') as outfile:
+            outfile.write("stale\n")
+        job = graph.job("run", {'name': "MIRZA"}, output=output, key="k1")
+        self.assertIsNotNone(job)
+        graph.submit(self.jobber)
+        self.assertFalse(os.path.exists(output))
+        self.assertEqual(self.jobber.submitted[0][0], cache.with_record("run", self.directory, output, "k1"))
+
+        with open(output, 'w') as outfile:
+            outfile.write("result\n")
+        cache.save_record(output, "k1")
+        graph = jobs.JobGraph(self.directory)
+        self.assertIsNone(graph.job("run", {'name': "MIRZA"}, output=output, key="k1"))
+        self.assertIsNotNone(graph.job("run", {'name': "MIRZA"}, output=output, key="k1", cacheable=False))
+        self.assertEqual(len(graph.jobs), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
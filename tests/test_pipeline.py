@@ -0,0 +1,46 @@
+"""
+Tests of the settings of the in-process seed protocol made from the config (mirzag.pipeline).
+"""
+
+__license__ = "GPL"
+
+import os
+import unittest
+
+from mirzag import pipeline
+from mirzag.models import load_models
+
+REGISTRY = os.path.join(pipeline.DATA_DIR, "glm-models.json")
+
+
+class SettingsFromConfigTest(unittest.TestCase):
+
+    def config(self, **general):
+        settings = {'general': {'mirza_binary': "MIRZA", 'contrafold_binary': "contrafold"},
+                    'tasks': {'CalculateSeedMatches': {'context': "60"},
+                              'MergeAndCollect': {'threshold': "0.2"}}}
+        settings['general'].update(general)
+        return settings
+
+    def test_defaults(self):
+        kwargs = pipeline.settings_from_config(self.config())
+        self.assertEqual(kwargs['context'], 60)
+        self.assertEqual(kwargs['threshold'], 0.2)
+        self.assertEqual(kwargs['models'], [])
+        self.assertNotIn('conservation', kwargs)
+
+    def test_registries_of_models(self):
+        kwargs = pipeline.settings_from_config(self.config(models="%s, " % REGISTRY))
+        self.assertEqual(kwargs['models'], [REGISTRY])
+        kwargs = pipeline.settings_from_config(self.config(models=[REGISTRY, " "]))
+        self.assertEqual(kwargs['models'], [REGISTRY])
+
+    def test_loaded_models_are_kept(self):
+        models = load_models([REGISTRY])
+        self.assertEqual([model.name for model in load_models(models)], [model.name for model in models])
+        self.assertIs(load_models(models)[0], models[0])
+        self.assertRaises(ValueError, load_models, models + [REGISTRY])
+
+
+if __name__ == '__main__':
+    unittest.main()
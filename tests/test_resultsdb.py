@@ -0,0 +1,89 @@
+"""
+Tests of the database of the results (mirzag.resultsdb).
+"""
+
+__license__ = "GPL"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mirzag import resultsdb
+
+NAN = float('nan')
+
+
+def site(gene, mirna, beg, probability):
+    return (gene, "%s|%s" % (gene, mirna), mirna, beg, beg + 50,
+            0.5, 0.25, -3.0, 0.1, 1.5, NAN, probability, NAN)
+
+
+class ResultsDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "results.sqlite")
+        self.connection = resultsdb.connect(self.path)
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def load(self):
+        resultsdb.load_chunk(self.connection, "chunk1", [("GENE1", "miR-1", 0.5, NAN),
+                                                         ("GENE2", "miR-1", 0.9, 0.7),
+                                                         ("GENE3", "miR-1", NAN, None)],
+                             [site("GENE1", "miR-1", 100, 0.4), site("GENE2", "miR-1", 200, 0.8)])
+        resultsdb.load_chunk(self.connection, "chunk2", [("GENE1", "miR-2", 0.8, 0.9),
+                                                         ("GENE2", "miR-2", 0.5, 0.1)])
+
+    def test_query(self):
+        self.load()
+        self.assertEqual(resultsdb.query(self.connection, mirna="miR-1"),
+                         [("GENE2", "miR-1", 0.9, 0.7), ("GENE1", "miR-1", 0.5, None), ("GENE3", "miR-1", None, None)])
+        # ties are ordered by gene and miRNA
+        self.assertEqual(resultsdb.query(self.connection, min_score=0.5),
+                         [("GENE2", "miR-1", 0.9, 0.7), ("GENE1", "miR-2", 0.8, 0.9),
+                          ("GENE1", "miR-1", 0.5, None), ("GENE2", "miR-2", 0.5, 0.1)])
+        self.assertEqual(resultsdb.query(self.connection, gene="GENE1", order_by='score_with_conservation', limit=1),
+                         [("GENE1", "miR-2", 0.8, 0.9)])
+        self.assertEqual(resultsdb.query(self.connection, gene="GENE4"), [])
+        self.assertRaises(ValueError, resultsdb.query, self.connection, order_by='gene')
+
+    def test_query_sites(self):
+        self.load()
+        sites = resultsdb.query_sites(self.connection, mirna="miR-1")
+        self.assertEqual([(row[0], row[3]) for row in sites], [("GENE2", 200), ("GENE1", 100)])
+        self.assertEqual(sites[0][10], None)
+        self.assertEqual(resultsdb.query_sites(self.connection, min_probability=0.5, limit=5)[0][:5],
+                         site("GENE2", "miR-1", 200, 0.8)[:5])
+
+    def test_chunk_is_replaced(self):
+        self.load()
+        self.assertEqual(resultsdb.load_chunk(self.connection, "chunk1", [("GENE4", "miR-1", 0.3, 0.2)]), 1)
+        self.assertEqual(resultsdb.query(self.connection, mirna="miR-1"), [("GENE4", "miR-1", 0.3, 0.2)])
+        self.assertEqual(resultsdb.query_sites(self.connection), [])
+        self.assertEqual(resultsdb.summary(self.connection),
+                         {'chunks': 2, 'scores': 3, 'genes': 3, 'mirnas': 2, 'sites': 0})
+
+    def test_keep_chunks(self):
+        self.load()
+        self.assertEqual(resultsdb.keep_chunks(self.connection, ["chunk2", "chunk3"]), ["chunk1"])
+        self.assertEqual(resultsdb.summary(self.connection),
+                         {'chunks': 1, 'scores': 2, 'genes': 2, 'mirnas': 1, 'sites': 0})
+
+    def test_reopened_database(self):
+        self.load()
+        self.connection.close()
+        self.connection = resultsdb.connect(self.path)
+        self.assertEqual(self.connection.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+        self.assertEqual(len(resultsdb.query(self.connection)), 5)
+
+    def test_format_rows(self):
+        self.assertEqual(resultsdb.format_rows([("GENE1", "miR-1", 0.5, None), ("GENE2", "miR-1", None, 0.25)]),
+                         "GENE1\tmiR-1\t0.500000\tNaN\nGENE2\tmiR-1\tNaN\t0.25\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
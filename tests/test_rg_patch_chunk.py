@@ -0,0 +1,75 @@
+"""
+Tests of the patch of reused chunks with the results of changed UTRs (scripts/rg_patch_chunk.py).
+"""
+
+__license__ = "GPL"
+
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from mirzag import columnar
+from scripts.rg_patch_chunk import patch
+
+GENES = set(["GENE2"])
+
+
+def mirza_rows(utrs):
+    return [("UTR%i|GENE%i" % (utr, gene), "miR-1", 10 * utr, 10 * utr + 50, 0.5, 0.25) for utr, gene in utrs]
+
+
+class PatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "mirnas_part_1.mirza")
+        self.update = os.path.join(self.directory, "mirnas_part_1.update.mirza")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_table(self, path, lines):
+        with gzip.open(path, 'wb') as outfile:
+            outfile.write("".join(lines))
+
+    def read_table(self, path):
+        with gzip.open(path, 'rb') as infile:
+            return infile.readlines()
+
+    def test_patch_table(self):
+        # the first column is UTR id or the site key
+        self.write_table(self.path, ["UTR1|GENE1,miR-1,10,60\t0.5\n",
+                                     "UTR2|GENE2,miR-1,20,70\t0.7\n",
+                                     "UTR3|GENE2\t3\n",
+                                     "UTR4|GENE3,miR-1,40,90\t0.1\n"])
+        self.write_table(self.update, ["UTR5|GENE2,miR-1,30,80\t0.9\n"])
+        self.assertEqual(patch(self.path, self.update, GENES, "|", 1), (2, 1))
+        self.assertEqual(self.read_table(self.path), ["UTR1|GENE1,miR-1,10,60\t0.5\n",
+                                                      "UTR4|GENE3,miR-1,40,90\t0.1\n",
+                                                      "UTR5|GENE2,miR-1,30,80\t0.9\n"])
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_only_remove_rows(self):
+        self.write_table(self.path, ["UTR1|GENE1\t1\n", "UTR2|GENE2\t2\n"])
+        self.assertEqual(patch(self.path, None, GENES, "|", 1), (1, 0))
+        self.assertEqual(self.read_table(self.path), ["UTR1|GENE1\t1\n"])
+
+    def test_patch_columnar(self):
+        with columnar.Writer(self.path, columnar.MIRZA) as writer:
+            writer.write_rows(mirza_rows([(1, 1), (2, 2), (3, 2), (4, 3)]))
+        with columnar.Writer(self.update, columnar.MIRZA) as writer:
+            writer.write_rows(mirza_rows([(5, 2)]))
+        self.assertEqual(patch(self.path, self.update, GENES, "|", 1), (2, 1))
+        self.assertEqual(list(columnar.read_rows(self.path)), mirza_rows([(1, 1), (4, 3), (5, 2)]))
+
+    def test_update_in_another_format(self):
+        with columnar.Writer(self.path, columnar.MIRZA) as writer:
+            writer.write_rows(mirza_rows([(1, 1)]))
+        self.write_table(self.update, ["UTR5|GENE2,miR-1,50,100\t0.5\n"])
+        self.assertRaises(Exception, patch, self.path, self.update, GENES, "|", 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Tests of the reuse of the chunks of the previous run (scripts/rg_prepare_mirnas_for_mirza_and_split.py).
+"""
+
+__license__ = "GPL"
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from mirzag import fingerprint
+from scripts.rg_prepare_mirnas_for_mirza_and_split import reuse_chunks
+
+MIRNAS = [("miR-1", "TAGCTTATCAGACTGATGTTG"),
+          ("miR-2", "TGAGGTAGTAGGTTGTATAGT"),
+          ("miR-3", "TCCCTGAGACCCTTTAACCTG")]
+
+
+class ReuseChunksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, content=""):
+        with open(self.path(name), 'w') as outfile:
+            outfile.write(content)
+
+    def add_chunk(self, chunk, mirnas, finished):
+        self.write(chunk + ".fa", "".join(">%s\n%s\n" % record for record in mirnas))
+        self.write(chunk + ".mirza", "results")
+        if finished:
+            self.write(chunk + ".score", "scores")
+            self.write(chunk + ".score.stats.json", json.dumps({'status': "ok"}))
+        return {'mirnas': {mirid: fingerprint.mirna_fingerprint(mirid, seq) for mirid, seq in mirnas}}
+
+    def save_manifest(self, chunks, run="run1", utrs=None):
+        fingerprint.save_manifest(self.directory, {'run': run, 'utrs': utrs, 'chunks': chunks})
+
+    def test_finished_and_unfinished_chunks(self):
+        chunks = {'miR-1': self.add_chunk("miR-1", MIRNAS[:1], True),
+                  'miR-2': self.add_chunk("miR-2", MIRNAS[1:2], False)}
+        self.save_manifest(chunks)
+        reused, restarted = reuse_chunks(MIRNAS, self.directory, "run1")
+        self.assertEqual(reused, {'miR-1': chunks['miR-1']['mirnas']})
+        self.assertEqual(restarted, {'miR-2': chunks['miR-2']['mirnas']})
+        self.assertTrue(os.path.exists(self.path("miR-2.mirza")))
+
+    def test_changed_mirna_is_removed(self):
+        chunks = {'mirnas_part_1': self.add_chunk("mirnas_part_1", MIRNAS[:2], True),
+                  'mirnas_part_2': self.add_chunk("mirnas_part_2", MIRNAS[2:], True)}
+        self.save_manifest(chunks)
+        mirnas = MIRNAS[:1] + [("miR-2", "TGAGGTAGTAGGTTGTATAGA")] + MIRNAS[2:]
+        reused, restarted = reuse_chunks(mirnas, self.directory, "run1")
+        self.assertEqual(reused.keys(), ["mirnas_part_2"])
+        self.assertEqual(restarted, {})
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [fingerprint.MANIFEST_NAME] + ["mirnas_part_2" + suffix for suffix in
+                                                        [".fa", ".mirza", ".score", ".score.stats.json"]])
+
+    def test_changed_run_removes_all_chunks(self):
+        self.save_manifest({'miR-1': self.add_chunk("miR-1", MIRNAS[:1], True)})
+        self.assertEqual(reuse_chunks(MIRNAS, self.directory, "run2"), ({}, {}))
+        self.assertFalse(os.path.exists(self.path("miR-1.score")))
+
+    def test_utrs_of_the_previous_run_are_needed(self):
+        self.save_manifest({'miR-1': self.add_chunk("miR-1", MIRNAS[:1], True)})
+        self.assertEqual(reuse_chunks(MIRNAS, self.directory, "run1", utrs={'UTR1': "fp"}), ({}, {}))
+
+    def test_chunks_without_manifest_are_removed(self):
+        self.add_chunk("miR-1", MIRNAS[:1], True)
+        self.write("mirnas.fa", ">miR-1\n%s\n" % MIRNAS[0][1])
+        self.assertEqual(reuse_chunks(MIRNAS, self.directory, "run1", exclude=[self.path("mirnas.fa")]), ({}, {}))
+        self.assertEqual(os.listdir(self.directory), ["mirnas.fa"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Tests of the per gene scores of mirzag.scoring.
+"""
+
+__license__ = "GPL"
+
+import math
+import random
+import unittest
+
+from mirzag.scoring import sweep_scores
+
+NAN = float('nan')
+
+
+def summed(keys, values, threshold):
+    """Sums of the values at or above the threshold per key (None without such a value)"""
+    sums = {}
+    for key, value in zip(keys, values):
+        if not math.isnan(value) and value >= threshold:
+            sums[key] = sums.get(key, 0.0) + value
+    return sums
+
+
+class SweepScoresTest(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(42)
+        self.keys = [("gene%i" % rand.randint(1, 20), "miR-%i" % rand.randint(1, 3)) for i in range(500)]
+        self.without = [rand.random() if rand.random() > 0.1 else NAN for key in self.keys]
+        self.with_conservation = [rand.random() if rand.random() > 0.5 else NAN for key in self.keys]
+        # thresholds equal to some of the probabilities check that they are summed at the threshold
+        self.thresholds = [0.5, 0.12, self.without[3], 0.9, 0.12]
+
+    def test_same_as_summing_per_threshold(self):
+        thresholds, genes = sweep_scores(self.keys, self.without, self.with_conservation, self.thresholds)
+        self.assertEqual(thresholds, sorted(set(self.thresholds)))
+        expected_keys = set(summed(self.keys, self.without, thresholds[0]))
+        self.assertEqual(set((gene, mirna) for gene, mirna, values, with_conservation_values in genes),
+                         expected_keys)
+        for index, threshold in enumerate(thresholds):
+            without = summed(self.keys, self.without, threshold)
+            with_conservation = summed(self.keys, self.with_conservation, threshold)
+            for gene, mirna, values, with_conservation_values in genes:
+                self.assertAlmostEqual(values[index], without.get((gene, mirna), 0.0))
+                if (gene, mirna) in with_conservation:
+                    self.assertAlmostEqual(with_conservation_values[index], with_conservation[(gene, mirna)])
+                else:
+                    self.assertIsNone(with_conservation_values[index])
+
+    def test_no_sites(self):
+        self.assertEqual(sweep_scores([], [], [], [0.2, 0.1]), ([0.1, 0.2], []))
+
+    def test_no_site_above_thresholds(self):
+        thresholds, genes = sweep_scores([("gene", "miR")], [0.05], [NAN], [0.1])
+        self.assertEqual(genes, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
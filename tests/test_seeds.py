@@ -0,0 +1,71 @@
+"""
+Tests of the search for seed matches of the in-process API (mirzag.seeds).
+"""
+
+__license__ = "GPL"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mirzag
+from mirzag import seeds
+
+MIRNA = "UAGCUUAUCAGACUGAUGUUGA"
+# 7-mer (2-8) match of the seed followed by A
+SITE = "ATAAGCTA"
+FILLER = "C" * 60
+
+
+class ScanSeedsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_seed_regex(self):
+        self.assertEqual(seeds.seed_regex("TAGCTTATCAGACTGATGTTGA"), "ATAAGCT|TAAGCTA")
+        self.assertEqual(seeds.seed_regex("TAGCTTATCAGACTGATGTTGA", "ElMMo"), "TAAGCTA|ATAAGCT")
+        self.assertEqual(seeds.seed_regex("TAGCTTATCAGACTGATGTTGA", "6-mer"), "TAAGCT")
+        self.assertRaises(ValueError, seeds.seed_regex, "TAGCTTATCAGACTGATGTTGA", "8-mer")
+
+    def test_sites_with_context(self):
+        utr = FILLER + SITE + FILLER + "acgu" + FILLER
+        sites = mirzag.scan_seeds([("UTR1|GENE1", utr)], [("miR-21", MIRNA)])
+        self.assertEqual(len(sites), 1)
+        site = sites[0]
+        self.assertEqual(site[:4], ("UTR1|GENE1", "miR-21", 60, 67))
+        self.assertEqual(len(site.seq), 50)
+        self.assertIn(SITE[:7], site.seq)
+        # the longer flank is upstream of the match
+        self.assertEqual(site.seq, utr[38:88])
+
+    def test_contexts_at_the_ends_of_utrs(self):
+        sites = mirzag.scan_seeds([("UTR1", SITE + FILLER), ("UTR2", FILLER + SITE), ("UTR3", SITE + "CCCC")],
+                                  [("miR-21", MIRNA)])
+        self.assertEqual([(site.id, site.seq) for site in sites],
+                         [("UTR1", (SITE + FILLER)[:50]), ("UTR2", (FILLER + SITE)[-50:])])
+
+    def test_sites_of_a_gene_are_reported_once(self):
+        utr = FILLER + SITE + FILLER
+        utrs = [("UTR1|GENE1", utr), ("UTR2|GENE1", utr), ("UTR3|GENE2", utr)]
+        self.assertEqual(len(mirzag.scan_seeds(utrs, [("miR-21", MIRNA)])), 3)
+        sites = mirzag.scan_seeds(utrs, [("miR-21", MIRNA)], split_by="|", index_after_split=1)
+        self.assertEqual([site.id for site in sites], ["UTR1|GENE1", "UTR3|GENE2"])
+
+    def test_fasta_files(self):
+        utrs_path = os.path.join(self.directory, "utrs.fa")
+        mirnas_path = os.path.join(self.directory, "mirnas.fa")
+        with open(utrs_path, 'w') as outfile:
+            outfile.write(">UTR1\n%s\n%s\n" % (FILLER, SITE + FILLER))
+        with open(mirnas_path, 'w') as outfile:
+            outfile.write(">miR-21\n%s\n" % MIRNA)
+        self.assertEqual(list(mirzag.scan_seeds(utrs_path, mirnas_path)),
+                         list(mirzag.scan_seeds({'UTR1': FILLER + SITE + FILLER}, {'miR-21': MIRNA})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Tests of the compact table of the sites of a chunk (mirzag.sites).
+"""
+
+__license__ = "GPL"
+
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from mirzag import sites as sitesmodule
+from mirzag.sites import Site, SiteTable
+
+UTRS = {'UTR1|GENE1': "ACGTACGTTTGGCCAAACGTAGCTAGCATCGATCGA",
+        'UTR2|GENE2': "GGGGCCCCAAAATTTTGGGGCCCCAAAATTTT"}
+SITES = [Site('UTR1|GENE1', "miR-1", 8, 16, UTRS['UTR1|GENE1'][4:20]),
+         Site('UTR2|GENE2', "miR-1", 4, 12, UTRS['UTR2|GENE2'][0:14]),
+         # the context is not in the UTR (e.g. the UTR changed)
+         Site('UTR2|GENE2', "miR-2", 10, 18, "ACGTACGTACGT"),
+         Site('UTR3|GENE3', "miR-2", 0, 8, "TTTTAAAACC"),
+         Site('UTR1|GENE1', "miR-2", 20, 28, None)]
+
+
+class SiteTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_table_as_list(self):
+        for utrs in [UTRS, None]:
+            table = SiteTable(utrs)
+            table.extend(SITES)
+            self.assertEqual(len(table), len(SITES))
+            self.assertEqual(list(table), SITES)
+            self.assertEqual(table[-1], SITES[-1])
+            self.assertEqual(table.utr_ids(), set(["UTR1|GENE1", "UTR2|GENE2", "UTR3|GENE3"]))
+            self.assertEqual(table.mirna_ids(), set(["miR-1", "miR-2"]))
+        # only contexts that are not in the UTRs take space in the table
+        self.assertEqual(len(table.buffer), sum(len(site.seq) for site in SITES if site.seq is not None))
+        table = SiteTable(UTRS)
+        table.extend(SITES)
+        self.assertEqual(len(table.buffer), len(SITES[2].seq) + len(SITES[3].seq))
+
+    def test_slices(self):
+        table = SiteTable(UTRS)
+        table.extend(SITES)
+        for index in [slice(None), slice(1, 4), slice(2, None), slice(None, None, 2), slice(3, 1)]:
+            self.assertEqual(list(table[index]), SITES[index])
+        self.assertEqual(list(table[3:][0:1]), SITES[3:4])
+
+    def test_without_contexts(self):
+        table = SiteTable(UTRS, context=False)
+        table.extend(SITES)
+        self.assertEqual(list(table), [site._replace(seq=None) for site in SITES])
+        self.assertEqual(len(table.buffer), 0)
+
+    def test_read_and_write(self):
+        path = os.path.join(self.directory, "chunk.seedcount")
+        written = SITES[:4]
+        for fmt in ["tsv", "columnar"]:
+            sitesmodule.write_sites(path, written, fmt)
+            self.assertEqual(list(sitesmodule.read_sites(path, utrs=UTRS)), written)
+            self.assertEqual(list(sitesmodule.read_sites(path, context=False)),
+                             [site._replace(seq=None) for site in written])
+
+    def test_several_mirnas_in_a_row(self):
+        path = os.path.join(self.directory, "chunk.seedcount")
+        with gzip.open(path, 'wb') as outfile:
+            outfile.write("UTR1|GENE1\tmiR-1,miR-2\t8\t16\n\nUTR2|GENE2\tmiR-3\t4\t12\tGGGGCCCC\n")
+        self.assertEqual(list(sitesmodule.read_sites(path)),
+                         [Site('UTR1|GENE1', "miR-1", 8, 16, None),
+                          Site('UTR1|GENE1', "miR-2", 8, 16, None),
+                          Site('UTR2|GENE2', "miR-3", 4, 12, "GGGGCCCC")])
+
+
+if __name__ == '__main__':
+    unittest.main()